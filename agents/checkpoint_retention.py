@@ -0,0 +1,568 @@
+import asyncio
+import gzip
+import io
+import os
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from opentelemetry import metrics
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+load_dotenv()
+
+# checkpoints kept per namespace of the threads that are still running
+CHECKPOINT_RETENTION_KEEP = int(os.getenv("CHECKPOINT_RETENTION_KEEP", "10"))
+# threads pruned or collapsed by a single run of the retention job
+CHECKPOINT_RETENTION_BATCH_SIZE = int(
+    os.getenv("CHECKPOINT_RETENTION_BATCH_SIZE", "500")
+)
+# where the history of the finished threads goes, "minio" or "local"
+CHECKPOINT_ARCHIVE = os.getenv("CHECKPOINT_ARCHIVE", "minio")
+CHECKPOINT_ARCHIVE_BUCKET = os.getenv("CHECKPOINT_ARCHIVE_BUCKET", "checkpoint-archive")
+CHECKPOINT_ARCHIVE_DIR = os.getenv("CHECKPOINT_ARCHIVE_DIR", "data/checkpoint-archive")
+
+meter = metrics.get_meter(__name__)
+reclaimed_bytes_counter = meter.create_counter(
+    "checkpoint_retention.reclaimed_bytes",
+    unit="By",
+    description="Checkpoint storage released by pruning (live) and collapsing (finished) threads",
+)
+deleted_checkpoints_counter = meter.create_counter(
+    "checkpoint_retention.deleted_checkpoints",
+    description="Checkpoints removed by the retention job",
+)
+archived_bytes_counter = meter.create_counter(
+    "checkpoint_retention.archived_bytes",
+    unit="By",
+    description="Compressed checkpoint history exported to the archive",
+)
+
+
+# metadata flag of the checkpoint a finished thread has been collapsed into,
+# the checkpoints before it are in the archive
+ARCHIVED_METADATA_KEY = "archived"
+
+
+def archive_object_name(thread_id: Any) -> str:
+    return f"{thread_id}.jsonl.gz"
+
+
+class CheckpointArchive(ABC):
+    """
+    Store of the checkpoint history of the finished threads, one gzipped
+    json lines object per thread with the newest checkpoint first (the order
+    of ``aget_state_history``)
+    """
+
+    def __init__(self):
+        self.serializer = JsonPlusSerializer()
+
+    @abstractmethod
+    async def read_object(self, name: str) -> Optional[bytes]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def write_object(self, name: str, data: bytes) -> str:
+        raise NotImplementedError()
+
+    async def read(self, thread_id: Any) -> Optional[List[Dict[str, Any]]]:
+        """
+        :return: archived checkpoints of the thread, newest first, or None
+            when the thread has not been archived
+        :rtype: Optional[List[Dict[str, Any]]]
+        """
+        data = await self.read_object(archive_object_name(thread_id))
+        if data is None:
+            return None
+        lines = gzip.decompress(data).splitlines()
+        return [self.serializer.loads(line) for line in lines if len(line) > 0]
+
+    async def write(self, thread_id: Any, records: List[Dict[str, Any]]) -> int:
+        """
+        Stores the checkpoints of the thread next to the ones archived by the
+        previous runs, a thread resumed after being collapsed is archived
+        again with its newer checkpoints
+
+        :return: size of the stored object
+        :rtype: int
+        """
+        archived = await self.read(thread_id) or []
+        # the collapsed checkpoint is archived again without its parent, the
+        # archived record keeps the original
+        known = {
+            (record["checkpoint_ns"], record["checkpoint_id"]) for record in archived
+        }
+        records = [
+            record
+            for record in records
+            if (record["checkpoint_ns"], record["checkpoint_id"]) not in known
+        ] + archived
+        data = gzip.compress(
+            b"\n".join(self.serializer.dumps(record) for record in records)
+        )
+        await self.write_object(archive_object_name(thread_id), data)
+        return len(data)
+
+
+class LocalCheckpointArchive(CheckpointArchive):
+    def __init__(self, directory: str = CHECKPOINT_ARCHIVE_DIR):
+        super().__init__()
+        self.directory = directory
+
+    async def read_object(self, name: str) -> Optional[bytes]:
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            return file.read()
+
+    async def write_object(self, name: str, data: bytes) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+
+class MinioCheckpointArchive(CheckpointArchive):
+    def __init__(self, bucket_name: str = CHECKPOINT_ARCHIVE_BUCKET):
+        super().__init__()
+        self.bucket_name = bucket_name
+        self.__client = None
+
+    async def read_object(self, name: str) -> Optional[bytes]:
+        from minio.error import S3Error
+
+        def read() -> Optional[bytes]:
+            try:
+                response = self.__get_client().get_object(self.bucket_name, name)
+            except S3Error as error:
+                if error.code in ("NoSuchKey", "NoSuchBucket"):
+                    return None
+                raise
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
+
+        return await asyncio.to_thread(read)
+
+    async def write_object(self, name: str, data: bytes) -> str:
+        def write() -> None:
+            client = self.__get_client()
+            if not client.bucket_exists(self.bucket_name):
+                client.make_bucket(self.bucket_name)
+            client.put_object(
+                self.bucket_name,
+                name,
+                io.BytesIO(data),
+                length=len(data),
+                content_type="application/gzip",
+            )
+
+        await asyncio.to_thread(write)
+        return f"{self.bucket_name}/{name}"
+
+    def __get_client(self):
+        if self.__client is None:
+            # same client and credentials as the uploaded files
+            from service.uploader import MinioUploader
+
+            self.__client = MinioUploader().client
+        return self.__client
+
+
+def get_checkpoint_archive() -> CheckpointArchive:
+    if CHECKPOINT_ARCHIVE == "local":
+        return LocalCheckpointArchive()
+    return MinioCheckpointArchive()
+
+
+class CheckpointTables(ABC):
+    """
+    Storage specific operations of the retention job, langgraph savers can
+    only delete whole threads
+    """
+
+    @abstractmethod
+    async def threads_over(
+        self, count: int, thread_ids: Optional[List[str]], limit: int
+    ) -> List[str]:
+        """
+        :return: threads with more than ``count`` checkpoints, among
+            ``thread_ids`` when given
+        :rtype: List[str]
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def delete_older(self, thread_id: str, keep: int) -> int:
+        """
+        Deletes all but the latest ``keep`` checkpoints of every namespace of
+        the thread, their writes and the blobs only they referenced
+
+        :return: deleted checkpoints
+        :rtype: int
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def collapse(self, thread_id: str) -> int:
+        """
+        Collapses every namespace of the thread into its latest checkpoint,
+        which keeps its pending writes and is flagged as archived. The latest
+        checkpoints stay where they are, a failed collapse leaves the thread
+        as it was.
+
+        :return: deleted checkpoints
+        :rtype: int
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def thread_bytes(self, thread_id: str) -> int:
+        raise NotImplementedError()
+
+
+class PostgresCheckpointTables(CheckpointTables):
+    def __init__(self, saver: BaseCheckpointSaver):
+        self.saver = saver
+
+    async def threads_over(
+        self, count: int, thread_ids: Optional[List[str]], limit: int
+    ) -> List[str]:
+        async with self.__cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT thread_id
+                FROM checkpoints
+                WHERE %(thread_ids)s::text[] IS NULL OR thread_id = ANY(%(thread_ids)s)
+                GROUP BY thread_id
+                HAVING count(*) > %(count)s
+                ORDER BY count(*) DESC
+                LIMIT %(limit)s;
+                """,
+                {"thread_ids": thread_ids, "count": count, "limit": limit},
+            )
+            return [row["thread_id"] for row in await cursor.fetchall()]
+
+    async def delete_older(self, thread_id: str, keep: int) -> int:
+        async with self.__cursor(transaction=True) as cursor:
+            return await self.__delete_older(cursor, thread_id, keep)
+
+    async def collapse(self, thread_id: str) -> int:
+        async with self.__cursor(transaction=True) as cursor:
+            await cursor.execute(
+                """
+                UPDATE checkpoints c
+                SET metadata = c.metadata || jsonb_build_object(%(key)s::text, true),
+                    parent_checkpoint_id = NULL
+                WHERE c.thread_id = %(thread_id)s
+                    AND c.checkpoint_id = (
+                        SELECT max(l.checkpoint_id)
+                        FROM checkpoints l
+                        WHERE l.thread_id = c.thread_id
+                            AND l.checkpoint_ns = c.checkpoint_ns
+                    );
+                """,
+                {"thread_id": thread_id, "key": ARCHIVED_METADATA_KEY},
+            )
+            return await self.__delete_older(cursor, thread_id, 1)
+
+    @staticmethod
+    async def __delete_older(cursor, thread_id: str, keep: int) -> int:
+        params = {"thread_id": thread_id, "keep": keep}
+        await cursor.execute(
+            """
+            WITH dropped AS (
+                SELECT checkpoint_ns, checkpoint_id
+                FROM (
+                    SELECT
+                        checkpoint_ns,
+                        checkpoint_id,
+                        row_number() OVER (
+                            PARTITION BY checkpoint_ns ORDER BY checkpoint_id DESC
+                        ) AS position
+                    FROM checkpoints
+                    WHERE thread_id = %(thread_id)s
+                ) ranked
+                WHERE position > %(keep)s
+            ), deleted_writes AS (
+                DELETE FROM checkpoint_writes w
+                USING dropped d
+                WHERE w.thread_id = %(thread_id)s
+                    AND w.checkpoint_ns = d.checkpoint_ns
+                    AND w.checkpoint_id = d.checkpoint_id
+            )
+            DELETE FROM checkpoints c
+            USING dropped d
+            WHERE c.thread_id = %(thread_id)s
+                AND c.checkpoint_ns = d.checkpoint_ns
+                AND c.checkpoint_id = d.checkpoint_id;
+            """,
+            params,
+        )
+        deleted = cursor.rowcount
+        # the blobs of a checkpoint being written land before its row,
+        # only versions older than the latest referenced one are dropped
+        await cursor.execute(
+            """
+            DELETE FROM checkpoint_blobs b
+            WHERE b.thread_id = %(thread_id)s
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM checkpoints c
+                    WHERE c.thread_id = b.thread_id
+                        AND c.checkpoint_ns = b.checkpoint_ns
+                        AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+                )
+                AND b.version < (
+                    SELECT max(c.checkpoint -> 'channel_versions' ->> b.channel)
+                    FROM checkpoints c
+                    WHERE c.thread_id = b.thread_id
+                        AND c.checkpoint_ns = b.checkpoint_ns
+                );
+            """,
+            params,
+        )
+        return deleted
+
+    async def thread_bytes(self, thread_id: str) -> int:
+        async with self.__cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT
+                    (SELECT coalesce(sum(pg_column_size(c.*)), 0) FROM checkpoints c WHERE c.thread_id = %(thread_id)s)
+                    + (SELECT coalesce(sum(pg_column_size(b.*)), 0) FROM checkpoint_blobs b WHERE b.thread_id = %(thread_id)s)
+                    + (SELECT coalesce(sum(pg_column_size(w.*)), 0) FROM checkpoint_writes w WHERE w.thread_id = %(thread_id)s)
+                    AS size;
+                """,
+                {"thread_id": thread_id},
+            )
+            row = await cursor.fetchone()
+            return int(row["size"])
+
+    @asynccontextmanager
+    async def __cursor(self, transaction: bool = False):
+        conn = self.saver.conn
+        if isinstance(conn, AsyncConnectionPool):
+            async with conn.connection() as connection:
+                async with self.__transaction(connection, transaction):
+                    async with connection.cursor(row_factory=dict_row) as cursor:
+                        yield cursor
+            return
+        # dedicated connection of the celery workers, shared with the saver
+        async with self.saver.lock:
+            async with self.__transaction(conn, transaction):
+                async with conn.cursor(row_factory=dict_row) as cursor:
+                    yield cursor
+
+    @asynccontextmanager
+    async def __transaction(self, connection, transaction: bool):
+        if not transaction:
+            yield
+            return
+        async with connection.transaction():
+            yield
+
+
+class InMemoryCheckpointTables(CheckpointTables):
+    def __init__(self, saver: InMemorySaver):
+        self.saver = saver
+
+    async def threads_over(
+        self, count: int, thread_ids: Optional[List[str]], limit: int
+    ) -> List[str]:
+        counts = {
+            thread_id: sum(len(checkpoints) for checkpoints in namespaces.values())
+            for thread_id, namespaces in self.saver.storage.items()
+            if thread_ids is None or thread_id in thread_ids
+        }
+        crowded = [thread_id for thread_id, total in counts.items() if total > count]
+        return sorted(crowded, key=lambda thread_id: -counts[thread_id])[:limit]
+
+    async def delete_older(self, thread_id: str, keep: int) -> int:
+        deleted = 0
+        referenced = set()
+        for checkpoint_ns, checkpoints in self.saver.storage[thread_id].items():
+            for checkpoint_id in sorted(checkpoints, reverse=True)[keep:]:
+                del checkpoints[checkpoint_id]
+                self.saver.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+                deleted += 1
+            for checkpoint, _, _ in checkpoints.values():
+                versions = self.saver.serde.loads_typed(checkpoint)["channel_versions"]
+                referenced.update(
+                    (checkpoint_ns, channel, version)
+                    for channel, version in versions.items()
+                )
+        for key in list(self.saver.blobs.keys()):
+            if key[0] == thread_id and key[1:] not in referenced:
+                del self.saver.blobs[key]
+        return deleted
+
+    async def collapse(self, thread_id: str) -> int:
+        for checkpoints in self.saver.storage[thread_id].values():
+            checkpoint_id = max(checkpoints)
+            checkpoint, metadata, _ = checkpoints[checkpoint_id]
+            metadata = {
+                **self.saver.serde.loads_typed(metadata),
+                ARCHIVED_METADATA_KEY: True,
+            }
+            checkpoints[checkpoint_id] = (
+                checkpoint,
+                self.saver.serde.dumps_typed(metadata),
+                None,
+            )
+        return await self.delete_older(thread_id, 1)
+
+    async def thread_bytes(self, thread_id: str) -> int:
+        size = sum(
+            len(checkpoint[1]) + len(metadata[1])
+            for namespaces in self.saver.storage.get(thread_id, {}).values()
+            for checkpoint, metadata, _ in namespaces.values()
+        )
+        size += sum(
+            len(blob[1])
+            for key, blob in self.saver.blobs.items()
+            if key[0] == thread_id
+        )
+        size += sum(
+            len(write[2][1])
+            for key, writes in self.saver.writes.items()
+            if key[0] == thread_id
+            for write in writes.values()
+        )
+        return size
+
+
+def checkpoint_tables(saver: BaseCheckpointSaver) -> CheckpointTables:
+    if isinstance(saver, InMemorySaver):
+        return InMemoryCheckpointTables(saver)
+    return PostgresCheckpointTables(saver)
+
+
+@dataclass
+class RetentionReport:
+    """
+    :ivar pruned_threads: live threads cut down to the latest checkpoints
+    :ivar collapsed_threads: finished threads archived and collapsed into
+        their final checkpoint
+    :ivar deleted_checkpoints: checkpoints removed from the database
+    :ivar reclaimed_bytes: checkpoint storage released
+    :ivar archived_bytes: compressed history exported to the archive
+    """
+
+    pruned_threads: int = 0
+    collapsed_threads: int = 0
+    deleted_checkpoints: int = 0
+    reclaimed_bytes: int = 0
+    archived_bytes: int = 0
+
+
+def checkpoint_record(checkpoint_tuple: CheckpointTuple) -> Dict[str, Any]:
+    configurable = checkpoint_tuple.config["configurable"]
+    parent = (checkpoint_tuple.parent_config or {}).get("configurable", {})
+    return {
+        "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+        "checkpoint_id": configurable["checkpoint_id"],
+        "parent_checkpoint_id": parent.get("checkpoint_id"),
+        "created_at": checkpoint_tuple.checkpoint["ts"],
+        "metadata": checkpoint_tuple.metadata,
+        "values": checkpoint_tuple.checkpoint["channel_values"],
+        "pending_writes": [
+            list(write) for write in checkpoint_tuple.pending_writes or []
+        ],
+    }
+
+
+class CheckpointRetention:
+    """
+    Keeps the checkpoint tables of the graphs from growing with every turn:
+    live threads keep their latest ``keep`` checkpoints, finished threads
+    are exported to the archive and collapsed into their final checkpoint
+    (with its pending writes, so an interrupted thread can still be resumed)
+    """
+
+    def __init__(
+        self,
+        saver: BaseCheckpointSaver,
+        archive: CheckpointArchive,
+        keep: int = CHECKPOINT_RETENTION_KEEP,
+        batch_size: int = CHECKPOINT_RETENTION_BATCH_SIZE,
+    ):
+        self.saver = saver
+        self.archive = archive
+        self.keep = keep
+        self.batch_size = batch_size
+        self.tables = checkpoint_tables(saver)
+
+    async def run(self, finished_thread_ids: Iterable[Any]) -> RetentionReport:
+        """
+        :param finished_thread_ids: threads that will not run again (completed
+            chats, answered validation questions)
+        """
+        report = RetentionReport()
+        finished = [str(thread_id) for thread_id in finished_thread_ids]
+        if len(finished) > 0:
+            for thread_id in await self.tables.threads_over(
+                1, finished, self.batch_size
+            ):
+                await self.collapse(thread_id, report)
+        for thread_id in await self.tables.threads_over(
+            self.keep, None, self.batch_size
+        ):
+            await self.prune(thread_id, report)
+        return report
+
+    async def prune(self, thread_id: str, report: RetentionReport) -> None:
+        size = await self.tables.thread_bytes(thread_id)
+        deleted = await self.tables.delete_older(thread_id, self.keep)
+        reclaimed = max(size - await self.tables.thread_bytes(thread_id), 0)
+        report.pruned_threads += 1
+        report.deleted_checkpoints += deleted
+        report.reclaimed_bytes += reclaimed
+        deleted_checkpoints_counter.add(deleted, {"kind": "pruned"})
+        reclaimed_bytes_counter.add(reclaimed, {"kind": "pruned"})
+
+    async def collapse(self, thread_id: str, report: RetentionReport) -> None:
+        size = await self.tables.thread_bytes(thread_id)
+        history = [
+            checkpoint_tuple
+            async for checkpoint_tuple in self.saver.alist(
+                {"configurable": {"thread_id": thread_id}}
+            )
+        ]
+        final = next(
+            (
+                checkpoint_tuple
+                for checkpoint_tuple in history
+                if checkpoint_tuple.config["configurable"].get("checkpoint_ns", "")
+                == ""
+            ),
+            None,
+        )
+        if final is None:
+            return
+        archived = await self.archive.write(
+            thread_id,
+            [checkpoint_record(checkpoint_tuple) for checkpoint_tuple in history],
+        )
+        # the history is only deleted once it has been archived, a failure
+        # leaves the thread as it was and the next run archives it again
+        deleted = await self.tables.collapse(thread_id)
+        reclaimed = max(size - await self.tables.thread_bytes(thread_id), 0)
+        report.collapsed_threads += 1
+        report.deleted_checkpoints += deleted
+        report.reclaimed_bytes += reclaimed
+        report.archived_bytes += archived
+        deleted_checkpoints_counter.add(deleted, {"kind": "collapsed"})
+        reclaimed_bytes_counter.add(reclaimed, {"kind": "collapsed"})
+        archived_bytes_counter.add(archived)
@@ -0,0 +1,142 @@
+import os
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from opentelemetry import metrics
+
+try:
+    import zstandard
+except ImportError:
+    # compression is optional, the blobs are then stored as plain msgpack
+    zstandard = None
+
+load_dotenv()
+
+CHECKPOINT_COMPRESSION_ENABLED = (
+    os.getenv("CHECKPOINT_COMPRESSION_ENABLED", "true").lower() == "true"
+)
+# blobs below this size are stored as plain msgpack, zstd frames would not
+# pay for their header
+CHECKPOINT_COMPRESSION_MIN_BYTES = int(
+    os.getenv("CHECKPOINT_COMPRESSION_MIN_BYTES", "1024")
+)
+CHECKPOINT_COMPRESSION_LEVEL = int(os.getenv("CHECKPOINT_COMPRESSION_LEVEL", "3"))
+
+# suffix of the blob type of the compressed blobs, e.g. "msgpack+zstd"
+ZSTD_TYPE_SUFFIX = "+zstd"
+# magic and format version written in front of every compressed blob
+ZSTD_HEADER_MAGIC = b"MCK"
+ZSTD_FORMAT_VERSION = 1
+ZSTD_HEADER_SIZE = len(ZSTD_HEADER_MAGIC) + 1
+
+meter = metrics.get_meter(__name__)
+bytes_counter = meter.create_counter(
+    "checkpoint_serde.bytes",
+    unit="By",
+    description="Checkpoint blob bytes before (raw) and after (stored) compression",
+)
+
+
+class CheckpointFormatError(ValueError):
+    """
+    Compressed checkpoint blob with an unknown header or format version
+    """
+
+
+@dataclass
+class CompressionStats:
+    """
+    Sizes of the blobs serialized since the process started
+
+    :ivar blobs: serialized blobs
+    :type blobs: int
+    :ivar compressed: blobs stored compressed
+    :type compressed: int
+    :ivar raw_bytes: msgpack bytes before compression
+    :type raw_bytes: int
+    :ivar stored_bytes: bytes handed to the checkpointer
+    :type stored_bytes: int
+    """
+
+    blobs: int = 0
+    compressed: int = 0
+    raw_bytes: int = 0
+    stored_bytes: int = 0
+
+
+class CompressedSerializer(SerializerProtocol):
+    """
+    Serializer of the langgraph checkpoints: msgpack (through the default
+    JsonPlusSerializer) with the blobs above ``min_bytes`` compressed with
+    zstd. Compressed blobs get their own type (``<type>+zstd``) and a
+    versioned header, everything else is stored exactly like the default
+    serializer does, so checkpoints written before stay readable and small
+    blobs remain readable without this serializer.
+    """
+
+    def __init__(
+        self,
+        inner: Optional[SerializerProtocol] = None,
+        enabled: bool = CHECKPOINT_COMPRESSION_ENABLED,
+        min_bytes: int = CHECKPOINT_COMPRESSION_MIN_BYTES,
+        level: int = CHECKPOINT_COMPRESSION_LEVEL,
+    ):
+        self.inner = inner or JsonPlusSerializer()
+        self.enabled = enabled and zstandard is not None
+        self.min_bytes = min_bytes
+        self.level = level
+        self.stats = CompressionStats()
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.inner.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.inner.loads(data)
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self.inner.dumps_typed(obj)
+        stored_type, stored = type_, data
+        if self.enabled and len(data) >= self.min_bytes:
+            compressed = zstandard.compress(data, self.level)
+            if ZSTD_HEADER_SIZE + len(compressed) < len(data):
+                stored_type = type_ + ZSTD_TYPE_SUFFIX
+                stored = ZSTD_HEADER_MAGIC + bytes([ZSTD_FORMAT_VERSION]) + compressed
+        self.__record(data, stored)
+        return stored_type, stored
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if not type_.endswith(ZSTD_TYPE_SUFFIX):
+            return self.inner.loads_typed(data)
+        return self.inner.loads_typed(
+            (type_[: -len(ZSTD_TYPE_SUFFIX)], decompress(payload))
+        )
+
+    def __record(self, raw: bytes, stored: bytes) -> None:
+        self.stats.blobs += 1
+        self.stats.compressed += stored is not raw
+        self.stats.raw_bytes += len(raw)
+        self.stats.stored_bytes += len(stored)
+        bytes_counter.add(len(raw), {"kind": "raw"})
+        bytes_counter.add(len(stored), {"kind": "stored"})
+
+
+def decompress(payload: bytes) -> bytes:
+    if payload[: len(ZSTD_HEADER_MAGIC)] != ZSTD_HEADER_MAGIC:
+        raise CheckpointFormatError("Compressed checkpoint blob without header")
+    version = payload[len(ZSTD_HEADER_MAGIC)]
+    if version > ZSTD_FORMAT_VERSION:
+        raise CheckpointFormatError(
+            f"Checkpoint blob format {version} is newer than the supported {ZSTD_FORMAT_VERSION}"
+        )
+    if zstandard is None:
+        raise CheckpointFormatError(
+            "Compressed checkpoint blob but zstandard is not installed"
+        )
+    return zstandard.decompress(payload[ZSTD_HEADER_SIZE:])
+
+
+checkpoint_serializer = CompressedSerializer()
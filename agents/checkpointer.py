@@ -0,0 +1,143 @@
+import os
+from typing import Optional, get_args
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.graph import StateGraph
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.types import Durability
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from agents.checkpoint_serde import checkpoint_serializer
+
+load_dotenv()
+
+db_url = os.getenv("PG_VECTOR_DATABASE_URL")
+
+CHECKPOINTER_POOL_MIN_SIZE = int(os.getenv("CHECKPOINTER_POOL_MIN_SIZE", "2"))
+CHECKPOINTER_POOL_MAX_SIZE = int(os.getenv("CHECKPOINTER_POOL_MAX_SIZE", "10"))
+CHECKPOINTER_POOL_TIMEOUT = float(os.getenv("CHECKPOINTER_POOL_TIMEOUT", "30"))
+
+# when the graph runs write their checkpoints: "sync" after every step,
+# "async" after every step without waiting for the write (write-behind),
+# "exit" only when the run is interrupted, fails or ends
+CHECKPOINT_DURABILITY_MODES = get_args(Durability)
+
+_pool: Optional[AsyncConnectionPool] = None
+_saver: Optional[AsyncPostgresSaver] = None
+_compiled_graphs: dict[int, CompiledStateGraph] = {}
+
+
+async def open_checkpointer_pool() -> Optional[AsyncPostgresSaver]:
+    """
+    Opens the process wide connection pool used by the langgraph checkpointers
+    and binds a single AsyncPostgresSaver to it. Meant to be called once from
+    the application lifespan. Calling it again while the pool is open returns
+    the already created saver.
+
+    :return: pooled checkpointer or None when no database url is configured
+    :rtype: Optional[AsyncPostgresSaver]
+    """
+    global _pool, _saver
+    if _saver is not None:
+        return _saver
+    if db_url is None:
+        return None
+    _pool = AsyncConnectionPool(
+        conninfo=db_url,
+        min_size=CHECKPOINTER_POOL_MIN_SIZE,
+        max_size=CHECKPOINTER_POOL_MAX_SIZE,
+        timeout=CHECKPOINTER_POOL_TIMEOUT,
+        name="langgraph-checkpointer",
+        kwargs={
+            "autocommit": True,
+            "prepare_threshold": 0,
+            "row_factory": dict_row,
+        },
+        open=False,
+    )
+    await _pool.open(wait=False)
+    _saver = AsyncPostgresSaver(conn=_pool, serde=checkpoint_serializer)
+    return _saver
+
+
+async def close_checkpointer_pool() -> None:
+    """
+    Closes the process wide checkpointer pool if it has been opened.
+    """
+    global _pool, _saver
+    pool = _pool
+    _pool = None
+    _saver = None
+    _compiled_graphs.clear()
+    if pool is not None:
+        await pool.close()
+
+
+def get_pooled_checkpointer() -> Optional[AsyncPostgresSaver]:
+    """
+    Returns the pooled checkpointer when the pool has been opened, otherwise
+    None so the callers can fall back to a dedicated connection (celery
+    workers, notebooks and evaluation scripts do not run the app lifespan).
+
+    :return: pooled checkpointer or None
+    :rtype: Optional[AsyncPostgresSaver]
+    """
+    return _saver
+
+
+def compile_with_checkpointer(
+    state_builder: StateGraph, checkpointer: AsyncPostgresSaver
+) -> CompiledStateGraph:
+    """
+    Compiles the builder once per pooled checkpointer and reuses the compiled
+    graph for every following request. Dedicated (non pooled) checkpointers
+    get a fresh compilation as they only live for a single request.
+
+    :param state_builder: graph builder to compile
+    :param checkpointer: checkpointer the compiled graph persists through
+    :return: compiled graph
+    :rtype: CompiledStateGraph
+    """
+    if checkpointer is not _saver:
+        return state_builder.compile(checkpointer=checkpointer)
+    key = id(state_builder)
+    compiled = _compiled_graphs.get(key)
+    if compiled is None:
+        compiled = state_builder.compile(checkpointer=checkpointer)
+        _compiled_graphs[key] = compiled
+    return compiled
+
+
+def get_checkpointer_pool_stats() -> Optional[dict[str, int]]:
+    """
+    Returns the psycopg pool usage stats of the checkpointer pool (size,
+    idle connections, waiting requests, accumulated wait time...) or None
+    when the pool is not open.
+
+    :return: pool stats or None
+    :rtype: Optional[dict[str, int]]
+    """
+    if _pool is None:
+        return None
+    return _pool.get_stats()
+
+
+def checkpoint_durability(value: Optional[str], default: Durability) -> Durability:
+    """
+    Durability of a graph run, e.g. from the per graph setting
+
+    :param value: "sync", "async" or "exit", the default when not given
+    :param default: durability used when no value is given
+    :return: durability to pass to the graph run
+    :rtype: Durability
+    :raises ValueError: unknown durability
+    """
+    if value is None or value == "":
+        return default
+    if value not in CHECKPOINT_DURABILITY_MODES:
+        raise ValueError(
+            f"Unknown checkpoint durability {value}, expected one of {', '.join(CHECKPOINT_DURABILITY_MODES)}"
+        )
+    return value
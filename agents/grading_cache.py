@@ -0,0 +1,230 @@
+import os
+import random
+import re
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from opentelemetry import metrics
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.db import async_session
+from db.models import GradingVerdictCache
+
+load_dotenv()
+
+LITE_LLM_API_KEY = os.getenv("OPENAI_API_KEY")
+LITE_LLM_URL = os.getenv("OPENAI_BASE_URL")
+
+GRADING_CACHE_ENABLED = os.getenv("GRADING_CACHE_ENABLED", "true").lower() == "true"
+GRADING_CACHE_EMBEDDING_MODEL = os.getenv(
+    "GRADING_CACHE_EMBEDDING_MODEL", "text-embedding-3-small"
+)
+# cosine similarity an answer needs with a graded one to reuse its verdict
+GRADING_CACHE_THRESHOLD = float(os.getenv("GRADING_CACHE_THRESHOLD", "0.97"))
+# share of the cache hits still graded by the LLM to detect drift
+GRADING_CACHE_SAMPLE_RATE = float(os.getenv("GRADING_CACHE_SAMPLE_RATE", "0.05"))
+
+meter = metrics.get_meter(__name__)
+lookup_counter = meter.create_counter(
+    "grading_cache.lookups",
+    description="Grading verdict cache lookups by result",
+)
+drift_counter = meter.create_counter(
+    "grading_cache.drift",
+    description="Sampled cache hits the LLM graded differently",
+)
+
+
+@dataclass
+class GradingVerdict:
+    """
+    Outcome of grading an answer to a knowledge base question
+
+    :ivar final_grade: Correct or Incorrect
+    :type final_grade: str
+    :ivar completeness: completeness percentage given by the evaluator
+    :type completeness: Optional[int]
+    :ivar response: evaluator response shown to the user
+    :type response: str
+    :ivar id: cache entry the verdict has been read from
+    :type id: Optional[int]
+    :ivar similarity: cosine similarity of the cached answer
+    :type similarity: Optional[float]
+    """
+
+    final_grade: str
+    completeness: Optional[int]
+    response: str
+    id: Optional[int] = None
+    similarity: Optional[float] = None
+
+
+def normalize_answer(answer: str) -> str:
+    return re.sub(r"\s+", " ", answer).strip().lower()
+
+
+class GradingCache:
+    """
+    Semantic cache of the validation evaluator verdicts. Answers to the same
+    knowledge base question are embedded and a verdict is reused when a
+    previously graded answer is at least ``threshold`` similar. A
+    ``sample_rate`` share of the hits is still graded by the LLM and compared
+    with the cached verdict. Verdicts are bound to the version of the grading
+    prompt that produced them.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        embeddings: Embeddings,
+        threshold: float = GRADING_CACHE_THRESHOLD,
+        sample_rate: float = GRADING_CACHE_SAMPLE_RATE,
+    ):
+        self.session_factory = session_factory
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+
+    def should_sample(self) -> bool:
+        return random.random() < self.sample_rate
+
+    async def lookup(
+        self, knowledge_base_id: int, answer: str, prompt_version: Optional[str]
+    ) -> Optional[GradingVerdict]:
+        """
+        Returns the verdict of the most similar graded answer above the
+        threshold
+
+        :param knowledge_base_id: answered knowledge base question
+        :param answer: answer of the user
+        :param prompt_version: version of the grading prompt
+        :return: cached verdict or None on a miss
+        :rtype: Optional[GradingVerdict]
+        """
+        try:
+            return await self.__lookup(knowledge_base_id, answer, prompt_version)
+        except Exception as e:
+            print(f"Grading cache lookup failed: {e}")
+            return None
+
+    async def __lookup(
+        self, knowledge_base_id: int, answer: str, prompt_version: Optional[str]
+    ) -> Optional[GradingVerdict]:
+        embedding = await self.embeddings.aembed_query(normalize_answer(answer))
+        async with self.session_factory() as session:
+            result = await session.execute(
+                text(
+                    """
+                    SELECT id, final_grade, completeness, response,
+                           1 - (embedding <=> CAST(:embedding AS vector)) AS similarity
+                    FROM grading_verdict_cache
+                    WHERE knowledge_base_id = :knowledge_base_id
+                      AND prompt_version IS NOT DISTINCT FROM :prompt_version
+                    ORDER BY embedding <=> CAST(:embedding AS vector)
+                    LIMIT 1
+                    """
+                ),
+                {
+                    "embedding": str(embedding),
+                    "knowledge_base_id": knowledge_base_id,
+                    "prompt_version": prompt_version,
+                },
+            )
+            row = result.first()
+            if row is None or row.similarity < self.threshold:
+                lookup_counter.add(1, {"result": "miss"})
+                return None
+            await session.execute(
+                text("UPDATE grading_verdict_cache SET hits = hits + 1 WHERE id = :id"),
+                {"id": row.id},
+            )
+            await session.commit()
+        lookup_counter.add(1, {"result": "hit"})
+        return GradingVerdict(
+            final_grade=row.final_grade,
+            completeness=row.completeness,
+            response=row.response,
+            id=row.id,
+            similarity=row.similarity,
+        )
+
+    async def store(
+        self,
+        knowledge_base_id: int,
+        answer: str,
+        prompt_version: Optional[str],
+        verdict: GradingVerdict,
+        cached_verdict: Optional[GradingVerdict] = None,
+    ) -> None:
+        """
+        Stores the verdict of the LLM. When the answer has been sampled from a
+        cache hit the cached entry is replaced by the fresh verdict and a
+        differing grade is reported as drift.
+
+        :param knowledge_base_id: answered knowledge base question
+        :param answer: answer of the user
+        :param prompt_version: version of the grading prompt
+        :param verdict: verdict of the LLM
+        :param cached_verdict: verdict served by the cache for the same answer
+        """
+        try:
+            await self.__store(
+                knowledge_base_id, answer, prompt_version, verdict, cached_verdict
+            )
+        except Exception as e:
+            print(f"Grading cache write failed: {e}")
+
+    async def __store(
+        self,
+        knowledge_base_id: int,
+        answer: str,
+        prompt_version: Optional[str],
+        verdict: GradingVerdict,
+        cached_verdict: Optional[GradingVerdict],
+    ) -> None:
+        async with self.session_factory() as session:
+            if cached_verdict is not None and cached_verdict.id is not None:
+                if cached_verdict.final_grade != verdict.final_grade:
+                    drift_counter.add(1)
+                    print(
+                        f"Grading cache drift on knowledge base {knowledge_base_id}: "
+                        f"cached {cached_verdict.final_grade}, "
+                        f"graded {verdict.final_grade}"
+                    )
+                entry = await session.get(GradingVerdictCache, cached_verdict.id)
+                if entry is not None:
+                    entry.final_grade = verdict.final_grade
+                    entry.completeness = verdict.completeness
+                    entry.response = verdict.response
+                    session.add(entry)
+                    await session.commit()
+                    return
+            embedding = await self.embeddings.aembed_query(normalize_answer(answer))
+            session.add(
+                GradingVerdictCache(
+                    knowledge_base_id=knowledge_base_id,
+                    prompt_version=prompt_version,
+                    answer=answer,
+                    embedding=embedding,
+                    final_grade=verdict.final_grade,
+                    completeness=verdict.completeness,
+                    response=verdict.response,
+                )
+            )
+            await session.commit()
+
+
+grading_cache = GradingCache(
+    async_session,
+    OpenAIEmbeddings(
+        model=GRADING_CACHE_EMBEDDING_MODEL,
+        base_url=LITE_LLM_URL,
+        api_key=LITE_LLM_API_KEY,
+        # the proxy gets the text instead of tiktoken token ids
+        check_embedding_ctx_length=False,
+    ),
+)
@@ -10,9 +10,12 @@ from langgraph.prebuilt import create_react_agent
 from pydantic import BaseModel, Field, ValidationError
 from sqlalchemy import Row, RowMapping
 
-from agents.llm_callback import CustomLlmTrackerCallback
+from agents.llm_cache import LLM_CACHE_ENABLED, llm_response_cache
+from agents.llm_callback import LlmTelemetryCallback
+from agents.llm_usage import usage_callbacks
+from agents.state_refs import SkillRef, UserRef
 from db.db import get_session
-from db.models import Grade, UserSkills, User, Skill
+from db.models import Grade, UserSkills
 from service.service import BaseService
 from tools.tools import get_grades_or_expertise
 
@@ -22,7 +25,7 @@ LITE_LLM_API_KEY = os.getenv("OPENAI_API_KEY")
 LITE_LLM_URL = os.getenv("OPENAI_BASE_URL")
 LITE_MODEL = os.getenv("OPENAI_MODEL")
 
-custom_callback = CustomLlmTrackerCallback("guidance")
+custom_callback = LlmTelemetryCallback("guidance")
 
 model = ChatOpenAI(
     temperature=0,
@@ -31,7 +34,10 @@ model = ChatOpenAI(
     base_url=LITE_LLM_URL,
     streaming=True,
     verbose=True,
-    callbacks=[custom_callback],
+    # usage of the streamed answers is only reported when asked for
+    stream_usage=True,
+    callbacks=[custom_callback] + usage_callbacks(),
+    cache=llm_response_cache if LLM_CACHE_ENABLED else False,
 )
 
 
@@ -77,8 +83,8 @@ async def get_current_grade_for_user(
 
 async def provide_guidance(
     msgs: List[str],
-    user: User,
-    skill: Skill,
+    user: UserRef,
+    skill: SkillRef,
 ) -> AsyncGenerator[GuidanceHelperStdOutput, Any]:
     tools = [
         StructuredTool.from_function(
@@ -0,0 +1,329 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration
+from opentelemetry import metrics
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.db import async_session
+from db.models import LLMResponseCacheEntry
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "100000"))
+# the persistent tier is trimmed back to LLM_CACHE_MAX_ROWS every N writes
+LLM_CACHE_EVICT_EVERY = int(os.getenv("LLM_CACHE_EVICT_EVERY", "500"))
+
+# response metadata flag of the answers served from the cache
+LLM_CACHE_HIT_KEY = "llm_cache_hit"
+# response metadata holding the cache key of a cached answer, used to drop
+# answers the calling node could not parse
+LLM_CACHE_KEY_KEY = "llm_cache_key"
+
+CACHE_TIER_MEMORY = "memory"
+CACHE_TIER_PERSISTENT = "persistent"
+
+meter = metrics.get_meter(__name__)
+lookup_counter = meter.create_counter(
+    "llm_cache.lookups",
+    description="LLM response cache lookups by tier and result",
+)
+invalidation_counter = meter.create_counter(
+    "llm_cache.invalidations",
+    description="Cached LLM answers dropped because the calling node could not parse them",
+)
+
+
+@dataclass
+class LLMCacheStats:
+    """
+    Lookup counters of the LLM response cache since the process started
+
+    :ivar memory_hits: lookups answered by the in-process tier
+    :type memory_hits: int
+    :ivar persistent_hits: lookups answered by the Postgres tier
+    :type persistent_hits: int
+    :ivar misses: lookups that went to the model
+    :type misses: int
+    :ivar writes: responses stored
+    :type writes: int
+    """
+
+    memory_hits: int = 0
+    persistent_hits: int = 0
+    misses: int = 0
+    writes: int = 0
+
+
+def build_cache_key(prompt: str, llm_string: str) -> str:
+    """
+    Canonical hash of a model call. ``llm_string`` is the serialized model
+    with its parameters and stop sequences and ``prompt`` the serialized
+    messages, both produced by langchain.
+    """
+    payload = json.dumps([llm_string, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def mark_cache_hit(generations: RETURN_VAL_TYPE) -> RETURN_VAL_TYPE:
+    """
+    Copies of the cached generations flagged as cache hits, so the usage
+    accounting does not bill them again
+    """
+    marked = []
+    for generation in generations:
+        if isinstance(generation, ChatGeneration):
+            metadata = {**generation.message.response_metadata, LLM_CACHE_HIT_KEY: True}
+            message = generation.message.model_copy(
+                update={"response_metadata": metadata}
+            )
+            generation = generation.model_copy(update={"message": message})
+        marked.append(generation)
+    return marked
+
+
+def tag_cache_key(generations: RETURN_VAL_TYPE, key: str) -> None:
+    """
+    Adds the cache key to the messages of the generations, langchain returns
+    the very generations it hands to the cache to the caller
+    """
+    for generation in generations:
+        if isinstance(generation, ChatGeneration):
+            generation.message.response_metadata[LLM_CACHE_KEY_KEY] = key
+
+
+class LLMResponseCache(BaseCache):
+    """
+    Exact match LangChain cache for deterministic (temperature 0) model calls.
+    Responses live in an in-process LRU tier in front of a Postgres tier that
+    is shared by the workers; both expire entries after ``ttl`` seconds and the
+    Postgres tier is trimmed to ``max_rows`` by last hit. The persistent tier is
+    only used by the async calls, a failing database degrades to a miss.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        memory_size: int = LLM_CACHE_MEMORY_SIZE,
+        ttl: float = LLM_CACHE_TTL,
+        max_rows: int = LLM_CACHE_MAX_ROWS,
+        evict_every: int = LLM_CACHE_EVICT_EVERY,
+    ):
+        self.session_factory = session_factory
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.evict_every = evict_every
+        self.stats = LLMCacheStats()
+        self.__memory: OrderedDict[str, Tuple[float, RETURN_VAL_TYPE]] = OrderedDict()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        generations = self.__memory_get(build_cache_key(prompt, llm_string))
+        if generations is None:
+            self.__record(None)
+            return None
+        self.__record(CACHE_TIER_MEMORY)
+        return mark_cache_hit(generations)
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = build_cache_key(prompt, llm_string)
+        tag_cache_key(return_val, key)
+        self.__memory_set(key, return_val)
+        self.stats.writes += 1
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = build_cache_key(prompt, llm_string)
+        generations = self.__memory_get(key)
+        if generations is not None:
+            self.__record(CACHE_TIER_MEMORY)
+            return mark_cache_hit(generations)
+        generations = await self.__persistent_get(key)
+        if generations is not None:
+            self.__memory_set(key, generations)
+            self.__record(CACHE_TIER_PERSISTENT)
+            return mark_cache_hit(generations)
+        self.__record(None)
+        return None
+
+    async def aupdate(
+        self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE
+    ) -> None:
+        key = build_cache_key(prompt, llm_string)
+        tag_cache_key(return_val, key)
+        self.__memory_set(key, return_val)
+        self.stats.writes += 1
+        await self.__persistent_set(key, llm_string, return_val)
+        if self.evict_every > 0 and self.stats.writes % self.evict_every == 0:
+            await self.evict()
+
+    async def ainvalidate(self, message: BaseMessage) -> bool:
+        """
+        Drops the cached answer a model call returned, e.g. when the calling
+        node can not parse it, so its retry asks the model again instead of
+        replaying the same answer
+
+        :param message: message returned by a model using this cache
+        :return: whether the message came from (or went to) the cache
+        :rtype: bool
+        """
+        key = message.response_metadata.get(LLM_CACHE_KEY_KEY)
+        if key is None:
+            return False
+        self.__memory.pop(key, None)
+        invalidation_counter.add(1)
+        if self.session_factory is None:
+            return True
+        try:
+            async with self.session_factory() as session:
+                await session.execute(
+                    text("DELETE FROM llm_response_cache WHERE key = :key"),
+                    {"key": key},
+                )
+                await session.commit()
+        except Exception as e:
+            print(f"LLM cache invalidation failed: {e}")
+        return True
+
+    def clear(self, **kwargs: Any) -> None:
+        self.__memory.clear()
+
+    async def aclear(self, **kwargs: Any) -> None:
+        self.__memory.clear()
+        if self.session_factory is None:
+            return
+        async with self.session_factory() as session:
+            await session.execute(text("DELETE FROM llm_response_cache"))
+            await session.commit()
+
+    async def evict(self) -> None:
+        """
+        Drops the expired entries of the persistent tier and the least recently
+        hit ones above ``max_rows``
+        """
+        if self.session_factory is None:
+            return
+        try:
+            async with self.session_factory() as session:
+                await session.execute(
+                    text("DELETE FROM llm_response_cache WHERE expires_at <= now()")
+                )
+                await session.execute(
+                    text(
+                        """
+                        DELETE FROM llm_response_cache
+                        WHERE key IN (
+                            SELECT key
+                            FROM llm_response_cache
+                            ORDER BY last_hit_at DESC
+                            OFFSET :max_rows
+                        )
+                        """
+                    ),
+                    {"max_rows": self.max_rows},
+                )
+                await session.commit()
+        except Exception as e:
+            print(f"LLM cache eviction failed: {e}")
+
+    def __record(self, tier: Optional[str]) -> None:
+        if tier == CACHE_TIER_MEMORY:
+            self.stats.memory_hits += 1
+        elif tier == CACHE_TIER_PERSISTENT:
+            self.stats.persistent_hits += 1
+        else:
+            self.stats.misses += 1
+        lookup_counter.add(
+            1, {"result": "miss" if tier is None else "hit", "tier": tier or "none"}
+        )
+
+    def __memory_get(self, key: str) -> Optional[RETURN_VAL_TYPE]:
+        entry = self.__memory.get(key)
+        if entry is None:
+            return None
+        expires_at, generations = entry
+        if expires_at <= time.monotonic():
+            del self.__memory[key]
+            return None
+        self.__memory.move_to_end(key)
+        return generations
+
+    def __memory_set(self, key: str, generations: RETURN_VAL_TYPE) -> None:
+        self.__memory[key] = (time.monotonic() + self.ttl, generations)
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.memory_size:
+            self.__memory.popitem(last=False)
+
+    async def __persistent_get(self, key: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.session_factory is None:
+            return None
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    text(
+                        """
+                        UPDATE llm_response_cache
+                        SET hits = hits + 1, last_hit_at = now()
+                        WHERE key = :key AND expires_at > now()
+                        RETURNING generations
+                        """
+                    ),
+                    {"key": key},
+                )
+                row = result.first()
+                await session.commit()
+        except Exception as e:
+            print(f"LLM cache read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return [loads(generation) for generation in json.loads(row.generations)]
+
+    async def __persistent_set(
+        self, key: str, llm_string: str, generations: RETURN_VAL_TYPE
+    ) -> None:
+        if self.session_factory is None:
+            return
+        now = datetime.now()
+        values = {
+            "key": key,
+            "llm_string": llm_string,
+            "generations": json.dumps(
+                [dumps(generation) for generation in generations]
+            ),
+            "created_at": now,
+            "last_hit_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl),
+        }
+        statement = insert(LLMResponseCacheEntry).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[LLMResponseCacheEntry.key],
+            set_={
+                "generations": statement.excluded.generations,
+                "last_hit_at": statement.excluded.last_hit_at,
+                "expires_at": statement.excluded.expires_at,
+            },
+        )
+        try:
+            async with self.session_factory() as session:
+                await session.execute(statement)
+                await session.commit()
+        except Exception as e:
+            print(f"LLM cache write failed: {e}")
+
+
+llm_response_cache = LLMResponseCache(session_factory=async_session)
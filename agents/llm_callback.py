@@ -1,249 +1,89 @@
-from typing import Any, Optional, Sequence, Union
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
 from uuid import UUID
 
-from langchain_core.agents import AgentFinish, AgentAction
+from dotenv import load_dotenv
 from langchain_core.callbacks import BaseCallbackHandler
-from langchain_core.documents import Document
 from langchain_core.messages import BaseMessage
-from langchain_core.outputs import LLMResult, GenerationChunk, ChatGenerationChunk
-from opentelemetry import trace
-from tenacity import RetryCallState
+from langchain_core.outputs import ChatGenerationChunk, GenerationChunk, LLMResult
+from opentelemetry import metrics, trace
+from opentelemetry.trace import Span, Status, StatusCode
 
+from agents.llm_usage import USAGE_NODE_KEY
 
-tracer = trace.get_tracer(__name__)
-
+load_dotenv()
 
-class CustomLlmTrackerCallback(BaseCallbackHandler):
+LLM_TELEMETRY_ENABLED = os.getenv("LLM_TELEMETRY_ENABLED", "true").lower() == "true"
+# share of the calls whose prompt and answer are attached to the span, off by
+# default as they hold the answers of the users
+LLM_PAYLOAD_SAMPLE_RATE = float(os.getenv("LLM_PAYLOAD_SAMPLE_RATE", "0"))
+# characters of the captured prompt and answer
+LLM_PAYLOAD_MAX_CHARS = int(os.getenv("LLM_PAYLOAD_MAX_CHARS", "2000"))
 
-    def __init__(self, name):
+tracer = trace.get_tracer(__name__)
+meter = metrics.get_meter(__name__)
+latency_histogram = meter.create_histogram(
+    "llm.latency", unit="s", description="Duration of the model calls by model and node"
+)
+ttft_histogram = meter.create_histogram(
+    "llm.time_to_first_token",
+    unit="s",
+    description="Time until the first streamed token by model and node",
+)
+token_counter = meter.create_counter(
+    "llm.tokens",
+    description="Prompt and completion tokens of the model calls by model and node",
+)
+error_counter = meter.create_counter(
+    "llm.errors", description="Failed model calls by model, node and error type"
+)
+
+
+@dataclass
+class _RunSpan:
+    span: Span
+    started: float
+    attributes: Dict[str, str]
+    first_token: Optional[float] = None
+    capture: bool = False
+
+
+def truncate(text: str, max_chars: int = LLM_PAYLOAD_MAX_CHARS) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"... [{len(text) - max_chars} more]"
+
+
+class LlmTelemetryCallback(BaseCallbackHandler):
+    """
+    Records the latency, time to first token, tokens and errors of the model
+    calls as OpenTelemetry metrics, tagged with the model and the graph node,
+    and one span per call under the span of the current request. Only
+    primitive attributes are set; the prompt and the answer are attached to a
+    sampled share of the spans (``LLM_PAYLOAD_SAMPLE_RATE``), truncated.
+    Chain, tool and agent events are not tracked, the graph nodes are
+    covered by the langgraph metadata of the model calls.
+
+    :param name: component the calls are attributed to outside of a graph
+    """
+
+    # cheap bookkeeping only, inline keeps the spans in the request context
+    run_inline = True
+
+    def __init__(
+        self,
+        name: str,
+        sample_rate: float = LLM_PAYLOAD_SAMPLE_RATE,
+        tracer: trace.Tracer = tracer,
+    ):
         super().__init__()
         self._name = name
-
-    def on_llm_new_token(
-        self,
-        token: str,
-        *,
-        chunk: Optional[Union[GenerationChunk, ChatGenerationChunk]] = None,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        pass
-
-    def on_llm_end(
-        self,
-        response: LLMResult,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_llm_end") as span:
-            span.set_attribute(f"{self._name}_llm.on_llm_error.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_llm_error.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_llm_error.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_llm_error.response", response)
-        return super().on_llm_end(
-            response, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_llm_error(
-        self,
-        error: BaseException,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_llm_error") as span:
-            span.set_attribute(f"{self._name}_llm.on_llm_error.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_llm_error.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_llm_error.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_llm_error.error", error)
-        return super().on_llm_error(
-            error, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_chain_end(
-        self,
-        outputs: dict[str, Any],
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_chain_end") as span:
-            span.set_attribute(f"{self._name}_llm.on_chain_end.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_chain_end.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_chain_end.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_chain_end.outputs", outputs)
-        return super().on_chain_end(
-            outputs, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_chain_error(
-        self,
-        error: BaseException,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_chain_error") as span:
-            span.set_attribute(f"{self._name}_llm.on_chain_error.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_chain_error.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_chain_error.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_chain_error.outputs", error)
-        return super().on_chain_error(
-            error, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_agent_action(
-        self,
-        action: AgentAction,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_agent_action") as span:
-            span.set_attribute(f"{self._name}_llm.on_agent_action.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_agent_action.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_agent_action.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_agent_action.outputs", action)
-        return super().on_agent_action(
-            action, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_agent_finish(
-        self,
-        finish: AgentFinish,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_agent_finish") as span:
-            span.set_attribute(f"{self._name}_llm.on_agent_finish.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_agent_finish.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_agent_finish.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_agent_finish.outputs", finish)
-        return super().on_agent_finish(
-            finish, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_tool_end(
-        self,
-        output: Any,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_tool_end") as span:
-            span.set_attribute(f"{self._name}_llm.on_tool_end.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_tool_end.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_tool_end.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_tool_end.outputs", output)
-        return super().on_tool_end(
-            output, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_tool_error(
-        self,
-        error: BaseException,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span(f"{self._name}_on_tool_error") as span:
-            span.set_attribute(f"{self._name}_llm.on_tool_error.run_id", run_id)
-            span.set_attribute(
-                f"{self._name}_llm.on_tool_error.parent_run_id", parent_run_id
-            )
-            span.set_attribute(f"{self._name}_llm.on_tool_error.kwargs", kwargs)
-            span.set_attribute(f"{self._name}_llm.on_tool_error.outputs", error)
-        return super().on_tool_error(
-            error, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_retriever_error(
-        self,
-        error: BaseException,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span("on_retriever_error") as span:
-            span.set_attribute("llm.on_retriever_error.run_id", run_id)
-            span.set_attribute("llm.on_retriever_error.parent_run_id", parent_run_id)
-            span.set_attribute("llm.on_retriever_error.kwargs", kwargs)
-            span.set_attribute("llm.on_retriever_error.outputs", error)
-        return super().on_retriever_error(
-            error, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_retriever_end(
-        self,
-        documents: Sequence[Document],
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span("on_retriever_end") as span:
-            span.set_attribute("llm.on_retriever_end.run_id", run_id)
-            span.set_attribute("llm.on_retriever_end.parent_run_id", parent_run_id)
-            span.set_attribute("llm.on_retriever_end.kwargs", kwargs)
-            span.set_attribute("llm.on_retriever_end.outputs", documents)
-        return super().on_retriever_end(
-            documents, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_llm_start(
-        self,
-        serialized: dict[str, Any],
-        prompts: list[str],
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        tags: Optional[list[str]] = None,
-        metadata: Optional[dict[str, Any]] = None,
-        **kwargs: Any,
-    ) -> Any:
-        with tracer.start_as_current_span("on_llm_start") as span:
-            span.set_attribute("llm.on_llm_start.run_id", str(run_id))
-            span.set_attribute("llm.on_llm_start.parent_run_id", str(parent_run_id))
-            span.set_attribute("llm.on_llm_start.kwargs", str(kwargs))
-            span.set_attribute("llm.on_llm_start.outputs", str(serialized))
-            span.set_attribute("llm.on_llm_start.prompts", str(prompts))
-            span.set_attribute("llm.on_llm_start.tags", str(tags))
-            span.set_attribute("llm.on_llm_start.metadata", str(metadata))
-        return super().on_llm_start(
-            serialized,
-            prompts,
-            run_id=run_id,
-            parent_run_id=parent_run_id,
-            tags=tags,
-            metadata=metadata,
-            **kwargs,
-        )
+        self.sample_rate = sample_rate
+        self.tracer = tracer
+        self.__runs: Dict[UUID, _RunSpan] = {}
 
     def on_chat_model_start(
         self,
@@ -256,49 +96,14 @@ class CustomLlmTrackerCallback(BaseCallbackHandler):
         metadata: Optional[dict[str, Any]] = None,
         **kwargs: Any,
     ) -> Any:
-        with tracer.start_as_current_span("on_chat_model_start") as span:
-            span.set_attribute("llm.on_chat_model_start.run_id", run_id)
-            span.set_attribute("llm.on_chat_model_start.parent_run_id", parent_run_id)
-            span.set_attribute("llm.on_chat_model_start.kwargs", kwargs)
-            span.set_attribute("llm.on_chat_model_start.outputs", serialized)
-            span.set_attribute("llm.on_chat_model_start.serialized", serialized)
-            span.set_attribute("llm.on_chat_model_start.messages", messages)
-            span.set_attribute("llm.on_chat_model_start.metadata", metadata)
-        return super().on_chat_model_start(
-            serialized,
-            messages,
-            run_id=run_id,
-            parent_run_id=parent_run_id,
-            tags=tags,
-            metadata=metadata,
-            **kwargs,
-        )
+        run = self.__start(run_id, metadata)
+        if run.capture and len(messages) > 0 and len(messages[0]) > 0:
+            run.span.set_attribute("llm.prompt", truncate(str(messages[0][-1].content)))
 
-    def on_retriever_start(
-        self,
-        serialized: dict[str, Any],
-        query: str,
-        *,
-        run_id: UUID,
-        parent_run_id: Optional[UUID] = None,
-        tags: Optional[list[str]] = None,
-        metadata: Optional[dict[str, Any]] = None,
-        **kwargs: Any,
-    ) -> Any:
-        return super().on_retriever_start(
-            serialized,
-            query,
-            run_id=run_id,
-            parent_run_id=parent_run_id,
-            tags=tags,
-            metadata=metadata,
-            **kwargs,
-        )
-
-    def on_chain_start(
+    def on_llm_start(
         self,
         serialized: dict[str, Any],
-        inputs: dict[str, Any],
+        prompts: list[str],
         *,
         run_id: UUID,
         parent_run_id: Optional[UUID] = None,
@@ -306,73 +111,122 @@ class CustomLlmTrackerCallback(BaseCallbackHandler):
         metadata: Optional[dict[str, Any]] = None,
         **kwargs: Any,
     ) -> Any:
-        return super().on_chain_start(
-            serialized,
-            inputs,
-            run_id=run_id,
-            parent_run_id=parent_run_id,
-            tags=tags,
-            metadata=metadata,
-            **kwargs,
-        )
+        run = self.__start(run_id, metadata)
+        if run.capture and len(prompts) > 0:
+            run.span.set_attribute("llm.prompt", truncate(prompts[-1]))
 
-    def on_tool_start(
+    def on_llm_new_token(
         self,
-        serialized: dict[str, Any],
-        input_str: str,
+        token: str,
         *,
+        chunk: Optional[Union[GenerationChunk, ChatGenerationChunk]] = None,
         run_id: UUID,
         parent_run_id: Optional[UUID] = None,
-        tags: Optional[list[str]] = None,
-        metadata: Optional[dict[str, Any]] = None,
-        inputs: Optional[dict[str, Any]] = None,
         **kwargs: Any,
     ) -> Any:
-        return super().on_tool_start(
-            serialized,
-            input_str,
-            run_id=run_id,
-            parent_run_id=parent_run_id,
-            tags=tags,
-            metadata=metadata,
-            inputs=inputs,
-            **kwargs,
-        )
+        run = self.__runs.get(run_id)
+        if run is not None and run.first_token is None:
+            run.first_token = time.perf_counter()
 
-    def on_text(
+    def on_llm_end(
         self,
-        text: str,
+        response: LLMResult,
         *,
         run_id: UUID,
         parent_run_id: Optional[UUID] = None,
         **kwargs: Any,
     ) -> Any:
-        return super().on_text(
-            text, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
+        run = self.__runs.pop(run_id, None)
+        if run is None:
+            return
+        attributes = run.attributes
+        llm_output = response.llm_output or {}
+        model = llm_output.get("model_name")
+        prompt_tokens = completion_tokens = 0
+        answers: List[str] = []
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+                if message is not None:
+                    model = message.response_metadata.get("model_name") or model
+                if run.capture:
+                    answers.append(generation.text)
+        if model is not None:
+            attributes = {**attributes, "model": model}
+        self.__record_latency(run, attributes)
+        if prompt_tokens > 0:
+            token_counter.add(prompt_tokens, {**attributes, "type": "prompt"})
+        if completion_tokens > 0:
+            token_counter.add(completion_tokens, {**attributes, "type": "completion"})
+        span = run.span
+        span.set_attribute("llm.response.model", attributes["model"])
+        span.set_attribute("llm.usage.prompt_tokens", prompt_tokens)
+        span.set_attribute("llm.usage.completion_tokens", completion_tokens)
+        if run.capture:
+            span.set_attribute("llm.completion", truncate("\n".join(answers)))
+        span.end()
 
-    def on_retry(
+    def on_llm_error(
         self,
-        retry_state: RetryCallState,
+        error: BaseException,
         *,
         run_id: UUID,
         parent_run_id: Optional[UUID] = None,
         **kwargs: Any,
     ) -> Any:
-        return super().on_retry(
-            retry_state, run_id=run_id, parent_run_id=parent_run_id, **kwargs
-        )
-
-    def on_custom_event(
-        self,
-        name: str,
-        data: Any,
-        *,
-        run_id: UUID,
-        tags: Optional[list[str]] = None,
-        metadata: Optional[dict[str, Any]] = None,
-        **kwargs: Any,
-    ) -> Any:
-        return super().on_custom_event(
-            name, data, run_id=run_id, tags=tags, metadata=metadata, **kwargs
-        )
+        run = self.__runs.pop(run_id, None)
+        if run is None:
+            return
+        attributes = {**run.attributes, "error": type(error).__name__}
+        self.__record_latency(run, attributes)
+        error_counter.add(1, attributes)
+        # truncated, provider errors may echo large parts of the request
+        run.span.set_status(Status(StatusCode.ERROR, truncate(str(error), 500)))
+        run.span.set_attribute("error.type", attributes["error"])
+        run.span.end()
+
+    def __start(self, run_id: UUID, metadata: Optional[dict[str, Any]]) -> _RunSpan:
+        metadata = metadata or {}
+        attributes = {
+            "model": str(metadata.get("ls_model_name", "unknown")),
+            "node": str(
+                metadata.get(USAGE_NODE_KEY)
+                or metadata.get("langgraph_node")
+                or self._name
+            ),
+        }
+        # the span of the current request (or graph node) is the parent
+        span = self.tracer.start_span(
+            f"llm {attributes['node']}",
+            kind=trace.SpanKind.CLIENT,
+            attributes={**attributes, "llm.component": self._name},
+        )
+        run = _RunSpan(
+            span=span,
+            started=time.perf_counter(),
+            attributes=attributes,
+            capture=self.sample_rate > 0 and random.random() < self.sample_rate,
+        )
+        self.__runs[run_id] = run
+        return run
+
+    def __record_latency(self, run: _RunSpan, attributes: Dict[str, str]) -> None:
+        now = time.perf_counter()
+        latency_histogram.record(now - run.started, attributes)
+        if run.first_token is not None:
+            ttft = run.first_token - run.started
+            ttft_histogram.record(ttft, attributes)
+            run.span.set_attribute("llm.time_to_first_token", ttft)
+
+
+llm_telemetry_callback = LlmTelemetryCallback("llm")
+
+
+def telemetry_callbacks() -> list:
+    """
+    Callbacks the chat models are created with
+    """
+    return [llm_telemetry_callback] if LLM_TELEMETRY_ENABLED else []
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import weakref
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+from agents.llm_cache import LLM_CACHE_ENABLED, llm_response_cache
+from agents.llm_callback import telemetry_callbacks
+from agents.llm_usage import usage_callbacks
+
+load_dotenv()
+
+LITE_LLM_API_KEY = os.getenv("OPENAI_API_KEY")
+LITE_LLM_URL = os.getenv("OPENAI_BASE_URL")
+
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# multiplexes the concurrent calls of the graph nodes over the pooled
+# connections, needs httpx[http2] (declared in the Pipfile), false falls back to
+# keep-alive http/1.1 connections
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+
+
+@dataclass(frozen=True)
+class LLMClientKey:
+    """
+    Configuration a chat model is shared by
+
+    :ivar model: litellm model name
+    :type model: str
+    :ivar temperature: sampling temperature
+    :type temperature: float
+    :ivar max_tokens: completion token limit
+    :type max_tokens: Optional[int]
+    :ivar stop: stop sequences
+    :type stop: Optional[Tuple[str, ...]]
+    :ivar top_p: nucleus sampling
+    :type top_p: Optional[float]
+    :ivar streaming: stream the completion tokens
+    :type streaming: bool
+    :ivar verbose: log the calls through the langchain callbacks
+    :type verbose: bool
+    :ivar cache: answer repeated calls from the response cache
+    :type cache: bool
+    """
+
+    model: str
+    temperature: float = 0
+    max_tokens: Optional[int] = None
+    stop: Optional[Tuple[str, ...]] = None
+    top_p: Optional[float] = None
+    streaming: bool = False
+    verbose: bool = False
+    cache: bool = False
+
+
+@dataclass
+class _LoopClients:
+    http_client: httpx.AsyncClient
+    models: Dict[LLMClientKey, ChatOpenAI] = field(default_factory=dict)
+
+
+# httpx connections belong to the event loop they were opened in and the
+# celery tasks run every task in a new loop, so the pool is kept per loop
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopClients]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=LLM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def _get_loop_clients() -> _LoopClients:
+    loop = asyncio.get_running_loop()
+    clients = _loop_clients.get(loop)
+    if clients is None or clients.http_client.is_closed:
+        clients = _LoopClients(http_client=_create_http_client())
+        _loop_clients[loop] = clients
+    return clients
+
+
+def get_chat_model(
+    model: str,
+    temperature: float = 0,
+    max_tokens: Optional[int] = None,
+    stop: Optional[List[str]] = None,
+    top_p: Optional[float] = None,
+    streaming: bool = False,
+    verbose: bool = False,
+    cache: Optional[bool] = None,
+) -> ChatOpenAI:
+    """
+    Returns the chat model for the given configuration. Models are created
+    once per configuration and all of them share one pooled http client to
+    the LiteLLM proxy, so the nodes reuse open connections instead of paying
+    for a new TLS handshake per call. The returned model is shared and must
+    not be mutated, use ``bind``/``with_config`` for per call settings.
+
+    :param model: litellm model name
+    :param temperature: sampling temperature
+    :param max_tokens: completion token limit
+    :param stop: stop sequences
+    :param top_p: nucleus sampling
+    :param streaming: stream the completion tokens
+    :param verbose: log the calls through the langchain callbacks
+    :param cache: answer repeated calls from the exact match response cache,
+        by default every temperature 0 model does
+    :return: shared chat model
+    :rtype: ChatOpenAI
+    """
+    if cache is None:
+        cache = temperature == 0
+    key = LLMClientKey(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stop=tuple(stop) if stop is not None else None,
+        top_p=top_p,
+        streaming=streaming,
+        verbose=verbose,
+        cache=cache and LLM_CACHE_ENABLED,
+    )
+    clients = _get_loop_clients()
+    chat_model = clients.models.get(key)
+    if chat_model is None:
+        chat_model = ChatOpenAI(
+            model=key.model,
+            base_url=LITE_LLM_URL,
+            api_key=LITE_LLM_API_KEY,
+            temperature=key.temperature,
+            max_tokens=key.max_tokens,
+            stop=list(key.stop) if key.stop is not None else None,
+            top_p=key.top_p,
+            streaming=key.streaming,
+            # usage of the streamed answers is only reported when asked for
+            stream_usage=key.streaming,
+            verbose=key.verbose,
+            callbacks=telemetry_callbacks() + usage_callbacks(),
+            cache=llm_response_cache if key.cache else False,
+            http_async_client=clients.http_client,
+        )
+        clients.models[key] = chat_model
+    return chat_model
+
+
+async def close_llm_clients() -> None:
+    """
+    Closes the pooled http client of the running event loop, meant to be
+    called on application shutdown.
+    """
+    clients = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients.http_client.aclose()
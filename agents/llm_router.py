@@ -0,0 +1,454 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import openai
+from dotenv import load_dotenv
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from opentelemetry import metrics
+
+load_dotenv()
+
+LITE_MODEL = os.getenv("OPENAI_MODEL")
+LITE_OPENAI_O3_MODEL = os.getenv("LITE_OPENAI_O3_MODEL")
+
+LLM_ROUTING_ENABLED = os.getenv("LLM_ROUTING_ENABLED", "true").lower() == "true"
+# json object of the LLMChatBuilder model names to their ordered litellm models
+LLM_FALLBACK_CHAINS = os.getenv("LLM_FALLBACK_CHAINS")
+LLM_ROUTER_TIMEOUT = float(os.getenv("LLM_ROUTER_TIMEOUT_SECONDS", "60"))
+# calls per model the error rate and the latency percentiles are computed on
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "50"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# successful calls needed before the percentile is trusted for hedging
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "0.5"))
+
+meter = metrics.get_meter(__name__)
+latency_histogram = meter.create_histogram(
+    "llm_router.latency",
+    unit="s",
+    description="LLM call latency by model and outcome",
+)
+error_counter = meter.create_counter(
+    "llm_router.errors",
+    description="Failed LLM calls by model and error kind",
+)
+fallback_counter = meter.create_counter(
+    "llm_router.fallbacks",
+    description="Calls served by a fallback model",
+)
+hedge_counter = meter.create_counter(
+    "llm_router.hedges",
+    description="Hedged LLM requests by model and whether the hedge won",
+)
+breaker_counter = meter.create_counter(
+    "llm_router.breaker_transitions",
+    description="Circuit breaker state changes by model",
+)
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+def load_fallback_chains() -> Dict[str, List[str]]:
+    if LLM_FALLBACK_CHAINS is not None:
+        return json.loads(LLM_FALLBACK_CHAINS)
+    chains = {
+        "gpt-4o": [LITE_MODEL, LITE_OPENAI_O3_MODEL],
+        "gpt-o3-mini": [LITE_OPENAI_O3_MODEL, LITE_MODEL],
+    }
+    return {
+        role: list(dict.fromkeys(model for model in chain if model is not None))
+        for role, chain in chains.items()
+    }
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether another model could answer the call. Client errors such as an
+    invalid request or a content policy refusal fail the same way everywhere.
+    """
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 409, 429)
+    return isinstance(error, Exception)
+
+
+class CircuitBreaker:
+    """
+    Error rate circuit breaker of a model. Opens once ``error_rate`` of the
+    last ``window`` calls failed (with at least ``min_calls`` of them), lets a
+    single trial call through after ``cooldown`` seconds and closes again
+    when the trial succeeds.
+    """
+
+    def __init__(
+        self,
+        window: int = LLM_ROUTER_WINDOW,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        error_rate: float = LLM_BREAKER_ERROR_RATE,
+        cooldown: float = LLM_BREAKER_COOLDOWN,
+    ):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.outcomes: deque = deque(maxlen=window)
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return BREAKER_CLOSED
+        if self.trial_in_flight or time.monotonic() - self.opened_at >= self.cooldown:
+            return BREAKER_HALF_OPEN
+        return BREAKER_OPEN
+
+    def allow(self) -> Optional[str]:
+        """
+        :return: the permit of the call, the state it was let through in
+            (``BREAKER_HALF_OPEN`` for the trial call), None when refused
+        :rtype: Optional[str]
+        """
+        state = self.state
+        if state == BREAKER_CLOSED:
+            return BREAKER_CLOSED
+        if state == BREAKER_HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return BREAKER_HALF_OPEN
+        return None
+
+    def release(self, permit: Optional[str]) -> None:
+        """
+        Gives the trial back when the trial call was cancelled before it
+        finished, the other cancelled calls never held it
+        """
+        if permit == BREAKER_HALF_OPEN:
+            self.trial_in_flight = False
+
+    def record(self, success: bool, permit: Optional[str] = None) -> Optional[str]:
+        """
+        :param success: outcome of the call
+        :param permit: permit the call got from :meth:`allow`
+        :return: the new state when the call changed it
+        :rtype: Optional[str]
+        """
+        if self.opened_at is not None:
+            if permit != BREAKER_HALF_OPEN:
+                # a call started before the breaker opened or let through
+                # with every breaker open, only the trial decides
+                return None
+            self.trial_in_flight = False
+            if success:
+                self.opened_at = None
+                self.outcomes.clear()
+                return BREAKER_CLOSED
+            self.opened_at = time.monotonic()
+            return BREAKER_OPEN
+        self.outcomes.append(success)
+        failures = self.outcomes.count(False)
+        if (
+            len(self.outcomes) >= self.min_calls
+            and failures / len(self.outcomes) >= self.error_rate
+        ):
+            self.opened_at = time.monotonic()
+            return BREAKER_OPEN
+        return None
+
+
+@dataclass
+class ModelStats:
+    """
+    Health of a model since the process started
+
+    :ivar calls: finished calls
+    :type calls: int
+    :ivar errors: failed or timed out calls
+    :type errors: int
+    :ivar hedges: hedged requests sent to the model
+    :type hedges: int
+    :ivar hedge_wins: hedged requests that answered first
+    :type hedge_wins: int
+    :ivar p95: recent 95th latency percentile in seconds
+    :type p95: Optional[float]
+    :ivar breaker: circuit breaker state
+    :type breaker: str
+    """
+
+    calls: int
+    errors: int
+    hedges: int
+    hedge_wins: int
+    p95: Optional[float]
+    breaker: str
+
+
+class ModelHealth:
+    """
+    Latency window, error counts and circuit breaker of a model, shared by
+    every chat model routed to it
+    """
+
+    def __init__(self, model: str, window: int = LLM_ROUTER_WINDOW):
+        self.model = model
+        self.breaker = CircuitBreaker(window=window)
+        self.latencies: deque = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if len(self.latencies) == 0:
+            return None
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(percentile * len(latencies)))
+        return latencies[index]
+
+    def record(
+        self,
+        latency: float,
+        error: Optional[BaseException] = None,
+        permit: Optional[str] = None,
+    ) -> None:
+        self.calls += 1
+        outcome = "success"
+        if error is None:
+            self.latencies.append(latency)
+        else:
+            self.errors += 1
+            outcome = "error"
+            error_counter.add(1, {"model": self.model, "kind": type(error).__name__})
+        latency_histogram.record(latency, {"model": self.model, "outcome": outcome})
+        transition = self.breaker.record(error is None, permit)
+        if transition is not None:
+            print(f"LLM circuit breaker of {self.model} is {transition}")
+            breaker_counter.add(1, {"model": self.model, "state": transition})
+
+    def stats(self) -> ModelStats:
+        return ModelStats(
+            calls=self.calls,
+            errors=self.errors,
+            hedges=self.hedges,
+            hedge_wins=self.hedge_wins,
+            p95=self.percentile(0.95),
+            breaker=self.breaker.state,
+        )
+
+
+fallback_chains = load_fallback_chains()
+
+_model_health: Dict[str, ModelHealth] = {}
+
+
+def get_model_health(model: str) -> ModelHealth:
+    health = _model_health.get(model)
+    if health is None:
+        health = ModelHealth(model)
+        _model_health[model] = health
+    return health
+
+
+def model_stats() -> Dict[str, ModelStats]:
+    return {model: health.stats() for model, health in _model_health.items()}
+
+
+class RoutedChatModel(BaseChatModel):
+    """
+    Chat model answering from an ordered chain of models. Models with an open
+    circuit breaker are skipped, a failing or timed out call falls through to
+    the next model and, with hedging, a second request is sent to the next
+    healthy model (or again to the same one) when the first one is slower
+    than its recent latency percentile; the first answer wins.
+    """
+
+    models: List[BaseChatModel]
+    model_names: List[str]
+    timeout: float = LLM_ROUTER_TIMEOUT
+    hedging: bool = LLM_HEDGING_ENABLED
+    hedge_percentile: float = LLM_HEDGE_PERCENTILE
+    hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES
+    hedge_min_delay: float = LLM_HEDGE_MIN_DELAY
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_names": self.model_names}
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        last_error = None
+        for index, permit in self.__attempts():
+            health = get_model_health(self.model_names[index])
+            started = time.monotonic()
+            try:
+                message = self.models[index].invoke(messages, stop=stop, **kwargs)
+            except Exception as e:
+                health.record(time.monotonic() - started, e, permit)
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                continue
+            health.record(time.monotonic() - started, permit=permit)
+            self.__record_fallback(index)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        raise last_error
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        last_error = None
+        for index, permit in self.__attempts():
+            try:
+                message = await self.__call_hedged(
+                    index, permit, messages, stop, **kwargs
+                )
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                continue
+            self.__record_fallback(index)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        raise last_error
+
+    async def __call_hedged(
+        self,
+        index: int,
+        permit: Optional[str],
+        messages: List[BaseMessage],
+        stop: Optional[List[str]],
+        **kwargs: Any,
+    ) -> BaseMessage:
+        primary = asyncio.create_task(
+            self.__call(index, permit, messages, stop, **kwargs)
+        )
+        delay = self.__hedge_delay(index)
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if primary in done:
+            return primary.result()
+        target = self.__hedge_target(index)
+        if target is None:
+            return await primary
+        hedge_index, hedge_permit = target
+        hedge_name = self.model_names[hedge_index]
+        hedge_health = get_model_health(hedge_name)
+        hedge_health.hedges += 1
+        hedge = asyncio.create_task(
+            self.__call(hedge_index, hedge_permit, messages, stop, **kwargs)
+        )
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    won = task is hedge
+                    if won:
+                        hedge_health.hedge_wins += 1
+                    result = "won" if won else "lost"
+                    hedge_counter.add(1, {"model": hedge_name, "result": result})
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise error
+
+    async def __call(
+        self,
+        index: int,
+        permit: Optional[str],
+        messages: List[BaseMessage],
+        stop: Optional[List[str]],
+        **kwargs: Any,
+    ) -> BaseMessage:
+        health = get_model_health(self.model_names[index])
+        started = time.monotonic()
+        try:
+            message = await asyncio.wait_for(
+                self.models[index].ainvoke(messages, stop=stop, **kwargs),
+                timeout=self.timeout,
+            )
+        except asyncio.CancelledError:
+            # the losing side of a hedge, neither a success nor a failure
+            health.breaker.release(permit)
+            raise
+        except Exception as e:
+            health.record(time.monotonic() - started, e, permit)
+            raise
+        health.record(time.monotonic() - started, permit=permit)
+        return message
+
+    def __attempts(self) -> Iterator[Tuple[int, Optional[str]]]:
+        """
+        Indexes and breaker permits of the models to call in turn, a model is
+        only claimed when its turn comes so a half open breaker keeps its
+        trial for a real call
+        """
+        attempted = False
+        for index, name in enumerate(self.model_names):
+            permit = get_model_health(name).breaker.allow()
+            if permit is not None:
+                attempted = True
+                yield index, permit
+        if not attempted:
+            # with every breaker open the primary is still tried
+            yield 0, None
+
+    def __hedge_delay(self, index: int) -> Optional[float]:
+        if not self.hedging:
+            return None
+        health = get_model_health(self.model_names[index])
+        if len(health.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, health.percentile(self.hedge_percentile))
+
+    def __hedge_target(self, index: int) -> Optional[Tuple[int, Optional[str]]]:
+        for hedge_index in range(index + 1, len(self.model_names)):
+            permit = get_model_health(self.model_names[hedge_index]).breaker.allow()
+            if permit is not None:
+                return hedge_index, permit
+        # no healthy fallback, the same model is asked a second time
+        if get_model_health(self.model_names[index]).breaker.state == BREAKER_CLOSED:
+            return index, BREAKER_CLOSED
+        return None
+
+    def __record_fallback(self, index: int) -> None:
+        if index > 0:
+            fallback_counter.add(
+                1,
+                {"model": self.model_names[0], "fallback": self.model_names[index]},
+            )
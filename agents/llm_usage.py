@@ -0,0 +1,389 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from agents.llm_cache import LLM_CACHE_HIT_KEY
+from db.db import async_session
+from db.models import LLMUsage
+
+load_dotenv()
+
+LLM_USAGE_ENABLED = os.getenv("LLM_USAGE_ENABLED", "true").lower() == "true"
+# records written per insert, a full buffer is flushed right away
+LLM_USAGE_BATCH_SIZE = int(os.getenv("LLM_USAGE_BATCH_SIZE", "200"))
+# seconds a record waits in the buffer at most
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL_SECONDS", "5"))
+# records kept while the database is unavailable, older ones are dropped
+LLM_USAGE_MAX_BUFFER = int(os.getenv("LLM_USAGE_MAX_BUFFER", "10000"))
+# json object of model name to usd per million [input, output, cached input] tokens
+LLM_PRICING = os.getenv("LLM_PRICING")
+# share of the price paid for Batch API requests
+LLM_BATCH_PRICE_RATIO = float(os.getenv("LLM_BATCH_PRICE_RATIO", "0.5"))
+
+DEFAULT_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gpt-4.1-mini": (0.40, 1.60, 0.10),
+    "gpt-4.1": (2.00, 8.00, 0.50),
+    "o3-mini": (1.10, 4.40, 0.55),
+}
+
+# config metadata keys the records are tagged with
+USAGE_GRAPH_KEY = "usage_graph"
+USAGE_NODE_KEY = "usage_node"
+USAGE_THREAD_KEY = "usage_thread_id"
+USAGE_USER_KEY = "usage_user_id"
+USAGE_SKILL_KEY = "usage_skill_id"
+USAGE_VALIDATION_KEY = "usage_validation_id"
+
+
+def load_pricing() -> Dict[str, Tuple[float, float, float]]:
+    if LLM_PRICING is None:
+        return DEFAULT_PRICING
+    return {model: tuple(prices) for model, prices in json.loads(LLM_PRICING).items()}
+
+
+pricing = load_pricing()
+
+
+def get_model_pricing(model: Optional[str]) -> Optional[Tuple[float, float, float]]:
+    """
+    Prices of the model, litellm names like ``openai/gpt-4o-2024-08-06`` are
+    matched by the longest known model name they contain
+    """
+    if model is None:
+        return None
+    if model in pricing:
+        return pricing[model]
+    matches = [name for name in pricing if name in model]
+    if len(matches) == 0:
+        return None
+    return pricing[max(matches, key=len)]
+
+
+def compute_cost(
+    model: Optional[str],
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int = 0,
+    price_ratio: float = 1.0,
+) -> float:
+    prices = get_model_pricing(model)
+    if prices is None:
+        return 0.0
+    input_price, output_price, cached_price = prices
+    cost = (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1_000_000
+    return cost * price_ratio
+
+
+def usage_tags(
+    graph: str,
+    thread_id: Any = None,
+    user_id: Optional[int] = None,
+    skill_id: Optional[int] = None,
+    validation_id: Optional[int] = None,
+    node: Optional[str] = None,
+) -> dict:
+    """
+    Config metadata tagging the model calls of a run, the graph node is taken
+    from the langgraph metadata when not given
+
+    :param graph: graph or job the calls belong to
+    :param thread_id: graph thread (chat) of the run
+    :param user_id: user the run is for
+    :param skill_id: skill the run is for
+    :param validation_id: user validation question the run grades
+    :param node: node name outside of a graph
+    :return: the ``metadata`` of a runnable config
+    :rtype: dict
+    """
+    tags = {
+        USAGE_GRAPH_KEY: graph,
+        USAGE_THREAD_KEY: str(thread_id) if thread_id is not None else None,
+        USAGE_USER_KEY: user_id,
+        USAGE_SKILL_KEY: skill_id,
+        USAGE_VALIDATION_KEY: validation_id,
+        USAGE_NODE_KEY: node,
+    }
+    return {key: value for key, value in tags.items() if value is not None}
+
+
+@dataclass
+class LLMUsageRecord:
+    """
+    Tokens, latency and cost of a single model call
+    """
+
+    model: Optional[str]
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    cost_usd: float
+    latency_ms: Optional[int]
+    cache_hit: bool
+    graph: Optional[str] = None
+    node: Optional[str] = None
+    thread_id: Optional[str] = None
+    user_id: Optional[int] = None
+    skill_id: Optional[int] = None
+    validation_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+
+class LLMUsageWriter:
+    """
+    Buffers the usage records in memory and bulk inserts them every
+    ``flush_interval`` seconds or once ``batch_size`` records are waiting, so
+    the model calls never wait for the accounting. The records of a failed
+    insert are kept for the next flush up to ``max_buffer`` records.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        batch_size: int = LLM_USAGE_BATCH_SIZE,
+        flush_interval: float = LLM_USAGE_FLUSH_INTERVAL,
+        max_buffer: int = LLM_USAGE_MAX_BUFFER,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.__buffer: List[dict] = []
+        self.__flusher: Optional[asyncio.Task] = None
+        # strong references, the event loop only keeps weak ones to tasks
+        self.__tasks: set[asyncio.Task] = set()
+
+    def record(self, record: LLMUsageRecord) -> None:
+        if record.created_at is None:
+            record.created_at = datetime.now()
+        self.__buffer.append(asdict(record))
+        del self.__buffer[: -self.max_buffer]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # sync calls outside of a loop wait for the next async flush
+            return
+        # celery runs every task in a new event loop
+        if (
+            self.__flusher is None
+            or self.__flusher.done()
+            or self.__flusher.get_loop() is not loop
+        ):
+            self.__flusher = loop.create_task(self.__flush_periodically())
+        elif len(self.__buffer) >= self.batch_size:
+            task = loop.create_task(self.flush())
+            self.__tasks.add(task)
+            task.add_done_callback(self.__tasks.discard)
+
+    async def flush(self) -> int:
+        """
+        Writes the buffered records
+
+        :return: number of written records
+        :rtype: int
+        """
+        if self.session_factory is None or len(self.__buffer) == 0:
+            return 0
+        rows, self.__buffer = self.__buffer, []
+        try:
+            async with self.session_factory() as session:
+                for start in range(0, len(rows), self.batch_size):
+                    await session.execute(
+                        insert(LLMUsage), rows[start : start + self.batch_size]
+                    )
+                await session.commit()
+        except Exception as e:
+            print(f"Unable to write {len(rows)} LLM usage records: {e}")
+            self.__buffer = (rows + self.__buffer)[-self.max_buffer :]
+            return 0
+        return len(rows)
+
+    async def close(self) -> None:
+        """
+        Writes what is left in the buffer, meant to be called on application
+        shutdown and at the end of the celery jobs
+        """
+        flusher = self.__flusher
+        if flusher is not None and flusher.get_loop() is asyncio.get_running_loop():
+            flusher.cancel()
+        self.__flusher = None
+        await self.flush()
+
+    async def __flush_periodically(self) -> None:
+        # stops with an empty buffer so no task outlives a celery event loop
+        while len(self.__buffer) > 0:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self.__buffer)
+
+
+@dataclass
+class _CallStart:
+    started: float
+    model: Optional[str]
+    metadata: dict
+
+
+class LLMUsageTracker(BaseCallbackHandler):
+    """
+    Callback recording the tokens, latency and cost of every chat model call
+    it is attached to, tagged with the graph, node, thread, user and skill of
+    the run (see :func:`usage_tags`)
+    """
+
+    # only buffers the record, there is nothing to move off the event loop
+    run_inline = True
+
+    def __init__(self, writer: LLMUsageWriter):
+        super().__init__()
+        self.writer = writer
+        self.__calls: Dict[UUID, _CallStart] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: dict[str, Any],
+        messages: list[list[BaseMessage]],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        metadata = metadata or {}
+        self.__calls[run_id] = _CallStart(
+            started=time.monotonic(),
+            model=metadata.get("ls_model_name"),
+            metadata=metadata,
+        )
+
+    def on_llm_end(
+        self,
+        response: LLMResult,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        call = self.__calls.pop(run_id, None)
+        if call is None:
+            return
+        self.writer.record(build_record(response, call))
+
+    def on_llm_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self.__calls.pop(run_id, None)
+
+
+def build_record(response: LLMResult, call: _CallStart) -> LLMUsageRecord:
+    prompt_tokens = completion_tokens = cached_tokens = 0
+    cache_hit = False
+    model = (response.llm_output or {}).get("model_name") or call.model
+    for generations in response.generations:
+        for generation in generations:
+            if not isinstance(generation, ChatGeneration):
+                continue
+            message = generation.message
+            cache_hit = cache_hit or message.response_metadata.get(
+                LLM_CACHE_HIT_KEY, False
+            )
+            usage = getattr(message, "usage_metadata", None) or {}
+            prompt_tokens += usage.get("input_tokens", 0)
+            completion_tokens += usage.get("output_tokens", 0)
+            details = usage.get("input_token_details") or {}
+            cached_tokens += details.get("cache_read", 0) or 0
+            model = message.response_metadata.get("model_name") or model
+    metadata = call.metadata
+    return LLMUsageRecord(
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens,
+        # a cached answer costs nothing, its tokens are what it saved
+        cost_usd=(
+            0.0
+            if cache_hit
+            else compute_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+        ),
+        latency_ms=int((time.monotonic() - call.started) * 1000),
+        cache_hit=cache_hit,
+        graph=metadata.get(USAGE_GRAPH_KEY),
+        node=metadata.get(USAGE_NODE_KEY) or metadata.get("langgraph_node"),
+        thread_id=metadata.get(USAGE_THREAD_KEY),
+        user_id=metadata.get(USAGE_USER_KEY),
+        skill_id=metadata.get(USAGE_SKILL_KEY),
+        validation_id=metadata.get(USAGE_VALIDATION_KEY),
+    )
+
+
+def completion_usage_record(
+    body: dict, metadata: dict, price_ratio: float = 1.0
+) -> LLMUsageRecord:
+    """
+    Usage record of a raw chat completions response, e.g. a Batch API result
+    that never went through a chat model
+
+    :param body: chat completions response body
+    :param metadata: tags of the call (see :func:`usage_tags`)
+    :param price_ratio: share of the list price paid for the call
+    """
+    usage = body.get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens", 0) or 0
+    model = body.get("model")
+    return LLMUsageRecord(
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens,
+        cost_usd=compute_cost(
+            model, prompt_tokens, completion_tokens, cached_tokens, price_ratio
+        ),
+        latency_ms=None,
+        cache_hit=False,
+        graph=metadata.get(USAGE_GRAPH_KEY),
+        node=metadata.get(USAGE_NODE_KEY),
+        thread_id=metadata.get(USAGE_THREAD_KEY),
+        user_id=metadata.get(USAGE_USER_KEY),
+        skill_id=metadata.get(USAGE_SKILL_KEY),
+        validation_id=metadata.get(USAGE_VALIDATION_KEY),
+    )
+
+
+llm_usage_writer = LLMUsageWriter(session_factory=async_session)
+llm_usage_tracker = LLMUsageTracker(llm_usage_writer)
+
+
+def usage_callbacks() -> list:
+    """
+    Callbacks the chat models are created with
+    """
+    return [llm_usage_tracker] if LLM_USAGE_ENABLED else []
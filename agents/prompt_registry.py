@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+from langtrace_python_sdk import get_prompt_from_registry
+
+load_dotenv()
+
+PROMPT_REGISTRY_TTL = float(os.getenv("PROMPT_REGISTRY_TTL_SECONDS", "300"))
+# how long a prompt may still be served while its refresh keeps failing
+PROMPT_REGISTRY_MAX_STALE = float(
+    os.getenv("PROMPT_REGISTRY_MAX_STALE_SECONDS", "86400")
+)
+# optional cache tier shared by the uvicorn workers and the celery workers
+PROMPT_REGISTRY_REDIS_URL = os.getenv("PROMPT_REGISTRY_REDIS_URL")
+PROMPT_REGISTRY_REDIS_PREFIX = "prompt-registry"
+PROMPT_REGISTRY_WARM_UP_TIMEOUT = float(
+    os.getenv("PROMPT_REGISTRY_WARM_UP_TIMEOUT_SECONDS", "10")
+)
+
+PromptKey = Tuple[str, Optional[int]]
+
+
+@dataclass
+class CachedPrompt:
+    """
+    Prompt fetched from the Langtrace registry
+
+    :ivar prompt: registry response (value, version...)
+    :type prompt: Dict[str, Any]
+    :ivar fetched_at: unix time of the fetch
+    :type fetched_at: float
+    """
+
+    prompt: Dict[str, Any]
+    fetched_at: float
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.fetched_at < ttl
+
+    def is_usable(self, max_stale: float) -> bool:
+        return time.time() - self.fetched_at < max_stale
+
+
+class PromptRegistry:
+    """
+    Cache in front of the Langtrace prompt registry. Prompts are kept in
+    process for ``ttl`` seconds (optionally in Redis as well), expired prompts
+    are served stale while a background task refreshes them and the blocking
+    registry call itself runs in a worker thread so it never stalls the event
+    loop. Concurrent misses of the same prompt share a single fetch.
+    """
+
+    def __init__(
+        self,
+        ttl: float = PROMPT_REGISTRY_TTL,
+        max_stale: float = PROMPT_REGISTRY_MAX_STALE,
+        redis_url: Optional[str] = PROMPT_REGISTRY_REDIS_URL,
+        fetcher: Callable[..., Dict[str, Any]] = get_prompt_from_registry,
+    ):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.fetcher = fetcher
+        self.__cache: Dict[PromptKey, CachedPrompt] = {}
+        self.__in_flight: Dict[PromptKey, asyncio.Task] = {}
+        self.__redis = None
+        if redis_url is not None:
+            from redis.asyncio import Redis
+
+            self.__redis = Redis.from_url(redis_url)
+
+    async def get(
+        self, prompt_id: str, version: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Returns the prompt from the cache, fetching it on a miss and
+        refreshing it in the background once it expires
+
+        :param prompt_id: Langtrace prompt registry id
+        :param version: specific prompt version, latest when omitted
+        :return: registry prompt, its text is under the "value" key
+        :rtype: Dict[str, Any]
+        """
+        key = (prompt_id, version)
+        cached = self.__cache.get(key)
+        if cached is None:
+            cached = await self.__get_shared(key)
+            if cached is not None:
+                self.__cache[key] = cached
+        if cached is not None and cached.is_fresh(self.ttl):
+            return cached.prompt
+        if cached is not None and cached.is_usable(self.max_stale):
+            self.__refresh_in_background(key)
+            return cached.prompt
+        return (await self.__fetch(key)).prompt
+
+    async def warm_up(
+        self,
+        prompt_ids: Iterable[str],
+        timeout: float = PROMPT_REGISTRY_WARM_UP_TIMEOUT,
+    ) -> None:
+        """
+        Fetches the prompts upfront so the first requests do not pay for it.
+        Failures are only reported, the prompts are fetched again on use and
+        fetches still running after ``timeout`` complete in the background.
+        """
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(
+                    *[self.get(prompt_id) for prompt_id in set(prompt_ids)],
+                    return_exceptions=True,
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            print("Prompt registry warm up timed out")
+            return
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Prompt registry warm up failed: {result}")
+
+    def invalidate(self, prompt_id: Optional[str] = None) -> None:
+        if prompt_id is None:
+            self.__cache.clear()
+            return
+        for key in [key for key in self.__cache if key[0] == prompt_id]:
+            del self.__cache[key]
+
+    async def close(self) -> None:
+        if self.__redis is not None:
+            await self.__redis.aclose()
+
+    def __refresh_in_background(self, key: PromptKey) -> None:
+        if key in self.__in_flight:
+            return
+        task = self.__start_fetch(key)
+
+        def report_failure(finished: asyncio.Task) -> None:
+            if not finished.cancelled() and finished.exception() is not None:
+                print(f"Prompt {key[0]} refresh failed: {finished.exception()}")
+
+        task.add_done_callback(report_failure)
+
+    async def __fetch(self, key: PromptKey) -> CachedPrompt:
+        task = self.__in_flight.get(key) or self.__start_fetch(key)
+        return await asyncio.shield(task)
+
+    def __start_fetch(self, key: PromptKey) -> asyncio.Task:
+        task = asyncio.create_task(self.__load(key))
+        self.__in_flight[key] = task
+        task.add_done_callback(lambda _: self.__in_flight.pop(key, None))
+        return task
+
+    async def __load(self, key: PromptKey) -> CachedPrompt:
+        prompt_id, version = key
+        options = {"prompt_version": version} if version is not None else None
+        prompt = await asyncio.to_thread(self.fetcher, prompt_id, options)
+        cached = CachedPrompt(prompt=prompt, fetched_at=time.time())
+        self.__cache[key] = cached
+        await self.__set_shared(key, cached)
+        return cached
+
+    def __redis_key(self, key: PromptKey) -> str:
+        prompt_id, version = key
+        return f"{PROMPT_REGISTRY_REDIS_PREFIX}:{prompt_id}:{version or 'latest'}"
+
+    async def __get_shared(self, key: PromptKey) -> Optional[CachedPrompt]:
+        if self.__redis is None:
+            return None
+        try:
+            raw = await self.__redis.get(self.__redis_key(key))
+        except Exception as e:
+            print(f"Prompt registry redis read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        return CachedPrompt(**json.loads(raw))
+
+    async def __set_shared(self, key: PromptKey, cached: CachedPrompt) -> None:
+        if self.__redis is None:
+            return
+        try:
+            await self.__redis.set(
+                self.__redis_key(key),
+                json.dumps({"prompt": cached.prompt, "fetched_at": cached.fetched_at}),
+                ex=int(self.max_stale),
+            )
+        except Exception as e:
+            print(f"Prompt registry redis write failed: {e}")
+
+
+prompt_registry = PromptRegistry()
+
+
+async def get_prompt(prompt_id: str, version: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Non blocking, cached replacement of ``get_prompt_from_registry``
+    """
+    return await prompt_registry.get(prompt_id, version)
+
+
+def get_prompt_version(prompt: Dict[str, Any]) -> Optional[str]:
+    """
+    Version of a registry prompt, used to invalidate what has been derived
+    from a previous version of the prompt
+    """
+    version = prompt.get("version")
+    return str(version) if version is not None else None
@@ -1,24 +1,59 @@
 import json
 import os
+import re
 import uuid
 from contextlib import asynccontextmanager
-from typing import TypedDict, Annotated, Optional, Literal, Any, List, AsyncGenerator
+from typing import (
+    TypedDict,
+    Annotated,
+    Optional,
+    Literal,
+    Any,
+    List,
+    AsyncGenerator,
+    Dict,
+    Tuple,
+)
 
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import (
+    HumanMessage,
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+)
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.utils.json import parse_partial_json
 from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph import add_messages
 from langgraph.graph.state import CompiledStateGraph
-from langgraph.types import interrupt, Command
+from langgraph.types import Durability, interrupt, Command
 from pydantic import BaseModel, Field
 
+from agents.checkpoint_serde import checkpoint_serializer
+from agents.checkpointer import (
+    checkpoint_durability,
+    compile_with_checkpointer,
+    get_pooled_checkpointer,
+)
 from agents.guidance import provide_guidance, GuidanceHelperStdOutput
-from agents.llm_callback import CustomLlmTrackerCallback
+from agents.llm_cache import LLM_CACHE_ENABLED, llm_response_cache
+from agents.llm_callback import LlmTelemetryCallback
+from agents.llm_usage import usage_callbacks, usage_tags
+from agents.state_refs import (
+    SkillRef,
+    UserRef,
+    grade_ids,
+    grade_loader,
+    is_legacy_state,
+    render_grades,
+    skill_ref,
+    user_ref,
+)
+from agents.structured_output import parse_structured, with_structured_output
 from db.models import Skill, User
-from dto.response.grades import GradeResponseBase
 from dto.response.matrix_chats import MessageDict
 
 load_dotenv()
@@ -27,6 +62,13 @@ db_url = os.getenv("PG_VECTOR_DATABASE_URL")
 LITE_LLM_API_KEY = os.getenv("OPENAI_API_KEY")
 LITE_LLM_URL = os.getenv("OPENAI_BASE_URL")
 LITE_MODEL = os.getenv("OPENAI_MODEL")
+# checkpoint durability of the reasoner runs that do not choose one. The chat
+# turns run detached from their request (service.chat_streams), nobody sends
+# the message again when the worker dies, so every step is kept without
+# waiting for the write
+REASONER_CHECKPOINT_DURABILITY = checkpoint_durability(
+    os.getenv("REASONER_CHECKPOINT_DURABILITY"), "async"
+)
 
 model = ChatOpenAI(
     model=LITE_MODEL,
@@ -35,10 +77,27 @@ model = ChatOpenAI(
     base_url=LITE_LLM_URL,
     streaming=True,
     verbose=True,
-    callbacks=[CustomLlmTrackerCallback("reasoner")],
+    # usage of the streamed answers is only reported when asked for
+    stream_usage=True,
+    callbacks=[LlmTelemetryCallback("reasoner")] + usage_callbacks(),
+    cache=llm_response_cache if LLM_CACHE_ENABLED else False,
 )
 
 
+REASONER_NODE = "reasoner"
+CLASSIFIER_REASONER_NODE = "classifier_reasoner"
+
+# nodes whose model tokens are streamed and the json field of their answer
+# that holds the message for the user
+STREAMED_NODE_FIELDS = {
+    "answer_classifier": "message",
+    "reasoner": "message_to_the_user",
+}
+TOKEN_EVENT_TYPE = "Token"
+# opening markdown fence of a json answer, complete or still being streamed
+JSON_FENCE_START = re.compile(r"^\s*`{1,3}(j(s(on?)?)?)?")
+
+
 def multiple_values(a: Any, b: Any) -> Any:
     if a is None and b is not None:
         return b
@@ -71,9 +130,10 @@ class ReasonerOutputBase(BaseModel):
 
 
 class ReasonerState(TypedDict):
-    grades: List[GradeResponseBase]
-    user: User
-    skill: Skill
+    # references only, the checkpointer stores the state on every step
+    grade_ids: List[int]
+    user: UserRef
+    skill: SkillRef
     messages: Annotated[list, add_messages]
     spellcheck_response: Optional[SpellcheckBase]
     reasoner_response: Optional[ReasonerOutputBase]
@@ -85,8 +145,20 @@ class ReasonerState(TypedDict):
     final_result: Optional[FinalClassificationStdOutput]
 
 
+def state_refs(state: ReasonerState) -> dict:
+    """
+    References carried over by the nodes, threads checkpointed with the rows
+    are compacted by their next step
+    """
+    return {
+        "grade_ids": state.get("grade_ids"),
+        "user": user_ref(state["user"]),
+        "skill": skill_ref(state["skill"]),
+    }
+
+
 class ClassifierState(TypedDict):
-    grades: Annotated[List[GradeResponseBase], multiple_values]
+    grade_ids: Annotated[List[int], multiple_values]
     msgs: Annotated[list, add_messages]
     finished_state: Annotated[str, multiple_values]
     interrupt_state: Annotated[dict[str, str], multiple_values]
@@ -110,15 +182,17 @@ async def reasoner(state: ClassifierState) -> ClassifierState:
             """,
         )
     )
-    msg = message.format(categories=state["grades"])
-    response = await model.ainvoke(state["msgs"] + [msg])
-    msg_output = response.content
-    msg_output = msg_output.replace("```json", "").replace("```", "")
-    res = ReasonerOutputBase.model_validate_json(msg_output)
+    grades = await grade_loader.get(state.get("grade_ids"))
+    msg = message.format(categories=render_grades(grades))
+    structured_model = with_structured_output(model, ReasonerOutputBase)
+    response = await structured_model.ainvoke(state["msgs"] + [msg])
+    res = parse_structured(
+        CLASSIFIER_REASONER_NODE, ReasonerOutputBase, response.content
+    )
     return {
         "msgs": [AIMessage(res.classification)],
         "finished_state": None,
-        "grades": state["grades"],
+        "grade_ids": state.get("grade_ids"),
         "interrupt_state": {},
     }
 
@@ -139,14 +213,19 @@ async def reflect(state: ClassifierState) -> ClassifierState:
         Predicted user expertise: {state}
         """
     )
+    grades = await grade_loader.get(state.get("grade_ids"))
     prompt = await prompt_template.ainvoke(
-        {"state": predicted_state, "msg": input_val, "categories": state["grades"]}
+        {
+            "state": predicted_state,
+            "msg": input_val,
+            "categories": render_grades(grades),
+        }
     )
     response = model.invoke(prompt)
     return {
         "msgs": [HumanMessage(response.content)],
         "finished_state": None,
-        "grades": state["grades"],
+        "grade_ids": state.get("grade_ids"),
         "interrupt_state": {},
     }
 
@@ -166,7 +245,7 @@ async def finish(state: ClassifierState) -> ClassifierState:
     return {
         "msgs": state["msgs"],
         "finished_state": finished_state,
-        "grades": state["grades"],
+        "grade_ids": state.get("grade_ids"),
         "interrupt_state": {},
     }
 
@@ -181,7 +260,7 @@ async def human(state: ClassifierState) -> ClassifierState:
     return {
         "msgs": [AIMessage(value)],
         "finished_state": state["finished_state"],
-        "grades": state["grades"],
+        "grade_ids": state.get("grade_ids"),
         "interrupt_state": interrupt_val,
     }
 
@@ -205,14 +284,13 @@ builder = StateGraph(ReasonerState)
 async def answer_classifier(state: ReasonerState) -> ReasonerState:
     response: GuidanceHelperStdOutput = None
     async for chunk in provide_guidance(
-        state["messages"], state["user"], state["skill"]
+        state["messages"], user_ref(state["user"]), skill_ref(state["skill"])
     ):
         print("ANSWER CLASSIFIER", chunk)
         if isinstance(chunk, GuidanceHelperStdOutput):
             response = chunk
             print("ACTUAL RETURN")
             return {
-                "grades": state["grades"],
                 "messages": [AIMessage(response.message)],
                 "number_of_irregularities": 0,
                 "spellcheck_response": None,
@@ -222,15 +300,13 @@ async def answer_classifier(state: ReasonerState) -> ReasonerState:
                 "ambiguous_output": (
                     "direct" if response.has_user_answered else "indirect"
                 ),
-                "user": state["user"],
-                "skill": state["skill"],
+                **state_refs(state),
                 "should_admin_continue": response.should_admin_be_involved,
                 "final_result": None,
             }
 
     print("THIS FUCKING RETURN")
     return {
-        "grades": state["grades"],
         "messages": [],
         "number_of_irregularities": 0,
         "spellcheck_response": None,
@@ -238,8 +314,7 @@ async def answer_classifier(state: ReasonerState) -> ReasonerState:
         "interrupt_state": {},
         "is_ambiguous": False,
         "ambiguous_output": None,
-        "user": state["user"],
-        "skill": state["skill"],
+        **state_refs(state),
         "should_admin_continue": False,
         "final_result": None,
     }
@@ -261,7 +336,6 @@ async def ask_clarification(state: ReasonerState) -> ReasonerState:
     }
     interrupt_msg = interrupt(interrupt_val)
     return {
-        "grades": state["grades"],
         "messages": [AIMessage(interrupt_msg)],
         "spellcheck_response": state["spellcheck_response"],
         "reasoner_response": None,
@@ -269,8 +343,7 @@ async def ask_clarification(state: ReasonerState) -> ReasonerState:
         "is_ambiguous": state["is_ambiguous"],
         "ambiguous_output": state["ambiguous_output"],
         "number_of_irregularities": state["number_of_irregularities"],
-        "user": state["user"],
-        "skill": state["skill"],
+        **state_refs(state),
         "should_admin_continue": state["should_admin_continue"],
         "final_result": None,
     }
@@ -278,7 +351,11 @@ async def ask_clarification(state: ReasonerState) -> ReasonerState:
 
 async def deeply_classify(state: ReasonerState) -> ReasonerState:
     async for class_chunk in classify.astream(
-        {"msgs": state["messages"], "finished_state": None, "grades": state["grades"]}
+        {
+            "msgs": state["messages"],
+            "finished_state": None,
+            "grade_ids": state.get("grade_ids"),
+        }
     ):
         if (
             "finished_state" in class_chunk
@@ -287,7 +364,6 @@ async def deeply_classify(state: ReasonerState) -> ReasonerState:
             msg = class_chunk["finished_state"]
 
     return {
-        "grades": state["grades"],
         "messages": [],
         "spellcheck_response": state["spellcheck_response"],
         "reasoner_response": state["reasoner_response"],
@@ -295,8 +371,7 @@ async def deeply_classify(state: ReasonerState) -> ReasonerState:
         "is_ambiguous": state["is_ambiguous"],
         "ambiguous_output": state["ambiguous_output"],
         "number_of_irregularities": state["number_of_irregularities"],
-        "user": state["user"],
-        "skill": state["skill"],
+        **state_refs(state),
         "should_admin_continue": state["should_admin_continue"],
         "final_result": None,
     }
@@ -315,13 +390,16 @@ async def reasoner(state: ReasonerState) -> ReasonerState:
         message_to_the_user: str, description=Message to user
         """
     )
-    prompt = prompt_template.invoke({"grades": state["grades"]})
-    response = model.invoke(state["messages"] + [HumanMessage(prompt.to_string())])
-    msg = response.content
-    msg = msg.replace("```json", "").replace("```", "")
-    full_response = FinalClassificationStdOutput.model_validate_json(msg)
+    grades = await grade_loader.get(state.get("grade_ids"))
+    prompt = prompt_template.invoke({"grades": render_grades(grades)})
+    structured_model = with_structured_output(model, FinalClassificationStdOutput)
+    response = await structured_model.ainvoke(
+        state["messages"] + [HumanMessage(prompt.to_string())]
+    )
+    full_response = parse_structured(
+        REASONER_NODE, FinalClassificationStdOutput, response.content
+    )
     return {
-        "grades": state["grades"],
         "messages": [],
         "spellcheck_response": state["spellcheck_response"],
         "reasoner_response": state["reasoner_response"],
@@ -329,8 +407,7 @@ async def reasoner(state: ReasonerState) -> ReasonerState:
         "is_ambiguous": state["is_ambiguous"],
         "ambiguous_output": state["ambiguous_output"],
         "number_of_irregularities": state["number_of_irregularities"],
-        "user": state["user"],
-        "skill": state["skill"],
+        **state_refs(state),
         "should_admin_continue": state["should_admin_continue"],
         "final_result": full_response,
     }
@@ -344,7 +421,6 @@ async def human(state: ReasonerState) -> ReasonerState:
         interrupt_val,
     )
     return {
-        "grades": state["grades"],
         "messages": [value],
         "spellcheck_response": state["spellcheck_response"],
         "reasoner_response": state["reasoner_response"],
@@ -352,8 +428,7 @@ async def human(state: ReasonerState) -> ReasonerState:
         "is_ambiguous": state["is_ambiguous"],
         "ambiguous_output": state["ambiguous_output"],
         "number_of_irregularities": state["number_of_irregularities"],
-        "user": state["user"],
-        "skill": state["skill"],
+        **state_refs(state),
         "should_admin_continue": True,
         "final_result": state["final_result"],
     }
@@ -376,7 +451,15 @@ full_graph = builder.compile()
 
 @asynccontextmanager
 async def get_checkpointer():
-    checkpointer = AsyncPostgresSaver.from_conn_string(db_url)
+    pooled_checkpointer = get_pooled_checkpointer()
+    if pooled_checkpointer is not None:
+        # Shared pool opened by the application lifespan, connections are
+        # borrowed per checkpoint operation so there is nothing to close here
+        yield pooled_checkpointer
+        return
+    checkpointer = AsyncPostgresSaver.from_conn_string(
+        db_url, serde=checkpoint_serializer
+    )
     # Check if it's a context manager
     if hasattr(checkpointer, "__aenter__"):
         # It's a context manager, use it with async with
@@ -393,33 +476,151 @@ async def get_checkpointer():
 @asynccontextmanager
 async def get_graph() -> AsyncGenerator[CompiledStateGraph, Any]:
     async with get_checkpointer() as checkpointer:
-        graph = builder.compile(checkpointer=checkpointer)
+        graph = compile_with_checkpointer(builder, checkpointer)
         yield graph
 
 
+class TokenStream:
+    """
+    Turns the model tokens of the streamed nodes into deltas of the message
+    shown to the user. The nodes answer in json, so the partial answer is
+    parsed on every token and only the growth of the user facing field is
+    emitted.
+    """
+
+    def __init__(self):
+        self.__contents: Dict[str, str] = {}
+        self.__emitted: Dict[str, str] = {}
+
+    def feed(
+        self, namespace: Tuple[str, ...], message: BaseMessage, metadata: dict
+    ) -> Optional[Tuple[str, str]]:
+        """
+        :param namespace: graph namespace the message has been streamed from
+        :param message: token chunk or, on a response cache hit, full message
+        :param metadata: run metadata of the message
+        :return: streaming node and the new text of its message
+        :rtype: Optional[Tuple[str, str]]
+        """
+        if len(namespace) > 0:
+            # model of a graph run inside a node, e.g. the guidance agent
+            node = namespace[0].split(":")[0]
+        else:
+            node = metadata.get("langgraph_node")
+        field = STREAMED_NODE_FIELDS.get(node)
+        # node outputs are streamed as well, only model runs carry ls_ metadata
+        if field is None or "ls_provider" not in metadata:
+            return None
+        if not isinstance(message.content, str) or message.id is None:
+            return None
+        if isinstance(message, AIMessageChunk):
+            content = self.__contents.get(message.id, "") + message.content
+        elif message.id in self.__contents:
+            return None
+        else:
+            content = message.content
+        self.__contents[message.id] = content
+        text = self.__user_text(content, field)
+        emitted = self.__emitted.get(message.id, "")
+        if len(text) <= len(emitted) or not text.startswith(emitted):
+            return None
+        self.__emitted[message.id] = text
+        return node, text[len(emitted) :]
+
+    def __user_text(self, content: str, field: str) -> str:
+        content = JSON_FENCE_START.sub("", content, count=1)
+        content = content.replace("```", "").lstrip()
+        if content == "":
+            return ""
+        if not content.startswith("{"):
+            # the model ignored the json format, its answer is the message
+            return content
+        parsed = parse_partial_json(content)
+        if not isinstance(parsed, dict) or not isinstance(parsed.get(field), str):
+            return ""
+        return parsed[field]
+
+
+async def stream_graph(
+    graph: CompiledStateGraph,
+    graph_input: dict,
+    config: dict,
+    stream_tokens: bool = False,
+    durability: Optional[Durability] = None,
+) -> AsyncGenerator[Tuple[str, Any], Any]:
+    """
+    Streams the node updates of the graph and, with ``stream_tokens``, the
+    user facing tokens of the streamed nodes as they are generated
+
+    :param durability: checkpoint durability of the run, the graph default
+        when not given
+    :return: "updates" with the node update or "tokens" with the streaming
+        node and the new text
+    :rtype: AsyncGenerator[Tuple[str, Any], Any]
+    """
+    if not stream_tokens:
+        async for chunk in graph.astream(graph_input, config, durability=durability):
+            yield "updates", chunk
+        return
+    tokens = TokenStream()
+    async for namespace, mode, chunk in graph.astream(
+        graph_input,
+        config,
+        stream_mode=["updates", "messages"],
+        subgraphs=True,
+        durability=durability,
+    ):
+        if mode == "updates":
+            # updates of the graphs run inside the nodes are not forwarded
+            if len(namespace) == 0:
+                yield "updates", chunk
+            continue
+        token = tokens.feed(namespace, *chunk)
+        if token is not None:
+            yield "tokens", token
+
+
 async def reasoner_run(
     thread_id: uuid.UUID,
     msgs: List[MessageDict],
-    grades: List[GradeResponseBase],
+    grade_ids: List[int],
     skill: Skill,
     user: User,
+    stream_tokens: bool = False,
+    durability: Optional[Durability] = None,
 ) -> AsyncGenerator[str, Any]:
     async with get_graph() as graph:
-        config = {"configurable": {"thread_id": thread_id}}
+        config = {
+            "configurable": {"thread_id": thread_id},
+            "metadata": usage_tags("matrix_chat", thread_id, user.id, skill.id),
+        }
         interrupt_happened = False
         interrupt_value = ""
         processing_type = ""
         message_val = ""
         should_admin_continue = False
-        async for chunk in graph.astream(
+        async for kind, chunk in stream_graph(
+            graph,
             {
                 "messages": msgs,
-                "grades": grades,
-                "skill": skill,
-                "user": user,
+                "grade_ids": grade_ids,
+                "skill": skill_ref(skill),
+                "user": user_ref(user),
             },
             config,
+            stream_tokens,
+            durability or REASONER_CHECKPOINT_DURABILITY,
         ):
+            if kind == "tokens":
+                node, token = chunk
+                yield json.dumps(
+                    {
+                        "type": TOKEN_EVENT_TYPE,
+                        "node": node,
+                        "token": token,
+                    }
+                )
+                continue
             actual_type = list(chunk.keys())[0]
 
             if actual_type == "answer_classifier":
@@ -468,12 +669,68 @@ async def reasoner_run(
             )
 
 
-async def run_interrupted(thread_id: uuid.UUID, unblock_value: str) -> dict[str, Any]:
+async def run_interrupted(
+    thread_id: uuid.UUID,
+    unblock_value: str,
+    durability: Optional[Durability] = None,
+) -> dict[str, Any]:
     async with get_graph() as graph:
-        config = {"configurable": {"thread_id": thread_id}}
+        config = {
+            "configurable": {"thread_id": thread_id},
+            "metadata": usage_tags("matrix_chat", thread_id),
+        }
         state = await graph.aget_state(config)
         unblock_response = await graph.ainvoke(
-            Command(resume=unblock_value), config=config
+            Command(resume=unblock_value),
+            config=config,
+            durability=durability or REASONER_CHECKPOINT_DURABILITY,
         )
         return unblock_response
     return None
+
+
+async def compact_thread_state(graph: CompiledStateGraph, thread_id: Any) -> bool:
+    """
+    Rewrites the latest checkpoint of a reasoner thread that still holds the
+    user, skill and grade rows with their references. The earlier checkpoints
+    of the thread keep the rows until the checkpoint retention removes them.
+
+    :return: whether the thread has been compacted
+    :rtype: bool
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    checkpoint = await graph.checkpointer.aget_tuple(config)
+    if checkpoint is None:
+        return False
+    values = checkpoint.checkpoint["channel_values"]
+    if not is_legacy_state(values):
+        return False
+    update = {}
+    if values.get("user") is not None:
+        update["user"] = user_ref(values["user"])
+    if values.get("skill") is not None:
+        update["skill"] = skill_ref(values["skill"])
+    if values.get("grades") is not None:
+        update["grade_ids"] = grade_ids(values["grades"])
+    # attributed to the node that wrote the checkpoint, so the pending
+    # interrupt or the next step of the thread stays the same
+    await graph.aupdate_state(config, update)
+    return True
+
+
+async def compact_threads(thread_ids: List[Any]) -> int:
+    """
+    Migrates the reasoner threads checkpointed before the state references
+
+    :param thread_ids: matrix chat ids
+    :return: number of compacted threads
+    :rtype: int
+    """
+    compacted = 0
+    async with get_graph() as graph:
+        for thread_id in thread_ids:
+            try:
+                compacted += await compact_thread_state(graph, thread_id)
+            except Exception as e:
+                print(f"Unable to compact the state of thread {thread_id}: {e}")
+    return compacted
@@ -0,0 +1,162 @@
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypedDict
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.db import async_session
+from db.models import Grade
+from dto.response.grades import GradeResponseBase
+
+load_dotenv()
+
+# seconds the grades are served from memory before they are read again
+STATE_REF_CACHE_TTL = float(os.getenv("STATE_REF_CACHE_TTL_SECONDS", "300"))
+
+
+class UserRef(TypedDict):
+    """
+    User of a graph thread as kept in its checkpoints, the user row holds the
+    password hash and personal data that must not end up in checkpoint blobs.
+    Plain dicts, a model would be serialized with its class path.
+    """
+
+    id: int
+
+
+class SkillRef(TypedDict):
+    """
+    Skill of a graph thread as kept in its checkpoints
+    """
+
+    id: int
+    name: str
+
+
+def user_ref(user: Any) -> UserRef:
+    """
+    Reference of a user row, a reference or the serialized user of a thread
+    checkpointed before the references
+    """
+    if isinstance(user, dict):
+        return UserRef(id=user["id"])
+    return UserRef(id=user.id)
+
+
+def skill_ref(skill: Any) -> SkillRef:
+    """
+    Reference of a skill row, a reference or the serialized skill of a thread
+    checkpointed before the references
+    """
+    if isinstance(skill, dict):
+        return SkillRef(id=skill["id"], name=skill["name"])
+    return SkillRef(id=skill.id, name=skill.name)
+
+
+def grade_ids(grades: Iterable[Any]) -> List[int]:
+    """
+    Ids of the grades of a thread, also accepts the grade json strings and
+    models of the threads checkpointed before the references
+    """
+    ids = []
+    for grade in grades:
+        if isinstance(grade, int):
+            ids.append(grade)
+        elif isinstance(grade, str):
+            ids.append(json.loads(grade)["id"])
+        elif isinstance(grade, dict):
+            ids.append(grade["id"])
+        else:
+            ids.append(grade.id)
+    return ids
+
+
+def is_legacy_state(values: Dict[str, Any]) -> bool:
+    """
+    Whether the checkpointed values of a reasoner thread still hold the rows
+    instead of their references
+    """
+    # langgraph carries the channels unknown to the graph over, the grades
+    # stay next to the grade ids of a compacted thread
+    if "grades" in values and "grade_ids" not in values:
+        return True
+    return not (
+        is_ref(values.get("user"), UserRef) and is_ref(values.get("skill"), SkillRef)
+    )
+
+
+def is_ref(value: Any, ref: type) -> bool:
+    return value is None or (
+        isinstance(value, dict) and value.keys() == ref.__annotations__.keys()
+    )
+
+
+def render_grades(grades: List[GradeResponseBase]) -> List[str]:
+    """
+    Grades the way the prompts list the categories
+    """
+    return [grade.model_dump_json() for grade in grades]
+
+
+class GradeLoader:
+    """
+    Hydrates the grade ids of the graph states. Grades are a handful of rows
+    that rarely change, so all of them are read at once and kept in memory
+    for ``ttl`` seconds.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        ttl: float = STATE_REF_CACHE_TTL,
+    ):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.__grades: Dict[int, GradeResponseBase] = {}
+        self.__loaded_at: Optional[float] = None
+        # ids a load did not find, e.g. grades removed since the thread began
+        self.__missing: set[int] = set()
+
+    async def get(self, ids: Optional[Iterable[int]] = None) -> List[GradeResponseBase]:
+        """
+        :param ids: grade ids in the order they should be listed, every grade
+            when not given (threads checkpointed before the references)
+        :return: the grades, unknown ids are looked up once per ``ttl`` and
+            then skipped
+        :rtype: List[GradeResponseBase]
+        """
+        if ids is None:
+            if not self.__is_fresh():
+                await self.__load()
+            return list(self.__grades.values())
+        ids = list(ids)
+        unknown = {
+            id for id in ids if id not in self.__grades and id not in self.__missing
+        }
+        if not self.__is_fresh() or len(unknown) > 0:
+            await self.__load()
+            self.__missing = {id for id in ids if id not in self.__grades}
+        return [self.__grades[id] for id in ids if id in self.__grades]
+
+    def __is_fresh(self) -> bool:
+        return (
+            self.__loaded_at is not None
+            and time.monotonic() - self.__loaded_at < self.ttl
+        )
+
+    async def __load(self) -> None:
+        async with self.session_factory() as session:
+            result = await session.execute(select(Grade).order_by(Grade.value))
+            self.__grades = {
+                grade.id: GradeResponseBase(
+                    id=grade.id, label=grade.label, value=grade.value
+                )
+                for grade in result.scalars()
+            }
+        self.__loaded_at = time.monotonic()
+
+
+grade_loader = GradeLoader(session_factory=async_session)
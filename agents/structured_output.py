@@ -0,0 +1,225 @@
+import ast
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Type, TypeVar
+
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from langchain_core.utils.json import parse_partial_json
+from opentelemetry import metrics
+from pydantic import BaseModel, ValidationError
+
+load_dotenv()
+
+STRUCTURED_OUTPUT_MODE_JSON_SCHEMA = "json_schema"
+STRUCTURED_OUTPUT_MODE_TEXT = "text"
+# "json_schema" constrains the answers of the json nodes to their schema with
+# the response format of the model, "text" keeps the free-form prompts
+STRUCTURED_OUTPUT_MODE = os.getenv(
+    "STRUCTURED_OUTPUT_MODE", STRUCTURED_OUTPUT_MODE_JSON_SCHEMA
+).lower()
+
+PARSE_VALID = "valid"
+PARSE_REPAIRED = "repaired"
+PARSE_FAILED = "failed"
+
+_FENCE = re.compile(r"```[a-zA-Z]*")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+meter = metrics.get_meter(__name__)
+parse_counter = meter.create_counter(
+    "structured_output.parses",
+    description="Parsed model answers by node, mode and outcome (valid, repaired, failed)",
+)
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class LLMFormatError(Exception):
+    """
+    Answer of a node that cannot be parsed. Unlike the ``ValidationError``
+    of the schema (a ``ValueError``) it is retried by the default retry
+    policy of the graph nodes.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+@dataclass
+class NodeParseStats:
+    """
+    Parse outcomes of a node since the process started, a failed parse makes
+    the node retry (or fail) the whole model call
+
+    :ivar parses: parsed answers
+    :type parses: int
+    :ivar repaired: answers that only parsed after the repair
+    :type repaired: int
+    :ivar failed: answers that could not be parsed
+    :type failed: int
+    """
+
+    parses: int = 0
+    repaired: int = 0
+    failed: int = 0
+
+
+_node_stats: Dict[str, NodeParseStats] = {}
+
+
+def is_structured_output_enabled() -> bool:
+    return STRUCTURED_OUTPUT_MODE == STRUCTURED_OUTPUT_MODE_JSON_SCHEMA
+
+
+def strict_json_schema(schema: Any) -> Any:
+    """
+    Makes a pydantic json schema acceptable for strict decoding: every
+    property is required (optional ones stay nullable), no additional
+    properties and no defaults
+    """
+    if isinstance(schema, list):
+        return [strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    strict = {
+        key: strict_json_schema(value)
+        for key, value in schema.items()
+        if key != "default"
+    }
+    if strict.get("type") == "object" and "properties" in strict:
+        strict["required"] = list(strict["properties"].keys())
+        strict["additionalProperties"] = False
+    return strict
+
+
+def json_schema_response_format(schema: Type[BaseModel]) -> dict:
+    """
+    ``response_format`` of the chat completions api constraining the answer
+    to the json schema of the model
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema.__name__,
+            "schema": strict_json_schema(schema.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+def with_structured_output(model: BaseChatModel, schema: Type[BaseModel]) -> Runnable:
+    """
+    Binds the response format of the schema to the model in the json schema
+    mode. The answer stays a plain message so its content can still be
+    streamed and cached, it is parsed with :func:`parse_structured`.
+    """
+    if not is_structured_output_enabled():
+        return model
+    return model.bind(response_format=json_schema_response_format(schema))
+
+
+def repair_json(content: str) -> Optional[Any]:
+    """
+    Recovers the json document of a near-miss answer: markdown fences, text
+    around the document, trailing commas, python literals and answers cut
+    off by the token limit
+
+    :param content: model answer
+    :return: the parsed document or None when nothing could be recovered
+    """
+    text = _FENCE.sub("", content).strip()
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if len(starts) == 0:
+        return None
+    text = text[min(starts) :]
+    end = max(text.rfind("}"), text.rfind("]"))
+    candidates = [text[: end + 1]] if end >= 0 else []
+    candidates.append(text)
+    for candidate in candidates:
+        candidate = _TRAILING_COMMA.sub(r"\1", candidate)
+        try:
+            return json.loads(candidate, strict=False)
+        except ValueError:
+            pass
+        try:
+            return ast.literal_eval(candidate)
+        except (ValueError, SyntaxError):
+            pass
+    # closes the objects and arrays of a truncated answer, the member cut
+    # off is dropped so the schema rejects an answer missing a required field
+    return parse_partial_json(_complete_prefix(text))
+
+
+def _complete_prefix(text: str) -> str:
+    """
+    Cuts a truncated json document after its last complete value, never
+    inside a string or a number
+    """
+    end = 0
+    in_string = False
+    escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ",":
+            end = index
+        elif char in "}]":
+            end = index + 1
+    return text[:end]
+
+
+def record_parse(node: str, outcome: str) -> None:
+    stats = _node_stats.setdefault(node, NodeParseStats())
+    stats.parses += 1
+    if outcome == PARSE_REPAIRED:
+        stats.repaired += 1
+    elif outcome == PARSE_FAILED:
+        stats.failed += 1
+        print(f"Unable to parse the answer of {node}")
+    parse_counter.add(
+        1, {"node": node, "mode": STRUCTURED_OUTPUT_MODE, "outcome": outcome}
+    )
+
+
+def parse_stats() -> Dict[str, NodeParseStats]:
+    return dict(_node_stats)
+
+
+def parse_structured(node: str, schema: Type[T], content: str) -> T:
+    """
+    Validates the answer of a node against its schema, repairing near-misses
+    before giving up. The validation error of the original answer is raised
+    when the repair fails too.
+
+    :param node: graph node the answer belongs to
+    :param schema: expected schema
+    :param content: model answer
+    :return: the validated answer
+    """
+    try:
+        parsed = schema.model_validate_json(content)
+        record_parse(node, PARSE_VALID)
+        return parsed
+    except ValidationError as e:
+        error = e
+    repaired = repair_json(content)
+    if repaired is not None:
+        try:
+            parsed = schema.model_validate(repaired)
+            record_parse(node, PARSE_REPAIRED)
+            return parsed
+        except ValidationError:
+            pass
+    record_parse(node, PARSE_FAILED)
+    raise error
@@ -10,21 +10,32 @@ from typing import (
     Annotated,
     Literal,
     Optional,
+    Tuple,
 )
 
 from dotenv import load_dotenv
 from langchain_core.messages import SystemMessage, AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import StructuredTool, render_text_description
-from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, START, END, add_messages
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.prebuilt import create_react_agent
 from langgraph.types import interrupt, RetryPolicy
-from langtrace_python_sdk import get_prompt_from_registry
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 
 from agents.dto import AgentMessage, ChatMessage
+from agents.checkpointer import compile_with_checkpointer
+from agents.llm_clients import get_chat_model
+from agents.prompt_registry import get_prompt
+from agents.structured_output import (
+    LLMFormatError,
+    PARSE_REPAIRED,
+    PARSE_VALID,
+    is_structured_output_enabled,
+    parse_structured,
+    record_parse,
+    with_structured_output,
+)
 from agents.reasoner import get_checkpointer
 from tools.tools import (
     find_current_grade_for_user_and_skill,
@@ -36,8 +47,6 @@ from utils.common import convert_agent_msg_to_llm_message
 
 load_dotenv()
 
-LITE_LLM_API_KEY = os.getenv("OPENAI_API_KEY")
-LITE_LLM_URL = os.getenv("OPENAI_BASE_URL")
 LITE_MODEL = os.getenv("OPENAI_MODEL")
 
 
@@ -58,6 +67,24 @@ DISCREPANCY_NODE = "discrepancy"
 GUIDANCE_NODE = "guidance"
 FINISH_NODE = "finish"
 
+CALL_PATTERN = re.compile(r"\nCall: (discrepancy|guidance|feedback|grading)")
+LENIENT_CALL_PATTERN = re.compile(
+    r"^\W*call\**\s*:\**\s*\**(discrepancy|guidance|feedback|grading)\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# langtrace prompt registry ids of the graph nodes
+DISCREPANCY_PROMPT_ID = "cmd4dt6xl000fyrs57cer5egx"
+SUPERVISOR_PROMPT_ID = "cmd4d8jim0009yrs50qqty8u3"
+FEEDBACK_PROMPT_ID = "cmd4i8ixd000tyrs5qs3egjwq"
+GUIDANCE_PROMPT_ID = "cmd4jco2x001fyrs5gjan2xki"
+PROMPT_IDS = [
+    DISCREPANCY_PROMPT_ID,
+    SUPERVISOR_PROMPT_ID,
+    FEEDBACK_PROMPT_ID,
+    GUIDANCE_PROMPT_ID,
+]
+
 
 class DiscrepancyValues(BaseModel):
     """
@@ -94,6 +121,68 @@ class GuidanceValue(BaseModel):
     messages: Annotated[list, add_messages]
 
 
+class SupervisorStdOutput(BaseModel):
+    """
+    Structured answer of the supervisor agent
+
+    :ivar thought: reasoning about the next step
+    :type thought: str
+    :ivar call: agent to call next, finish to answer the user
+    :type call: str
+    :ivar message: message to the user when finishing
+    :type message: str
+    """
+
+    thought: str = Field(description="Reasoning about the next step")
+    call: Literal["discrepancy", "guidance", "feedback", "grading", "finish"] = Field(
+        description="Agent to call next, finish to answer the user directly"
+    )
+    message: str = Field(description="Message to the user on finish, empty otherwise")
+
+    def to_react(self) -> str:
+        """
+        Renders the answer in the text format of the supervisor prompt, which
+        is what the scratchpad and the user get to see
+        """
+        if self.call == FINISH_NODE:
+            return self.message
+        return f"Thought: {self.thought}\nCall: {self.call}"
+
+
+def parse_supervisor_call(content: str) -> Tuple[Optional[str], str]:
+    """
+    Finds the agent the supervisor calls, in the structured output mode from
+    its json answer and otherwise from the ``Call:`` line of its text, also
+    accepted in a different case or with markdown emphasis
+
+    :param content: model answer
+    :return: called agent or None to finish, and the answer as text
+    :rtype: Tuple[Optional[str], str]
+    :raises LLMFormatError: when the json answer does not match the schema
+    """
+    if is_structured_output_enabled():
+        try:
+            output = parse_structured(
+                TRACING_SUPERVISOR_AGENT, SupervisorStdOutput, content
+            )
+        except ValidationError as e:
+            # a ValueError is not retried by the retry policy of the node
+            raise LLMFormatError(f"Not correct response format: {e}")
+        call = output.call if output.call != FINISH_NODE else None
+        return call, output.to_react()
+    match = CALL_PATTERN.search(content)
+    if match is not None:
+        record_parse(TRACING_SUPERVISOR_AGENT, PARSE_VALID)
+        return match.group(1), content
+    match = LENIENT_CALL_PATTERN.search(content)
+    if match is not None:
+        record_parse(TRACING_SUPERVISOR_AGENT, PARSE_REPAIRED)
+        return match.group(1).lower(), content
+    # without a call the answer is meant for the user
+    record_parse(TRACING_SUPERVISOR_AGENT, PARSE_VALID)
+    return None, content
+
+
 class SupervisorState(TypedDict):
     """
     Represents a state used by a supervisor system for managing and guiding agent
@@ -146,12 +235,10 @@ async def moderation_agent(state: SupervisorState) -> SupervisorState:
     :return: An updated SupervisorState instance with processed changes applied.
     :rtype: SupervisorState
     """
-    model = ChatOpenAI(
+    model = get_chat_model(
+        model=LITE_MODEL,
         temperature=0,
         max_tokens=300,
-        model=LITE_MODEL,
-        api_key=LITE_LLM_API_KEY,
-        base_url=LITE_LLM_URL,
         streaming=True,
         verbose=True,
     )
@@ -206,12 +293,10 @@ async def discrepancy_agent(state: SupervisorState) -> SupervisorState:
             coroutine=get_days_difference,
         ),
     ]
-    model = ChatOpenAI(
+    model = get_chat_model(
+        model=LITE_MODEL,
         temperature=0,
         max_tokens=300,
-        model=LITE_MODEL,
-        api_key=LITE_LLM_API_KEY,
-        base_url=LITE_LLM_URL,
         streaming=True,
         verbose=True,
     )
@@ -222,8 +307,8 @@ async def discrepancy_agent(state: SupervisorState) -> SupervisorState:
             msgs.append(("human", msg["message"]))
         elif msg["role"] == "ai":
             msgs.append(("ai", msg["message"]))
-    prompt_id = "cmd4dt6xl000fyrs57cer5egx"
-    discrepancy_prompt = get_prompt_from_registry(prompt_id)
+    prompt_id = DISCREPANCY_PROMPT_ID
+    discrepancy_prompt = await get_prompt(prompt_id)
     prompt_template = ChatPromptTemplate.from_messages(
         [("system", discrepancy_prompt["value"])] + msgs
     )
@@ -276,8 +361,8 @@ async def supervisor_agent(state: SupervisorState) -> SupervisorState:
         messages processed by the supervisor, and any additional chat messages to append.
     :rtype: SupervisorState
     """
-    prompt_id = "cmd4d8jim0009yrs50qqty8u3"
-    supervisor_prompt = get_prompt_from_registry(prompt_id)
+    prompt_id = SUPERVISOR_PROMPT_ID
+    supervisor_prompt = await get_prompt(prompt_id)
     prompt_template = ChatPromptTemplate.from_template(supervisor_prompt["value"])
     msgs = []
     for msg in state["chat_messages"]:
@@ -295,27 +380,29 @@ async def supervisor_agent(state: SupervisorState) -> SupervisorState:
     )
     print(f"\n\nSUPERVISOR AGENT PROMPT\n {prompt}")
 
-    model = ChatOpenAI(
+    # the prompt carries the whole discussion and scratchpad, it never repeats
+    model = get_chat_model(
+        model=LITE_MODEL,
         temperature=0,
         max_tokens=300,
-        model=LITE_MODEL,
-        api_key=LITE_LLM_API_KEY,
-        base_url=LITE_LLM_URL,
+        stop=["\nObserve:"],
         streaming=True,
         verbose=True,
-        stop=["\nObserve:"],
+        cache=False,
+    )
+    response = await with_structured_output(model, SupervisorStdOutput).ainvoke(
+        prompt
     )
-    response = await model.ainvoke(prompt)
     print(f"\n\nSUPERVISOR AGENT RESPONSE\n {response}")
-    content = response.content
+    call, content = parse_supervisor_call(response.content)
+    if content != response.content:
+        response = response.model_copy(update={"content": content})
     next_steps = []
-    match = re.search(r"\nCall: (discrepancy|guidance|feedback|grading)", content)
     msg_to_append = []
     print(f"SUPERVISOR CHAT MESSAGES -> {state['chat_messages']}")
-    if match:
+    if call is not None:
         print("\n\n\nIS MATCHING THIS\n\n\n")
-        for val in match.groups():
-            next_steps.append(val)
+        next_steps.append(call)
     else:
         next_steps.append("finish")
         chat_msg = ChatMessage(
@@ -374,12 +461,10 @@ async def grading_agent(state: SupervisorState) -> SupervisorState:
             msgs.append(question)
 
     prompt = await prompt_template.ainvoke(input={"discussion": "\n".join(msgs)})
-    model = ChatOpenAI(
+    model = get_chat_model(
+        model=LITE_MODEL,
         temperature=0,
         max_tokens=50,
-        model=LITE_MODEL,
-        api_key=LITE_LLM_API_KEY,
-        base_url=LITE_LLM_URL,
         streaming=True,
         verbose=True,
     )
@@ -410,17 +495,15 @@ async def feedback_agent(state: SupervisorState) -> SupervisorState:
              responses and new messages integrated into the state.
     :rtype: SupervisorState
     """
-    model = ChatOpenAI(
+    model = get_chat_model(
+        model=LITE_MODEL,
         temperature=0,
         max_tokens=300,
-        model=LITE_MODEL,
-        api_key=LITE_LLM_API_KEY,
-        base_url=LITE_LLM_URL,
         streaming=True,
         verbose=True,
     )
-    prompt_id = "cmd4i8ixd000tyrs5qs3egjwq"
-    feedback_prompt = get_prompt_from_registry(prompt_id)
+    prompt_id = FEEDBACK_PROMPT_ID
+    feedback_prompt = await get_prompt(prompt_id)
     msgs = convert_agent_msg_to_llm_message(state["messages"])
     print(f"\n\nFEEDBACK AGENT PROMPT\n {msgs}")
     print(f"\n\nFEEDBACK AGENT PROMPT\n {state['chat_messages'][-1]}")
@@ -483,18 +566,16 @@ async def guidance_agent(state: SupervisorState) -> SupervisorState:
         elif msg["role"] == "ai":
             msgs.append(f"Question: {msg['message']}")
     msgs_str = "\n".join(msgs)
-    prompt_id = "cmd4jco2x001fyrs5gjan2xki"
-    guidance_prompt = get_prompt_from_registry(prompt_id)
+    prompt_id = GUIDANCE_PROMPT_ID
+    guidance_prompt = await get_prompt(prompt_id)
     template = ChatPromptTemplate.from_template(guidance_prompt["value"])
     prompt = await template.ainvoke(
         input={"tools": render_text_description(tools), "discussion": msgs_str}
     )
-    model = ChatOpenAI(
+    model = get_chat_model(
+        model=LITE_MODEL,
         temperature=0,
         max_tokens=300,
-        model=LITE_MODEL,
-        api_key=LITE_LLM_API_KEY,
-        base_url=LITE_LLM_URL,
         streaming=True,
         verbose=True,
     )
@@ -536,38 +617,39 @@ async def next_step(
     return FINISH_NODE
 
 
+state_graph = StateGraph(SupervisorState)
+# state_graph.add_node(MODERATION_NODE, moderation_agent)
+state_graph.add_node(
+    SUPERVISOR_NODE,
+    supervisor_agent,
+    retry_policy=RetryPolicy(max_attempts=3),
+)
+state_graph.add_node(
+    DISCREPANCY_NODE,
+    discrepancy_agent,
+    retry_policy=RetryPolicy(max_attempts=3),
+)
+state_graph.add_node(
+    GUIDANCE_NODE, guidance_agent, retry_policy=RetryPolicy(max_attempts=3)
+)
+state_graph.add_node(FEEDBACK_NODE, feedback_agent)
+state_graph.add_node(GRADING_NODE, grading_agent)
+state_graph.add_node(FINISH_NODE, finish)
+# state_graph.add_edge(START, MODERATION_NODE)
+state_graph.add_edge(START, SUPERVISOR_NODE)
+state_graph.add_conditional_edges(SUPERVISOR_NODE, next_step)
+state_graph.add_edge(DISCREPANCY_NODE, SUPERVISOR_NODE)
+state_graph.add_edge(GUIDANCE_NODE, SUPERVISOR_NODE)
+state_graph.add_edge(FEEDBACK_NODE, SUPERVISOR_NODE)
+state_graph.add_edge(GRADING_NODE, SUPERVISOR_NODE)
+state_graph.add_edge(FINISH_NODE, END)
+
+
 @asynccontextmanager
 async def get_graph() -> AsyncGenerator[CompiledStateGraph, Any]:
     try:
         async with get_checkpointer() as saver:
-            state_graph = StateGraph(SupervisorState)
-            # state_graph.add_node(MODERATION_NODE, moderation_agent)
-            state_graph.add_node(
-                SUPERVISOR_NODE,
-                supervisor_agent,
-                retry_policy=RetryPolicy(max_attempts=3),
-            )
-            state_graph.add_node(
-                DISCREPANCY_NODE,
-                discrepancy_agent,
-                retry_policy=RetryPolicy(max_attempts=3),
-            )
-            state_graph.add_node(
-                GUIDANCE_NODE, guidance_agent, retry_policy=RetryPolicy(max_attempts=3)
-            )
-            state_graph.add_node(FEEDBACK_NODE, feedback_agent)
-            state_graph.add_node(GRADING_NODE, grading_agent)
-            state_graph.add_node(FINISH_NODE, finish)
-            # state_graph.add_edge(START, MODERATION_NODE)
-            state_graph.add_edge(START, SUPERVISOR_NODE)
-            state_graph.add_conditional_edges(SUPERVISOR_NODE, next_step)
-            state_graph.add_edge(DISCREPANCY_NODE, SUPERVISOR_NODE)
-            state_graph.add_edge(GUIDANCE_NODE, SUPERVISOR_NODE)
-            state_graph.add_edge(FEEDBACK_NODE, SUPERVISOR_NODE)
-            state_graph.add_edge(GRADING_NODE, SUPERVISOR_NODE)
-            state_graph.add_edge(FINISH_NODE, END)
-
-            graph = state_graph.compile(checkpointer=saver)
+            graph = compile_with_checkpointer(state_graph, saver)
             yield graph
     finally:
         print("Cleaning up")
@@ -0,0 +1,182 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from dto.request.testing import MessagesRequestBase
+
+load_dotenv()
+
+MSG_TRIM_MODE_LLM = "llm"
+MSG_TRIM_MODE_TOKENS = "tokens"
+# "llm" summarizes the AI turns with the trim prompt on every evaluator pass,
+# "tokens" keeps the latest AI turns within a token budget without a model call
+MSG_TRIM_MODE = os.getenv("MSG_TRIM_MODE", MSG_TRIM_MODE_TOKENS).lower()
+# tokens of the latest AI turns passed to the evaluator as they are
+MSG_TRIM_TOKEN_BUDGET = int(os.getenv("MSG_TRIM_TOKEN_BUDGET", "300"))
+# tokens of the rolling summary of the AI turns that fell out of the budget
+MSG_TRIM_SUMMARY_TOKEN_BUDGET = int(os.getenv("MSG_TRIM_SUMMARY_TOKEN_BUDGET", "150"))
+# tokens kept of every turn folded into the rolling summary
+MSG_TRIM_SUMMARY_LINE_TOKENS = int(os.getenv("MSG_TRIM_SUMMARY_LINE_TOKENS", "40"))
+MSG_TRIM_ENCODING = os.getenv("MSG_TRIM_ENCODING", "o200k_base")
+
+SUMMARY_HEADER = "Earlier in the conversation:"
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+class TokenCounter:
+    """
+    Local token counter. Uses the tiktoken encoding of the grading models and
+    falls back to the ~4 characters per token approximation when the encoding
+    can not be loaded (tiktoken downloads it on first use).
+    """
+
+    def __init__(self, encoding_name: str = MSG_TRIM_ENCODING):
+        self.encoding_name = encoding_name
+        self.__encoding = None
+        self.__loaded = False
+
+    def count(self, content: str) -> int:
+        encoding = self.__get_encoding()
+        if encoding is None:
+            return (len(content) + 3) // 4
+        return len(encoding.encode(content))
+
+    def truncate(self, content: str, limit: int) -> str:
+        encoding = self.__get_encoding()
+        if encoding is None:
+            return content[: limit * 4]
+        tokens = encoding.encode(content)
+        if len(tokens) <= limit:
+            return content
+        return encoding.decode(tokens[:limit])
+
+    def __get_encoding(self):
+        if not self.__loaded:
+            self.__loaded = True
+            try:
+                import tiktoken
+
+                self.__encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                print(f"Tiktoken encoding unavailable, approximating tokens: {e}")
+        return self.__encoding
+
+
+@dataclass
+class TrimmedMessages:
+    """
+    Discussion context handed to the evaluator
+
+    :ivar ai_context: rolling summary and latest AI turns
+    :type ai_context: str
+    :ivar human_message: latest message of the user
+    :type human_message: str
+    :ivar summary: rolling summary of the AI turns outside of the budget
+    :type summary: str
+    :ivar summarized_turns: AI turns folded into the summary
+    :type summarized_turns: int
+    """
+
+    ai_context: str
+    human_message: str
+    summary: str = ""
+    summarized_turns: int = 0
+
+
+class TokenBudgetTrimmer:
+    """
+    Deterministic replacement of the LLM based ``MsgTrimmer``. The latest AI
+    turns are kept as long as they fit into ``budget`` tokens, older turns are
+    folded into a rolling summary made of their leading sentence. The summary
+    is kept in the graph state and only extended with the turns that left the
+    budget since the previous call, so the evaluator passes of the same turn
+    reuse it as it is.
+    """
+
+    def __init__(
+        self,
+        budget: int = MSG_TRIM_TOKEN_BUDGET,
+        summary_budget: int = MSG_TRIM_SUMMARY_TOKEN_BUDGET,
+        summary_line_tokens: int = MSG_TRIM_SUMMARY_LINE_TOKENS,
+        counter: Optional[TokenCounter] = None,
+    ):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.summary_line_tokens = summary_line_tokens
+        self.counter = counter or token_counter
+
+    def trim(
+        self,
+        messages: List[MessagesRequestBase],
+        summary: Optional[str] = None,
+        summarized_turns: Optional[int] = None,
+    ) -> TrimmedMessages:
+        """
+        Keeps the latest AI turns within the budget and folds the new turns
+        outside of it into the rolling summary
+
+        :param messages: discussion ending with the message of the user
+        :param summary: rolling summary stored in the graph state
+        :param summarized_turns: AI turns already folded into ``summary``
+        :return: evaluator context with the updated rolling summary
+        :rtype: TrimmedMessages
+        """
+        summary = summary or ""
+        summarized_turns = summarized_turns or 0
+        ai_msgs = [msg.message for msg in messages if msg.role == "ai"]
+        if len(ai_msgs) < 2:
+            return TrimmedMessages(
+                ai_context=messages[-2].message,
+                human_message=messages[-1].message,
+                summary=summary,
+                summarized_turns=summarized_turns,
+            )
+        if summarized_turns >= len(ai_msgs):
+            # the discussion has been replaced, the summary no longer applies
+            summary, summarized_turns = "", 0
+        first_kept = self.__first_kept_turn(ai_msgs)
+        if first_kept > summarized_turns:
+            summary = self.__fold(summary, ai_msgs[summarized_turns:first_kept])
+            summarized_turns = first_kept
+        kept = [
+            self.counter.truncate(msg, self.budget)
+            for msg in ai_msgs[summarized_turns:]
+        ]
+        ai_context = "\n- ".join([""] + kept).lstrip("\n")
+        if summary:
+            ai_context = f"{SUMMARY_HEADER}\n{summary}\nLatest messages:\n{ai_context}"
+        return TrimmedMessages(
+            ai_context=ai_context,
+            human_message=messages[-1].message,
+            summary=summary,
+            summarized_turns=summarized_turns,
+        )
+
+    def __first_kept_turn(self, ai_msgs: List[str]) -> int:
+        used = 0
+        for index in range(len(ai_msgs) - 1, -1, -1):
+            used += self.counter.count(ai_msgs[index])
+            if used > self.budget:
+                # the latest turn is always kept, truncated when needed
+                return min(index + 1, len(ai_msgs) - 1)
+        return 0
+
+    def __fold(self, summary: str, turns: List[str]) -> str:
+        lines = summary.splitlines() if summary else []
+        for turn in turns:
+            lead = _SENTENCE_END.split(" ".join(turn.split()), maxsplit=1)[0]
+            lines.append(f"- {self.counter.truncate(lead, self.summary_line_tokens)}")
+        while len(lines) > 1 and self.__count_lines(lines) > self.summary_budget:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def __count_lines(self, lines: List[str]) -> int:
+        return self.counter.count("\n".join(lines))
+
+
+token_counter = TokenCounter()
+token_trimmer = TokenBudgetTrimmer()
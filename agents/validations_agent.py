@@ -2,10 +2,11 @@ import os
 import re
 from collections import Counter
 from contextlib import asynccontextmanager
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from typing import AsyncGenerator, Any, List, Optional, Literal, Tuple
 
 from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import (
     ToolMessage,
     AIMessage,
@@ -20,32 +21,77 @@ from langgraph.graph import StateGraph
 from langgraph.graph import add_messages
 from langgraph.graph.state import CompiledStateGraph
 from langgraph.types import RetryPolicy, interrupt
-from langtrace_python_sdk import get_prompt_from_registry
+from pydantic import BaseModel, Field, ValidationError
 from sqlalchemy.sql.annotation import Annotated
 from typing_extensions import TypedDict
 
+from agents.checkpointer import checkpoint_durability, compile_with_checkpointer
+from agents.grading_cache import GRADING_CACHE_ENABLED, GradingVerdict, grading_cache
+from agents.llm_cache import llm_response_cache
+from agents.llm_clients import get_chat_model
+from agents.llm_router import (
+    LLM_HEDGING_ENABLED,
+    LLM_ROUTING_ENABLED,
+    RoutedChatModel,
+    fallback_chains,
+)
+from agents.prompt_registry import get_prompt, get_prompt_version
 from agents.reasoner import get_checkpointer
+from agents.structured_output import (
+    LLMFormatError,
+    PARSE_FAILED,
+    PARSE_REPAIRED,
+    PARSE_VALID,
+    is_structured_output_enabled,
+    parse_structured,
+    record_parse,
+    with_structured_output,
+)
+from agents.token_trimmer import MSG_TRIM_MODE, MSG_TRIM_MODE_LLM, token_trimmer
+from db.db import async_session
+from db.models import KnowledgeBaseGradingArtifacts
 from dto.request.testing import MessagesRequestBase
+from service.grading_artifacts import GradingArtifactsStore, compute_source_hash
 from utils.common import convert_msg_request_to_llm_messages
 
 load_dotenv()
 
-LITE_LLM_API_KEY = os.getenv("OPENAI_API_KEY")
-LITE_LLM_URL = os.getenv("OPENAI_BASE_URL")
 LITE_MODEL = os.getenv("OPENAI_MODEL")
 LITE_OPENAI_O3_MODEL = os.getenv("LITE_OPENAI_O3_MODEL")
+# checkpoint durability of the validation runs, the evaluator and split loop
+# runs several steps per answer while only the interrupts (finish,
+# feedback_agent) and the end of the run have to be kept
+VALIDATIONS_CHECKPOINT_DURABILITY = checkpoint_durability(
+    os.getenv("VALIDATIONS_CHECKPOINT_DURABILITY"), "exit"
+)
 
 FINAL_ANSWER_STR = "Final Answer: "
+ACTION_STR = "Action: "
+# markers of a ReAct answer that only misses the exact format
+FINAL_ANSWER_PATTERN = re.compile(r"\**final answer\**\s*:\**\s*", re.IGNORECASE)
+ACTION_PATTERN = re.compile(r"^\W*action\**\s*:", re.IGNORECASE | re.MULTILINE)
+COMPLETENESS_PATTERN = re.compile(
+    r"completeness\**\s*:?\**\s*(\d+(?:\.\d+)?)\s*%", re.IGNORECASE
+)
+EVALUATOR_NODE = "evaluator"
 
 RECURSION_BREAK_STR = """
 Observation: All information has been provided. I know the final answer!
 """
 
-
-class LLMFormatError(Exception):
-
-    def __init__(self, message):
-        super().__init__(message)
+# langtrace prompt registry ids of the graph nodes
+AI_TRIM_PROMPT_ID = "cmdshls0h00xsyrs5f5fdzxkv"
+MONITOR_PROMPT_ID = "cmdu0li9u014syrs5ds86grzz"
+GRADING_PROMPT_ID = "cmdnantct00iwyrs5wqoa9nkv"
+QUESTION_NEEDS_PROMPT_ID = "cmdnbhy7c00jjyrs5i348rspq"
+SAFETY_PROMPT_ID = "cmdr0133z00wiyrs5ab18a8sy"
+PROMPT_IDS = [
+    AI_TRIM_PROMPT_ID,
+    MONITOR_PROMPT_ID,
+    GRADING_PROMPT_ID,
+    QUESTION_NEEDS_PROMPT_ID,
+    SAFETY_PROMPT_ID,
+]
 
 
 class LLMChatBuilder:
@@ -64,51 +110,48 @@ class LLMChatBuilder:
     :type max_tokens: int
     :ivar stop_sequences: stop sequences for chat models
     :type stop_sequences: List[str]
+    :ivar cache: use the LLM response cache, defaults to the model temperature
+    :type cache: Optional[bool]
     """
 
     def __init__(
-        self, model: str, max_tokens: int = 500, stop_sequences: List[str] = None
+        self,
+        model: str,
+        max_tokens: int = 500,
+        stop_sequences: List[str] = None,
+        cache: Optional[bool] = None,
     ):
         self.model = model
         self.__max_tokens = max_tokens
         self.__stop_sequence = stop_sequences
+        self.__cache = cache
 
-    def build(self) -> ChatOpenAI:
-        if self.model == "gpt-o3-mini":
-            return self.__build_gpt_o3_mini()
-        return self.__build_gpt_4o()
-
-    def __build_gpt_4o(self) -> ChatOpenAI:
-        additional_kw = self.__get_additional_kw()
-        model = ChatOpenAI(
-            model=LITE_MODEL,
-            base_url=LITE_LLM_URL,
-            api_key=LITE_LLM_API_KEY,
-            temperature=0,
-            top_p=1,
-            max_tokens=self.__max_tokens,
-            **additional_kw,
+    def build(self) -> BaseChatModel:
+        """
+        Builds the model of the role. With routing on, the role is answered by
+        its fallback chain behind a circuit breaker per model (and hedged
+        requests when enabled).
+        """
+        primary = LITE_OPENAI_O3_MODEL if self.model == "gpt-o3-mini" else LITE_MODEL
+        chain = fallback_chains.get(self.model) or [primary]
+        if not LLM_ROUTING_ENABLED or (len(chain) == 1 and not LLM_HEDGING_ENABLED):
+            return self.__build_model(chain[0])
+        return RoutedChatModel(
+            models=[self.__build_model(model) for model in chain],
+            model_names=chain,
+            # the models of the chain answer from the response cache themselves
+            cache=False,
         )
-        return model
-
-    def __build_gpt_o3_mini(self) -> ChatOpenAI:
-        additional_kw = self.__get_additional_kw()
-        model = ChatOpenAI(
-            model=LITE_OPENAI_O3_MODEL,
-            base_url=LITE_LLM_URL,
-            api_key=LITE_LLM_API_KEY,
-            max_tokens=self.__max_tokens,
+
+    def __build_model(self, model: str) -> ChatOpenAI:
+        return get_chat_model(
+            model=model,
             temperature=0,
             top_p=1,
-            **additional_kw,
+            max_tokens=self.__max_tokens,
+            stop=self.__stop_sequence,
+            cache=self.__cache,
         )
-        return model
-
-    def __get_additional_kw(self) -> dict[str, str]:
-        additional_kw = {}
-        if self.__stop_sequence is not None:
-            additional_kw["stop_sequences"] = self.__stop_sequence
-        return additional_kw
 
 
 class MsgTrimmer:
@@ -126,7 +169,7 @@ class MsgTrimmer:
 
     def __init__(self, model: str):
         self.llm = LLMChatBuilder(model, max_tokens=200).build()
-        self.__ai_trimp_prompt_id = "cmdshls0h00xsyrs5f5fdzxkv"
+        self.__ai_trimp_prompt_id = AI_TRIM_PROMPT_ID
         self.__human_msgs_trim_prompt_id = ""
 
     def set_ai_trim_prompt_id(self, ai_trim_prompt_id: str):
@@ -135,11 +178,13 @@ class MsgTrimmer:
     def set_human_trim_prompt_id(self, human_trim_prompt_id: str):
         self.__human_msgs_trim_prompt_id = human_trim_prompt_id
 
-    def get_ai_trim_prompt(self) -> str:
-        return self.__get_langtrace_prompt_with_id(self.__ai_trimp_prompt_id)
+    async def get_ai_trim_prompt(self) -> str:
+        return await self.__get_langtrace_prompt_with_id(self.__ai_trimp_prompt_id)
 
-    def get_human_trim_prompt(selfs) -> str:
-        return self.__get_langtrace_prompt_with_id(self.__human_msgs_trim_prompt_id)
+    async def get_human_trim_prompt(self) -> str:
+        return await self.__get_langtrace_prompt_with_id(
+            self.__human_msgs_trim_prompt_id
+        )
 
     async def trim(self, messages: List[MessagesRequestBase]) -> List[BaseMessage]:
         len_of_ai_msgs = self.__get_msg_len_for_role(messages, "ai")
@@ -151,8 +196,8 @@ class MsgTrimmer:
             ]
         return [messages[-2].message, messages[-1].message]
 
-    def __get_langtrace_prompt_with_id(self, prompt_id: str):
-        prompt = get_prompt_from_registry(prompt_id)
+    async def __get_langtrace_prompt_with_id(self, prompt_id: str):
+        prompt = await get_prompt(prompt_id)
         return prompt["value"]
 
     def __get_msg_len_for_role(
@@ -165,7 +210,7 @@ class MsgTrimmer:
         return counter
 
     async def __trim_ai_msgs(self, messages: List["MessagesRequestBase"]):
-        prompt = self.get_ai_trim_prompt()
+        prompt = await self.get_ai_trim_prompt()
         prompt_template = ChatPromptTemplate.from_messages([("system", prompt)])
         prompt = await prompt_template.ainvoke(
             {"messages": "\n- ".join(self.__get_ai_messages(messages))}
@@ -198,6 +243,10 @@ class MatrixValidationState(TypedDict):
     completed: bool
     final_grade: Literal["Correct", "Incorrect"]
     monitor: Optional[str] = None
+    graded_from_cache: Optional[bool] = None
+    sampled_verdict: Optional[dict] = None
+    trim_summary: Optional[str] = None
+    trim_summarized_turns: Optional[int] = None
 
 
 @dataclass
@@ -207,6 +256,103 @@ class Agent:
     param: str
 
 
+class EvaluatorStdOutput(BaseModel):
+    thought: str = Field(description="Reasoning about the answer of the user")
+    action: Literal["split", "final_answer"] = Field(
+        description="split to clarify what has been answered and what is left unanswered, final_answer to grade the answer"
+    )
+    action_input: str = Field(
+        description="Query of the split action, empty for the final answer"
+    )
+    final_answer: str = Field(
+        description="Final answer to the user, empty for the split action"
+    )
+    completeness: int = Field(
+        description="Percentage (0-100) of the question the user has answered"
+    )
+
+    def to_react(self) -> str:
+        """
+        Renders the answer in the text format of the grading prompt, which is
+        what the scratchpad and the user get to see
+        """
+        if self.action == "split":
+            return f"Thought: {self.thought}\nAction: split\nAction Input: {self.action_input}"
+        return f"{FINAL_ANSWER_STR}{self.graded_answer()}"
+
+    def graded_answer(self) -> str:
+        return f"{self.final_answer}\nCompleteness: {self.completeness}%"
+
+
+@dataclass
+class EvaluatorAnswer:
+    """
+    Parsed answer of the evaluator
+
+    :ivar content: answer in the text format of the grading prompt
+    :type content: str
+    :ivar final_answer: message to the user, None for the split action
+    :type final_answer: Optional[str]
+    :ivar completeness: graded completeness percentage
+    :type completeness: Optional[int]
+    """
+
+    content: str
+    final_answer: Optional[str] = None
+    completeness: Optional[int] = None
+
+
+def parse_completeness(final_answer: str) -> Optional[int]:
+    match = COMPLETENESS_PATTERN.search(final_answer)
+    if match is None:
+        return None
+    return int(float(match.group(1)))
+
+
+def parse_evaluator_answer(content: str) -> EvaluatorAnswer:
+    """
+    Parses the json answer of the evaluator in the structured output mode and
+    its ReAct text otherwise. Text answers that only miss the exact markers
+    (a different case, markdown emphasis) are repaired instead of retried.
+
+    :param content: model answer
+    :return: the parsed answer
+    :raises LLMFormatError: when neither an action nor a final answer is found
+    """
+    if is_structured_output_enabled():
+        try:
+            output = parse_structured(EVALUATOR_NODE, EvaluatorStdOutput, content)
+        except ValidationError as e:
+            raise LLMFormatError(f"Not correct response format: {e}")
+        if output.action == "split":
+            return EvaluatorAnswer(content=output.to_react())
+        return EvaluatorAnswer(
+            content=output.to_react(),
+            final_answer=output.graded_answer(),
+            completeness=output.completeness,
+        )
+    if FINAL_ANSWER_STR in content:
+        record_parse(EVALUATOR_NODE, PARSE_VALID)
+        final_answer = content.split(FINAL_ANSWER_STR, 1)[1]
+    elif ACTION_STR in content:
+        record_parse(EVALUATOR_NODE, PARSE_VALID)
+        return EvaluatorAnswer(content=content)
+    elif FINAL_ANSWER_PATTERN.search(content) is not None:
+        record_parse(EVALUATOR_NODE, PARSE_REPAIRED)
+        final_answer = FINAL_ANSWER_PATTERN.split(content, 1)[1]
+    elif ACTION_PATTERN.search(content) is not None:
+        record_parse(EVALUATOR_NODE, PARSE_REPAIRED)
+        return EvaluatorAnswer(content=content)
+    else:
+        record_parse(EVALUATOR_NODE, PARSE_FAILED)
+        raise LLMFormatError("Not correct response format")
+    return EvaluatorAnswer(
+        content=content,
+        final_answer=final_answer,
+        completeness=parse_completeness(final_answer),
+    )
+
+
 def parse_discussion(messages: List[MessagesRequestBase]) -> str:
     full_discussion = ""
     for msg in messages:
@@ -229,6 +375,19 @@ def has_run_steps(steps: List[str]) -> bool:
     return False
 
 
+def get_cacheable_answer(state: MatrixValidationState) -> Optional[str]:
+    """
+    Returns the answer of the user when the discussion is a single answer to
+    the knowledge base question, only such verdicts are shared between users
+    """
+    if not GRADING_CACHE_ENABLED:
+        return None
+    answers = [msg.message for msg in state["messages"] if msg.role == "human"]
+    if len(answers) != 1:
+        return None
+    return answers[0]
+
+
 async def start_execution(state: MatrixValidationState) -> MatrixValidationState:
     return state
 
@@ -237,8 +396,8 @@ async def monitor_detector(state: MatrixValidationState) -> MatrixValidationStat
     llm = LLMChatBuilder(
         state["model"], max_tokens=300, stop_sequences=["\nObservation"]
     ).build()
-    prompt_id = "cmdu0li9u014syrs5ds86grzz"
-    monitor_prompt = get_prompt_from_registry(prompt_id)
+    prompt_id = MONITOR_PROMPT_ID
+    monitor_prompt = await get_prompt(prompt_id)
     prompt_template = ChatPromptTemplate.from_messages(
         [("system", monitor_prompt["value"]), ("human", state["messages"][-1].message)]
     )
@@ -247,10 +406,35 @@ async def monitor_detector(state: MatrixValidationState) -> MatrixValidationStat
     return {"monitor": response.content}
 
 
+async def trim_discussion(state: MatrixValidationState) -> Tuple[List[str], dict]:
+    """
+    Trims the discussion to the last AI context and user message with the
+    configured ``MSG_TRIM_MODE``
+
+    :return: trimmed messages and the rolling summary update of the state
+    :rtype: Tuple[List[str], dict]
+    """
+    if MSG_TRIM_MODE == MSG_TRIM_MODE_LLM:
+        trimmer = MsgTrimmer(state["model"])
+        return await trimmer.trim(state["messages"]), {}
+    trimmed = token_trimmer.trim(
+        state["messages"],
+        state.get("trim_summary"),
+        state.get("trim_summarized_turns"),
+    )
+    return [trimmed.ai_context, trimmed.human_message], {
+        "trim_summary": trimmed.summary,
+        "trim_summarized_turns": trimmed.summarized_turns,
+    }
+
+
 async def evaluator(state: MatrixValidationState) -> MatrixValidationState:
-    model = LLMChatBuilder(
-        state["model"], max_tokens=300, stop_sequences=["\nObservation"]
-    ).build()
+    model = with_structured_output(
+        LLMChatBuilder(
+            state["model"], max_tokens=300, stop_sequences=["\nObservation"]
+        ).build(),
+        EvaluatorStdOutput,
+    )
     agents = [
         Agent(
             name="split",
@@ -258,10 +442,28 @@ async def evaluator(state: MatrixValidationState) -> MatrixValidationState:
             param="query: The question you want to split",
         )
     ]
-    prompt_id = "cmdnantct00iwyrs5wqoa9nkv"
-    grading_prompt = get_prompt_from_registry(prompt_id)
-    trimmer = MsgTrimmer(state["model"])
-    msgs = await trimmer.trim(state["messages"])
+    prompt_id = GRADING_PROMPT_ID
+    grading_prompt = await get_prompt(prompt_id)
+    prompt_version = get_prompt_version(grading_prompt)
+    cacheable_answer = get_cacheable_answer(state)
+    # verdict of a cache hit sampled for a drift check on an earlier pass
+    cached_verdict = None
+    if state.get("sampled_verdict") is not None:
+        cached_verdict = GradingVerdict(**state["sampled_verdict"])
+    if cacheable_answer is not None and len(state["next"]) == 0:
+        cached_verdict = await grading_cache.lookup(
+            state["question_id"], cacheable_answer, prompt_version
+        )
+        if cached_verdict is not None and not grading_cache.should_sample():
+            return {
+                "messages": state.get("messages", [])
+                + [MessagesRequestBase(role="ai", message=cached_verdict.response)],
+                "next": state.get("next", []) + ["finish"],
+                "completed": cached_verdict.final_grade == "Correct",
+                "final_grade": cached_verdict.final_grade,
+                "graded_from_cache": True,
+            }
+    msgs, trim_update = await trim_discussion(state)
     msgs = [AIMessage(msgs[0]), HumanMessage(msgs[1])]
     discussion = parse_discussion(state["messages"])
     if has_run_steps(state["next"]):
@@ -293,38 +495,38 @@ async def evaluator(state: MatrixValidationState) -> MatrixValidationState:
         }
     )
     response = await model.ainvoke(prompt)
+    try:
+        answer = parse_evaluator_answer(response.content)
+    except LLMFormatError:
+        # the retry of the node must not be answered by the cached answer
+        await llm_response_cache.ainvalidate(response)
+        raise
     next_step = []
     response_msgs = []
     intermediate_msgs = []
     is_correct_answer = False
-    if not FINAL_ANSWER_STR in response.content and not "Action: " in response.content:
-        raise LLMFormatError("Not correct response format")
-    if FINAL_ANSWER_STR in response.content or response.content.startswith(
-        "Final Answer:"
-    ):
+    completeness = answer.completeness
+    if answer.final_answer is not None:
         next_step.append("finish")
-        if FINAL_ANSWER_STR in response.content:
-            full_answer = response.content.split(FINAL_ANSWER_STR)[1]
-            percentage_match = re.search("Completeness: \d+?%", full_answer)
-            if percentage_match:
-                full_txt = percentage_match.group()
-                full_txt = full_txt.strip("Completeness: ").strip("%")
-                if int(full_txt) >= 60:
-                    is_correct_answer = True
-            response_msgs.append(MessagesRequestBase(role="ai", message=full_answer))
-        elif response.content.startswith("Final Answer:"):
-            full_answer = response.content.split(FINAL_ANSWER_STR)[1]
-            percentage_match = re.search("Completeness: \d+(\.\d+)?%", full_answer)
-            if percentage_match:
-                full_txt = percentage_match.group()
-                full_txt = full_txt.strip("Completeness: ").strip("%")
-                if int(full_txt) >= 60:
-                    is_correct_answer = True
-            response_msgs.append(MessagesRequestBase(role="ai", message=full_answer))
+        full_answer = answer.final_answer
+        if completeness is not None and completeness >= 60:
+            is_correct_answer = True
+        response_msgs.append(MessagesRequestBase(role="ai", message=full_answer))
+        if cacheable_answer is not None:
+            await grading_cache.store(
+                state["question_id"],
+                cacheable_answer,
+                prompt_version,
+                GradingVerdict(
+                    final_grade="Correct" if is_correct_answer else "Incorrect",
+                    completeness=completeness,
+                    response=full_answer,
+                ),
+                cached_verdict,
+            )
     else:
-        if "Action: " in response.content:
-            next_step.append("split")
-            intermediate_msgs.append(response)
+        next_step.append("split")
+        intermediate_msgs.append(AIMessage(answer.content))
     print("BEFORE EVALUATOR RETURN")
     return {
         "messages": state.get("messages", []) + response_msgs,
@@ -332,10 +534,59 @@ async def evaluator(state: MatrixValidationState) -> MatrixValidationState:
         "next": state.get("next", []) + next_step,
         "completed": is_correct_answer,
         "final_grade": "Correct" if is_correct_answer else "Incorrect",
+        "graded_from_cache": False,
+        "sampled_verdict": asdict(cached_verdict) if cached_verdict else None,
+        **trim_update,
     }
 
 
+async def get_stored_artifacts(
+    state: MatrixValidationState,
+) -> Optional[KnowledgeBaseGradingArtifacts]:
+    """
+    Returns the precomputed grading artifacts of the question when they were
+    generated for its current question, answer and rules
+    """
+    try:
+        async with async_session() as session:
+            artifacts = await GradingArtifactsStore(session).get(state["question_id"])
+    except Exception as e:
+        print(f"Unable to read grading artifacts: {e}")
+        return None
+    source_hash = compute_source_hash(
+        state["question"], state["answer"], state["rules"]
+    )
+    if artifacts is None or artifacts.source_hash != source_hash:
+        return None
+    return artifacts
+
+
 async def get_question_needs(state: MatrixValidationState) -> MatrixValidationState:
+    """
+    Define parts of the question that needs to be answered
+    by the user. Uses the precomputed decomposition of the question
+    when available and asks the model otherwise
+    :param state:
+    :return: the updated state
+    :rtype MatrixValidationState
+    """
+    question_needs_prompt = await get_prompt(QUESTION_NEEDS_PROMPT_ID)
+    artifacts = await get_stored_artifacts(state)
+    if (
+        artifacts is not None
+        and artifacts.split_response is not None
+        and artifacts.split_prompt_version == get_prompt_version(question_needs_prompt)
+    ):
+        return {
+            "inner_messages": state.get("inner_messages", [])
+            + [AIMessage(artifacts.split_response)],
+        }
+    return await generate_question_needs(state)
+
+
+async def generate_question_needs(
+    state: MatrixValidationState,
+) -> MatrixValidationState:
     """
     Define parts of the question that needs to be answered
     by the user. Returns the string representation
@@ -346,8 +597,8 @@ async def get_question_needs(state: MatrixValidationState) -> MatrixValidationSt
     :rtype MatrixValidationState
     """
     model = LLMChatBuilder(state["model"]).build()
-    prompt_id = "cmdnbhy7c00jjyrs5i348rspq"
-    question_definition_prompt = get_prompt_from_registry(prompt_id)
+    prompt_id = QUESTION_NEEDS_PROMPT_ID
+    question_definition_prompt = await get_prompt(prompt_id)
     msgs = convert_msg_request_to_llm_messages(state["messages"])
     prompt_template = ChatPromptTemplate.from_messages(
         [("system", question_definition_prompt["value"])] + msgs
@@ -364,6 +615,7 @@ async def get_question_needs(state: MatrixValidationState) -> MatrixValidationSt
     response = await model.ainvoke(prompt)
     print("BEFORE SPLIT RETURN")
     if not response.content.startswith("Observation: "):
+        await llm_response_cache.ainvalidate(response)
         raise LLMFormatError("split action invalid response format")
     return {
         "inner_messages": state.get("inner_messages", []) + [response],
@@ -372,14 +624,37 @@ async def get_question_needs(state: MatrixValidationState) -> MatrixValidationSt
 
 async def safety_agent(state: MatrixValidationState) -> MatrixValidationState:
     """
+    Provides the grading instructions of the question, precomputed when
+    available and asked from the model otherwise
+
+    :param state:
+    :return:
+    """
+    safety_prompt = await get_prompt(SAFETY_PROMPT_ID)
+    artifacts = await get_stored_artifacts(state)
+    if (
+        artifacts is not None
+        and artifacts.safety_response is not None
+        and artifacts.safety_prompt_version == get_prompt_version(safety_prompt)
+    ):
+        return {
+            "safety_response": artifacts.safety_response,
+        }
+    return await generate_safety_response(state)
+
+
+async def generate_safety_response(
+    state: MatrixValidationState,
+) -> MatrixValidationState:
+    """
 
     :param state:
     :return:
     """
 
     model = LLMChatBuilder(state["model"], max_tokens=300).build()
-    prompt_id = "cmdr0133z00wiyrs5ab18a8sy"
-    safety_prompt = get_prompt_from_registry(prompt_id)
+    prompt_id = SAFETY_PROMPT_ID
+    safety_prompt = await get_prompt(prompt_id)
     prompt_template = ChatPromptTemplate.from_messages(
         [
             ("system", safety_prompt["value"]),
@@ -395,6 +670,34 @@ async def safety_agent(state: MatrixValidationState) -> MatrixValidationState:
     }
 
 
+async def generate_grading_artifacts(
+    model: str, question: str, answer: Optional[str], rules: Optional[str]
+) -> Tuple[str, str]:
+    """
+    Generates the split decomposition and the safety instructions of a
+    knowledge base question ahead of any answer, the decomposition is asked
+    without a discussion
+
+    :param model: name of the model used for grading
+    :param question: knowledge base question
+    :param answer: expected answer
+    :param rules: grading rules
+    :return: split response and safety response
+    :rtype: Tuple[str, str]
+    """
+    state = {
+        "model": model,
+        "question": question,
+        "answer": answer,
+        "rules": rules,
+        "messages": [],
+        "inner_messages": [],
+    }
+    split = await generate_question_needs(state)
+    safety = await generate_safety_response(state)
+    return split["inner_messages"][-1].content, safety["safety_response"]
+
+
 async def finish(state: MatrixValidationState) -> MatrixValidationState:
     msg_updates = []
     if state["completed"] or len(state["messages"]) >= 8:
@@ -438,53 +741,54 @@ async def break_loop_decision(
     return "run_checks"
 
 
+state_graph = StateGraph(MatrixValidationState)
+state_graph.add_node("start_exec", start_execution)
+state_graph.add_node("monitor", monitor_detector)
+state_graph.add_node(
+    "evaluator",
+    evaluator,
+    retry_policy=RetryPolicy(max_attempts=4, initial_interval=1.0),
+)
+state_graph.add_node(
+    "split",
+    get_question_needs,
+    retry_policy=RetryPolicy(max_attempts=4, initial_interval=1.0),
+)
+state_graph.add_node(
+    "run_checks",
+    run_all_checks,
+)
+state_graph.add_node("recursion_check", recursion_check)
+state_graph.add_node("break_recursion", break_from_recursion)
+state_graph.add_node(
+    "safety",
+    safety_agent,
+    retry_policy=RetryPolicy(max_attempts=2, initial_interval=1.0),
+)
+state_graph.add_node(
+    "finish",
+    finish,
+)
+state_graph.add_edge(START, "start_exec")
+state_graph.add_edge("start_exec", "evaluator")
+state_graph.add_edge("start_exec", "monitor")
+state_graph.add_conditional_edges("evaluator", route_request)
+state_graph.add_conditional_edges("recursion_check", break_loop_decision)
+state_graph.add_edge("break_recursion", "evaluator")
+state_graph.add_edge("run_checks", "split")
+state_graph.add_edge("run_checks", "safety")
+state_graph.add_edge("split", "evaluator")
+state_graph.add_edge("safety", "evaluator")
+state_graph.add_edge("monitor", "finish")
+state_graph.add_edge("evaluator", "finish")
+state_graph.add_edge("finish", END)
+
+
 @asynccontextmanager
 async def get_graph() -> AsyncGenerator[CompiledStateGraph, Any]:
     try:
         async with get_checkpointer() as saver:
-            state_graph = StateGraph(MatrixValidationState)
-            state_graph.add_node("start_exec", start_execution)
-            state_graph.add_node("monitor", monitor_detector)
-            state_graph.add_node(
-                "evaluator",
-                evaluator,
-                retry_policy=RetryPolicy(max_attempts=4, initial_interval=1.0),
-            )
-            state_graph.add_node(
-                "split",
-                get_question_needs,
-                retry_policy=RetryPolicy(max_attempts=4, initial_interval=1.0),
-            )
-            state_graph.add_node(
-                "run_checks",
-                run_all_checks,
-            )
-            state_graph.add_node("recursion_check", recursion_check)
-            state_graph.add_node("break_recursion", break_from_recursion)
-            state_graph.add_node(
-                "safety",
-                safety_agent,
-                retry_policy=RetryPolicy(max_attempts=2, initial_interval=1.0),
-            )
-            state_graph.add_node(
-                "finish",
-                finish,
-            )
-            state_graph.add_edge(START, "start_exec")
-            state_graph.add_edge("start_exec", "evaluator")
-            state_graph.add_edge("start_exec", "monitor")
-            state_graph.add_conditional_edges("evaluator", route_request)
-            state_graph.add_conditional_edges("recursion_check", break_loop_decision)
-            state_graph.add_edge("break_recursion", "evaluator")
-            state_graph.add_edge("run_checks", "split")
-            state_graph.add_edge("run_checks", "safety")
-            state_graph.add_edge("split", "evaluator")
-            state_graph.add_edge("safety", "evaluator")
-            state_graph.add_edge("monitor", "finish")
-            state_graph.add_edge("evaluator", "finish")
-            state_graph.add_edge("finish", END)
-
-            graph = state_graph.compile(checkpointer=saver)
+            graph = compile_with_checkpointer(state_graph, saver)
             yield graph
     finally:
         print("Cleaning up")
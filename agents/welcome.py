@@ -6,11 +6,11 @@ from typing import Any, List
 from dotenv import load_dotenv
 from litellm import batch_completion
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from agents.llm_callback import CustomLlmTrackerCallback
+from agents.llm_clients import get_chat_model
+from agents.llm_usage import usage_tags
 from db.models import User, Skill, Grade
 from dto.response.matrix_chats import MessageDict
 from service.service import BaseService
@@ -65,17 +65,21 @@ async def prepare_welcome_prompt(
 
 async def welcome_agent(user_id: int, skill_id: int, session: AsyncSession):
     prompt = await prepare_welcome_prompt(user_id, skill_id, session)
-    model = ChatOpenAI(
-        temperature=0,
-        base_url=LITE_LLM_URL,
-        api_key=LITE_LLM_API_KEY,
+    model = get_chat_model(
         model=LITE_MODEL,
+        temperature=0,
         max_tokens=500,
         streaming=True,
         verbose=True,
-        callbacks=[CustomLlmTrackerCallback("welcome")],
     )
-    async for chunk in model.astream(prompt):
+    async for chunk in model.astream(
+        prompt,
+        config={
+            "metadata": usage_tags(
+                "welcome", user_id=user_id, skill_id=skill_id, node="welcome"
+            )
+        },
+    ):
         message_chunk = MessageDict(
             msg_type="ai", message=chunk.content
         ).model_dump_json()
@@ -0,0 +1,44 @@
+"""add llm response cache
+
+Revision ID: 2f7a9c4e1d83
+Revises: 5d2b8e0f4c17
+Create Date: 2026-10-18 17:41:12.304518
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "2f7a9c4e1d83"
+down_revision: Union[str, None] = "5d2b8e0f4c17"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "llm_response_cache",
+        sa.Column("key", sa.String(64), nullable=False),
+        sa.Column("llm_string", sa.Text(), nullable=False),
+        sa.Column("generations", sa.Text(), nullable=False),
+        sa.Column("hits", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("last_hit_at", sa.DateTime(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index(
+        "ix_llm_response_cache_last_hit_at", "llm_response_cache", ["last_hit_at"]
+    )
+    op.create_index(
+        "ix_llm_response_cache_expires_at", "llm_response_cache", ["expires_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_response_cache_expires_at", table_name="llm_response_cache")
+    op.drop_index("ix_llm_response_cache_last_hit_at", table_name="llm_response_cache")
+    op.drop_table("llm_response_cache")
@@ -0,0 +1,53 @@
+"""add knowledgebase random ordinal
+
+Revision ID: 3b8f0d6e5a21
+Revises: 7c1e4a9b2f30
+Create Date: 2026-10-18 11:04:17.532908
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3b8f0d6e5a21"
+down_revision: Union[str, None] = "7c1e4a9b2f30"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # server default fills the existing rows with random values as well
+    op.add_column(
+        "matrix_skill_knowledgebase",
+        sa.Column(
+            "random_ordinal",
+            sa.Float(),
+            nullable=False,
+            server_default=sa.text("random()"),
+        ),
+    )
+    op.create_index(
+        "matrix_knowledgebase_skill_level_ordinal_idx",
+        "matrix_skill_knowledgebase",
+        ["skill_id", "difficulty_level", "random_ordinal"],
+    )
+    op.create_index(
+        "user_validation_questions_user_skill_kb_idx",
+        "user_validation_questions",
+        ["user_id", "skill_id", "knowledge_base_id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "user_validation_questions_user_skill_kb_idx",
+        table_name="user_validation_questions",
+    )
+    op.drop_index(
+        "matrix_knowledgebase_skill_level_ordinal_idx",
+        table_name="matrix_skill_knowledgebase",
+    )
+    op.drop_column("matrix_skill_knowledgebase", "random_ordinal")
@@ -0,0 +1,50 @@
+"""add llm usage
+
+Revision ID: 3c7e1a5d9f42
+Revises: 8b1d4f6a9e25
+Create Date: 2026-10-18 22:14:37.520931
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3c7e1a5d9f42"
+down_revision: Union[str, None] = "8b1d4f6a9e25"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "llm_usage",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("model", sa.String(100), nullable=True),
+        sa.Column("graph", sa.String(50), nullable=True),
+        sa.Column("node", sa.String(100), nullable=True),
+        sa.Column("thread_id", sa.String(100), nullable=True),
+        sa.Column("user_id", sa.BigInteger(), nullable=True),
+        sa.Column("skill_id", sa.BigInteger(), nullable=True),
+        sa.Column("validation_id", sa.BigInteger(), nullable=True),
+        sa.Column("prompt_tokens", sa.Integer(), nullable=False),
+        sa.Column("completion_tokens", sa.Integer(), nullable=False),
+        sa.Column("cached_tokens", sa.Integer(), nullable=False),
+        sa.Column("cost_usd", sa.Float(), nullable=False),
+        sa.Column("latency_ms", sa.Integer(), nullable=True),
+        sa.Column("cache_hit", sa.Boolean(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_llm_usage_created_at", "llm_usage", ["created_at"])
+    op.create_index("ix_llm_usage_skill_id", "llm_usage", ["skill_id"])
+    op.create_index("ix_llm_usage_validation_id", "llm_usage", ["validation_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_usage_validation_id", table_name="llm_usage")
+    op.drop_index("ix_llm_usage_skill_id", table_name="llm_usage")
+    op.drop_index("ix_llm_usage_created_at", table_name="llm_usage")
+    op.drop_table("llm_usage")
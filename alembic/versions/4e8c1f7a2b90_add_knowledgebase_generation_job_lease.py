@@ -0,0 +1,34 @@
+"""add knowledgebase generation job lease
+
+Revision ID: 4e8c1f7a2b90
+Revises: 3c7e1a5d9f42
+Create Date: 2026-10-19 09:41:12.604318
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "4e8c1f7a2b90"
+down_revision: Union[str, None] = "3c7e1a5d9f42"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "knowledgebase_generation_jobs",
+        sa.Column("lease_token", sa.String(36), nullable=True),
+    )
+    op.add_column(
+        "knowledgebase_generation_jobs",
+        sa.Column("lease_expires_at", sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("knowledgebase_generation_jobs", "lease_expires_at")
+    op.drop_column("knowledgebase_generation_jobs", "lease_token")
@@ -0,0 +1,73 @@
+"""add knowledgebase generation jobs
+
+Revision ID: 5d2b8e0f4c17
+Revises: 9e4c2a7d1b56
+Create Date: 2026-10-18 15:02:38.916420
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "5d2b8e0f4c17"
+down_revision: Union[str, None] = "9e4c2a7d1b56"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "knowledgebase_generation_jobs",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("run_id", sa.String(36), nullable=False),
+        sa.Column("skill_id", sa.BigInteger(), nullable=False),
+        sa.Column("skill_name", sa.String(), nullable=False),
+        sa.Column("difficulty_level", sa.Integer(), nullable=False),
+        sa.Column("min_level", sa.Integer(), nullable=False),
+        sa.Column("max_level", sa.Integer(), nullable=False),
+        sa.Column("questions_requested", sa.Integer(), nullable=False),
+        sa.Column(
+            "questions_created", sa.Integer(), nullable=False, server_default="0"
+        ),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("prompt_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column(
+            "completion_tokens", sa.Integer(), nullable=False, server_default="0"
+        ),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["skill_id"],
+            ["skills.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_knowledgebase_generation_jobs_run_id",
+        "knowledgebase_generation_jobs",
+        ["run_id"],
+    )
+    op.create_index(
+        "knowledgebase_generation_jobs_status_created_idx",
+        "knowledgebase_generation_jobs",
+        ["status", "created_at"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "knowledgebase_generation_jobs_status_created_idx",
+        table_name="knowledgebase_generation_jobs",
+    )
+    op.drop_index(
+        "ix_knowledgebase_generation_jobs_run_id",
+        table_name="knowledgebase_generation_jobs",
+    )
+    op.drop_table("knowledgebase_generation_jobs")
@@ -0,0 +1,72 @@
+"""add grading verdict cache
+
+Revision ID: 6a3e5b9d2c48
+Revises: 2f7a9c4e1d83
+Create Date: 2026-10-18 19:12:47.551093
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+# revision identifiers, used by Alembic.
+revision: str = "6a3e5b9d2c48"
+down_revision: Union[str, None] = "2f7a9c4e1d83"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    op.create_table(
+        "grading_verdict_cache",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("knowledge_base_id", sa.BigInteger(), nullable=False),
+        sa.Column("prompt_version", sa.String(50), nullable=True),
+        sa.Column("answer", sa.Text(), nullable=False),
+        sa.Column("embedding", Vector(1536), nullable=False),
+        sa.Column("final_grade", sa.String(20), nullable=False),
+        sa.Column("completeness", sa.Integer(), nullable=True),
+        sa.Column("response", sa.Text(), nullable=False),
+        sa.Column("hits", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["knowledge_base_id"],
+            ["matrix_skill_knowledgebase.id"],
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_grading_verdict_cache_knowledge_base_id",
+        "grading_verdict_cache",
+        ["knowledge_base_id"],
+    )
+    op.execute(
+        """
+        CREATE INDEX grading_verdict_cache_embedding_hnsw_idx
+            ON grading_verdict_cache USING hnsw (embedding vector_cosine_ops)
+        """
+    )
+    op.add_column(
+        "user_validation_questions",
+        sa.Column(
+            "graded_from_cache", sa.Boolean(), nullable=False, server_default="false"
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("user_validation_questions", "graded_from_cache")
+    op.drop_index(
+        "grading_verdict_cache_embedding_hnsw_idx", table_name="grading_verdict_cache"
+    )
+    op.drop_index(
+        "ix_grading_verdict_cache_knowledge_base_id",
+        table_name="grading_verdict_cache",
+    )
+    op.drop_table("grading_verdict_cache")
@@ -0,0 +1,60 @@
+"""add keyset pagination indexes
+
+Revision ID: 7c1e4a9b2f30
+Revises: e22d2ed15ec5
+Create Date: 2026-10-18 09:12:41.220317
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "7c1e4a9b2f30"
+down_revision: Union[str, None] = "e22d2ed15ec5"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "notifications_user_created_id_idx",
+        "notifications",
+        ["user_id", "created_at", "id"],
+    )
+    op.create_index(
+        "notifications_user_group_created_id_idx",
+        "notifications",
+        ["user_group", "created_at", "id"],
+    )
+    op.create_index(
+        "matrix_chats_user_created_id_idx",
+        "matrix_chats",
+        ["user_id", "created_at", "id"],
+    )
+    op.create_index(
+        "user_validation_questions_user_created_id_idx",
+        "user_validation_questions",
+        ["user_id", "created_at", "id"],
+    )
+    op.create_index(
+        "matrix_knowledgebase_created_id_idx",
+        "matrix_skill_knowledgebase",
+        ["created_at", "id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "matrix_knowledgebase_created_id_idx",
+        table_name="matrix_skill_knowledgebase",
+    )
+    op.drop_index(
+        "user_validation_questions_user_created_id_idx",
+        table_name="user_validation_questions",
+    )
+    op.drop_index("matrix_chats_user_created_id_idx", table_name="matrix_chats")
+    op.drop_index("notifications_user_group_created_id_idx", table_name="notifications")
+    op.drop_index("notifications_user_created_id_idx", table_name="notifications")
@@ -0,0 +1,33 @@
+"""add knowledgebase batch imports
+
+Revision ID: 7f3a9d2e6b14
+Revises: 4e8c1f7a2b90
+Create Date: 2026-10-19 11:05:47.213590
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "7f3a9d2e6b14"
+down_revision: Union[str, None] = "4e8c1f7a2b90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "knowledgebase_batch_imports",
+        sa.Column("batch_id", sa.String(100), nullable=False),
+        sa.Column("requests", sa.Integer(), nullable=False),
+        sa.Column("questions_created", sa.Integer(), nullable=False),
+        sa.Column("imported_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("batch_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("knowledgebase_batch_imports")
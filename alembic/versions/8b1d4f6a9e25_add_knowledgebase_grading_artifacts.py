@@ -0,0 +1,42 @@
+"""add knowledgebase grading artifacts
+
+Revision ID: 8b1d4f6a9e25
+Revises: 6a3e5b9d2c48
+Create Date: 2026-10-18 20:26:03.118274
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "8b1d4f6a9e25"
+down_revision: Union[str, None] = "6a3e5b9d2c48"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "knowledgebase_grading_artifacts",
+        sa.Column("knowledge_base_id", sa.BigInteger(), nullable=False),
+        sa.Column("source_hash", sa.String(32), nullable=False),
+        sa.Column("split_response", sa.Text(), nullable=True),
+        sa.Column("split_prompt_version", sa.String(50), nullable=True),
+        sa.Column("safety_response", sa.Text(), nullable=True),
+        sa.Column("safety_prompt_version", sa.String(50), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["knowledge_base_id"],
+            ["matrix_skill_knowledgebase.id"],
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("knowledge_base_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("knowledgebase_grading_artifacts")
@@ -0,0 +1,46 @@
+"""add question assignment state
+
+Revision ID: 9e4c2a7d1b56
+Revises: 3b8f0d6e5a21
+Create Date: 2026-10-18 13:26:50.184733
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "9e4c2a7d1b56"
+down_revision: Union[str, None] = "3b8f0d6e5a21"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "question_assignment_state",
+        sa.Column("name", sa.String(100), nullable=False),
+        sa.Column("users_skills_watermark", sa.DateTime(), nullable=True),
+        sa.Column("knowledgebase_watermark", sa.DateTime(), nullable=True),
+        sa.Column("last_full_run_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.create_index(
+        "users_skills_updated_at_idx",
+        "users_skills",
+        ["updated_at"],
+    )
+    op.create_index(
+        "users_skills_skill_grade_idx",
+        "users_skills",
+        ["skill_id", "grade_id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("users_skills_skill_grade_idx", table_name="users_skills")
+    op.drop_index("users_skills_updated_at_idx", table_name="users_skills")
+    op.drop_table("question_assignment_state")
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from opentelemetry import metrics
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+
+from agents.llm_callback import LlmTelemetryCallback
+
+ANSWER = " ".join(["token"] * 200)
+
+
+class NoOpCallback(BaseCallbackHandler):
+    """
+    Baseline of a handler that does nothing, langchain dispatches every
+    streamed token to the attached handlers whatever they do with it
+    """
+
+    run_inline = True
+
+
+def build_model(callbacks: List[BaseCallbackHandler]) -> GenericFakeChatModel:
+    message = AIMessage(
+        content=ANSWER,
+        usage_metadata={"input_tokens": 500, "output_tokens": 200, "total_tokens": 700},
+    )
+    return GenericFakeChatModel(
+        messages=iter([message] * 1_000_000), callbacks=callbacks
+    )
+
+
+async def run(callback: Optional[BaseCallbackHandler], calls: int) -> List[float]:
+    model = build_model([callback] if callback is not None else [])
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        async for _ in model.astream(
+            "question", config={"metadata": {"langgraph_node": "evaluator"}}
+        ):
+            pass
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def summarize(latencies: List[float], baseline: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    summary = {
+        "mean ms": statistics.mean(latencies) * 1000,
+        "p95 ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+    if len(baseline) > 0:
+        # compared to the no-op handler, i.e. the cost of the callback itself
+        summary["overhead per call ms"] = (
+            statistics.mean(latencies) - statistics.mean(baseline)
+        ) * 1000
+    return summary
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Measures the overhead of the LLM telemetry callback on a streamed fake model call"
+    )
+    parser.add_argument("--calls", type=int, default=500)
+    args = parser.parse_args()
+
+    # real sdk providers, the no-op defaults would hide the cost of the spans
+    exporter = InMemorySpanExporter()
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(SimpleSpanProcessor(exporter))
+    metrics.set_meter_provider(MeterProvider(metric_readers=[InMemoryMetricReader()]))
+    tracer = tracer_provider.get_tracer(__name__)
+
+    callbacks: Dict[str, Any] = {
+        "telemetry": LlmTelemetryCallback("benchmark", sample_rate=0, tracer=tracer),
+        "telemetry with payloads": LlmTelemetryCallback(
+            "benchmark", sample_rate=1, tracer=tracer
+        ),
+    }
+    # warm up the imports and the model
+    await run(None, 10)
+    print("\nno callback")
+    for name, value in summarize(await run(None, args.calls), []).items():
+        print(f"  {name}: {round(value, 3)}")
+    baseline = await run(NoOpCallback(), args.calls)
+    print("\nno-op callback")
+    for name, value in summarize(baseline, baseline).items():
+        print(f"  {name}: {round(value, 3)}")
+    for label, callback in callbacks.items():
+        latencies = await run(callback, args.calls)
+        print(f"\n{label}")
+        for name, value in summarize(latencies, baseline).items():
+            print(f"  {name}: {round(value, 3)}")
+    print(f"\nspans exported: {len(exporter.get_finished_spans())}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
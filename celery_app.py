@@ -33,11 +33,23 @@ app.conf.update(
         #     "schedule": crontab(minute="*"),  # Alternative: using crontab every minute
         #     "args": (),
         # },
+        # picks up created and edited knowledge base questions
+        "generate-knowledge-base-grading-artifacts": {
+            "task": "tasks.generate_knowledge_base_grading_artifacts",
+            "schedule": crontab(minute="*/10"),
+            "args": (),
+        },
         "generate-user-validation-questions-hourly": {
             "task": "tasks.generate_user_validation_questions",
             "schedule": crontab(minute="*"),  # Run every hour at minute 0
             "args": (),
         },
+        # archives finished threads and prunes the live ones
+        "enforce-checkpoint-retention-nightly": {
+            "task": "tasks.enforce_checkpoint_retention",
+            "schedule": crontab(minute=0, hour=3),
+            "args": (),
+        },
     },
 )
 
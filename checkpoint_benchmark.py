@@ -0,0 +1,126 @@
+import argparse
+import glob
+import json
+import statistics
+import time
+from typing import Any, Dict, List
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from agents.checkpoint_serde import CompressedSerializer
+
+
+def to_message(row: Dict[str, Any]) -> BaseMessage:
+    role = row.get("msg_type", row.get("role"))
+    if role == "ai":
+        return AIMessage(content=row["message"])
+    return HumanMessage(content=row["message"])
+
+
+def load_threads(pattern: str) -> List[List[BaseMessage]]:
+    """
+    Conversations of the test data files: rows with ``messages`` or
+    ``chat_messages``, files of bare messages are a single conversation
+    """
+    threads = []
+    for path in sorted(glob.glob(pattern)):
+        loose = []
+        with open(path) as file:
+            for line in file:
+                if line.strip() == "":
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # a few rows of the evaluation sets are not valid json
+                    continue
+                if "message" in row:
+                    loose.append(to_message(row))
+                    continue
+                messages = row.get("chat_messages") or row.get("messages") or []
+                if len(messages) > 0:
+                    threads.append([to_message(message) for message in messages])
+        if len(loose) > 0:
+            threads.append(loose)
+    return threads
+
+
+def checkpoints(thread: List[BaseMessage]) -> List[Dict[str, Any]]:
+    """
+    Channel values written after every turn, the messages channel holds the
+    whole conversation so far like it does in the reasoner
+    """
+    return [
+        {
+            "messages": thread[: turn + 1],
+            "grade_ids": [1, 2, 3, 4, 5, 6, 7],
+            "user": {"id": 7},
+            "skill": {"id": 3, "name": "Java"},
+            "answer": thread[turn].content,
+        }
+        for turn in range(len(thread))
+    ]
+
+
+def run(
+    serializer: SerializerProtocol, states: List[Dict[str, Any]]
+) -> Dict[str, float]:
+    written = 0
+    encode = []
+    decode = []
+    for state in states:
+        # one blob per channel, like the postgres checkpointer stores them
+        for value in state.values():
+            started = time.perf_counter()
+            blob = serializer.dumps_typed(value)
+            encode.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            serializer.loads_typed(blob)
+            decode.append(time.perf_counter() - started)
+            written += len(blob[1])
+    return {
+        "bytes written": written,
+        "encode total ms": sum(encode) * 1000,
+        "decode total ms": sum(decode) * 1000,
+        "encode mean us": statistics.mean(encode) * 1_000_000,
+        "decode mean us": statistics.mean(decode) * 1_000_000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the checkpoint blobs of the default and the compressed serializer on the test data conversations"
+    )
+    parser.add_argument("--data", default="test_data/*.jsonl")
+    parser.add_argument("--min-bytes", type=int, default=1024)
+    parser.add_argument("--level", type=int, default=3)
+    args = parser.parse_args()
+
+    threads = load_threads(args.data)
+    states = [state for thread in threads for state in checkpoints(thread)]
+    print(f"{len(threads)} conversations, {len(states)} checkpoints")
+
+    compressed = CompressedSerializer(
+        enabled=True, min_bytes=args.min_bytes, level=args.level
+    )
+    serializers: Dict[str, SerializerProtocol] = {
+        "msgpack": JsonPlusSerializer(),
+        f"msgpack+zstd level {args.level}": compressed,
+    }
+    results = {}
+    for label, serializer in serializers.items():
+        results[label] = run(serializer, states)
+        print(f"\n{label}")
+        for name, value in results[label].items():
+            print(f"  {name}: {round(value, 3)}")
+    print(f"\nblobs compressed: {compressed.stats.compressed}/{compressed.stats.blobs}")
+    baseline, candidate = results.values()
+    print(
+        f"bytes written: {round(candidate['bytes written'] / baseline['bytes written'] * 100, 1)}% of msgpack"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
+import random
 import uuid
 from uuid import UUID as UUID4
 from datetime import datetime
 from typing import Optional, List
 
 from pgvector.sqlalchemy import VECTOR
-from sqlalchemy import String, Boolean, BigInteger, Integer, Text, DateTime, UUID, JSON
+from sqlalchemy import (
+    String,
+    Boolean,
+    BigInteger,
+    Integer,
+    Float,
+    Text,
+    DateTime,
+    UUID,
+    JSON,
+    text,
+)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlmodel import SQLModel, Field, Column, Relationship, ForeignKey
@@ -120,7 +132,12 @@ class UserSkills(AsyncAttrs, SQLModel, table=True):
         sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
     )
     updated_at: datetime = Field(
-        sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
+        sa_column=Column(
+            DateTime(),
+            nullable=False,
+            insert_default=datetime.now,
+            onupdate=datetime.now,
+        )
     )
     note: str = Field(sa_column=Column(Text, nullable=True))
     user: User = Relationship(back_populates="skills")
@@ -295,6 +312,16 @@ class MatrixSkillKnowledgeBase(SQLModel, table=True):
     updated_at: datetime = Field(
         sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
     )
+    # random position in [0, 1) used to sample questions per skill and
+    # difficulty level without sorting the table by RANDOM()
+    random_ordinal: float = Field(
+        sa_column=Column(
+            Float,
+            nullable=False,
+            insert_default=random.random,
+            server_default=text("random()"),
+        )
+    )
     validation_questions: List["UserValidationQuestions"] = Relationship(
         back_populates="knowledge_base"
     )
@@ -321,6 +348,15 @@ class UserValidationQuestions(AsyncAttrs, SQLModel, table=True):
             BigInteger, ForeignKey("matrix_skill_knowledgebase.id"), nullable=False
         )
     )
+    graded_from_cache: bool = Field(
+        sa_column=Column(
+            Boolean,
+            nullable=False,
+            default=False,
+            insert_default=False,
+            server_default=text("false"),
+        )
+    )
     created_at: datetime = Field(
         sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
     )
@@ -330,3 +366,200 @@ class UserValidationQuestions(AsyncAttrs, SQLModel, table=True):
     knowledge_base: MatrixSkillKnowledgeBase = Relationship(
         back_populates="validation_questions"
     )
+
+
+class QuestionAssignmentState(SQLModel, table=True):
+    __tablename__ = "question_assignment_state"
+    name: str = Field(sa_column=Column(String(100), primary_key=True, nullable=False))
+    users_skills_watermark: Optional[datetime] = Field(
+        sa_column=Column(DateTime(), nullable=True)
+    )
+    knowledgebase_watermark: Optional[datetime] = Field(
+        sa_column=Column(DateTime(), nullable=True)
+    )
+    last_full_run_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(), nullable=True)
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            DateTime(),
+            nullable=False,
+            insert_default=datetime.now,
+            onupdate=datetime.now,
+        )
+    )
+
+
+class KnowledgeBaseGenerationJob(SQLModel, table=True):
+    __tablename__ = "knowledgebase_generation_jobs"
+    id: int = Field(sa_column=Column(BigInteger, primary_key=True, autoincrement=True))
+    run_id: str = Field(sa_column=Column(String(36), nullable=False, index=True))
+    skill_id: int = Field(
+        sa_column=Column(BigInteger, ForeignKey("skills.id"), nullable=False)
+    )
+    skill_name: str = Field(sa_column=Column(String, nullable=False))
+    difficulty_level: int = Field(sa_column=Column(Integer, nullable=False))
+    min_level: int = Field(sa_column=Column(Integer, nullable=False))
+    max_level: int = Field(sa_column=Column(Integer, nullable=False))
+    questions_requested: int = Field(sa_column=Column(Integer, nullable=False))
+    questions_created: int = Field(
+        sa_column=Column(Integer, nullable=False, default=0, insert_default=0)
+    )
+    status: str = Field(sa_column=Column(String(20), nullable=False))
+    attempts: int = Field(
+        sa_column=Column(Integer, nullable=False, default=0, insert_default=0)
+    )
+    last_error: Optional[str] = Field(sa_column=Column(Text, nullable=True))
+    lease_token: Optional[str] = Field(sa_column=Column(String(36), nullable=True))
+    lease_expires_at: Optional[datetime] = Field(
+        sa_column=Column(DateTime(), nullable=True)
+    )
+    prompt_tokens: int = Field(
+        sa_column=Column(Integer, nullable=False, default=0, insert_default=0)
+    )
+    completion_tokens: int = Field(
+        sa_column=Column(Integer, nullable=False, default=0, insert_default=0)
+    )
+    started_at: Optional[datetime] = Field(sa_column=Column(DateTime(), nullable=True))
+    finished_at: Optional[datetime] = Field(sa_column=Column(DateTime(), nullable=True))
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            DateTime(),
+            nullable=False,
+            insert_default=datetime.now,
+            onupdate=datetime.now,
+        )
+    )
+
+
+class KnowledgeBaseBatchImport(SQLModel, table=True):
+    __tablename__ = "knowledgebase_batch_imports"
+    batch_id: str = Field(
+        sa_column=Column(String(100), primary_key=True, nullable=False)
+    )
+    requests: int = Field(sa_column=Column(Integer, nullable=False))
+    questions_created: int = Field(sa_column=Column(Integer, nullable=False))
+    imported_at: datetime = Field(
+        sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
+    )
+
+
+class LLMResponseCacheEntry(SQLModel, table=True):
+    __tablename__ = "llm_response_cache"
+    key: str = Field(sa_column=Column(String(64), primary_key=True, nullable=False))
+    llm_string: str = Field(sa_column=Column(Text, nullable=False))
+    generations: str = Field(sa_column=Column(Text, nullable=False))
+    hits: int = Field(
+        sa_column=Column(Integer, nullable=False, default=0, insert_default=0)
+    )
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
+    )
+    last_hit_at: datetime = Field(
+        sa_column=Column(
+            DateTime(), nullable=False, insert_default=datetime.now, index=True
+        )
+    )
+    expires_at: datetime = Field(
+        sa_column=Column(DateTime(), nullable=False, index=True)
+    )
+
+
+class GradingVerdictCache(SQLModel, table=True):
+    __tablename__ = "grading_verdict_cache"
+    id: int = Field(sa_column=Column(BigInteger, primary_key=True, autoincrement=True))
+    knowledge_base_id: int = Field(
+        sa_column=Column(
+            BigInteger,
+            ForeignKey("matrix_skill_knowledgebase.id", ondelete="CASCADE"),
+            nullable=False,
+            index=True,
+        )
+    )
+    prompt_version: Optional[str] = Field(sa_column=Column(String(50), nullable=True))
+    answer: str = Field(sa_column=Column(Text, nullable=False))
+    embedding: List[float] = Field(sa_column=Column(VECTOR(1536), nullable=False))
+    final_grade: str = Field(sa_column=Column(String(20), nullable=False))
+    completeness: Optional[int] = Field(sa_column=Column(Integer, nullable=True))
+    response: str = Field(sa_column=Column(Text, nullable=False))
+    hits: int = Field(
+        sa_column=Column(Integer, nullable=False, default=0, insert_default=0)
+    )
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            DateTime(),
+            nullable=False,
+            insert_default=datetime.now,
+            onupdate=datetime.now,
+        )
+    )
+
+
+class KnowledgeBaseGradingArtifacts(SQLModel, table=True):
+    __tablename__ = "knowledgebase_grading_artifacts"
+    knowledge_base_id: int = Field(
+        sa_column=Column(
+            BigInteger,
+            ForeignKey("matrix_skill_knowledgebase.id", ondelete="CASCADE"),
+            primary_key=True,
+            nullable=False,
+        )
+    )
+    # md5 of the question, answer and rules the artifacts were generated for
+    source_hash: str = Field(sa_column=Column(String(32), nullable=False))
+    split_response: Optional[str] = Field(sa_column=Column(Text, nullable=True))
+    split_prompt_version: Optional[str] = Field(
+        sa_column=Column(String(50), nullable=True)
+    )
+    safety_response: Optional[str] = Field(sa_column=Column(Text, nullable=True))
+    safety_prompt_version: Optional[str] = Field(
+        sa_column=Column(String(50), nullable=True)
+    )
+    created_at: datetime = Field(
+        sa_column=Column(DateTime(), nullable=False, insert_default=datetime.now)
+    )
+    updated_at: datetime = Field(
+        sa_column=Column(
+            DateTime(),
+            nullable=False,
+            insert_default=datetime.now,
+            onupdate=datetime.now,
+        )
+    )
+
+
+class LLMUsage(SQLModel, table=True):
+    __tablename__ = "llm_usage"
+    id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(BigInteger, primary_key=True, autoincrement=True),
+    )
+    model: Optional[str] = Field(sa_column=Column(String(100), nullable=True))
+    graph: Optional[str] = Field(sa_column=Column(String(50), nullable=True))
+    node: Optional[str] = Field(sa_column=Column(String(100), nullable=True))
+    thread_id: Optional[str] = Field(sa_column=Column(String(100), nullable=True))
+    # no foreign keys, the accounting outlives deleted users and questions
+    user_id: Optional[int] = Field(sa_column=Column(BigInteger, nullable=True))
+    skill_id: Optional[int] = Field(
+        sa_column=Column(BigInteger, nullable=True, index=True)
+    )
+    validation_id: Optional[int] = Field(
+        sa_column=Column(BigInteger, nullable=True, index=True)
+    )
+    prompt_tokens: int = Field(sa_column=Column(Integer, nullable=False))
+    completion_tokens: int = Field(sa_column=Column(Integer, nullable=False))
+    cached_tokens: int = Field(sa_column=Column(Integer, nullable=False))
+    cost_usd: float = Field(sa_column=Column(Float, nullable=False))
+    latency_ms: Optional[int] = Field(sa_column=Column(Integer, nullable=True))
+    cache_hit: bool = Field(sa_column=Column(Boolean, nullable=False))
+    created_at: datetime = Field(
+        sa_column=Column(
+            DateTime(), nullable=False, insert_default=datetime.now, index=True
+        )
+    )
@@ -0,0 +1,42 @@
+from datetime import datetime
+from typing import Any, List, Literal, Optional
+
+from pydantic import BaseModel, model_validator
+
+
+class KnowledgeBaseOption(BaseModel):
+    option: str
+    is_correct: bool
+
+
+class CreateKnowledgeBaseRequest(BaseModel):
+    type: Literal["multi", "single", "input"]
+    question: str
+    answer: Optional[str] = None
+    options: Optional[List[KnowledgeBaseOption]] = None
+    is_code: bool
+
+
+class GeneratedKnowledgeBase(BaseModel):
+    questions: List[CreateKnowledgeBaseRequest]
+
+    @model_validator(mode="before")
+    @classmethod
+    def wrap_question_list(cls, data):
+        # the free-form builder prompt answers with the bare list
+        if isinstance(data, list):
+            return {"questions": data}
+        return data
+
+
+class KnowledgeBaseModelCreate(BaseModel):
+    skill_id: int
+    difficulty_level: int
+    question: str
+    answer: Optional[str]
+    options: Optional[Any]
+    question_type: str
+    is_code_question: bool
+    rules: str
+    created_at: datetime
+    updated_at: datetime
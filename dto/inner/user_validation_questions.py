@@ -6,3 +6,4 @@ from pydantic import BaseModel
 class UserValidationQuestionUpdateDTO(BaseModel):
     status: Literal["pending", "waiting_admin", "verified"]
     answer_correct: bool
+    graded_from_cache: bool = False
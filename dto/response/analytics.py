@@ -1,3 +1,6 @@
+from datetime import date
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -6,3 +9,34 @@ class AnalyticsResponseCompletionRate(BaseModel):
     status: str
     evaluation_start: int
     evaluation_end: int
+
+
+class AnalyticsResponseCost(BaseModel):
+    calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    cache_hits: int
+    cost_usd: float
+
+
+class AnalyticsResponseSkillCost(AnalyticsResponseCost):
+    skill_id: Optional[int]
+    skill_name: Optional[str]
+
+
+class AnalyticsResponseValidationCost(AnalyticsResponseCost):
+    validation_id: int
+    skill_id: Optional[int]
+    user_id: Optional[int]
+
+
+class AnalyticsResponseWeeklyCost(AnalyticsResponseCost):
+    week: date
+    graph: Optional[str]
+
+
+class AnalyticsResponseNodeCost(AnalyticsResponseCost):
+    graph: Optional[str]
+    node: Optional[str]
+    model: Optional[str]
@@ -0,0 +1,44 @@
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class CheckpointerPoolStatsResponse(BaseModel):
+    status: Literal["ok", "degraded", "disabled"]
+    pool_min: int = 0
+    pool_max: int = 0
+    pool_size: int = 0
+    connections_in_use: int = 0
+    connections_idle: int = 0
+    requests_waiting: int = 0
+    requests_num: int = 0
+    requests_wait_ms: int = 0
+    average_wait_ms: float = 0.0
+    requests_errors: int = 0
+    connections_errors: int = 0
+    connections_lost: int = 0
+
+
+class LLMModelHealthResponse(BaseModel):
+    model: str
+    breaker: Literal["closed", "open", "half_open"]
+    calls: int = 0
+    errors: int = 0
+    error_rate: float = 0.0
+    p95_seconds: Optional[float] = None
+    hedges: int = 0
+    hedge_wins: int = 0
+
+
+class NodeParseHealthResponse(BaseModel):
+    node: str
+    parses: int = 0
+    repaired: int = 0
+    failed: int = 0
+    failure_rate: float = 0.0
+
+
+class LLMRouterHealthResponse(BaseModel):
+    status: Literal["ok", "degraded"]
+    models: List[LLMModelHealthResponse] = []
+    nodes: List[NodeParseHealthResponse] = []
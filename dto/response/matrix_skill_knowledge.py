@@ -20,3 +20,23 @@ class MatrixSkillKnowledgeBaseResponse(BaseModel):
     is_code_question: bool
     created_at: datetime
     updated_at: Optional[datetime]
+
+
+class KnowledgeBaseGenerationProgressResponse(BaseModel):
+    run_id: str
+    total_jobs: int
+    pending_jobs: int
+    running_jobs: int
+    done_jobs: int
+    failed_jobs: int
+    questions_requested: int
+    questions_created: int
+    prompt_tokens: int
+    completion_tokens: int
+    started_at: Optional[datetime] = None
+    last_update_at: Optional[datetime] = None
+    elapsed_seconds: float
+    jobs_per_minute: float
+    questions_per_minute: float
+    tokens_per_minute: float
+    eta_seconds: Optional[float] = None
@@ -49,6 +49,7 @@ class UserValidationQuestionResponse(BaseModel):
     created_at: datetime
     status: str
     answer_correct: bool
+    graded_from_cache: bool = False
 
 
 class KnowledgeBaseQuestionResponse(BaseModel):
@@ -89,3 +90,19 @@ class AdminValidationQuestionsGroupedResponse(BaseModel):
     user: UserResponseBase
     questions: List[UserValidationQuestionResponse]
     total_questions: int
+
+
+class ValidationQuestionsAssignmentRow(BaseModel):
+    user_id: int
+    skill_id: int
+    difficulty_level: int
+    questions: int
+
+
+class ValidationQuestionsAssignmentReport(BaseModel):
+    dry_run: bool
+    full: bool = True
+    total_rows: int
+    users: int
+    skills: int
+    rows: List[ValidationQuestionsAssignmentRow] = []
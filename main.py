@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
@@ -6,11 +7,17 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from langtrace_python_sdk import langtrace
 
+from agents import supervisor, validations_agent
+from agents.checkpointer import open_checkpointer_pool, close_checkpointer_pool
+from agents.llm_clients import close_llm_clients
+from agents.llm_usage import llm_usage_writer
+from agents.prompt_registry import prompt_registry
 from routers.admin_matrix_knowledge import admin_matrix_knowledge_router
 from routers.admin_validation_questions import admin_validation_questions_router
 from routers.analytics import analytics_router
 from routers.configs import config_router
 from routers.grades import grades_router
+from routers.health import health_router
 from routers.matrix import matrix_router
 from routers.matrix_chats import matrix_chats_router
 from routers.matrix_validations import matrix_validations_router
@@ -21,6 +28,8 @@ from routers.testing import testing_router
 from routers.users import users_router
 from routers.user_skills import user_skills_router
 from routers.user_validation_questions import user_validation_questions_router
+from service.chat_streams import chat_streams
+from service.pagination import NEXT_CURSOR_HEADER
 
 from logger import logger
 from telemetry import setup_telemetry, instrument_fastapi
@@ -37,12 +46,29 @@ LANGTRACE_HOST = os.getenv("LANGTRACE_HOST")
 
 langtrace.init(api_key=LANGTRACE_API_KEY, api_host=LANGTRACE_HOST)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled checkpointer for every agent graph instead of a new
+    # postgres connection per request
+    await open_checkpointer_pool()
+    # agent nodes read their prompts from the cache instead of langtrace
+    await prompt_registry.warm_up(supervisor.PROMPT_IDS + validations_agent.PROMPT_IDS)
+    yield
+    await close_checkpointer_pool()
+    await prompt_registry.close()
+    await close_llm_clients()
+    await chat_streams.close()
+    await llm_usage_writer.close()
+
+
 app = FastAPI(
     title="Morpheus @ HTEC",
     description="""Morpheus @ HTEC helps engineers populate and validate their skill matrix.
         Application will remind the engineers, that still have not populated entire matrix, or have some
         unpopulated fields to populate these fields accordingly.
         """,
+    lifespan=lifespan,
 )
 
 origins = [
@@ -56,6 +82,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 app.add_middleware(TraceIdMiddleware)
 
@@ -74,6 +101,7 @@ app.include_router(matrix_chats_router)
 app.include_router(analytics_router)
 app.include_router(testing_router)
 app.include_router(matrix_validations_router)
+app.include_router(health_router)
 
 # Instrument FastAPI with OpenTelemetry
 instrument_fastapi(app)
@@ -18,7 +18,6 @@ from inspect_ai.scorer import (
 from inspect_ai.solver import solver, TaskState
 from typing import TypedDict, Optional, Annotated
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from langgraph.graph.message import add_messages
 from langtrace_python_sdk import langtrace
 
@@ -40,14 +39,13 @@ class MatrixValidationState(TypedDict):
 
 load_dotenv()
 
-LITE_LLM_API_KEY = os.getenv("OPENAI_API_KEY")
-LITE_LLM_URL = os.getenv("OPENAI_BASE_URL")
 LITE_MODEL = os.getenv("OPENAI_MODEL")
 LITE_OPENAI_O3_MODEL = os.getenv("LITE_OPENAI_O3_MODEL")
 
 LANGTRACE_API_KEY = os.getenv("LANGTRACE_API_KEY")
 LANGTRACE_HOST = os.getenv("LANGTRACE_HOST")
 
+from agents.llm_clients import get_chat_model
 from agents.validations_agent import get_graph, LLMFormatError
 
 langtrace.init(api_key=LANGTRACE_API_KEY, api_host=LANGTRACE_HOST)
@@ -131,14 +129,12 @@ def matrix_validation_scorer():
             ]
         )
         prompt = await template.ainvoke({"expected": expected, "actual": response})
-        model = ChatOpenAI(
+        model = get_chat_model(
             model=LITE_MODEL,
-            base_url=LITE_LLM_URL,
-            api_key=LITE_LLM_API_KEY,
             temperature=0,
             top_p=1,
             max_tokens=50,
-            stop_sequences=["\nObservation: "],
+            stop=["\nObservation: "],
         )
         result = await model.ainvoke(prompt)
         content = result.content
@@ -1,6 +1,6 @@
 from typing import Annotated, List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.db import get_session
@@ -9,7 +9,12 @@ from dto.request.matrix_skill_knowledge import (
     MatrixSkillKnowledgeBaseRequest,
     MatrixSkillKnowledgeBaseUpdate,
 )
-from dto.response.matrix_skill_knowledge import MatrixSkillKnowledgeBaseResponse
+from dto.response.matrix_skill_knowledge import (
+    MatrixSkillKnowledgeBaseResponse,
+    KnowledgeBaseGenerationProgressResponse,
+)
+from service.knowledgebase_generation import KnowledgeBaseGenerationLedger
+from service.pagination import NEXT_CURSOR_HEADER
 from service.service import BaseService
 from security import get_current_user, admin_required
 from utils.common import common_parameters
@@ -58,18 +63,43 @@ async def matrix_knowledge_filters(
     "", response_model=List[MatrixSkillKnowledgeBaseResponse]
 )
 async def get_all_matrix_knowledge(
+    response: Response,
     session: Annotated[AsyncSession, Depends(get_session)],
     common: Annotated[dict, Depends(common_parameters)],
     filters: Annotated[dict, Depends(matrix_knowledge_filters)],
     current_user: Optional[User] = Depends(get_current_user),
 ) -> List[MatrixSkillKnowledgeBaseResponse]:
     service = BaseService(MatrixSkillKnowledgeBase, session)
-    items = await service.list_all(
-        filters=filters, limit=common["limit"], offset=common["offset"]
+    page = await service.list_page(
+        filters=filters,
+        limit=common["limit"],
+        offset=common["offset"],
+        cursor=common["cursor"],
     )
+    items = page.items
+    if page.next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
     return [MatrixSkillKnowledgeBaseResponse(**item.model_dump()) for item in items]
 
 
+@admin_matrix_knowledge_router.get(
+    "/generation/progress", response_model=KnowledgeBaseGenerationProgressResponse
+)
+async def get_matrix_knowledge_generation_progress(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    run_id: Optional[str] = Query(None),
+) -> KnowledgeBaseGenerationProgressResponse:
+    """
+    Progress and throughput of a knowledge base generation run, defaults to
+    the latest run
+    """
+    ledger = KnowledgeBaseGenerationLedger(session)
+    progress = await ledger.get_progress(run_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Generation run not found")
+    return progress
+
+
 @admin_matrix_knowledge_router.get(
     "/{knowledge_id}", response_model=MatrixSkillKnowledgeBaseResponse
 )
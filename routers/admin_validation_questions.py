@@ -1,7 +1,7 @@
-from typing import Annotated, List, Dict
+from typing import Annotated, List, Dict, Optional
 from collections import defaultdict
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.db import get_session
@@ -9,7 +9,9 @@ from db.models import UserValidationQuestions, User
 from dto.response.user_validation_questions import (
     UserValidationQuestionResponse,
     AdminValidationQuestionsGroupedResponse,
+    ValidationQuestionsAssignmentReport,
 )
+from service.question_assignment import UserValidationQuestionsAssigner
 from service.service import BaseService
 from security import get_current_user, admin_required
 from utils.common import common_parameters
@@ -35,6 +37,7 @@ async def get_admin_validation_questions(
         limit=common["limit"],
         offset=common["offset"],
         order_by=[UserValidationQuestions.created_at.asc()],
+        load=["user", "skill", "knowledge_base"],
     )
 
     user_questions: Dict[int, List[UserValidationQuestionResponse]] = defaultdict(list)
@@ -63,3 +66,21 @@ async def get_admin_validation_questions(
         )
         for user_id, questions_list in user_questions.items()
     ]
+
+
+@admin_validation_questions_router.get(
+    "/assignment-plan", response_model=ValidationQuestionsAssignmentReport
+)
+async def get_validation_questions_assignment_plan(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    sample_size: Annotated[int, Query(ge=0, le=1000)] = 100,
+    full: Optional[bool] = None,
+) -> ValidationQuestionsAssignmentReport:
+    """
+    Dry run of the periodic validation questions assignment. Reports how many
+    questions would be created for which users and skills without writing them.
+    Without ``full`` the plan follows the scheduler and is incremental unless a
+    full reconciliation is due.
+    """
+    assigner = UserValidationQuestionsAssigner(session)
+    return await assigner.run(dry_run=True, full=full, sample_size=sample_size)
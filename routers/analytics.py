@@ -1,13 +1,20 @@
+from datetime import datetime
 from typing import Annotated, Any, List, Dict, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 from fastapi.params import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.db import get_session
 from db.models import Skill, User
 from dto.request.skills import SkillRequestBase
-from dto.response.analytics import AnalyticsResponseCompletionRate
+from dto.response.analytics import (
+    AnalyticsResponseCompletionRate,
+    AnalyticsResponseNodeCost,
+    AnalyticsResponseSkillCost,
+    AnalyticsResponseValidationCost,
+    AnalyticsResponseWeeklyCost,
+)
 from dto.response.skills import SkillResponseFull
 from service.analytics import AnalyticsServiceFactory, AnalyticsServiceType
 from service.service import BaseService
@@ -32,3 +39,65 @@ async def get_analytics(
         .build()
     )
     return await analytics_service.get_completion_rate()
+
+
+@analytics_router.get("/costs/skills", response_model=List[AnalyticsResponseSkillCost])
+async def get_cost_per_skill(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    created_after: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
+) -> List[AnalyticsResponseSkillCost]:
+    analytics_service = (
+        AnalyticsServiceFactory(AnalyticsServiceType.NORMAL)
+        .set_session(session)
+        .build()
+    )
+    return await analytics_service.get_cost_per_skill(created_after, created_before)
+
+
+@analytics_router.get(
+    "/costs/validations", response_model=List[AnalyticsResponseValidationCost]
+)
+async def get_cost_per_validation(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    created_after: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
+    skill_id: Optional[int] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+) -> List[AnalyticsResponseValidationCost]:
+    analytics_service = (
+        AnalyticsServiceFactory(AnalyticsServiceType.NORMAL)
+        .set_session(session)
+        .build()
+    )
+    return await analytics_service.get_cost_per_validation(
+        created_after, created_before, skill_id, limit
+    )
+
+
+@analytics_router.get("/costs/weekly", response_model=List[AnalyticsResponseWeeklyCost])
+async def get_cost_per_week(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    created_after: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
+) -> List[AnalyticsResponseWeeklyCost]:
+    analytics_service = (
+        AnalyticsServiceFactory(AnalyticsServiceType.NORMAL)
+        .set_session(session)
+        .build()
+    )
+    return await analytics_service.get_cost_per_week(created_after, created_before)
+
+
+@analytics_router.get("/costs/nodes", response_model=List[AnalyticsResponseNodeCost])
+async def get_cost_per_node(
+    session: Annotated[AsyncSession, Depends(get_session)],
+    created_after: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
+) -> List[AnalyticsResponseNodeCost]:
+    analytics_service = (
+        AnalyticsServiceFactory(AnalyticsServiceType.NORMAL)
+        .set_session(session)
+        .build()
+    )
+    return await analytics_service.get_cost_per_node(created_after, created_before)
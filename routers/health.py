@@ -0,0 +1,87 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+
+from agents.checkpointer import get_checkpointer_pool_stats
+from agents.llm_router import BREAKER_CLOSED, model_stats
+from agents.structured_output import parse_stats
+from db.models import User
+from dto.response.health import (
+    CheckpointerPoolStatsResponse,
+    LLMModelHealthResponse,
+    LLMRouterHealthResponse,
+    NodeParseHealthResponse,
+)
+from security import get_current_user, admin_required
+
+health_router = APIRouter(
+    prefix="/api/v1/health",
+    tags=["Health"],
+    dependencies=[Depends(admin_required)],
+)
+
+
+@health_router.get("/checkpointer", response_model=CheckpointerPoolStatsResponse)
+async def get_checkpointer_health(
+    current_user: Optional[User] = Depends(get_current_user),
+) -> CheckpointerPoolStatsResponse:
+    stats = get_checkpointer_pool_stats()
+    if stats is None:
+        return CheckpointerPoolStatsResponse(status="disabled")
+    pool_size = stats.get("pool_size", 0)
+    pool_available = stats.get("pool_available", 0)
+    requests_waiting = stats.get("requests_waiting", 0)
+    requests_num = stats.get("requests_num", 0)
+    requests_wait_ms = stats.get("requests_wait_ms", 0)
+    status = "ok"
+    if requests_waiting > 0 and pool_available == 0:
+        status = "degraded"
+    return CheckpointerPoolStatsResponse(
+        status=status,
+        pool_min=stats.get("pool_min", 0),
+        pool_max=stats.get("pool_max", 0),
+        pool_size=pool_size,
+        connections_in_use=pool_size - pool_available,
+        connections_idle=pool_available,
+        requests_waiting=requests_waiting,
+        requests_num=requests_num,
+        requests_wait_ms=requests_wait_ms,
+        average_wait_ms=(requests_wait_ms / requests_num if requests_num > 0 else 0.0),
+        requests_errors=stats.get("requests_errors", 0),
+        connections_errors=stats.get("connections_errors", 0),
+        connections_lost=stats.get("connections_lost", 0),
+    )
+
+
+@health_router.get("/llm", response_model=LLMRouterHealthResponse)
+async def get_llm_health(
+    current_user: Optional[User] = Depends(get_current_user),
+) -> LLMRouterHealthResponse:
+    models = [
+        LLMModelHealthResponse(
+            model=model,
+            breaker=stats.breaker,
+            calls=stats.calls,
+            errors=stats.errors,
+            error_rate=stats.errors / stats.calls if stats.calls > 0 else 0.0,
+            p95_seconds=stats.p95,
+            hedges=stats.hedges,
+            hedge_wins=stats.hedge_wins,
+        )
+        for model, stats in model_stats().items()
+    ]
+    # a failed parse retries (or fails) the whole node
+    nodes = [
+        NodeParseHealthResponse(
+            node=node,
+            parses=stats.parses,
+            repaired=stats.repaired,
+            failed=stats.failed,
+            failure_rate=stats.failed / stats.parses if stats.parses > 0 else 0.0,
+        )
+        for node, stats in parse_stats().items()
+    ]
+    status = "ok"
+    if any(model.breaker != BREAKER_CLOSED for model in models):
+        status = "degraded"
+    return LLMRouterHealthResponse(status=status, models=models, nodes=nodes)
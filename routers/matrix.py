@@ -65,6 +65,7 @@ async def get_matrix(
         offset=common["offset"],
         limit=common["limit"],
         filters=filters,
+        load=AWAITABLES,
     )
     response_list: List[UserMatrixResponseBase] = []
     for skill in all_skills:
@@ -96,6 +97,7 @@ async def get_matrix(
         offset=common["offset"],
         limit=common["limit"],
         filters=filters,
+        load=AWAITABLES,
     )
     response_list: List[UserMatrixResponseBase] = []
     for skill in all_skills:
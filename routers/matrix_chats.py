@@ -1,9 +1,9 @@
 import json
 import uuid
-from typing import Annotated, Any, List, AsyncGenerator
+from typing import Annotated, Any, List, AsyncGenerator, AsyncIterator, Optional
 from opentelemetry import trace
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi.params import Depends
 from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBasicCredentials
@@ -17,9 +17,11 @@ from agents.reasoner import (
     get_graph,
     run_interrupted,
     FinalClassificationStdOutput,
+    TOKEN_EVENT_TYPE,
+    REASONER_CHECKPOINT_DURABILITY,
 )
 from agents.welcome import welcome_agent
-from db.db import get_session
+from db.db import async_session, get_session
 from db.models import Grade, MatrixChat, Notification, UserSkills, User, Skill
 from dto.inner.matrix_chat import UpdateMatrixChatStatusBase
 from dto.inner.notifications import CreateNotificationRequestBase
@@ -28,14 +30,25 @@ from dto.request.matrix_chat import (
     MatrixChatRequestBase,
     MatrixChatInterruptRequestBase,
 )
-from dto.response.grades import GradeResponseBase
 from dto.response.matrix_chats import (
     MatrixChatResponseBase,
     MessageDict,
 )
 from security import security, get_current_user
+from service.chat_streams import (
+    ChatRunConflictError,
+    chat_streams,
+    is_valid_event_id,
+)
+from service.pagination import NEXT_CURSOR_HEADER
 from service.service import BaseService
-from utils.common import convert_msg_dict_to_langgraph_format
+from utils.common import convert_msg_dict_to_langgraph_format, common_parameters
+from utils.sse import (
+    ServerSentEvent,
+    accepts_event_stream,
+    event_stream_response,
+    json_events,
+)
 
 matrix_chats_router = APIRouter(
     prefix="/api/v1/matrix-chats", tags=["Matrix Validations Chat"]
@@ -49,12 +62,46 @@ async def send_msg_by_msg(msgs: List[MessageDict]):
         yield msg.model_dump_json()
 
 
+def stream_messages(chunks: AsyncIterator[str], request: Request) -> StreamingResponse:
+    """
+    Streams the ``MessageDict`` json chunks as server-sent events typed by
+    their ``msg_type`` to the clients accepting ``text/event-stream`` and as
+    concatenated json to the others
+    """
+    if accepts_event_stream(request):
+        return event_stream_response(
+            json_events(chunks, lambda chunk: chunk["msg_type"]), request
+        )
+    return StreamingResponse(chunks, media_type="application/json")
+
+
+async def event_data(
+    events: AsyncIterator[ServerSentEvent],
+) -> AsyncGenerator[str, Any]:
+    async for event in events:
+        yield event.data
+
+
+def stream_chat_events(
+    events: AsyncIterator[ServerSentEvent], request: Request
+) -> StreamingResponse:
+    """
+    Streams the events of a chat run read from its event log, as server-sent
+    events or as the concatenated json chunks
+    """
+    if accepts_event_stream(request):
+        return event_stream_response(events, request)
+    return StreamingResponse(event_data(events), media_type="application/json")
+
+
 @matrix_chats_router.get(
     "/users/{user_id}", response_model=List[MatrixChatResponseBase]
 )
 async def get_matrix_users_chats(
     user_id: int,
+    response: Response,
     session: Annotated[AsyncSession, Depends(get_session)],
+    common: Annotated[dict, Depends(common_parameters)],
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
 ) -> List[MatrixChatResponseBase]:
     with tracer.start_as_current_span("get_matrix_chats_for_user") as span:
@@ -66,9 +113,17 @@ async def get_matrix_users_chats(
         filters = {
             "user_id": user_id,
         }
-        all_user_validations = await service.list_all(
-            filters=filters, order_by=[MatrixChat.created_at.desc()]
+        page = await service.list_page(
+            filters=filters,
+            descending=True,
+            limit=common["limit"],
+            offset=common["offset"],
+            cursor=common["cursor"],
+            load=["user", "skill"],
         )
+        all_user_validations = page.items
+        if page.next_cursor is not None:
+            response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
         all_matrices: List[MatrixChatResponseBase] = []
         for user_validation in all_user_validations:
             user = await user_validation.awaitable_attrs.user
@@ -91,7 +146,7 @@ async def get_matrix_chat_info(
     service: BaseService[MatrixChat, uuid.UUID, Any, Any] = BaseService(
         MatrixChat, session
     )
-    chat = await service.get(chat_id)
+    chat = await service.get(chat_id, load=["user", "skill"])
     user = await chat.awaitable_attrs.user
     skill = await chat.awaitable_attrs.skill
     return MatrixChatResponseBase(
@@ -102,6 +157,7 @@ async def get_matrix_chat_info(
 @matrix_chats_router.get("/{chat_id}", response_model=None)
 async def get_matrix_chat(
     chat_id: uuid.UUID,
+    request: Request,
     session: Annotated[AsyncSession, Depends(get_session)],
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
 ) -> None | StreamingResponse:
@@ -111,7 +167,7 @@ async def get_matrix_chat(
     async with get_graph() as graph:
         config = {"configurable": {"thread_id": chat_id}}
         messages = []
-        chat = await service.get(chat_id)
+        chat = await service.get(chat_id, load=["user", "skill"])
         user = await chat.awaitable_attrs.user
         skill = await chat.awaitable_attrs.skill
         state = await graph.aget_state(config)
@@ -144,22 +200,28 @@ async def get_matrix_chat(
                         )
                     )
         else:
-            return StreamingResponse(
-                welcome_agent(user.id, skill.id, session), media_type="application/json"
-            )
+            return stream_messages(welcome_agent(user.id, skill.id, session), request)
 
-        return StreamingResponse(
-            send_msg_by_msg(messages), media_type="application/json"
-        )
+        return stream_messages(send_msg_by_msg(messages), request)
 
 
 @matrix_chats_router.post("/{chat_id}", response_model=None)
 async def post_matrix_message(
     chat_id: uuid.UUID,
+    request: Request,
     create_dto: MatrixChatRequestBase,
     session: Annotated[AsyncSession, Depends(get_session)],
     credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    stream_tokens: bool = False,
 ) -> StreamingResponse:
+    """
+    Runs the reasoner on the new message of the user. With ``stream_tokens``
+    the message of the answering node is streamed token by token as
+    ``ai_token`` messages before the node update. The run continues when the
+    client disconnects and can be followed again through
+    ``GET /{chat_id}/stream``, a message posted while the chat is still
+    running attaches to the running graph.
+    """
     chat_service: BaseService[
         MatrixChat, uuid.UUID, Any, UpdateMatrixChatStatusBase
     ] = BaseService(MatrixChat, session)
@@ -174,15 +236,14 @@ async def post_matrix_message(
             detail="Forbidden to modify completed discussion",
         )
     grades = await service.list_all()
-    all_grades = []
-    for grade in grades:
-        all_grades.append(grade.model_dump_json())
+    all_grades = [grade.id for grade in grades]
     state = await get_current_state(chat_id)
     users_skill = await user_skill_service.list_all(
         filters={
             "skill_id": current_chat.skill_id,
             "user_id": current_chat.user_id,
-        }
+        },
+        load=["user", "skill"],
     )
     skill = await users_skill[0].awaitable_attrs.skill
     user = await users_skill[0].awaitable_attrs.user
@@ -190,26 +251,64 @@ async def post_matrix_message(
     messages_to_send = []
     grades_to_send = []
     print(f"STATE VALUES {state.values}")
-    if "messages" in state.values and "grades" in state.values:
+    # threads checkpointed before the grade references have no grade ids
+    if "messages" in state.values:
         messages_to_send = state.values["messages"] + [
             HumanMessage(create_dto.messages[-1].message)
         ]
-        grades_to_send = state.values["grades"]
+        grades_to_send = state.values.get("grade_ids") or all_grades
     else:
         messages_to_send = convert_msg_dict_to_langgraph_format(create_dto.messages)
         grades_to_send = all_grades
-    return StreamingResponse(
-        save_after_processing(
+    try:
+        start_id = await chat_streams.start(
             chat_id,
-            messages_to_send,
-            grades_to_send,
-            skill,
-            user,
-            session,
-            current_chat,
-        ),
-        media_type="application/json",
-    )
+            lambda: save_after_processing(
+                chat_id,
+                messages_to_send,
+                grades_to_send,
+                skill,
+                user,
+                current_chat,
+                stream_tokens,
+            ),
+            lambda chunk: chunk["msg_type"],
+            message=(create_dto.messages[-1].message if create_dto.messages else None),
+        )
+    except ChatRunConflictError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The previous message of the discussion is still being answered",
+        )
+    return stream_chat_events(chat_streams.tail(chat_id, start_id), request)
+
+
+@matrix_chats_router.get("/{chat_id}/stream", response_model=None)
+async def resume_matrix_chat_stream(
+    chat_id: uuid.UUID,
+    request: Request,
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+    last_event_id: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Replays the events of the chat run after ``Last-Event-ID`` (header or
+    query parameter) and follows the run until it ends. Without an event id
+    the active run is streamed from its start.
+    """
+    after_id = request.headers.get("last-event-id") or last_event_id
+    if after_id is None:
+        after_id = await chat_streams.active_run(chat_id)
+        if after_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No running discussion to follow",
+            )
+    elif not is_valid_event_id(after_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid Last-Event-ID",
+        )
+    return stream_chat_events(chat_streams.tail(chat_id, after_id), request)
 
 
 @matrix_chats_router.get("/{chat_id/all")
@@ -227,7 +326,8 @@ async def post_interrupt_resolution(
     chat_service: BaseService[
         MatrixChat, uuid.UUID, Any, UpdateMatrixChatStatusBase
     ] = BaseService(MatrixChat, session)
-    response = await run_interrupted(chat_id, create_dto.grade)
+    # the resolution of the admin is kept after every step
+    response = await run_interrupted(chat_id, create_dto.grade, durability="sync")
 
     final_classification = response["final_result"]
     await chat_service.update(chat_id, UpdateMatrixChatStatusBase(status="COMPLETED"))
@@ -268,17 +368,29 @@ async def get_current_state(thread_id: uuid.UUID) -> StateSnapshot | None:
 async def save_after_processing(
     thread_id: uuid.UUID,
     msgs: List[MessageDict],
-    grades: List[GradeResponseBase],
+    grade_ids: List[int],
     skill: Skill,
     user: User,
-    session: Annotated[AsyncSession, Depends(get_session)],
     current_chat: MatrixChat,
+    stream_tokens: bool = False,
 ) -> AsyncGenerator[str, Any]:
-    async for chunk in reasoner_run(thread_id, msgs, grades, skill, user):
-        async for processed_chunk in process_chunk(
-            thread_id, current_chat, chunk, session
+    # the run outlives the request, so it can not use the request session
+    async with async_session() as session:
+        # the turn outlives the request, a worker dying mid-turn must leave
+        # the steps so far for the next message
+        async for chunk in reasoner_run(
+            thread_id,
+            msgs,
+            grade_ids,
+            skill,
+            user,
+            stream_tokens,
+            durability=REASONER_CHECKPOINT_DURABILITY,
         ):
-            yield processed_chunk
+            async for processed_chunk in process_chunk(
+                thread_id, current_chat, chunk, session
+            ):
+                yield processed_chunk
 
 
 async def process_chunk(
@@ -294,6 +406,11 @@ async def process_chunk(
         MatrixChat, uuid.UUID, Any, UpdateMatrixChatStatusBase
     ] = BaseService(MatrixChat, session)
     response = json.loads(chunk)
+    if response["type"] == TOKEN_EVENT_TYPE:
+        yield MessageDict(
+            msg_type="ai_token", message=response["token"]
+        ).model_dump_json()
+        return
     print("CHUNK RESPONSE REASONER -> ", response)
     if response["interrupt_happened"]:
         print(f"INTERRUPT HAPPENED RESPONSE {response}")
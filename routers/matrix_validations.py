@@ -26,5 +26,7 @@ async def validate_matrix(dto: CreateMatrixValidation):
                 "intermediate_steps": [],
             },
             configurable_run,
+            # one-off thread, nothing reads its checkpoints again
+            durability="exit",
         )
         return response
@@ -1,7 +1,7 @@
 import uuid
 from typing import Annotated, Any, List, Optional, Dict
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.db import get_session
@@ -14,6 +14,7 @@ from dto.response.notifications import (
     NotificationResponseBase,
     NotificationSmallResponseBase,
 )
+from service.pagination import NEXT_CURSOR_HEADER
 from service.service import BaseService
 from security import get_current_user
 from utils.common import common_parameters
@@ -26,6 +27,7 @@ notifications_router = APIRouter(
 @notifications_router.get("", response_model=List[NotificationResponseBase])
 async def list_notifications(
     user_id: int,
+    response: Response,
     session: Annotated[AsyncSession, Depends(get_session)],
     common: Annotated[dict, Depends(common_parameters)],
     current_user: Optional[User] = Depends(get_current_user),
@@ -35,12 +37,17 @@ async def list_notifications(
     )
     group = "ADMIN" if current_user.is_admin else "USER"
     filters = {"or_": {"user_id": user_id, "user_group": group}}
-    notifications = await service.list_all_with_or(
+    page = await service.list_page(
         filters=filters,
-        order_by=[Notification.created_at.desc()],
+        descending=True,
         limit=common["limit"],
         offset=common["offset"],
+        cursor=common["cursor"],
+        load=["user"],
     )
+    notifications = page.items
+    if page.next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
     print(f"Notifications -> {notifications}")
     all_notifications = []
     for notif in notifications:
@@ -41,7 +41,9 @@ async def get_all_skills(
     current_user: Optional[User] = Depends(get_current_user),
 ) -> List[SkillResponseFull]:
     service: BaseService[Skill, int, Any, Any] = BaseService(Skill, session)
-    all_skills = await service.list_all(limit=common["limit"], offset=common["offset"])
+    all_skills = await service.list_all(
+        limit=common["limit"], offset=common["offset"], load=AWAITABLES
+    )
     response_skills: List[SkillResponseFull] = []
     for skill in all_skills:
         parent = await skill.awaitable_attrs.parent
@@ -64,7 +66,7 @@ async def get_skill(
     current_user: Optional[User] = Depends(get_current_user),
 ) -> SkillResponseFull:
     service: BaseService[Skill, int, Any, Any] = BaseService(Skill, session)
-    res_skill: Skill = await service.get(skill_id)
+    res_skill: Skill = await service.get(skill_id, load=AWAITABLES)
     parent = await res_skill.awaitable_attrs.parent
     children = await res_skill.awaitable_attrs.children
     parent_dump = None if parent is None else parent.model_dump()
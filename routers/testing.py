@@ -2,7 +2,7 @@ import json
 import uuid
 from typing import AsyncGenerator, Dict, Any, Annotated, Optional, List
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBasicCredentials
 from langgraph.types import Interrupt
@@ -16,6 +16,7 @@ from agents.supervisor import (
     DiscrepancyValues,
     GuidanceValue,
 )
+from agents.llm_usage import usage_tags
 from agents.welcome import SingleUserSkillData, welcome_agent_batch
 from db.db import get_session
 from db.models import TestSupervisorMatrix, TestSupervisorWelcome, User
@@ -30,9 +31,12 @@ from dto.response.matrix_chats import (
 )
 from security import admin_required, security, get_current_user
 from service.service import BaseService
+from utils.sse import accepts_event_stream, event_stream_response, json_events
 
 testing_router = APIRouter(prefix="/api/v1/testing", tags=["testing"])
 
+AWAITABLES = ["user", "skill", "welcome_msg"]
+
 
 class TestModel(BaseModel):
     name: str
@@ -52,7 +56,9 @@ async def get_testing_chats(
         "user_id": current_user.id,
     }
     all_user_validations = await service.list_all(
-        filters=filters, order_by=[TestSupervisorMatrix.created_at.desc()]
+        filters=filters,
+        order_by=[TestSupervisorMatrix.created_at.desc()],
+        load=AWAITABLES,
     )
     all_matrices: List[MatrixChatResponseSmallBase] = []
     for user_validation in all_user_validations:
@@ -89,7 +95,7 @@ async def get_testing_chat(
     filters = {
         "user_id": current_user.id,
     }
-    test_matrice = await service.get(chat_id)
+    test_matrice = await service.get(chat_id, load=AWAITABLES)
     user = await test_matrice.awaitable_attrs.user
     skill = await test_matrice.awaitable_attrs.skill
     welcome = await test_matrice.awaitable_attrs.welcome_msg
@@ -168,6 +174,7 @@ async def create_testing_models():
 @testing_router.post("/chats/{chat_id}", response_model=str)
 async def reason_through(
     chat_id: uuid.UUID,
+    request: Request,
     session: Annotated[AsyncSession, Depends(get_session)],
     created_dto: TestingRequestBase,
     current_user: Optional[User] = Depends(get_current_user),
@@ -178,7 +185,7 @@ async def reason_through(
     filters = {
         "user_id": current_user.id,
     }
-    test_matrice = await service.get(chat_id)
+    test_matrice = await service.get(chat_id, load=AWAITABLES)
     user = await test_matrice.awaitable_attrs.user
     skill = await test_matrice.awaitable_attrs.skill
     welcome = await test_matrice.awaitable_attrs.welcome_msg
@@ -207,6 +214,12 @@ async def reason_through(
         chat_messages=[m.model_dump() for m in created_dto.messages],
     )
     print(f"SENDING STATE {state}")
+    if accepts_event_stream(request):
+        # chunks are keyed by the graph node they come from
+        return event_stream_response(
+            json_events(run_graph_stream(state), lambda chunk: next(iter(chunk))),
+            request,
+        )
     return StreamingResponse(content=run_graph_stream(state), media_type="text/plain")
 
 
@@ -214,6 +227,7 @@ async def run_graph_stream(state: SupervisorState) -> AsyncGenerator[str, None]:
     async with get_graph() as graph:
         configurable_run = {
             "configurable": {"thread_id": uuid.uuid4()},
+            "metadata": usage_tags("supervisor"),
             "recursion_limit": 10,
         }
         state_history = await graph.aget_state(configurable_run)
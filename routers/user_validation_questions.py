@@ -3,12 +3,19 @@ import uuid
 from typing import Annotated, List, Optional, Any, Dict
 
 import openai
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from langchain_core.messages import AIMessage
 from langgraph.errors import GraphRecursionError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from agents.validations_agent import get_graph, LLMFormatError, MatrixValidationState
+from agents.checkpoint_retention import ARCHIVED_METADATA_KEY, get_checkpoint_archive
+from agents.llm_usage import usage_tags
+from agents.validations_agent import (
+    VALIDATIONS_CHECKPOINT_DURABILITY,
+    get_graph,
+    LLMFormatError,
+    MatrixValidationState,
+)
 from db.db import get_session
 from db.models import UserValidationQuestions, MatrixSkillKnowledgeBase, User
 from dto.inner.user_validation_questions import UserValidationQuestionUpdateDTO
@@ -25,6 +32,7 @@ from dto.response.user_validation_questions import (
     SkillFormResponse,
     SkillFormQuestionResponse,
 )
+from service.pagination import NEXT_CURSOR_HEADER
 from service.service import BaseService
 from security import get_current_user
 from utils.common import common_parameters
@@ -41,17 +49,22 @@ FINAL_ANSWER = "Final Answer: "
     "", response_model=List[UserValidationQuestionResponse]
 )
 async def get_user_validation_questions(
+    response: Response,
     session: Annotated[AsyncSession, Depends(get_session)],
     common: Annotated[dict, Depends(common_parameters)],
     current_user: User = Depends(get_current_user),
 ) -> List[UserValidationQuestionResponse]:
     service = BaseService(UserValidationQuestions, session)
-    questions = await service.list_all(
+    page = await service.list_page(
         filters={"user_id": current_user.id},
         limit=common["limit"],
         offset=common["offset"],
-        order_by=[UserValidationQuestions.created_at.asc()],
+        cursor=common["cursor"],
+        load=["user", "skill", "knowledge_base"],
     )
+    questions = page.items
+    if page.next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
     user, skill, knowledge_base = None, None, None
     full_questions = []
     for question in questions:
@@ -147,7 +160,7 @@ async def answer_multi_validation_question(
     from fastapi import HTTPException
 
     validation_service = BaseService(UserValidationQuestions, session)
-    user_question = await validation_service.get(question_id)
+    user_question = await validation_service.get(question_id, load=["knowledge_base"])
     if user_question.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     knowledge_base = await user_question.awaitable_attrs.knowledge_base
@@ -181,7 +194,7 @@ async def answer_single_validation_question(
     from fastapi import HTTPException
 
     validation_service = BaseService(UserValidationQuestions, session)
-    user_question = await validation_service.get(question_id)
+    user_question = await validation_service.get(question_id, load=["knowledge_base"])
     if user_question.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     knowledge_base = await user_question.awaitable_attrs.knowledge_base
@@ -220,7 +233,7 @@ async def answer_input_validation_question(
         service: BaseService[
             UserValidationQuestions, int, UserValidationQuestionUpdateDTO, Any
         ] = BaseService(UserValidationQuestions, session)
-        question = await service.get(question_id)
+        question = await service.get(question_id, load=["skill", "knowledge_base"])
         skill = await question.awaitable_attrs.skill
         knowledge_base = await question.awaitable_attrs.knowledge_base
         async with get_graph() as graph:
@@ -230,6 +243,13 @@ async def answer_input_validation_question(
                         "thread_id": question.question_uuid
                     },  # This for correct state management
                     # "configurable": {"thread_id": uuid.uuid4()},  # This is for testing
+                    "metadata": usage_tags(
+                        "matrix_validation",
+                        question.question_uuid,
+                        current_user.id,
+                        skill.id,
+                        validation_id=question_id,
+                    ),
                     "recursion_limit": 16,
                 }
                 graph_state = await graph.aget_state(configurable_run)
@@ -257,6 +277,9 @@ async def answer_input_validation_question(
                         "monitor": None,
                     },
                     configurable_run,
+                    # a failed answer is sent again, the thread only has to
+                    # keep the admin interrupt and the graded answer
+                    durability=VALIDATIONS_CHECKPOINT_DURABILITY,
                 )
                 msg = response["messages"][-1]
                 if "__interrupt__" in response:
@@ -269,6 +292,7 @@ async def answer_input_validation_question(
                             answer_correct=(
                                 True if response["final_grade"] == "Correct" else False
                             ),
+                            graded_from_cache=bool(response.get("graded_from_cache")),
                         ),
                     )
 
@@ -277,14 +301,10 @@ async def answer_input_validation_question(
                 else:
                     return MessagesRequestBase(role="human", message=msg.message)
 
-            except LLMFormatError as format_err:  # LLMFormatErr
-                await answer_input_validation_question(
-                    question_id=question_id,
-                    dto=dto,
-                    session=session,
-                    current_user=current_user,
-                    model="gpt-o3-mini",
-                )
+            except LLMFormatError as format_err:
+                # provider failures are handled by the model router and the
+                # format errors by the retry policy of the graph nodes
+                raise HTTPException(status_code=502, detail=str(format_err))
             except (openai.PermissionDeniedError, GraphRecursionError) as e:
                 state = await graph.aget_state(configurable_run)
                 values = state[0]
@@ -306,7 +326,8 @@ async def get_skill_validation_form(
 
     validation_service = BaseService(UserValidationQuestions, session)
     questions = await validation_service.list_all(
-        filters={"user_id": current_user.id, "skill_id": skill_id}
+        filters={"user_id": current_user.id, "skill_id": skill_id},
+        load=["skill", "knowledge_base"],
     )
     if not questions:
         raise HTTPException(status_code=404, detail="No questions found for this skill")
@@ -351,11 +372,11 @@ async def answer_input_validation_history(
 ) -> List[Dict[str, Any]]:
     async for session in get_session():
         service = BaseService(UserValidationQuestions, session)
-        question = await service.get(question_id)
+        question = await service.get(question_id, load=["skill", "knowledge_base"])
         skill = await question.awaitable_attrs.skill
         knowledge_base = await question.awaitable_attrs.knowledge_base
         async for session in get_session():
-            question = await service.get(question_id)
+            question = await service.get(question_id, load=["skill", "knowledge_base"])
             skill = await question.awaitable_attrs.skill
             knowledge_base = await question.awaitable_attrs.knowledge_base
             try:
@@ -367,10 +388,30 @@ async def answer_input_validation_history(
                         "recursion_limit": 25,
                     }
                     print("BEFORE AGET STATE HISTORY")
+                    checkpoint_ids = set()
+                    oldest = None
                     async for state_chunk in graph.aget_state_history(configurable_run):
                         all_chunks.append(MatrixValidationState(**state_chunk[0]))
+                        checkpoint_ids.add(
+                            state_chunk.config["configurable"]["checkpoint_id"]
+                        )
+                        oldest = state_chunk
                         print("AFTER AGET STATE HISTORY")
                         print(f"STATE CHUNK {state_chunk}")
+                    if oldest is not None and oldest.metadata.get(
+                        ARCHIVED_METADATA_KEY
+                    ):
+                        # the thread has been collapsed by the checkpoint
+                        # retention, the earlier checkpoints are archived
+                        archived = await get_checkpoint_archive().read(
+                            question.question_uuid
+                        )
+                        all_chunks += [
+                            MatrixValidationState(**record["values"])
+                            for record in archived or []
+                            if record["checkpoint_ns"] == ""
+                            and record["checkpoint_id"] not in checkpoint_ids
+                        ]
                     return all_chunks
             except Exception as e:
                 print(f"Error getting state history: {e}")
@@ -1,11 +1,28 @@
 import enum
 from abc import ABC, abstractmethod
-from typing import Self
+from datetime import datetime
+from typing import List, Optional, Self, Tuple
 
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from dto.response.analytics import AnalyticsResponseCompletionRate
+from dto.response.analytics import (
+    AnalyticsResponseCompletionRate,
+    AnalyticsResponseNodeCost,
+    AnalyticsResponseSkillCost,
+    AnalyticsResponseValidationCost,
+    AnalyticsResponseWeeklyCost,
+)
+
+# aggregates shared by the cost queries over llm_usage
+COST_COLUMNS = """
+    count(*) as calls,
+    coalesce(sum(u.prompt_tokens), 0) as prompt_tokens,
+    coalesce(sum(u.completion_tokens), 0) as completion_tokens,
+    coalesce(sum(u.cached_tokens), 0) as cached_tokens,
+    count(*) filter (where u.cache_hit) as cache_hits,
+    coalesce(sum(u.cost_usd), 0) as cost_usd
+"""
 
 
 class AnalyticsServiceType(enum.Enum):
@@ -25,6 +42,40 @@ class BaseAnalytics(ABC):
     async def get_top_skills_by_completion_rate(self):
         raise NotImplementedError()
 
+    @abstractmethod
+    async def get_cost_per_skill(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> List[AnalyticsResponseSkillCost]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_cost_per_validation(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        skill_id: Optional[int] = None,
+        limit: int = 100,
+    ) -> List[AnalyticsResponseValidationCost]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_cost_per_week(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> List[AnalyticsResponseWeeklyCost]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_cost_per_node(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> List[AnalyticsResponseNodeCost]:
+        raise NotImplementedError()
+
 
 class AnalyticsService(BaseAnalytics):
 
@@ -83,6 +134,126 @@ class AnalyticsService(BaseAnalytics):
                 )
             )
 
+    async def get_cost_per_skill(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> List[AnalyticsResponseSkillCost]:
+        """
+        Model cost of every skill, across the chats, validations and the
+        knowledge base generation of the skill, most expensive first
+        """
+        where, params = self.__period(created_after, created_before)
+        query = text(
+            f"""
+            select u.skill_id, s.name as skill_name, {COST_COLUMNS}
+            from llm_usage u
+            left join skills s on s.id = u.skill_id
+            {where}
+            group by u.skill_id, s.name
+            order by cost_usd desc;
+            """
+        )
+        results = await self.session.execute(query, params)
+        return [AnalyticsResponseSkillCost(**result) for result in results.mappings()]
+
+    async def get_cost_per_validation(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        skill_id: Optional[int] = None,
+        limit: int = 100,
+    ) -> List[AnalyticsResponseValidationCost]:
+        """
+        Model cost of grading the user validation questions, most expensive
+        first
+        """
+        where, params = self.__period(
+            created_after, created_before, ["u.validation_id is not null"]
+        )
+        if skill_id is not None:
+            where += " and u.skill_id = :skill_id"
+            params["skill_id"] = skill_id
+        query = text(
+            f"""
+            select u.validation_id,
+                   max(u.skill_id) as skill_id,
+                   max(u.user_id) as user_id,
+                   {COST_COLUMNS}
+            from llm_usage u
+            {where}
+            group by u.validation_id
+            order by cost_usd desc
+            limit :limit;
+            """
+        )
+        results = await self.session.execute(query, {**params, "limit": limit})
+        return [
+            AnalyticsResponseValidationCost(**result) for result in results.mappings()
+        ]
+
+    async def get_cost_per_week(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> List[AnalyticsResponseWeeklyCost]:
+        """
+        Model cost of every graph per calendar week, oldest week first
+        """
+        where, params = self.__period(created_after, created_before)
+        query = text(
+            f"""
+            select date_trunc('week', u.created_at)::date as week,
+                   u.graph,
+                   {COST_COLUMNS}
+            from llm_usage u
+            {where}
+            group by week, u.graph
+            order by week, u.graph;
+            """
+        )
+        results = await self.session.execute(query, params)
+        return [AnalyticsResponseWeeklyCost(**result) for result in results.mappings()]
+
+    async def get_cost_per_node(
+        self,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> List[AnalyticsResponseNodeCost]:
+        """
+        Model cost of every graph node and model, most expensive first
+        """
+        where, params = self.__period(created_after, created_before)
+        query = text(
+            f"""
+            select u.graph, u.node, u.model, {COST_COLUMNS}
+            from llm_usage u
+            {where}
+            group by u.graph, u.node, u.model
+            order by cost_usd desc;
+            """
+        )
+        results = await self.session.execute(query, params)
+        return [AnalyticsResponseNodeCost(**result) for result in results.mappings()]
+
+    def __period(
+        self,
+        created_after: Optional[datetime],
+        created_before: Optional[datetime],
+        conditions: Optional[List[str]] = None,
+    ) -> Tuple[str, dict]:
+        conditions = list(conditions or [])
+        params = {}
+        if created_after is not None:
+            conditions.append("u.created_at >= :created_after")
+            params["created_after"] = created_after
+        if created_before is not None:
+            conditions.append("u.created_at < :created_before")
+            params["created_before"] = created_before
+        # keeps the optional filters appendable with "and"
+        conditions.insert(0, "true")
+        return "where " + " and ".join(conditions), params
+
 
 class AnalyticsServiceFactory:
 
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.messages import convert_to_openai_messages
+from langchain_core.prompts import ChatPromptTemplate
+from openai import AsyncOpenAI
+from openai.types import Batch
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from agents.llm_usage import (
+    LLM_BATCH_PRICE_RATIO,
+    LLM_USAGE_ENABLED,
+    LLMUsageRecord,
+    completion_usage_record,
+    llm_usage_writer,
+    usage_tags,
+)
+from agents.structured_output import (
+    is_structured_output_enabled,
+    json_schema_response_format,
+)
+from db.models import (
+    KnowledgeBaseBatchImport,
+    KnowledgeBaseGenerationJob,
+    MatrixSkillKnowledgeBase,
+)
+from dto.inner.knowledge_base import GeneratedKnowledgeBase
+from service.knowledgebase_generation import (
+    KB_GENERATION_NODE,
+    get_prompt_variables,
+    parse_knowledge_base_content,
+)
+
+load_dotenv()
+
+KB_BATCH_ENDPOINT = "/v1/chat/completions"
+KB_BATCH_COMPLETION_WINDOW = "24h"
+KB_BATCH_POLL_INTERVAL = float(os.getenv("KB_BATCH_POLL_INTERVAL_SECONDS", "60"))
+KB_BATCH_INSERT_SIZE = int(os.getenv("KB_BATCH_INSERT_SIZE", "500"))
+KB_BATCH_METADATA = {"purpose": "knowledge_base"}
+KB_RESPONSE_FORMAT = json_schema_response_format(GeneratedKnowledgeBase)
+
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass
+class BatchImportReport:
+    """
+    Outcome of importing the results file of a batch
+
+    :ivar requests: result lines read
+    :type requests: int
+    :ivar succeeded: result lines turned into knowledge base rows
+    :type succeeded: int
+    :ivar failed: result lines with an error or an unparsable response
+    :type failed: int
+    :ivar questions_created: knowledge base rows inserted
+    :type questions_created: int
+    :ivar already_imported: the batch had been imported before, nothing was
+        inserted
+    :type already_imported: bool
+    """
+
+    requests: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    questions_created: int = 0
+    already_imported: bool = False
+
+
+def build_custom_id(skill_id: int, difficulty_level: int) -> str:
+    return f"kb-{skill_id}-{difficulty_level}"
+
+
+def parse_custom_id(custom_id: str) -> Tuple[int, int]:
+    _, skill_id, difficulty_level = custom_id.split("-")
+    return int(skill_id), int(difficulty_level)
+
+
+class KnowledgeBaseBatchPipeline:
+    """
+    Knowledge base generation through the OpenAI Batch API. Every
+    (skill, level) gap becomes one line of a JSONL requests file, the file is
+    submitted as a single batch and the results file is streamed back into
+    the knowledge base with bulk inserts.
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        client: AsyncOpenAI,
+        model: str,
+        prompt_template: Optional[ChatPromptTemplate] = None,
+    ):
+        self.session = session
+        self.client = client
+        self.model = model
+        self.prompt_template = prompt_template
+
+    async def write_requests(
+        self, jobs: List[KnowledgeBaseGenerationJob], path: str
+    ) -> int:
+        """
+        Writes one batch request line per generation job
+
+        :param jobs: (skill, level) gaps to generate questions for
+        :param path: JSONL file to write
+        :return: number of written requests
+        :rtype: int
+        """
+        assert self.prompt_template is not None
+        written = 0
+        with open(path, "w") as requests_file:
+            for job in jobs:
+                prompt = await self.prompt_template.ainvoke(get_prompt_variables(job))
+                request = {
+                    "custom_id": build_custom_id(job.skill_id, job.difficulty_level),
+                    "method": "POST",
+                    "url": KB_BATCH_ENDPOINT,
+                    "body": {
+                        "model": self.model,
+                        "messages": convert_to_openai_messages(prompt.to_messages()),
+                    },
+                }
+                if is_structured_output_enabled():
+                    request["body"]["response_format"] = KB_RESPONSE_FORMAT
+                requests_file.write(json.dumps(request) + "\n")
+                written += 1
+        return written
+
+    async def submit(self, path: str) -> Batch:
+        with open(path, "rb") as requests_file:
+            batch_file = await self.client.files.create(
+                file=requests_file, purpose="batch"
+            )
+        return await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=KB_BATCH_ENDPOINT,
+            completion_window=KB_BATCH_COMPLETION_WINDOW,
+            metadata=KB_BATCH_METADATA,
+        )
+
+    async def wait(
+        self, batch_id: str, poll_interval: float = KB_BATCH_POLL_INTERVAL
+    ) -> Batch:
+        """
+        Polls the batch until it reaches a terminal status
+
+        :param batch_id: id of the submitted batch
+        :param poll_interval: seconds between two polls
+        :return: batch in its terminal status
+        :rtype: Batch
+        """
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status in BATCH_TERMINAL_STATUSES:
+                return batch
+            if batch.request_counts is not None:
+                print(
+                    f"Batch {batch_id} {batch.status}: "
+                    f"{batch.request_counts.completed}/{batch.request_counts.total} completed, "
+                    f"{batch.request_counts.failed} failed"
+                )
+            await asyncio.sleep(poll_interval)
+
+    async def import_results(self, batch: Batch) -> BatchImportReport:
+        """
+        Streams the results file line by line and bulk inserts the generated
+        questions. The batch is recorded as imported in the same transaction
+        as its questions, so a failed import can simply be repeated and a
+        repeated successful one inserts nothing. The usage of the batch is
+        handed to the usage writer only once that transaction is committed,
+        so a failed import records nothing and its retry counts no cost twice.
+
+        :param batch: completed batch
+        :return: report of the import
+        :rtype: BatchImportReport
+        """
+        report = BatchImportReport()
+        if batch.output_file_id is None:
+            return report
+        # concurrent imports of the batch wait here for the first one to commit
+        claimed = await self.session.execute(
+            pg_insert(KnowledgeBaseBatchImport)
+            .values(batch_id=batch.id, requests=0, questions_created=0)
+            .on_conflict_do_nothing(index_elements=["batch_id"])
+            .returning(KnowledgeBaseBatchImport.batch_id)
+        )
+        if claimed.scalar() is None:
+            await self.session.rollback()
+            print(f"Knowledge base batch {batch.id} has already been imported")
+            report.already_imported = True
+            return report
+        rows: List[dict] = []
+        usage: List[LLMUsageRecord] = []
+        async with self.client.files.with_streaming_response.content(
+            batch.output_file_id
+        ) as response:
+            async for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                report.requests += 1
+                try:
+                    result = json.loads(line)
+                    if result.get("error") or result["response"]["status_code"] != 200:
+                        raise ValueError(result.get("error") or result["response"])
+                    skill_id, difficulty_level = parse_custom_id(result["custom_id"])
+                    usage.append(self.__usage(result["response"]["body"], skill_id))
+                    content = result["response"]["body"]["choices"][0]["message"][
+                        "content"
+                    ]
+                    dtos = parse_knowledge_base_content(
+                        content, skill_id, difficulty_level
+                    )
+                except Exception as e:
+                    print(f"Unable to import batch result line: {e}")
+                    report.failed += 1
+                    continue
+                report.succeeded += 1
+                rows.extend(dto.model_dump() for dto in dtos)
+                if len(rows) >= KB_BATCH_INSERT_SIZE:
+                    report.questions_created += await self.__insert(rows)
+                    rows = []
+        if rows:
+            report.questions_created += await self.__insert(rows)
+        await self.session.execute(
+            update(KnowledgeBaseBatchImport)
+            .where(KnowledgeBaseBatchImport.batch_id == batch.id)
+            .values(
+                requests=report.requests, questions_created=report.questions_created
+            )
+        )
+        await self.session.commit()
+        if LLM_USAGE_ENABLED:
+            for record in usage:
+                llm_usage_writer.record(record)
+        return report
+
+    @staticmethod
+    def __usage(body: dict, skill_id: int) -> LLMUsageRecord:
+        metadata = usage_tags(
+            "knowledge_base", skill_id=skill_id, node=KB_GENERATION_NODE
+        )
+        return completion_usage_record(body, metadata, LLM_BATCH_PRICE_RATIO)
+
+    async def __insert(self, rows: List[dict]) -> int:
+        await self.session.execute(insert(MatrixSkillKnowledgeBase), rows)
+        return len(rows)
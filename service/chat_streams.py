@@ -0,0 +1,377 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.sse import SSE_END_EVENT, SSE_ERROR_EVENT, ServerSentEvent
+
+load_dotenv()
+
+# event log shared by the workers, an in process stand-in is used without it
+CHAT_STREAM_REDIS_URL = os.getenv("CHAT_STREAM_REDIS_URL", os.getenv("REDIS_URL"))
+CHAT_STREAM_REDIS_PREFIX = "chat-stream"
+# seconds the events of a thread are kept after its last event
+CHAT_STREAM_TTL = int(os.getenv("CHAT_STREAM_TTL_SECONDS", "3600"))
+# events kept per thread, older ones are trimmed
+CHAT_STREAM_MAX_LENGTH = int(os.getenv("CHAT_STREAM_MAX_LENGTH", "5000"))
+# seconds a run marks its thread as busy, released earlier once it finishes
+CHAT_STREAM_RUN_TTL = int(os.getenv("CHAT_STREAM_RUN_TTL_SECONDS", "900"))
+# milliseconds a reader waits for new events before checking the run again
+CHAT_STREAM_BLOCK_MS = int(os.getenv("CHAT_STREAM_BLOCK_MS", "5000"))
+
+FIRST_EVENT_ID = "0-0"
+EVENT_ID_PATTERN = re.compile(r"^\d+-\d+$")
+
+# deletes the run marker only while it is still the one of the finishing run,
+# a marker that expired and was taken by the next run is left alone
+RELEASE_RUN_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class ChatRunConflictError(Exception):
+    """
+    A different message was posted while the thread answers another one
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+@dataclass
+class ChatStreamEntry:
+    """
+    Event of a chat run stored in the event log
+
+    :ivar id: stream id, sent to the client as the event id
+    :type id: str
+    :ivar event: event type
+    :type event: str
+    :ivar data: json payload
+    :type data: str
+    """
+
+    id: str
+    event: str
+    data: str
+
+
+@dataclass
+class ChatRun:
+    """
+    Marker of the active run of a thread
+
+    :ivar start_id: id after which the events of the run follow
+    :type start_id: str
+    :ivar token: identifies the run, only its owner releases the marker
+    :type token: str
+    :ivar message: fingerprint of the message the run answers
+    :type message: str
+    """
+
+    start_id: str
+    token: str = field(default_factory=lambda: str(uuid.uuid4()))
+    message: str = ""
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {"start_id": self.start_id, "token": self.token, "message": self.message}
+        )
+
+    @staticmethod
+    def loads(value: str) -> "ChatRun":
+        return ChatRun(**json.loads(value))
+
+
+class RedisChatEventLog:
+    """
+    Chat events in a Redis Stream per thread, readable by every worker
+    """
+
+    def __init__(self, redis_url: str, ttl: int, max_length: int, run_ttl: int):
+        from redis.asyncio import Redis
+
+        self.redis = Redis.from_url(redis_url, decode_responses=True)
+        self.ttl = ttl
+        self.max_length = max_length
+        self.run_ttl = run_ttl
+        self.release_script = self.redis.register_script(RELEASE_RUN_SCRIPT)
+
+    async def append(self, key: str, event: str, data: str) -> str:
+        # one round trip per event, the tokens of a run are many small events
+        async with self.redis.pipeline(transaction=False) as pipeline:
+            pipeline.xadd(key, {"event": event, "data": data}, maxlen=self.max_length)
+            pipeline.expire(key, self.ttl)
+            entry_id, _ = await pipeline.execute()
+        return entry_id
+
+    async def read(
+        self, key: str, after_id: str, block_ms: int
+    ) -> List[ChatStreamEntry]:
+        # redis blocks forever on 0, None does not block at all
+        response = await self.redis.xread(
+            {key: after_id}, block=block_ms or None, count=100
+        )
+        entries = []
+        for _, stream_entries in response or []:
+            for entry_id, fields in stream_entries:
+                entries.append(
+                    ChatStreamEntry(
+                        id=entry_id, event=fields["event"], data=fields["data"]
+                    )
+                )
+        return entries
+
+    async def last_id(self, key: str) -> str:
+        entries = await self.redis.xrevrange(key, count=1)
+        return entries[0][0] if entries else FIRST_EVENT_ID
+
+    async def acquire_run(self, key: str, run: ChatRun) -> Optional[ChatRun]:
+        if await self.redis.set(f"{key}:run", run.dumps(), nx=True, ex=self.run_ttl):
+            return None
+        # the marker may have expired in between, the run is then taken as
+        # the active one and never started
+        return await self.active_run(key) or run
+
+    async def active_run(self, key: str) -> Optional[ChatRun]:
+        value = await self.redis.get(f"{key}:run")
+        return ChatRun.loads(value) if value is not None else None
+
+    async def release_run(self, key: str, run: ChatRun) -> None:
+        await self.release_script(keys=[f"{key}:run"], args=[run.dumps()])
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+@dataclass
+class _LocalStream:
+    entries: List[ChatStreamEntry] = field(default_factory=list)
+    expires_at: float = 0
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class InMemoryChatEventLog:
+    """
+    Stand-in of the Redis event log for a single worker, streams expire
+    ``ttl`` seconds after their last event
+    """
+
+    def __init__(self, ttl: int, max_length: int, run_ttl: int):
+        self.ttl = ttl
+        self.max_length = max_length
+        self.run_ttl = run_ttl
+        self.__streams: Dict[str, _LocalStream] = {}
+        self.__runs: Dict[str, tuple[ChatRun, float]] = {}
+        # ids are ordered by the sequence, the clock part only mimics redis
+        self.__sequence = itertools.count(1)
+
+    async def append(self, key: str, event: str, data: str) -> str:
+        self.__expire()
+        stream = self.__streams.setdefault(key, _LocalStream())
+        entry_id = f"{int(time.time() * 1000)}-{next(self.__sequence)}"
+        stream.entries.append(ChatStreamEntry(id=entry_id, event=event, data=data))
+        del stream.entries[: -self.max_length]
+        stream.expires_at = time.monotonic() + self.ttl
+        stream.changed.set()
+        stream.changed = asyncio.Event()
+        return entry_id
+
+    async def read(
+        self, key: str, after_id: str, block_ms: int
+    ) -> List[ChatStreamEntry]:
+        stream = self.__streams.get(key)
+        if stream is None:
+            stream = _LocalStream(expires_at=time.monotonic() + self.ttl)
+            self.__streams[key] = stream
+        entries = self.__after(stream, after_id)
+        if len(entries) == 0 and block_ms > 0:
+            try:
+                await asyncio.wait_for(stream.changed.wait(), timeout=block_ms / 1000)
+            except asyncio.TimeoutError:
+                return []
+            entries = self.__after(stream, after_id)
+        return entries
+
+    async def last_id(self, key: str) -> str:
+        stream = self.__streams.get(key)
+        if stream is None or len(stream.entries) == 0:
+            return FIRST_EVENT_ID
+        return stream.entries[-1].id
+
+    async def acquire_run(self, key: str, run: ChatRun) -> Optional[ChatRun]:
+        active = await self.active_run(key)
+        if active is not None:
+            return active
+        self.__runs[key] = (run, time.monotonic() + self.run_ttl)
+        return None
+
+    async def active_run(self, key: str) -> Optional[ChatRun]:
+        run = self.__runs.get(key)
+        if run is None or run[1] <= time.monotonic():
+            return None
+        return run[0]
+
+    async def release_run(self, key: str, run: ChatRun) -> None:
+        active = self.__runs.get(key)
+        if active is not None and active[0].token == run.token:
+            del self.__runs[key]
+
+    async def close(self) -> None:
+        self.__streams.clear()
+
+    def __after(self, stream: _LocalStream, after_id: str) -> List[ChatStreamEntry]:
+        after = _sequence(after_id)
+        return [entry for entry in stream.entries if _sequence(entry.id) > after]
+
+    def __expire(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, s in self.__streams.items() if s.expires_at <= now]:
+            del self.__streams[key]
+
+
+def is_valid_event_id(entry_id: str) -> bool:
+    return EVENT_ID_PATTERN.match(entry_id) is not None
+
+
+def message_fingerprint(message: Optional[str]) -> str:
+    if message is None:
+        return ""
+    return hashlib.sha256(message.encode()).hexdigest()
+
+
+def _sequence(entry_id: str) -> int:
+    return int(entry_id.partition("-")[2] or 0)
+
+
+class ChatStreams:
+    """
+    Runs the chat graphs independently of the HTTP connection that started
+    them. Every event of a run is appended to the event log of its thread, the
+    connections only tail the log, so a client that dropped can reconnect
+    with ``Last-Event-ID`` to replay what it missed and follow the rest of
+    the run. A thread has at most one run at a time, the same message
+    posted again while its thread is busy attaches to the running graph and
+    a different one is refused.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = CHAT_STREAM_REDIS_URL,
+        ttl: int = CHAT_STREAM_TTL,
+        max_length: int = CHAT_STREAM_MAX_LENGTH,
+        run_ttl: int = CHAT_STREAM_RUN_TTL,
+        block_ms: int = CHAT_STREAM_BLOCK_MS,
+    ):
+        if redis_url is not None:
+            self.log = RedisChatEventLog(redis_url, ttl, max_length, run_ttl)
+        else:
+            self.log = InMemoryChatEventLog(ttl, max_length, run_ttl)
+        self.block_ms = block_ms
+        # strong references, the event loop only keeps weak ones to tasks
+        self.__tasks: set[asyncio.Task] = set()
+
+    async def start(
+        self,
+        thread_id: Any,
+        run: Callable[[], AsyncIterator[str]],
+        event_type: Callable[[dict], str],
+        message: Optional[str] = None,
+    ) -> str:
+        """
+        Starts the run of the thread in the background unless one is active
+
+        :param thread_id: graph thread of the chat
+        :param run: creates the json chunks of the run
+        :param event_type: returns the event type of a parsed chunk
+        :param message: message the run answers
+        :return: id after which the events of the (already) active run follow
+        :rtype: str
+        :raises ChatRunConflictError: when the active run answers a different
+            message
+        """
+        key = self.__key(thread_id)
+        chat_run = ChatRun(
+            start_id=await self.log.last_id(key),
+            message=message_fingerprint(message),
+        )
+        active = await self.log.acquire_run(key, chat_run)
+        if active is not None:
+            if active.message != chat_run.message:
+                raise ChatRunConflictError(
+                    f"Thread {thread_id} is answering another message"
+                )
+            return active.start_id
+        task = asyncio.create_task(self.__run(key, chat_run, run, event_type))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return chat_run.start_id
+
+    async def active_run(self, thread_id: Any) -> Optional[str]:
+        active = await self.log.active_run(self.__key(thread_id))
+        return active.start_id if active is not None else None
+
+    async def tail(
+        self, thread_id: Any, after_id: str
+    ) -> AsyncGenerator[ServerSentEvent, Any]:
+        """
+        Replays the events after ``after_id`` and follows the run until its
+        end event
+
+        :param thread_id: graph thread of the chat
+        :param after_id: last event id the client has received
+        """
+        key = self.__key(thread_id)
+        while True:
+            entries = await self.log.read(key, after_id, self.block_ms)
+            if len(entries) == 0:
+                if await self.log.active_run(key) is not None:
+                    continue
+                # the run may have finished between the two reads
+                entries = await self.log.read(key, after_id, 0)
+                if len(entries) == 0:
+                    return
+            for entry in entries:
+                if entry.event == SSE_END_EVENT:
+                    return
+                after_id = entry.id
+                yield ServerSentEvent(data=entry.data, event=entry.event, id=entry.id)
+
+    async def close(self) -> None:
+        await self.log.close()
+
+    async def __run(
+        self,
+        key: str,
+        chat_run: ChatRun,
+        run: Callable[[], AsyncIterator[str]],
+        event_type: Callable[[dict], str],
+    ) -> None:
+        try:
+            async for chunk in run():
+                await self.log.append(key, event_type(json.loads(chunk)), chunk)
+        except Exception as e:
+            print(f"Chat run {key} failed: {e}")
+            await self.log.append(key, SSE_ERROR_EVENT, json.dumps({"detail": str(e)}))
+        finally:
+            try:
+                await self.log.append(key, SSE_END_EVENT, "{}")
+            finally:
+                await self.log.release_run(key, chat_run)
+
+    def __key(self, thread_id: Any) -> str:
+        return f"{CHAT_STREAM_REDIS_PREFIX}:{thread_id}"
+
+
+chat_streams = ChatStreams()
@@ -0,0 +1,136 @@
+import hashlib
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from db.models import KnowledgeBaseGradingArtifacts, MatrixSkillKnowledgeBase
+
+load_dotenv()
+
+# knowledge base rows refreshed by a single artifacts run
+GRADING_ARTIFACTS_BATCH_SIZE = int(os.getenv("GRADING_ARTIFACTS_BATCH_SIZE", "500"))
+
+_SOURCE_SEPARATOR = "\x1f"
+
+
+def compute_source_hash(
+    question: str, answer: Optional[str], rules: Optional[str]
+) -> str:
+    """
+    Hash of the knowledge base fields the grading artifacts depend on, the
+    same value is computed in SQL by ``GradingArtifactsStore.find_stale``
+    """
+    source = _SOURCE_SEPARATOR.join([question, answer or "", rules or ""])
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+class GradingArtifactsStore:
+    """
+    Split decomposition and safety rubric of the input knowledge base
+    questions, generated offline so the grading graph does not have to ask
+    the model for them on every answer
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get(
+        self, knowledge_base_id: int
+    ) -> Optional[KnowledgeBaseGradingArtifacts]:
+        return await self.session.get(KnowledgeBaseGradingArtifacts, knowledge_base_id)
+
+    async def find_stale(
+        self,
+        split_prompt_version: Optional[str],
+        safety_prompt_version: Optional[str],
+        knowledge_base_ids: Optional[List[int]] = None,
+        limit: int = GRADING_ARTIFACTS_BATCH_SIZE,
+    ) -> List[MatrixSkillKnowledgeBase]:
+        """
+        Input questions without artifacts or with artifacts generated for a
+        previous version of the question or of the prompts
+
+        :param split_prompt_version: current version of the split prompt
+        :param safety_prompt_version: current version of the safety prompt
+        :param knowledge_base_ids: restricts the search to these questions
+        :param limit: maximum number of returned questions
+        :return: questions to generate the artifacts for
+        :rtype: List[MatrixSkillKnowledgeBase]
+        """
+        result = await self.session.execute(
+            text(
+                """
+                SELECT kb.id
+                FROM matrix_skill_knowledgebase kb
+                LEFT JOIN knowledgebase_grading_artifacts a
+                    ON a.knowledge_base_id = kb.id
+                WHERE kb.question_type = 'input'
+                  AND (CAST(:knowledge_base_ids AS BIGINT[]) IS NULL
+                       OR kb.id = ANY(CAST(:knowledge_base_ids AS BIGINT[])))
+                  AND (a.knowledge_base_id IS NULL
+                       OR a.source_hash <> md5(concat_ws(
+                              chr(31), kb.question,
+                              coalesce(kb.answer, ''), coalesce(kb.rules, '')))
+                       OR a.split_response IS NULL
+                       OR a.safety_response IS NULL
+                       OR a.split_prompt_version IS DISTINCT FROM :split_prompt_version
+                       OR a.safety_prompt_version IS DISTINCT FROM :safety_prompt_version)
+                ORDER BY kb.id
+                LIMIT :limit
+                """
+            ),
+            {
+                "knowledge_base_ids": knowledge_base_ids,
+                "split_prompt_version": split_prompt_version,
+                "safety_prompt_version": safety_prompt_version,
+                "limit": limit,
+            },
+        )
+        ids = [row.id for row in result]
+        if len(ids) == 0:
+            return []
+        items = await self.session.execute(
+            select(MatrixSkillKnowledgeBase)
+            .where(MatrixSkillKnowledgeBase.id.in_(ids))
+            .order_by(MatrixSkillKnowledgeBase.id)
+        )
+        return list(items.scalars().all())
+
+    async def save(
+        self,
+        knowledge_base: MatrixSkillKnowledgeBase,
+        split_response: str,
+        split_prompt_version: Optional[str],
+        safety_response: str,
+        safety_prompt_version: Optional[str],
+    ) -> None:
+        values = {
+            "knowledge_base_id": knowledge_base.id,
+            "source_hash": compute_source_hash(
+                knowledge_base.question, knowledge_base.answer, knowledge_base.rules
+            ),
+            "split_response": split_response,
+            "split_prompt_version": split_prompt_version,
+            "safety_response": safety_response,
+            "safety_prompt_version": safety_prompt_version,
+            "updated_at": datetime.now(),
+        }
+        statement = insert(KnowledgeBaseGradingArtifacts).values(
+            **values, created_at=datetime.now()
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[KnowledgeBaseGradingArtifacts.knowledge_base_id],
+            set_={
+                key: statement.excluded[key]
+                for key in values
+                if key != "knowledge_base_id"
+            },
+        )
+        await self.session.execute(statement)
+        await self.session.commit()
@@ -0,0 +1,508 @@
+import asyncio
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from db.models import KnowledgeBaseGenerationJob, MatrixSkillKnowledgeBase
+from agents.structured_output import parse_structured
+from dto.inner.knowledge_base import (
+    GeneratedKnowledgeBase,
+    KnowledgeBaseModelCreate,
+)
+from dto.response.matrix_skill_knowledge import KnowledgeBaseGenerationProgressResponse
+from utils.rate_limit import RateLimiter, retry_with_jitter
+
+load_dotenv()
+
+KB_GENERATION_CONCURRENCY = int(os.getenv("KB_GENERATION_CONCURRENCY", "8"))
+KB_GENERATION_RPM = int(os.getenv("KB_GENERATION_RPM", "60"))
+KB_GENERATION_TPM = int(os.getenv("KB_GENERATION_TPM", "200000"))
+KB_GENERATION_MAX_ATTEMPTS = int(os.getenv("KB_GENERATION_MAX_ATTEMPTS", "5"))
+# failed jobs are picked up again by the next runs until they used this many
+# model attempts in total
+KB_GENERATION_MAX_JOB_ATTEMPTS = int(
+    os.getenv("KB_GENERATION_MAX_JOB_ATTEMPTS", str(KB_GENERATION_MAX_ATTEMPTS * 3))
+)
+# a claimed job is renewed while the worker runs it, a job whose lease ran out
+# belongs to a worker that died and is claimed again
+KB_GENERATION_LEASE = timedelta(
+    seconds=int(os.getenv("KB_GENERATION_LEASE_SECONDS", "300"))
+)
+# token estimate of a single job used to reserve tpm capacity upfront, the
+# difference to the real usage is settled once the response arrives
+KB_GENERATION_PROMPT_TOKENS = int(os.getenv("KB_GENERATION_PROMPT_TOKENS", "1500"))
+KB_GENERATION_TOKENS_PER_QUESTION = int(
+    os.getenv("KB_GENERATION_TOKENS_PER_QUESTION", "350")
+)
+
+KB_GENERATION_NODE = "knowledge_base_generation"
+KB_GENERATION_LOCK = "knowledgebase_generation"
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class GeneratedQuestions:
+    """
+    Outcome of a single generation job
+
+    :ivar questions: knowledge base rows to persist
+    :type questions: List[MatrixSkillKnowledgeBase]
+    :ivar prompt_tokens: prompt tokens reported by the model
+    :type prompt_tokens: int
+    :ivar completion_tokens: completion tokens reported by the model
+    :type completion_tokens: int
+    """
+
+    questions: List[MatrixSkillKnowledgeBase] = field(default_factory=list)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+GenerationHandler = Callable[
+    [KnowledgeBaseGenerationJob], Awaitable[GeneratedQuestions]
+]
+
+
+def get_prompt_variables(job: KnowledgeBaseGenerationJob) -> dict:
+    """
+    Variables of the knowledge base builder prompt for a single job
+    """
+    return {
+        "scenario_number": job.questions_requested,
+        "min_level": job.min_level,
+        "max_level": job.max_level,
+        "topic": job.skill_name,
+        "current_level": job.difficulty_level,
+    }
+
+
+def parse_knowledge_base_content(
+    content: str, skill_id: int, difficulty_level: int
+) -> List[KnowledgeBaseModelCreate]:
+    """
+    Parses the questions generated by the knowledge base builder prompt, the
+    json list of the free-form prompt or the object of the structured output
+    mode, near-misses (markdown fences, trailing commas) are repaired and a
+    list cut off by the token limit keeps its complete questions
+
+    :param content: model response content
+    :param skill_id: skill the questions were generated for
+    :param difficulty_level: level the questions were generated for
+    :return: knowledge base rows ready to be persisted
+    :rtype: List[KnowledgeBaseModelCreate]
+    """
+    generated = parse_structured(KB_GENERATION_NODE, GeneratedKnowledgeBase, content)
+    all_dtos: List[KnowledgeBaseModelCreate] = []
+    for chunk in generated.questions:
+        all_dtos.append(
+            KnowledgeBaseModelCreate(
+                skill_id=skill_id,
+                difficulty_level=difficulty_level,
+                question=chunk.question,
+                answer=chunk.answer,
+                options=(chunk.options if chunk.options is not None else None),
+                question_type=chunk.type,
+                rules="Testing",
+                is_code_question=chunk.is_code,
+                created_at=datetime.now(),
+                updated_at=datetime.now(),
+            )
+        )
+    return all_dtos
+
+
+def estimate_job_tokens(job: KnowledgeBaseGenerationJob) -> int:
+    return (
+        KB_GENERATION_PROMPT_TOKENS
+        + job.questions_requested * KB_GENERATION_TOKENS_PER_QUESTION
+    )
+
+
+class KnowledgeBaseGenerationLedger:
+    """
+    Job ledger of the knowledge base generation runs. Every (skill, level) gap
+    of a run is one row, so a crashed worker picks the unfinished run back up
+    instead of starting over. Workers claim the jobs one at a time with a
+    lease, several workers on the same run never generate a job twice.
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        lease: timedelta = KB_GENERATION_LEASE,
+        max_job_attempts: int = KB_GENERATION_MAX_JOB_ATTEMPTS,
+    ):
+        self.session = session
+        self.lease = lease
+        self.max_job_attempts = max_job_attempts
+
+    async def try_lock(self) -> bool:
+        """
+        Serializes the planning of the runs, held until the transaction ends.
+        Without it two workers starting at once would both create a run for
+        the same gaps.
+        """
+        locked = await self.session.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"),
+            {"name": KB_GENERATION_LOCK},
+        )
+        return locked.scalar()
+
+    async def get_unfinished_run(self) -> Optional[str]:
+        statement = text(
+            """
+            SELECT run_id FROM knowledgebase_generation_jobs
+            WHERE status IN (:pending, :running)
+               OR (status = :failed AND attempts < :max_job_attempts)
+            ORDER BY created_at DESC
+            LIMIT 1
+            """
+        )
+        result = await self.session.execute(
+            statement,
+            {
+                "pending": JOB_PENDING,
+                "running": JOB_RUNNING,
+                "failed": JOB_FAILED,
+                "max_job_attempts": self.max_job_attempts,
+            },
+        )
+        return result.scalar()
+
+    async def create_run(self, jobs: List[KnowledgeBaseGenerationJob]) -> str:
+        run_id = str(uuid.uuid4())
+        for job in jobs:
+            job.run_id = run_id
+            job.status = JOB_PENDING
+        self.session.add_all(jobs)
+        await self.session.commit()
+        return run_id
+
+    async def claim_next_job(
+        self, run_id: str, failed_before: datetime
+    ) -> Optional[KnowledgeBaseGenerationJob]:
+        """
+        Claims the next job of the run: a pending one, one whose lease ran out
+        or one that failed before ``failed_before`` and has attempts left.
+        Rows locked by another worker are skipped.
+
+        :param run_id: run to claim from
+        :param failed_before: start of the claiming run, jobs failing during it
+            wait for the next run
+        :return: claimed job holding a fresh lease or None when there is none
+        :rtype: Optional[KnowledgeBaseGenerationJob]
+        """
+        now = datetime.now()
+        statement = text(
+            """
+            UPDATE knowledgebase_generation_jobs
+            SET status = :running,
+                lease_token = :lease_token,
+                lease_expires_at = :lease_expires_at,
+                started_at = COALESCE(started_at, :now),
+                updated_at = :now
+            WHERE id = (
+                SELECT id FROM knowledgebase_generation_jobs
+                WHERE run_id = :run_id
+                  AND (status = :pending
+                       OR (status = :running AND lease_expires_at < :now)
+                       OR (status = :failed
+                           AND attempts < :max_job_attempts
+                           AND finished_at < :failed_before))
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+            """
+        )
+        result = await self.session.execute(
+            statement,
+            {
+                "run_id": run_id,
+                "pending": JOB_PENDING,
+                "running": JOB_RUNNING,
+                "failed": JOB_FAILED,
+                "max_job_attempts": self.max_job_attempts,
+                "failed_before": failed_before,
+                "lease_token": str(uuid.uuid4()),
+                "lease_expires_at": now + self.lease,
+                "now": now,
+            },
+        )
+        job_id = result.scalar()
+        await self.session.commit()
+        if job_id is None:
+            return None
+        return await self.session.get(KnowledgeBaseGenerationJob, job_id)
+
+    async def renew_lease(self, job: KnowledgeBaseGenerationJob) -> bool:
+        """
+        Extends the lease of a claimed job
+
+        :return: False when the job was claimed by another worker meanwhile
+        :rtype: bool
+        """
+        result = await self.session.execute(
+            update(KnowledgeBaseGenerationJob)
+            .where(KnowledgeBaseGenerationJob.id == job.id)
+            .where(KnowledgeBaseGenerationJob.lease_token == job.lease_token)
+            .values(lease_expires_at=datetime.now() + self.lease)
+        )
+        await self.session.commit()
+        return result.rowcount == 1
+
+    async def get_progress(
+        self, run_id: Optional[str] = None
+    ) -> Optional[KnowledgeBaseGenerationProgressResponse]:
+        """
+        Progress and throughput of a run, the latest run when no id is given
+
+        :param run_id: run to report on
+        :return: progress of the run or None when there is no such run
+        :rtype: Optional[KnowledgeBaseGenerationProgressResponse]
+        """
+        if run_id is None:
+            result = await self.session.execute(
+                text(
+                    """
+                    SELECT run_id FROM knowledgebase_generation_jobs
+                    ORDER BY created_at DESC LIMIT 1
+                    """
+                )
+            )
+            run_id = result.scalar()
+            if run_id is None:
+                return None
+        statement = text(
+            """
+            SELECT COUNT(*),
+                   COUNT(*) FILTER (WHERE status = :pending),
+                   COUNT(*) FILTER (WHERE status = :running),
+                   COUNT(*) FILTER (WHERE status = :done),
+                   COUNT(*) FILTER (WHERE status = :failed),
+                   COALESCE(SUM(questions_requested), 0),
+                   COALESCE(SUM(questions_created), 0),
+                   COALESCE(SUM(prompt_tokens), 0),
+                   COALESCE(SUM(completion_tokens), 0),
+                   MIN(started_at),
+                   MAX(updated_at)
+            FROM knowledgebase_generation_jobs
+            WHERE run_id = :run_id
+            """
+        )
+        result = await self.session.execute(
+            statement,
+            {
+                "run_id": run_id,
+                "pending": JOB_PENDING,
+                "running": JOB_RUNNING,
+                "done": JOB_DONE,
+                "failed": JOB_FAILED,
+            },
+        )
+        (
+            total_jobs,
+            pending_jobs,
+            running_jobs,
+            done_jobs,
+            failed_jobs,
+            questions_requested,
+            questions_created,
+            prompt_tokens,
+            completion_tokens,
+            started_at,
+            last_update_at,
+        ) = result.one()
+        if total_jobs == 0:
+            return None
+
+        elapsed_seconds = 0.0
+        if started_at is not None:
+            finished = pending_jobs == 0 and running_jobs == 0
+            until = last_update_at if finished else datetime.now()
+            elapsed_seconds = max((until - started_at).total_seconds(), 0.0)
+        elapsed_minutes = elapsed_seconds / 60
+        jobs_per_minute = done_jobs / elapsed_minutes if elapsed_minutes else 0.0
+        eta_seconds = None
+        if jobs_per_minute:
+            eta_seconds = (pending_jobs + running_jobs) / jobs_per_minute * 60
+        return KnowledgeBaseGenerationProgressResponse(
+            run_id=run_id,
+            total_jobs=total_jobs,
+            pending_jobs=pending_jobs,
+            running_jobs=running_jobs,
+            done_jobs=done_jobs,
+            failed_jobs=failed_jobs,
+            questions_requested=questions_requested,
+            questions_created=questions_created,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            started_at=started_at,
+            last_update_at=last_update_at,
+            elapsed_seconds=elapsed_seconds,
+            jobs_per_minute=jobs_per_minute,
+            questions_per_minute=(
+                questions_created / elapsed_minutes if elapsed_minutes else 0.0
+            ),
+            tokens_per_minute=(
+                (prompt_tokens + completion_tokens) / elapsed_minutes
+                if elapsed_minutes
+                else 0.0
+            ),
+            eta_seconds=eta_seconds,
+        )
+
+
+class KnowledgeBaseGenerator:
+    """
+    Runs the ledger jobs with bounded concurrency, each worker claims the
+    next job of the run until none is left. Every model call goes through the
+    shared rpm/tpm limiter and failed jobs are retried with jittered backoff.
+    The generated questions and the job completion are committed in the same
+    transaction, only while the worker still holds the lease of the job, so a
+    job is never persisted twice.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        handler: GenerationHandler,
+        limiter: Optional[RateLimiter] = None,
+        concurrency: int = KB_GENERATION_CONCURRENCY,
+        max_attempts: int = KB_GENERATION_MAX_ATTEMPTS,
+        lease: timedelta = KB_GENERATION_LEASE,
+        max_job_attempts: int = KB_GENERATION_MAX_JOB_ATTEMPTS,
+    ):
+        self.session_factory = session_factory
+        self.handler = handler
+        self.limiter = limiter or RateLimiter(KB_GENERATION_RPM, KB_GENERATION_TPM)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.max_job_attempts = max_job_attempts
+
+    async def run(self, run_id: str) -> int:
+        """
+        Processes the claimable jobs of the run and returns the number of the
+        finished ones
+        """
+        started_at = datetime.now()
+        results = await asyncio.gather(
+            *[self.__work(run_id, started_at) for _ in range(self.concurrency)]
+        )
+        return sum(results)
+
+    async def __work(self, run_id: str, started_at: datetime) -> int:
+        finished = 0
+        while True:
+            async with self.session_factory() as session:
+                job = await self.__ledger(session).claim_next_job(run_id, started_at)
+            if job is None:
+                return finished
+            if await self.process(job):
+                finished += 1
+
+    async def process(self, job: KnowledgeBaseGenerationJob) -> bool:
+        """
+        Generates the questions of a claimed job, the lease is renewed until
+        the job is done or failed
+        """
+        heartbeat = asyncio.create_task(self.__heartbeat(job))
+        try:
+            return await self.__generate(job)
+        finally:
+            heartbeat.cancel()
+
+    async def __generate(self, job: KnowledgeBaseGenerationJob) -> bool:
+        async def attempt() -> GeneratedQuestions:
+            estimated_tokens = estimate_job_tokens(job)
+            await self.limiter.acquire(estimated_tokens)
+            generated = await self.handler(job)
+            self.limiter.record_usage(
+                estimated_tokens,
+                generated.prompt_tokens + generated.completion_tokens,
+            )
+            return generated
+
+        async def record_error(attempt_number: int, error: Exception) -> None:
+            print(
+                f"Knowledge base job {job.id} ({job.skill_name}, level {job.difficulty_level}) "
+                f"attempt {attempt_number} failed: {error}"
+            )
+            await self.__set_job(
+                job,
+                attempts=KnowledgeBaseGenerationJob.attempts + 1,
+                last_error=str(error),
+            )
+
+        try:
+            generated = await retry_with_jitter(
+                attempt, max_attempts=self.max_attempts, on_error=record_error
+            )
+        except Exception:
+            await self.__set_job(
+                job,
+                status=JOB_FAILED,
+                lease_expires_at=None,
+                finished_at=datetime.now(),
+            )
+            return False
+
+        async with self.session_factory() as session:
+            result = await session.execute(
+                self.__claimed(job).values(
+                    status=JOB_DONE,
+                    attempts=KnowledgeBaseGenerationJob.attempts + 1,
+                    questions_created=len(generated.questions),
+                    prompt_tokens=generated.prompt_tokens,
+                    completion_tokens=generated.completion_tokens,
+                    lease_expires_at=None,
+                    finished_at=datetime.now(),
+                )
+            )
+            if result.rowcount != 1:
+                print(f"Knowledge base job {job.id} lost its lease, result dropped")
+                await session.rollback()
+                return False
+            session.add_all(generated.questions)
+            await session.commit()
+        return True
+
+    async def __heartbeat(self, job: KnowledgeBaseGenerationJob) -> None:
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            try:
+                async with self.session_factory() as session:
+                    await self.__ledger(session).renew_lease(job)
+            except Exception as e:
+                print(f"Unable to renew the lease of knowledge base job {job.id}: {e}")
+
+    def __ledger(self, session: AsyncSession) -> KnowledgeBaseGenerationLedger:
+        return KnowledgeBaseGenerationLedger(
+            session, lease=self.lease, max_job_attempts=self.max_job_attempts
+        )
+
+    @staticmethod
+    def __claimed(job: KnowledgeBaseGenerationJob):
+        return (
+            update(KnowledgeBaseGenerationJob)
+            .where(KnowledgeBaseGenerationJob.id == job.id)
+            .where(KnowledgeBaseGenerationJob.lease_token == job.lease_token)
+        )
+
+    async def __set_job(self, job: KnowledgeBaseGenerationJob, **values) -> None:
+        async with self.session_factory() as session:
+            await session.execute(self.__claimed(job).values(**values))
+            await session.commit()
@@ -0,0 +1,62 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Generic, TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy import Column
+
+T = TypeVar("T")
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+@dataclass
+class KeysetPage(Generic[T]):
+    """
+    Single page of rows returned by the keyset (cursor) pagination.
+
+    :ivar items: rows of the current page
+    :type items: Sequence[T]
+    :ivar next_cursor: opaque cursor pointing right after the last row of the
+        page, None when there are no more rows
+    :type next_cursor: Optional[str]
+    """
+
+    items: Sequence[T] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """
+    Encodes the keyset values of the last row into an opaque url safe cursor
+    """
+    raw = json.dumps([str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, columns: List[Column]) -> List[Any]:
+    """
+    Decodes the cursor back into keyset values typed as the keyset columns
+
+    :param cursor: cursor previously returned as next cursor
+    :param columns: keyset columns the cursor was built from
+    :return: typed keyset values
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("cursor does not match the keyset")
+        typed_values = []
+        for column, value in zip(columns, values):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                typed_values.append(datetime.fromisoformat(value))
+            else:
+                typed_values.append(python_type(value))
+        return typed_values
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
@@ -0,0 +1,343 @@
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import QuestionAssignmentState
+from dto.response.user_validation_questions import (
+    ValidationQuestionsAssignmentReport,
+    ValidationQuestionsAssignmentRow,
+)
+
+load_dotenv()
+
+QUESTIONS_PER_SKILL = 10
+ASSIGNMENT_STATE_NAME = "user_validation_questions"
+# incremental runs fall back to a full rescan once this much time has passed
+# since the last one, it also picks up the deficits no watermark can see
+# (deleted questions, lowered grades...)
+FULL_RECONCILIATION_INTERVAL = timedelta(
+    minutes=int(os.getenv("QUESTION_ASSIGNMENT_FULL_RECONCILIATION_MINUTES", "1440"))
+)
+# incremental runs reprocess this window before the stored watermarks so rows
+# committed late by long running transactions are not skipped, reprocessing is
+# harmless as only the missing questions get created
+WATERMARK_OVERLAP = timedelta(
+    seconds=int(os.getenv("QUESTION_ASSIGNMENT_WATERMARK_OVERLAP_SECONDS", "60"))
+)
+
+_ALL_USER_SKILLS = """
+    SELECT us.user_id, us.skill_id, us.grade_id
+    FROM users_skills us
+"""
+
+# only the user skills changed since the watermark and the user skills whose
+# skill and level received new knowledge base questions since the watermark
+_TOUCHED_USER_SKILLS = """
+    SELECT us.user_id, us.skill_id, us.grade_id
+    FROM users_skills us
+    WHERE us.updated_at > :users_skills_since
+    UNION
+    SELECT us.user_id, us.skill_id, us.grade_id
+    FROM (
+        SELECT DISTINCT skill_id, difficulty_level
+        FROM matrix_skill_knowledgebase
+        WHERE created_at > :knowledgebase_since
+    ) fresh
+    JOIN grades fresh_grade ON fresh_grade.value = fresh.difficulty_level
+    JOIN users_skills us
+      ON us.skill_id = fresh.skill_id AND us.grade_id = fresh_grade.id
+"""
+
+# Deficit of every (user, skill) pair computed in a single grouped pass, every
+# pair gets a random rotation of the precomputed random ordinal circle so the
+# users do not all receive the same questions for the same skill and level.
+# The picks of a pair are an index seek on (skill_id, difficulty_level,
+# random_ordinal) starting at the rotation and wrapping around from 0, the
+# scan stops after the missing questions instead of sorting every question of
+# the skill and level
+_PICKED_QUESTIONS_CTE = """
+    WITH user_skills_scope AS (
+        {user_skills}
+    ),
+    user_skill_levels AS (
+        SELECT DISTINCT us.user_id, us.skill_id, g.value AS difficulty_level
+        FROM user_skills_scope us
+        JOIN grades g ON us.grade_id = g.id
+    ),
+    deficits AS (
+        SELECT usl.user_id, usl.skill_id, usl.difficulty_level,
+               :questions_per_skill - COUNT(uvq.id) AS questions_needed,
+               random() AS rotation
+        FROM user_skill_levels usl
+        LEFT JOIN user_validation_questions uvq
+               ON uvq.user_id = usl.user_id AND uvq.skill_id = usl.skill_id
+        GROUP BY usl.user_id, usl.skill_id, usl.difficulty_level
+        HAVING COUNT(uvq.id) < :questions_per_skill
+    ),
+    picked AS (
+        SELECT d.user_id, d.skill_id, d.difficulty_level, k.knowledge_base_id
+        FROM deficits d
+        CROSS JOIN LATERAL (
+            (
+                SELECT q.id AS knowledge_base_id
+                FROM matrix_skill_knowledgebase q
+                WHERE q.skill_id = d.skill_id
+                  AND q.difficulty_level = d.difficulty_level
+                  AND q.random_ordinal >= d.rotation
+                  AND NOT EXISTS (
+                      SELECT 1 FROM user_validation_questions assigned
+                      WHERE assigned.user_id = d.user_id
+                        AND assigned.skill_id = d.skill_id
+                        AND assigned.knowledge_base_id = q.id
+                  )
+                ORDER BY q.random_ordinal
+                LIMIT d.questions_needed
+            )
+            UNION ALL
+            (
+                SELECT q.id AS knowledge_base_id
+                FROM matrix_skill_knowledgebase q
+                WHERE q.skill_id = d.skill_id
+                  AND q.difficulty_level = d.difficulty_level
+                  AND q.random_ordinal < d.rotation
+                  AND NOT EXISTS (
+                      SELECT 1 FROM user_validation_questions assigned
+                      WHERE assigned.user_id = d.user_id
+                        AND assigned.skill_id = d.skill_id
+                        AND assigned.knowledge_base_id = q.id
+                  )
+                ORDER BY q.random_ordinal
+                LIMIT d.questions_needed
+            )
+            LIMIT d.questions_needed
+        ) k
+    )
+"""
+
+
+@dataclass
+class AssignmentWatermarks:
+    """
+    High water marks of the tables driving the assignment
+
+    :ivar users_skills: latest seen users_skills.updated_at
+    :type users_skills: Optional[datetime]
+    :ivar knowledgebase: latest seen matrix_skill_knowledgebase.created_at
+    :type knowledgebase: Optional[datetime]
+    """
+
+    users_skills: Optional[datetime] = None
+    knowledgebase: Optional[datetime] = None
+
+
+class UserValidationQuestionsAssigner:
+    """
+    Set based assignment of the knowledge base questions to the users.
+    Every (user, skill) pair is topped up to ``questions_per_skill`` questions
+    of the user's grade level with a single INSERT ... SELECT statement instead
+    of a count, a random pick and a commit per pair.
+    Runs are either full (every user skill) or incremental (only the user
+    skills touched since the stored watermarks).
+    """
+
+    def __init__(
+        self, session: AsyncSession, questions_per_skill: int = QUESTIONS_PER_SKILL
+    ):
+        self.session = session
+        self.questions_per_skill = questions_per_skill
+
+    async def run(
+        self,
+        dry_run: bool = False,
+        full: Optional[bool] = None,
+        sample_size: int = 100,
+    ) -> ValidationQuestionsAssignmentReport:
+        """
+        Scheduled entry point. Runs incrementally from the stored watermarks
+        unless a full reconciliation is due (or forced) and advances the
+        watermarks in the same transaction as the inserted questions.
+
+        :param dry_run: only report the rows that would be created
+        :param full: force (True) or skip (False) the full reconciliation,
+            None decides based on the time since the last full run
+        :param sample_size: maximum number of rows listed by a dry run
+        :return: report of the run
+        :rtype: ValidationQuestionsAssignmentReport
+        """
+        state = await self.session.get(QuestionAssignmentState, ASSIGNMENT_STATE_NAME)
+        if full is None:
+            full = self.is_full_reconciliation_due(state)
+        since = None if full else self.get_since(state)
+        if dry_run:
+            return await self.plan(sample_size=sample_size, since=since)
+
+        # overlapping beat ticks must not assign the same deficits twice
+        locked = await self.session.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"),
+            {"name": ASSIGNMENT_STATE_NAME},
+        )
+        if not locked.scalar():
+            await self.session.rollback()
+            return ValidationQuestionsAssignmentReport(
+                dry_run=False, full=full, total_rows=0, users=0, skills=0
+            )
+        watermarks = await self.get_current_watermarks()
+        report = await self._insert(since)
+        if state is None:
+            state = QuestionAssignmentState(name=ASSIGNMENT_STATE_NAME)
+        state.users_skills_watermark = watermarks.users_skills
+        state.knowledgebase_watermark = watermarks.knowledgebase
+        if full:
+            state.last_full_run_at = datetime.now()
+        self.session.add(state)
+        await self.session.commit()
+        return report
+
+    @staticmethod
+    def is_full_reconciliation_due(state: Optional[QuestionAssignmentState]) -> bool:
+        if state is None or state.last_full_run_at is None:
+            return True
+        return datetime.now() - state.last_full_run_at >= FULL_RECONCILIATION_INTERVAL
+
+    @staticmethod
+    def get_since(state: QuestionAssignmentState) -> AssignmentWatermarks:
+        """
+        Lower bounds of the incremental run, the stored watermarks moved back
+        by the overlap window. Missing watermarks (empty tables on the last
+        run) mean every row is new.
+        """
+        return AssignmentWatermarks(
+            users_skills=(
+                state.users_skills_watermark - WATERMARK_OVERLAP
+                if state.users_skills_watermark is not None
+                else datetime.min
+            ),
+            knowledgebase=(
+                state.knowledgebase_watermark - WATERMARK_OVERLAP
+                if state.knowledgebase_watermark is not None
+                else datetime.min
+            ),
+        )
+
+    async def get_current_watermarks(self) -> AssignmentWatermarks:
+        statement = text(
+            """
+            SELECT (SELECT MAX(updated_at) FROM users_skills),
+                   (SELECT MAX(created_at) FROM matrix_skill_knowledgebase)
+            """
+        )
+        result = await self.session.execute(statement)
+        users_skills, knowledgebase = result.one()
+        return AssignmentWatermarks(
+            users_skills=users_skills, knowledgebase=knowledgebase
+        )
+
+    async def assign(
+        self, since: Optional[AssignmentWatermarks] = None
+    ) -> ValidationQuestionsAssignmentReport:
+        """
+        Creates the missing user validation questions
+
+        :param since: watermarks limiting the run to the touched user skills,
+            None processes every user skill
+        :return: summary of the created rows
+        :rtype: ValidationQuestionsAssignmentReport
+        """
+        report = await self._insert(since)
+        await self.session.commit()
+        return report
+
+    async def plan(
+        self, sample_size: int = 100, since: Optional[AssignmentWatermarks] = None
+    ) -> ValidationQuestionsAssignmentReport:
+        """
+        Dry run of the assignment, nothing is written
+
+        :param sample_size: maximum number of (user, skill) rows listed in the
+            report, totals always cover the entire run
+        :param since: watermarks limiting the run to the touched user skills,
+            None processes every user skill
+        :return: rows that would be created grouped by user, skill and level
+        :rtype: ValidationQuestionsAssignmentReport
+        """
+        statement = text(
+            self._picked_questions(since)
+            + """
+            SELECT user_id, skill_id, difficulty_level, COUNT(*) AS questions
+            FROM picked
+            GROUP BY user_id, skill_id, difficulty_level
+            ORDER BY user_id, skill_id
+            """
+        )
+        result = await self.session.execute(statement, self._params(since))
+        total_rows = 0
+        users = set()
+        skills = set()
+        rows = []
+        for user_id, skill_id, difficulty_level, questions in result:
+            total_rows += questions
+            users.add(user_id)
+            skills.add(skill_id)
+            if len(rows) < sample_size:
+                rows.append(
+                    ValidationQuestionsAssignmentRow(
+                        user_id=user_id,
+                        skill_id=skill_id,
+                        difficulty_level=difficulty_level,
+                        questions=questions,
+                    )
+                )
+        return ValidationQuestionsAssignmentReport(
+            dry_run=True,
+            full=since is None,
+            total_rows=total_rows,
+            users=len(users),
+            skills=len(skills),
+            rows=rows,
+        )
+
+    async def _insert(
+        self, since: Optional[AssignmentWatermarks]
+    ) -> ValidationQuestionsAssignmentReport:
+        statement = text(
+            self._picked_questions(since)
+            + """
+            , inserted AS (
+                INSERT INTO user_validation_questions
+                    (user_id, skill_id, knowledge_base_id, question_uuid,
+                     status, answer_correct, graded_from_cache, created_at)
+                SELECT user_id, skill_id, knowledge_base_id,
+                       gen_random_uuid()::text, 'pending', FALSE, FALSE, NOW()
+                FROM picked
+                RETURNING user_id, skill_id
+            )
+            SELECT COUNT(*), COUNT(DISTINCT user_id), COUNT(DISTINCT skill_id)
+            FROM inserted
+            """
+        )
+        result = await self.session.execute(statement, self._params(since))
+        total_rows, users, skills = result.one()
+        return ValidationQuestionsAssignmentReport(
+            dry_run=False,
+            full=since is None,
+            total_rows=total_rows,
+            users=users,
+            skills=skills,
+        )
+
+    @staticmethod
+    def _picked_questions(since: Optional[AssignmentWatermarks]) -> str:
+        user_skills = _ALL_USER_SKILLS if since is None else _TOUCHED_USER_SKILLS
+        return _PICKED_QUESTIONS_CTE.format(user_skills=user_skills)
+
+    def _params(self, since: Optional[AssignmentWatermarks]) -> dict:
+        params = {"questions_per_skill": self.questions_per_skill}
+        if since is not None:
+            params["users_skills_since"] = since.users_skills
+            params["knowledgebase_since"] = since.knowledgebase
+        return params
@@ -10,11 +10,14 @@ from typing import (
 )
 
 from fastapi import HTTPException
-from sqlalchemy import Row, RowMapping
+from sqlalchemy import Row, RowMapping, inspect, tuple_, Column
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.interfaces import LoaderOption
 from sqlmodel import select, or_
 
 from service.filters import FilterModel, FilterType
+from service.pagination import KeysetPage, encode_cursor, decode_cursor
 
 T = TypeVar("T")
 I = TypeVar("I")
@@ -30,8 +33,56 @@ class __AbstractService(ABC, Generic[T, I, CR, UR]):
         self.model = model
         self.session = session
 
-    async def get(self, model_id: I) -> Optional[T]:
-        model = await self.session.get(self.model, model_id)
+    def _load_options(self, load: Optional[List[str]]) -> List[LoaderOption]:
+        """
+        Translates a declarative relationship spec into loader options so the
+        relationships are fetched together with the rows instead of one
+        awaitable_attrs round trip per row. Nested relationships are separated
+        with a dot (ex. ["user", "skill.parent", "knowledge_base"]).
+        Many-to-one relationships are joined into the main query, collections
+        are loaded with a single additional SELECT ... IN query.
+
+        :param load: relationship paths to eagerly load
+        :return: list of loader options for the select statement
+        :raises ValueError: unknown relationship
+        """
+        if load is None or len(load) == 0:
+            return []
+        options = []
+        for path in load:
+            current_model = self.model
+            option = None
+            for attribute_name in path.split("."):
+                relationship = inspect(current_model).relationships.get(attribute_name)
+                if relationship is None:
+                    # a typo in the load spec of a route, not a client error
+                    raise ValueError(
+                        f"Unknown relationship {attribute_name} on {current_model.__name__}"
+                    )
+                attribute = getattr(current_model, attribute_name)
+                loader = selectinload if relationship.uselist else joinedload
+                if option is None:
+                    option = loader(attribute)
+                elif relationship.uselist:
+                    option = option.selectinload(attribute)
+                else:
+                    option = option.joinedload(attribute)
+                current_model = relationship.mapper.class_
+            options.append(option)
+        return options
+
+    async def get(self, model_id: I, load: Optional[List[str]] = None) -> Optional[T]:
+        if load is not None and len(load) > 0:
+            primary_key = inspect(self.model).primary_key[0]
+            statement = (
+                select(self.model)
+                .where(primary_key == model_id)
+                .options(*self._load_options(load))
+            )
+            result = await self.session.execute(statement)
+            model = result.scalars().first()
+        else:
+            model = await self.session.get(self.model, model_id)
         if model is None:
             raise HTTPException(status_code=404, detail="Not found")
         return model
@@ -51,6 +102,7 @@ class __AbstractService(ABC, Generic[T, I, CR, UR]):
         offset: Optional[int] = 0,
         filters: dict = None,
         order_by: Optional[list] = None,
+        load: Optional[List[str]] = None,
     ) -> Sequence[Row[Any] | RowMapping | Any]:
         statement = select(self.model)
         if filters is not None and len(filters) > 0:
@@ -61,6 +113,7 @@ class __AbstractService(ABC, Generic[T, I, CR, UR]):
         statement = statement.limit(limit).offset(offset)
         if order_by is not None and len(order_by) > 0:
             statement = statement.order_by(*order_by)
+        statement = statement.options(*self._load_options(load))
         result = await self.session.execute(statement)
         models = result.scalars().all()
         return models
@@ -71,9 +124,11 @@ class __AbstractService(ABC, Generic[T, I, CR, UR]):
         in_list: List[I],
         limit: Optional[int] = 20,
         offset: Optional[int] = 0,
+        load: Optional[List[str]] = None,
     ) -> Sequence[Row[Any] | RowMapping | Any]:
         statement = select(self.model).where(getattr(self.model, field).in_(in_list))
         statement = statement.limit(limit).offset(offset)
+        statement = statement.options(*self._load_options(load))
         result = await self.session.execute(statement)
         models = result.scalars().all()
         return models
@@ -118,6 +173,7 @@ class __AbstractService(ABC, Generic[T, I, CR, UR]):
         limit: Optional[int] = 20,
         offset: Optional[int] = 0,
         order_by: Optional[list] = None,
+        load: Optional[List[str]] = None,
     ) -> Sequence[Row[Any] | RowMapping | Any]:
         statement = select(self.model)
         if (
@@ -134,10 +190,91 @@ class __AbstractService(ABC, Generic[T, I, CR, UR]):
         if order_by is not None and len(order_by) > 0:
             statement = statement.order_by(*order_by)
         statement = statement.limit(limit).offset(offset)
+        statement = statement.options(*self._load_options(load))
         result = await self.session.execute(statement)
         models = result.scalars().all()
         return models
 
+    def _keyset_columns(self) -> List[Column]:
+        """
+        Columns used for keyset pagination, (created_at, primary key) when
+        the model has a creation timestamp, otherwise only the primary key
+        """
+        mapper = inspect(self.model)
+        columns = []
+        if "created_at" in mapper.columns:
+            columns.append(mapper.columns["created_at"])
+        columns.extend(mapper.primary_key)
+        return columns
+
+    async def list_page(
+        self,
+        limit: Optional[int] = 20,
+        offset: Optional[int] = 0,
+        cursor: Optional[str] = None,
+        filters: dict = None,
+        descending: bool = False,
+        load: Optional[List[str]] = None,
+    ) -> KeysetPage[T]:
+        """
+        Lists a single page ordered by the keyset columns. When a cursor is
+        provided the page starts right after the row the cursor points to
+        (WHERE (created_at, id) > (...)) so deep pages cost the same as the
+        first one, otherwise the page is selected with LIMIT/OFFSET for
+        backwards compatibility. Both modes return the cursor of the next page.
+        Filters follow the list_all format, or list_all_with_or format when
+        they are nested under the "or_" key.
+
+        :param limit: page size
+        :param offset: offset used only when no cursor is provided
+        :param cursor: opaque cursor returned as next_cursor of a previous page
+        :param filters: equality filters
+        :param descending: whether to order from the newest rows
+        :param load: relationship paths to eagerly load
+        :return: page of rows with the cursor to the next page
+        :rtype: KeysetPage[T]
+        """
+        columns = self._keyset_columns()
+        statement = select(self.model)
+        if filters is not None and len(filters) > 0:
+            if "or_" in filters and isinstance(filters["or_"], dict):
+                clauses = [
+                    getattr(self.model, key) == value
+                    for key, value in filters["or_"].items()
+                ]
+                statement = statement.where(or_(*clauses))
+            else:
+                clauses = [
+                    getattr(self.model, key) == value for key, value in filters.items()
+                ]
+                statement = statement.where(*clauses)
+        if cursor is not None:
+            keyset_values = decode_cursor(cursor, columns)
+            if descending:
+                statement = statement.where(tuple_(*columns) < tuple_(*keyset_values))
+            else:
+                statement = statement.where(tuple_(*columns) > tuple_(*keyset_values))
+        if descending:
+            statement = statement.order_by(*[column.desc() for column in columns])
+        else:
+            statement = statement.order_by(*[column.asc() for column in columns])
+        statement = statement.limit(limit)
+        if cursor is None:
+            statement = statement.offset(offset)
+        statement = statement.options(*self._load_options(load))
+        result = await self.session.execute(statement)
+        models = result.scalars().all()
+        next_cursor = None
+        if limit is not None and len(models) == limit:
+            mapper = inspect(self.model)
+            next_cursor = encode_cursor(
+                [
+                    getattr(models[-1], mapper.get_property_by_column(column).key)
+                    for column in columns
+                ]
+            )
+        return KeysetPage(items=models, next_cursor=next_cursor)
+
     async def create(self, create_dto: CR) -> T:
         created_model = self.model(**create_dto.model_dump())
         self.session.add(created_model)
@@ -1,10 +1,11 @@
 import asyncio
+import functools
 import json
 import os
-import pprint
+import tempfile
 import time
 
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from abc import ABC, abstractmethod
 from datetime import timedelta, date, datetime
 from typing import Any, Tuple, Literal, Optional, List, Dict
@@ -13,23 +14,59 @@ from billiard.exceptions import WorkerLostError
 from celery import shared_task
 from dotenv import load_dotenv
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
-from langtrace_python_sdk import get_prompt_from_registry, langtrace
+from langtrace_python_sdk import langtrace
+from openai import AsyncOpenAI
 from pydantic import BaseModel
 from sqlalchemy import text
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.db import get_session
+from agents.checkpoint_retention import (
+    CheckpointRetention,
+    RetentionReport,
+    get_checkpoint_archive,
+)
+from agents.llm_usage import llm_usage_writer, usage_callbacks, usage_tags
+from agents.prompt_registry import get_prompt, get_prompt_version
+from agents.reasoner import compact_threads, get_checkpointer
+from agents.structured_output import with_structured_output
+from agents.validations_agent import (
+    QUESTION_NEEDS_PROMPT_ID,
+    SAFETY_PROMPT_ID,
+    generate_grading_artifacts,
+)
+from db.db import get_session, async_session
 from db.models import (
     Grade,
+    KnowledgeBaseGenerationJob,
     Skill,
     MatrixSkillKnowledgeBase,
     User,
     UserSkills,
     UserValidationQuestions,
 )
+from dto.inner.knowledge_base import (
+    GeneratedKnowledgeBase,
+    KnowledgeBaseOption,
+    CreateKnowledgeBaseRequest,
+    KnowledgeBaseModelCreate,
+)
+from dto.response.user_validation_questions import ValidationQuestionsAssignmentReport
+from service.batch_generation import KnowledgeBaseBatchPipeline
+from service.grading_artifacts import GradingArtifactsStore
+from service.knowledgebase_generation import (
+    GeneratedQuestions,
+    KB_GENERATION_NODE,
+    KnowledgeBaseGenerationLedger,
+    KnowledgeBaseGenerator,
+    get_prompt_variables,
+    parse_knowledge_base_content,
+)
+from service.question_assignment import UserValidationQuestionsAssigner
 from service.service import BaseService
+from utils.rate_limit import retry_with_jitter
 
 load_dotenv()
 
@@ -39,6 +76,10 @@ BUILD_MODEL = os.getenv("LITE_OPENAI_O3_MODEL")
 BUILDER_PROMPT_ID = (
     "cmd7pckhx0072yrs57rtjn8ld"  # langtrace prompt id to build knowledge base
 )
+# model the split and safety artifacts are generated with, the grading graph
+# is run with gpt-4o by default
+GRADING_ARTIFACTS_MODEL = os.getenv("GRADING_ARTIFACTS_MODEL", "gpt-4o")
+GRADING_ARTIFACTS_CONCURRENCY = int(os.getenv("GRADING_ARTIFACTS_CONCURRENCY", "5"))
 
 LANGTRACE_API_KEY = os.getenv("LANGTRACE_API_KEY")
 LANGTRACE_HOST = os.getenv("LANGTRACE_HOST")
@@ -48,32 +89,6 @@ langtrace.init(api_key=LANGTRACE_API_KEY, api_host=LANGTRACE_HOST)
 QUESTION_THRESHOLD = 30
 
 
-class KnowledgeBaseOption(BaseModel):
-    option: str
-    is_correct: bool
-
-
-class CreateKnowledgeBaseRequest(BaseModel):
-    type: Literal["multi", "single", "input"]
-    question: str
-    answer: Optional[str] = None
-    options: Optional[List[KnowledgeBaseOption]] = None
-    is_code: bool
-
-
-class KnowledgeBaseModelCreate(BaseModel):
-    skill_id: int
-    difficulty_level: int
-    question: str
-    answer: Optional[str]
-    options: Optional[Any]
-    question_type: str
-    is_code_question: bool
-    rules: str
-    created_at: datetime
-    updated_at: datetime
-
-
 @dataclass
 class QnABuilder:
     current_question_count: int
@@ -220,161 +235,265 @@ class MatrixValidationQuestionsResolver(MatrixValidationResolver):
         )
 
 
-async def create_matrix_validations():
-    async for session in get_session():
-        resolver = MatrixValidationQuestionsResolver(session)
-        matrix_builder_response = await resolver.run()
-        for key in matrix_builder_response.q_n_a_builder.keys():
-            for val in matrix_builder_response.q_n_a_builder[key]:
-                if val.questions_to_create_count <= 0:
-                    continue
-                await create_matrix_validation_questions(
-                    session,
-                    val,
-                    key,
-                    matrix_builder_response.skills[key],
-                    matrix_builder_response.min_value,
-                    matrix_builder_response.max_value,
+def build_generation_jobs(
+    matrix_builder_response: MatrixBuilderResponse,
+) -> List[KnowledgeBaseGenerationJob]:
+    """
+    One generation job for every (skill, level) below the question threshold
+    """
+    jobs: List[KnowledgeBaseGenerationJob] = []
+    for key in matrix_builder_response.q_n_a_builder.keys():
+        for val in matrix_builder_response.q_n_a_builder[key]:
+            if val.questions_to_create_count <= 0:
+                continue
+            jobs.append(
+                KnowledgeBaseGenerationJob(
+                    skill_id=key,
+                    skill_name=matrix_builder_response.skills[key],
+                    difficulty_level=val.difficulty_level,
+                    min_level=matrix_builder_response.min_value,
+                    max_level=matrix_builder_response.max_value,
+                    questions_requested=val.questions_to_create_count,
                 )
+            )
+    return jobs
 
 
-async def create_matrix_validation_questions(
-    session: AsyncSession,
-    qa_builder: QnABuilder,
-    skill_id: int,
-    skill_name: str,
-    min_grade: int,
-    max_grade: int,
-):
-    knowledgebase_service: BaseService[
-        MatrixSkillKnowledgeBase, int, KnowledgeBaseModelCreate, Any
-    ] = BaseService(MatrixSkillKnowledgeBase, session)
-    model = ChatOpenAI(
-        model=BUILD_MODEL,
-        base_url=LITE_LLM_URL,
-        api_key=LITE_LLM_API_KEY,
+async def create_matrix_validations():
+    async for session in get_session():
+        ledger = KnowledgeBaseGenerationLedger(session)
+        if not await ledger.try_lock():
+            print("Knowledge base generation run is being planned by another worker")
+            return
+        run_id = await ledger.get_unfinished_run()
+        if run_id is None:
+            resolver = MatrixValidationQuestionsResolver(session)
+            jobs = build_generation_jobs(await resolver.run())
+            if len(jobs) == 0:
+                print("Knowledge base is complete, nothing to generate")
+                return
+            run_id = await ledger.create_run(jobs)
+            print(
+                f"Started knowledge base generation run {run_id} with {len(jobs)} jobs"
+            )
+        else:
+            # releases the planning lock
+            await session.commit()
+            print(f"Resuming knowledge base generation run {run_id}")
+
+    # model and prompt are shared by every job of the run
+    model = with_structured_output(
+        ChatOpenAI(
+            model=BUILD_MODEL,
+            base_url=LITE_LLM_URL,
+            api_key=LITE_LLM_API_KEY,
+            callbacks=usage_callbacks(),
+        ),
+        GeneratedKnowledgeBase,
     )
-    prompt_template_value = get_prompt_from_registry(BUILDER_PROMPT_ID)
+    prompt_template_value = await get_prompt(BUILDER_PROMPT_ID)
     prompt_template = ChatPromptTemplate.from_messages(
         [("system", prompt_template_value["value"])]
     )
-    prompt = await prompt_template.ainvoke(
-        {
-            "scenario_number": qa_builder.questions_to_create_count,
-            "min_level": min_grade,
-            "max_level": max_grade,
-            "topic": skill_name,
-            "current_level": qa_builder.difficulty_level,
-        }
+    generator = KnowledgeBaseGenerator(
+        async_session,
+        handler=functools.partial(
+            create_matrix_validation_questions, model, prompt_template
+        ),
     )
-    response = await model.ainvoke(prompt)
-    cnt = response.content
-    if cnt.startswith("```json"):
-        cnt = cnt.strip("```json").strip("```")
-    data = json.loads(cnt)
-    knowledge_base = [CreateKnowledgeBaseRequest(**item) for item in data]
-    all_dtos: List[KnowledgeBaseModelCreate] = []
-    for chunk in knowledge_base:
-        all_dtos.append(
-            KnowledgeBaseModelCreate(
-                skill_id=skill_id,
-                difficulty_level=qa_builder.difficulty_level,
-                question=chunk.question,
-                answer=chunk.answer,
-                options=(chunk.options if chunk.options is not None else None),
-                question_type=chunk.type,
-                rules="Testing",
-                is_code_question=chunk.is_code,
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
+    finished = await generator.run(run_id)
+    await llm_usage_writer.close()
+    print(f"Knowledge base generation run {run_id} finished {finished} jobs")
+    generate_knowledge_base_grading_artifacts.delay()
+
+
+async def create_matrix_validations_batch(batch_id: Optional[str] = None):
+    """
+    Fills the knowledge base through the Batch API. Without a batch id the
+    gaps are written to a JSONL requests file and submitted, with one the
+    already submitted batch is awaited (resuming after a worker restart).
+    """
+    client = AsyncOpenAI(base_url=LITE_LLM_URL, api_key=LITE_LLM_API_KEY)
+    async for session in get_session():
+        if batch_id is None:
+            prompt_template_value = await get_prompt(BUILDER_PROMPT_ID)
+            prompt_template = ChatPromptTemplate.from_messages(
+                [("system", prompt_template_value["value"])]
             )
-        )
-    pprint.pprint(f"RESPONSE {cnt}")
-    pprint.pprint(f"Knowledgebase: {knowledge_base}")
-    created_dtos = await knowledgebase_service.create_many(all_dtos)
-    for dto in created_dtos:
-        print(f"DTO ---> {dto}")
-    return created_dtos
+            pipeline = KnowledgeBaseBatchPipeline(
+                session, client, BUILD_MODEL, prompt_template
+            )
+            resolver = MatrixValidationQuestionsResolver(session)
+            jobs = build_generation_jobs(await resolver.run())
+            if len(jobs) == 0:
+                print("Knowledge base is complete, nothing to generate")
+                return None
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                requests_path = os.path.join(tmp_dir, "requests.jsonl")
+                await pipeline.write_requests(jobs, requests_path)
+                batch = await pipeline.submit(requests_path)
+            batch_id = batch.id
+            print(
+                f"Submitted knowledge base batch {batch_id} with {len(jobs)} requests"
+            )
+        else:
+            pipeline = KnowledgeBaseBatchPipeline(session, client, BUILD_MODEL)
 
+        batch = await pipeline.wait(batch_id)
+        if batch.status != "completed":
+            print(f"Knowledge base batch {batch_id} ended as {batch.status}")
+            return None
+        report = await pipeline.import_results(batch)
+        await llm_usage_writer.close()
+        print(f"Knowledge base batch {batch_id} imported: {report}")
+        generate_knowledge_base_grading_artifacts.delay()
+        return report
 
-async def generate_validation_questions_for_users():
-    async for session in get_session():
-        validation_service = BaseService(UserValidationQuestions, session)
 
-        # Get users with populated skills
-        statement = text(
-            """
-            SELECT DISTINCT u.id, u.email, us.skill_id, us.grade_id, g.value as difficulty_level
-            FROM users u
-            JOIN users_skills us ON u.id = us.user_id
-            JOIN grades g ON us.grade_id = g.id
-        """
+async def create_matrix_validation_questions(
+    model: Runnable,
+    prompt_template: ChatPromptTemplate,
+    job: KnowledgeBaseGenerationJob,
+) -> GeneratedQuestions:
+    prompt = await prompt_template.ainvoke(get_prompt_variables(job))
+    response = await model.ainvoke(
+        prompt,
+        config={
+            "metadata": usage_tags(
+                "knowledge_base", skill_id=job.skill_id, node=KB_GENERATION_NODE
+            )
+        },
+    )
+    all_models: List[MatrixSkillKnowledgeBase] = [
+        MatrixSkillKnowledgeBase(**dto.model_dump())
+        for dto in parse_knowledge_base_content(
+            response.content, job.skill_id, job.difficulty_level
         )
+    ]
+    usage = response.usage_metadata or {}
+    return GeneratedQuestions(
+        questions=all_models,
+        prompt_tokens=usage.get("input_tokens", 0),
+        completion_tokens=usage.get("output_tokens", 0),
+    )
 
-        results = await session.execute(statement)
-
-        for row in results:
-            user_id, email, skill_id, grade_id, difficulty_level = row
 
-            # Check if user already has 10 questions for this skill
-            existing_count_statement = text(
-                """
-                SELECT COUNT(*) FROM user_validation_questions 
-                WHERE user_id = :user_id AND skill_id = :skill_id
-            """
-            )
+async def create_grading_artifacts(
+    knowledge_base_ids: Optional[List[int]] = None,
+) -> int:
+    """
+    Generates the split and safety artifacts of the input knowledge base
+    questions that have none yet or whose question, answer, rules or prompts
+    changed since they were generated
+
+    :param knowledge_base_ids: restricts the run to these questions
+    :return: number of questions the artifacts were generated for
+    :rtype: int
+    """
+    split_prompt_version = get_prompt_version(
+        await get_prompt(QUESTION_NEEDS_PROMPT_ID)
+    )
+    safety_prompt_version = get_prompt_version(await get_prompt(SAFETY_PROMPT_ID))
+    async for session in get_session():
+        knowledge_bases = await GradingArtifactsStore(session).find_stale(
+            split_prompt_version, safety_prompt_version, knowledge_base_ids
+        )
+    semaphore = asyncio.Semaphore(GRADING_ARTIFACTS_CONCURRENCY)
 
-            existing_result = await session.execute(
-                existing_count_statement, {"user_id": user_id, "skill_id": skill_id}
+    async def generate(knowledge_base: MatrixSkillKnowledgeBase) -> bool:
+        async with semaphore:
+            try:
+                split_response, safety_response = await retry_with_jitter(
+                    lambda: generate_grading_artifacts(
+                        GRADING_ARTIFACTS_MODEL,
+                        knowledge_base.question,
+                        knowledge_base.answer,
+                        knowledge_base.rules,
+                    ),
+                    max_attempts=3,
+                )
+            except Exception as e:
+                print(
+                    f"Unable to generate grading artifacts of knowledge base {knowledge_base.id}: {e}"
+                )
+                return False
+        async with async_session() as session:
+            await GradingArtifactsStore(session).save(
+                knowledge_base,
+                split_response,
+                split_prompt_version,
+                safety_response,
+                safety_prompt_version,
             )
+        return True
 
-            existing_count = existing_result.scalar()
+    results = await asyncio.gather(
+        *[generate(knowledge_base) for knowledge_base in knowledge_bases]
+    )
+    await llm_usage_writer.close()
+    print(
+        f"Generated grading artifacts for {sum(results)} of {len(knowledge_bases)} questions"
+    )
+    return sum(results)
 
-            if existing_count >= 10:
-                print(
-                    f"User {email} already has {existing_count} questions for skill {skill_id}, skipping"
-                )
-                continue
 
-            questions_needed = 10 - existing_count
+async def generate_validation_questions_for_users(
+    dry_run: bool = False, full: Optional[bool] = None
+) -> ValidationQuestionsAssignmentReport:
+    async for session in get_session():
+        assigner = UserValidationQuestionsAssigner(session)
+        report = await assigner.run(dry_run=dry_run, full=full)
+        print(
+            f"{'Would create' if dry_run else 'Created'} {report.total_rows} validation questions "
+            f"for {report.users} users across {report.skills} skills "
+            f"({'full' if report.full else 'incremental'} run)"
+        )
+        return report
 
-            # Get random questions for this skill and difficulty level
-            questions_statement = text(
-                """
-                SELECT id FROM matrix_skill_knowledgebase 
-                WHERE skill_id = :skill_id AND difficulty_level = :difficulty_level
-                ORDER BY RANDOM() LIMIT :limit
-                """
-            )
 
-            questions_result = await session.execute(
-                questions_statement,
-                {
-                    "skill_id": skill_id,
-                    "difficulty_level": difficulty_level,
-                    "limit": questions_needed,
-                },
-            )
+async def compact_matrix_chat_threads() -> int:
+    """
+    Replaces the user, skill and grade rows checkpointed by the matrix chats
+    started before the state references with their references
+    """
+    async for session in get_session():
+        statement = text(
+            """
+            SELECT id FROM matrix_chats;
+            """
+        )
+        results = await session.execute(statement)
+        thread_ids = [result[0] for result in results]
+    compacted = await compact_threads(thread_ids)
+    print(f"Compacted the state of {compacted} of {len(thread_ids)} matrix chats")
+    return compacted
 
-            questions = questions_result.fetchall()
-
-            # Save questions to UserValidationQuestions
-            validation_records = []
-            for question_row in questions:
-                validation_records.append(
-                    UserValidationQuestions(
-                        user_id=user_id,
-                        skill_id=skill_id,
-                        knowledge_base_id=question_row[0],
-                        created_at=datetime.now(),
-                    )
-                )
 
-            if validation_records:
-                await validation_service.create_many(validation_records)
-                print(
-                    f"Saved {len(validation_records)} questions for user {email}, skill {skill_id}, level {difficulty_level}"
-                )
+async def apply_checkpoint_retention() -> RetentionReport:
+    """
+    Archives and collapses the checkpoints of the completed matrix chats and
+    answered validation questions, the other threads keep their latest ones
+    """
+    async for session in get_session():
+        statement = text(
+            """
+            SELECT id::text FROM matrix_chats WHERE status = 'COMPLETED'
+            UNION
+            SELECT question_uuid FROM user_validation_questions
+            WHERE status IN ('waiting_admin', 'verified');
+            """
+        )
+        results = await session.execute(statement)
+        finished = [result[0] for result in results]
+    async with get_checkpointer() as checkpointer:
+        retention = CheckpointRetention(checkpointer, get_checkpoint_archive())
+        report = await retention.run(finished)
+    print(
+        f"Collapsed {report.collapsed_threads} finished and pruned {report.pruned_threads} live threads, "
+        f"deleted {report.deleted_checkpoints} checkpoints ({report.reclaimed_bytes} bytes), "
+        f"archived {report.archived_bytes} bytes"
+    )
+    return report
 
 
 @shared_task
@@ -395,15 +514,78 @@ def generate_matrix_validation_questions():
 
 
 @shared_task
-def generate_user_validation_questions():
+def generate_matrix_validation_questions_batch(batch_id: Optional[str] = None):
     try:
         loop = asyncio.get_event_loop()
-        if loop.is_running():
-            result = loop.run_until_complete(generate_validation_questions_for_users())
-        else:
-            result = loop.run_until_complete(generate_validation_questions_for_users())
+        result = loop.run_until_complete(create_matrix_validations_batch(batch_id))
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        result = loop.run_until_complete(create_matrix_validations_batch(batch_id))
+    except WorkerLostError as work_lost_err:
+        print(f"Worker lost during task execution: {work_lost_err}")
+        return None
+    return asdict(result) if result is not None else None
+
+
+@shared_task
+def generate_user_validation_questions(
+    dry_run: bool = False, full: Optional[bool] = None
+):
+    try:
+        loop = asyncio.get_event_loop()
+        result = loop.run_until_complete(
+            generate_validation_questions_for_users(dry_run=dry_run, full=full)
+        )
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        result = loop.run_until_complete(
+            generate_validation_questions_for_users(dry_run=dry_run, full=full)
+        )
+    except WorkerLostError as work_lost_err:
+        print(f"Worker lost during task execution: {work_lost_err}")
+        return None
+    return result.model_dump()
+
+
+@shared_task
+def generate_knowledge_base_grading_artifacts(
+    knowledge_base_ids: Optional[List[int]] = None,
+):
+    try:
+        loop = asyncio.get_event_loop()
+        result = loop.run_until_complete(create_grading_artifacts(knowledge_base_ids))
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        result = loop.run_until_complete(create_grading_artifacts(knowledge_base_ids))
+    except WorkerLostError as work_lost_err:
+        print(f"Worker lost during task execution: {work_lost_err}")
+        return None
+    return result
+
+
+@shared_task
+def compact_matrix_chat_states():
+    try:
+        loop = asyncio.get_event_loop()
+        result = loop.run_until_complete(compact_matrix_chat_threads())
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        result = loop.run_until_complete(compact_matrix_chat_threads())
+    except WorkerLostError as work_lost_err:
+        print(f"Worker lost during task execution: {work_lost_err}")
+        return None
+    return result
+
+
+@shared_task
+def enforce_checkpoint_retention():
+    try:
+        loop = asyncio.get_event_loop()
+        result = loop.run_until_complete(apply_checkpoint_retention())
     except RuntimeError:
         loop = asyncio.new_event_loop()
-        result = loop.run_until_complete(generate_validation_questions_for_users())
+        result = loop.run_until_complete(apply_checkpoint_retention())
     except WorkerLostError as work_lost_err:
         print(f"Worker lost during task execution: {work_lost_err}")
+        return None
+    return asdict(result)
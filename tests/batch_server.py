@@ -0,0 +1,144 @@
+import json
+import time
+import uuid
+from typing import Callable, Dict
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+# status a batch moves through, one step per retrieve call so the clients
+# exercise their polling
+BATCH_STATUS_FLOW = ["validating", "in_progress", "finalizing", "completed"]
+
+
+class CreateBatchRequest(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str
+    metadata: Dict[str, str] | None = None
+
+
+def create_batch_stand_in_app(responder: Callable[[dict], str]) -> FastAPI:
+    """
+    Local stand-in of the OpenAI files and batches endpoints. Every request
+    line of a batch is answered with the content returned by ``responder``
+    for the request body.
+
+    :param responder: produces the assistant message content of a request
+    :return: app serving /v1/files and /v1/batches
+    :rtype: FastAPI
+    """
+    app = FastAPI()
+    files: Dict[str, dict] = {}
+    batches: Dict[str, dict] = {}
+
+    def store_file(content: bytes, filename: str, purpose: str) -> dict:
+        file_id = f"file-{uuid.uuid4().hex}"
+        files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+            "content": content,
+        }
+        return files[file_id]
+
+    def public_file(file: dict) -> dict:
+        return {key: value for key, value in file.items() if key != "content"}
+
+    def complete(batch: dict) -> None:
+        lines = files[batch["input_file_id"]]["content"].decode().splitlines()
+        output = []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.append(
+                json.dumps(
+                    {
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "request_id": uuid.uuid4().hex,
+                            "body": {
+                                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                                "object": "chat.completion",
+                                "model": request["body"]["model"],
+                                "choices": [
+                                    {
+                                        "index": 0,
+                                        "message": {
+                                            "role": "assistant",
+                                            "content": responder(request["body"]),
+                                        },
+                                        "finish_reason": "stop",
+                                    }
+                                ],
+                            },
+                        },
+                        "error": None,
+                    }
+                )
+            )
+        output_file = store_file(
+            "\n".join(output).encode(), f"{batch['id']}_output.jsonl", "batch_output"
+        )
+        batch["output_file_id"] = output_file["id"]
+        batch["request_counts"] = {
+            "total": len(output),
+            "completed": len(output),
+            "failed": 0,
+        }
+        batch["completed_at"] = int(time.time())
+
+    @app.post("/v1/files")
+    async def create_file(file: UploadFile = File(...), purpose: str = Form(...)):
+        content = await file.read()
+        return public_file(store_file(content, file.filename, purpose))
+
+    @app.get("/v1/files/{file_id}/content")
+    async def get_file_content(file_id: str):
+        if file_id not in files:
+            raise HTTPException(status_code=404, detail="File not found")
+        return Response(
+            content=files[file_id]["content"], media_type="application/jsonl"
+        )
+
+    @app.post("/v1/batches")
+    async def create_batch(request: CreateBatchRequest):
+        if request.input_file_id not in files:
+            raise HTTPException(status_code=404, detail="File not found")
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request.endpoint,
+            "input_file_id": request.input_file_id,
+            "completion_window": request.completion_window,
+            "status": BATCH_STATUS_FLOW[0],
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.metadata,
+        }
+        return batches[batch_id]
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        if batch_id not in batches:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        batch = batches[batch_id]
+        step = BATCH_STATUS_FLOW.index(batch["status"])
+        if step < len(BATCH_STATUS_FLOW) - 1:
+            batch["status"] = BATCH_STATUS_FLOW[step + 1]
+            if batch["status"] == "completed":
+                complete(batch)
+        return batch
+
+    return app
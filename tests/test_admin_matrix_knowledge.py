@@ -0,0 +1,73 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from db.models import KnowledgeBaseGenerationJob
+
+
+class TestAdminMatrixKnowledgeRouter:
+    def test_get_generation_progress_unauthorized(self, test_client: TestClient):
+        response = test_client.get("/api/v1/admin/matrix-knowledge/generation/progress")
+        assert response.status_code == 401
+
+    def test_get_generation_progress_forbidden_non_admin(
+        self, test_client: TestClient, auth_headers
+    ):
+        response = test_client.get(
+            "/api/v1/admin/matrix-knowledge/generation/progress",
+            headers=auth_headers,
+        )
+        assert response.status_code == 403
+
+    def test_get_generation_progress_unknown_run(
+        self, test_client: TestClient, admin_auth_headers, mock_admin_user
+    ):
+        response = test_client.get(
+            "/api/v1/admin/matrix-knowledge/generation/progress",
+            params={"run_id": str(uuid.uuid4())},
+            headers=admin_auth_headers,
+        )
+        assert response.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_get_generation_progress_success(
+        self,
+        test_client: TestClient,
+        admin_auth_headers,
+        mock_admin_user,
+        test_skill,
+        test_session,
+    ):
+        run_id = str(uuid.uuid4())
+        started_at = datetime.now() - timedelta(minutes=2)
+        for status, created in [("done", 5), ("done", 5), ("pending", 0)]:
+            test_session.add(
+                KnowledgeBaseGenerationJob(
+                    run_id=run_id,
+                    skill_id=test_skill.id,
+                    skill_name=test_skill.name,
+                    difficulty_level=1,
+                    min_level=1,
+                    max_level=5,
+                    questions_requested=5,
+                    questions_created=created,
+                    status=status,
+                    started_at=started_at if status == "done" else None,
+                )
+            )
+        await test_session.commit()
+
+        response = test_client.get(
+            "/api/v1/admin/matrix-knowledge/generation/progress",
+            params={"run_id": run_id},
+            headers=admin_auth_headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total_jobs"] == 3
+        assert data["done_jobs"] == 2
+        assert data["pending_jobs"] == 1
+        assert data["questions_created"] == 10
+        assert data["jobs_per_minute"] > 0
@@ -0,0 +1,62 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from db.models import MatrixSkillKnowledgeBase, UserSkills
+
+
+class TestAdminValidationQuestionsRouter:
+    def test_get_assignment_plan_unauthorized(self, test_client: TestClient):
+        response = test_client.get("/api/v1/admin/validation-questions/assignment-plan")
+        assert response.status_code == 401
+
+    def test_get_assignment_plan_forbidden_non_admin(
+        self, test_client: TestClient, auth_headers
+    ):
+        response = test_client.get(
+            "/api/v1/admin/validation-questions/assignment-plan",
+            headers=auth_headers,
+        )
+        assert response.status_code == 403
+
+    @pytest.mark.asyncio
+    async def test_get_assignment_plan_success(
+        self,
+        test_client: TestClient,
+        admin_auth_headers,
+        mock_admin_user,
+        test_user,
+        test_skill,
+        test_grade,
+        test_session,
+    ):
+        test_session.add(
+            UserSkills(
+                user_id=test_user.id,
+                skill_id=test_skill.id,
+                grade_id=test_grade.id,
+            )
+        )
+        for index in range(3):
+            test_session.add(
+                MatrixSkillKnowledgeBase(
+                    skill_id=test_skill.id,
+                    difficulty_level=test_grade.value,
+                    question=f"Question {index}",
+                    answer=f"Answer {index}",
+                    rules="Rules",
+                    question_type="input",
+                    is_code_question=False,
+                )
+            )
+        await test_session.commit()
+
+        response = test_client.get(
+            "/api/v1/admin/validation-questions/assignment-plan",
+            headers=admin_auth_headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["dry_run"] is True
+        assert data["total_rows"] == 3
+        assert data["rows"][0]["user_id"] == test_user.id
+        assert data["rows"][0]["questions"] == 3
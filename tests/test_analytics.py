@@ -1,5 +1,89 @@
+from datetime import datetime
+
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import delete
+
+from db.models import LLMUsage
+
+COST_ENDPOINTS = [
+    "/api/v1/analytics/costs/skills",
+    "/api/v1/analytics/costs/validations",
+    "/api/v1/analytics/costs/weekly",
+    "/api/v1/analytics/costs/nodes",
+]
+# rows of the other tests are created now, the seeded usage lies in this period
+PERIOD = {
+    "created_after": "2020-01-01T00:00:00",
+    "created_before": "2020-02-01T00:00:00",
+}
+
+
+def usage(created_at: datetime, cost_usd: float, **kwargs) -> LLMUsage:
+    return LLMUsage(
+        model="gpt-4o-mini",
+        prompt_tokens=1000,
+        completion_tokens=100,
+        cached_tokens=0,
+        cost_usd=cost_usd,
+        cache_hit=False,
+        created_at=created_at,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+async def llm_usage(test_session, test_skill):
+    skill_id = test_skill.id
+    test_session.add_all(
+        [
+            # monday and sunday of the same week
+            usage(
+                datetime(2020, 1, 6, 10, 0),
+                0.1,
+                graph="validations",
+                node="evaluator",
+                skill_id=skill_id,
+                validation_id=1,
+            ),
+            usage(
+                datetime(2020, 1, 12, 23, 0),
+                0.2,
+                graph="validations",
+                node="evaluator",
+                skill_id=skill_id,
+                validation_id=1,
+            ),
+            # monday of the next week
+            usage(
+                datetime(2020, 1, 13, 0, 30),
+                0.5,
+                graph="reasoner",
+                node="reasoner",
+                skill_id=skill_id,
+            ),
+            usage(
+                datetime(2020, 1, 14, 8, 0),
+                0.05,
+                graph="knowledgebase",
+                node="generator",
+            ),
+            # outside of the period
+            usage(
+                datetime(2020, 2, 3, 8, 0),
+                1.0,
+                graph="reasoner",
+                node="reasoner",
+                skill_id=skill_id,
+            ),
+        ]
+    )
+    await test_session.commit()
+    yield skill_id
+    await test_session.execute(
+        delete(LLMUsage).where(LLMUsage.created_at < datetime(2020, 3, 1))
+    )
+    await test_session.commit()
 
 
 class TestAnalyticsRouter:
@@ -18,3 +102,84 @@ class TestAnalyticsRouter:
     ):
         response = test_client.get("/api/v1/analytics", headers=admin_auth_headers)
         assert response.status_code == 200
+
+
+class TestAnalyticsCostsRouter:
+    @pytest.mark.parametrize("endpoint", COST_ENDPOINTS)
+    def test_get_costs_unauthorized(self, test_client: TestClient, endpoint):
+        response = test_client.get(endpoint)
+        assert response.status_code == 401
+
+    @pytest.mark.parametrize("endpoint", COST_ENDPOINTS)
+    def test_get_costs_forbidden_non_admin(
+        self, test_client: TestClient, auth_headers, endpoint
+    ):
+        response = test_client.get(endpoint, headers=auth_headers)
+        assert response.status_code == 403
+
+    def test_get_cost_per_skill_success(
+        self, test_client: TestClient, admin_auth_headers, mock_admin_user, llm_usage
+    ):
+        response = test_client.get(
+            "/api/v1/analytics/costs/skills",
+            params=PERIOD,
+            headers=admin_auth_headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert [(row["skill_id"], row["skill_name"], row["calls"]) for row in data] == [
+            (llm_usage, "Python", 3),
+            (None, None, 1),
+        ]
+        assert data[0]["cost_usd"] == pytest.approx(0.8)
+        assert data[0]["prompt_tokens"] == 3000
+
+    def test_get_cost_per_validation_success(
+        self, test_client: TestClient, admin_auth_headers, mock_admin_user, llm_usage
+    ):
+        response = test_client.get(
+            "/api/v1/analytics/costs/validations",
+            params={**PERIOD, "skill_id": llm_usage},
+            headers=admin_auth_headers,
+        )
+        assert response.status_code == 200
+        [validation] = response.json()
+        assert validation["validation_id"] == 1
+        assert validation["skill_id"] == llm_usage
+        assert validation["calls"] == 2
+        assert validation["cost_usd"] == pytest.approx(0.3)
+
+    def test_get_cost_per_week_success(
+        self, test_client: TestClient, admin_auth_headers, mock_admin_user, llm_usage
+    ):
+        response = test_client.get(
+            "/api/v1/analytics/costs/weekly",
+            params=PERIOD,
+            headers=admin_auth_headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        # weeks start on monday, the sunday row belongs to the week before
+        assert [(row["week"], row["graph"], row["calls"]) for row in data] == [
+            ("2020-01-06", "validations", 2),
+            ("2020-01-13", "knowledgebase", 1),
+            ("2020-01-13", "reasoner", 1),
+        ]
+        assert data[0]["cost_usd"] == pytest.approx(0.3)
+
+    def test_get_cost_per_node_success(
+        self, test_client: TestClient, admin_auth_headers, mock_admin_user, llm_usage
+    ):
+        response = test_client.get(
+            "/api/v1/analytics/costs/nodes",
+            params=PERIOD,
+            headers=admin_auth_headers,
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert [(row["graph"], row["node"], row["model"]) for row in data] == [
+            ("reasoner", "reasoner", "gpt-4o-mini"),
+            ("validations", "evaluator", "gpt-4o-mini"),
+            ("knowledgebase", "generator", "gpt-4o-mini"),
+        ]
+        assert [row["cost_usd"] for row in data] == pytest.approx([0.5, 0.3, 0.05])
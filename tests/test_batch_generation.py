@@ -0,0 +1,133 @@
+import json
+import os
+from typing import List
+
+import httpx
+import pytest
+from langchain_core.prompts import ChatPromptTemplate
+from openai import AsyncOpenAI
+from sqlalchemy import func, select
+
+from agents.llm_usage import LLMUsageRecord, LLMUsageWriter
+from db.models import KnowledgeBaseGenerationJob, MatrixSkillKnowledgeBase
+from service.batch_generation import KnowledgeBaseBatchPipeline
+from tests.batch_server import create_batch_stand_in_app
+
+
+def generated_questions(body: dict) -> str:
+    return json.dumps(
+        [
+            {
+                "type": "input",
+                "question": f"Question {index}",
+                "answer": f"Answer {index}",
+                "is_code": False,
+            }
+            for index in range(3)
+        ]
+    )
+
+
+class RecordingWriter(LLMUsageWriter):
+    def __init__(self):
+        super().__init__()
+        self.records: List[LLMUsageRecord] = []
+
+    def record(self, record: LLMUsageRecord) -> None:
+        self.records.append(record)
+
+
+async def completed_batch(test_session, test_skill, tmp_path):
+    app = create_batch_stand_in_app(generated_questions)
+    client = AsyncOpenAI(
+        api_key="test",
+        base_url="http://batch-stand-in/v1",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=app)),
+    )
+    prompt_template = ChatPromptTemplate.from_messages(
+        [("system", "Create {scenario_number} questions about {topic}")]
+    )
+    pipeline = KnowledgeBaseBatchPipeline(
+        test_session, client, "test-model", prompt_template
+    )
+    jobs = [
+        KnowledgeBaseGenerationJob(
+            skill_id=test_skill.id,
+            skill_name=test_skill.name,
+            difficulty_level=level,
+            min_level=1,
+            max_level=2,
+            questions_requested=3,
+        )
+        for level in [1, 2]
+    ]
+    requests_path = os.path.join(tmp_path, "requests.jsonl")
+
+    assert await pipeline.write_requests(jobs, requests_path) == 2
+    batch = await pipeline.submit(requests_path)
+    batch = await pipeline.wait(batch.id, poll_interval=0)
+    assert batch.status == "completed"
+    return pipeline, batch
+
+
+async def count_questions(test_session, test_skill) -> int:
+    result = await test_session.execute(
+        select(func.count()).where(MatrixSkillKnowledgeBase.skill_id == test_skill.id)
+    )
+    return result.scalar()
+
+
+class TestKnowledgeBaseBatchPipeline:
+    @pytest.mark.asyncio
+    async def test_generate_knowledge_base_batch(
+        self, test_session, test_skill, tmp_path
+    ):
+        pipeline, batch = await completed_batch(test_session, test_skill, tmp_path)
+
+        report = await pipeline.import_results(batch)
+
+        assert report.succeeded == 2
+        assert report.failed == 0
+        assert report.questions_created == 6
+        assert await count_questions(test_session, test_skill) == 6
+
+    @pytest.mark.asyncio
+    async def test_reimported_batch_inserts_nothing(
+        self, test_session, test_skill, tmp_path
+    ):
+        pipeline, batch = await completed_batch(test_session, test_skill, tmp_path)
+        await pipeline.import_results(batch)
+
+        report = await pipeline.import_results(batch)
+
+        assert report.already_imported is True
+        assert report.questions_created == 0
+        assert await count_questions(test_session, test_skill) == 6
+
+    @pytest.mark.asyncio
+    async def test_usage_is_recorded_once_the_import_is_committed(
+        self, test_session, test_skill, tmp_path, monkeypatch
+    ):
+        writer = RecordingWriter()
+        monkeypatch.setattr("service.batch_generation.llm_usage_writer", writer)
+        monkeypatch.setattr("service.batch_generation.LLM_USAGE_ENABLED", True)
+        pipeline, batch = await completed_batch(test_session, test_skill, tmp_path)
+        commit = test_session.commit
+
+        async def fail():
+            raise ConnectionError("connection lost")
+
+        monkeypatch.setattr(test_session, "commit", fail)
+        with pytest.raises(ConnectionError):
+            await pipeline.import_results(batch)
+        await test_session.rollback()
+
+        assert writer.records == []
+
+        monkeypatch.setattr(test_session, "commit", commit)
+        report = await pipeline.import_results(batch)
+        await pipeline.import_results(batch)
+
+        assert report.questions_created == 6
+        assert len(writer.records) == 2
+        assert {record.graph for record in writer.records} == {"knowledge_base"}
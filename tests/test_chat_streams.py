@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import pytest
+
+from service.chat_streams import (
+    ChatRun,
+    ChatRunConflictError,
+    ChatStreams,
+    InMemoryChatEventLog,
+)
+
+
+def chunk(msg_type: str, message: str) -> str:
+    return json.dumps({"msg_type": msg_type, "message": message})
+
+
+class TestChatStreams:
+    @pytest.mark.asyncio
+    async def test_client_resumes_after_last_event_id(self):
+        streams = ChatStreams(redis_url=None, block_ms=50)
+        release = asyncio.Event()
+        runs = []
+
+        async def run():
+            runs.append(1)
+            yield chunk("ai_token", "Hel")
+            await release.wait()
+            yield chunk("ai_token", "lo")
+            yield chunk("ai", "Hello")
+
+        start_id = await streams.start("thread", run, lambda c: c["msg_type"])
+        tail = streams.tail("thread", start_id)
+        first = await tail.__anext__()
+        # the client drops, the run goes on without it
+        await tail.aclose()
+        release.set()
+
+        # a resubmitted message attaches to the running graph
+        assert await streams.start("thread", run, lambda c: c["msg_type"]) == start_id
+        resumed = [event async for event in streams.tail("thread", first.id)]
+
+        assert first.event == "ai_token"
+        assert [event.data for event in resumed] == [
+            chunk("ai_token", "lo"),
+            chunk("ai", "Hello"),
+        ]
+        assert runs == [1]
+        assert await streams.active_run("thread") is None
+
+    @pytest.mark.asyncio
+    async def test_next_run_is_streamed_from_its_start(self):
+        streams = ChatStreams(redis_url=None, block_ms=50)
+
+        async def run():
+            yield chunk("ai", "answer")
+
+        start_id = await streams.start("thread", run, lambda c: c["msg_type"])
+        first = [event async for event in streams.tail("thread", start_id)]
+        start_id = await streams.start("thread", run, lambda c: c["msg_type"])
+        second = [event async for event in streams.tail("thread", start_id)]
+
+        assert len(first) == 1
+        assert len(second) == 1
+        assert first[0].id != second[0].id
+
+    @pytest.mark.asyncio
+    async def test_failed_run_ends_with_error_event(self):
+        streams = ChatStreams(redis_url=None, block_ms=50)
+
+        async def run():
+            yield chunk("ai", "partial")
+            raise RuntimeError("graph failed")
+
+        start_id = await streams.start("thread", run, lambda c: c["msg_type"])
+        events = [event async for event in streams.tail("thread", start_id)]
+
+        assert [event.event for event in events] == ["ai", "error"]
+
+    @pytest.mark.asyncio
+    async def test_events_expire_after_ttl(self):
+        streams = ChatStreams(redis_url=None, ttl=0, block_ms=50)
+
+        async def run():
+            yield chunk("ai", "answer")
+
+        await streams.start("thread", run, lambda c: c["msg_type"])
+        await asyncio.sleep(0.01)
+        await streams.start("other", run, lambda c: c["msg_type"])
+
+        assert [event async for event in streams.tail("thread", "0-0")] == []
+
+    @pytest.mark.asyncio
+    async def test_different_message_is_refused_while_running(self):
+        streams = ChatStreams(redis_url=None, block_ms=50)
+        release = asyncio.Event()
+
+        async def run():
+            await release.wait()
+            yield chunk("ai", "answer")
+
+        start_id = await streams.start(
+            "thread", run, lambda c: c["msg_type"], message="first"
+        )
+
+        with pytest.raises(ChatRunConflictError):
+            await streams.start(
+                "thread", run, lambda c: c["msg_type"], message="second"
+            )
+        assert (
+            await streams.start("thread", run, lambda c: c["msg_type"], message="first")
+            == start_id
+        )
+        release.set()
+        assert len([event async for event in streams.tail("thread", start_id)]) == 1
+
+    @pytest.mark.asyncio
+    async def test_finished_run_does_not_release_the_next_one(self):
+        log = InMemoryChatEventLog(ttl=60, max_length=10, run_ttl=0)
+        expired = ChatRun(start_id="0-0")
+        await log.acquire_run("thread", expired)
+        # the marker of the slow run expired and the next run took the thread
+        log.run_ttl = 60
+        next_run = ChatRun(start_id="0-0")
+        assert await log.acquire_run("thread", next_run) is None
+
+        await log.release_run("thread", expired)
+
+        assert (await log.active_run("thread")).token == next_run.token
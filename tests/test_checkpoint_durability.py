@@ -0,0 +1,153 @@
+import copy
+from typing import Callable, TypedDict
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import Command, interrupt
+
+from agents.checkpointer import checkpoint_durability
+
+EVALUATIONS = 4
+
+
+class CountingSaver(InMemorySaver):
+    def __init__(self):
+        super().__init__()
+        self.puts = 0
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        self.puts += 1
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+
+class LoopState(TypedDict):
+    evaluations: int
+    answer: str
+
+
+def durable_copy(saver: InMemorySaver) -> InMemorySaver:
+    """
+    What the database holds at this moment, i.e. all a new worker finds
+    when the process dies here
+    """
+    durable = InMemorySaver()
+    durable.storage = copy.deepcopy(saver.storage)
+    durable.writes = copy.deepcopy(saver.writes)
+    durable.blobs = copy.deepcopy(saver.blobs)
+    return durable
+
+
+def build(crash_at: int = 0, on_crash: Callable[[], None] = None):
+    """
+    The evaluator and split loop of the validations graph ending in the
+    admin interrupt of finish, split fails on the ``crash_at`` evaluation
+    """
+    builder = StateGraph(LoopState)
+
+    async def evaluator(state):
+        return {"evaluations": state["evaluations"] + 1}
+
+    async def split(state):
+        if state["evaluations"] == crash_at:
+            on_crash()
+            raise ConnectionError("worker lost")
+        return {}
+
+    async def finish(state):
+        return {"answer": interrupt({"completed_matrix_validation": "Correct"})}
+
+    builder.add_node("evaluator", evaluator)
+    builder.add_node("split", split)
+    builder.add_node("finish", finish)
+    builder.add_edge(START, "evaluator")
+    builder.add_conditional_edges(
+        "evaluator",
+        lambda state: "split" if state["evaluations"] < EVALUATIONS else "finish",
+    )
+    builder.add_edge("split", "evaluator")
+    builder.add_edge("finish", END)
+    return builder
+
+
+async def crash(durability: str):
+    """
+    :return: checkpoints kept when the worker dies during the run and when
+        the run fails with an error
+    """
+    saver = CountingSaver()
+    crashed = []
+    graph = build(
+        crash_at=3, on_crash=lambda: crashed.append(durable_copy(saver))
+    ).compile(checkpointer=saver)
+    config = {"configurable": {"thread_id": durability}}
+    with pytest.raises(ConnectionError):
+        await graph.ainvoke({"evaluations": 0}, config, durability=durability)
+    died = await build().compile(checkpointer=crashed[0]).aget_state(config)
+    failed = await build().compile(checkpointer=saver).aget_state(config)
+    return died, failed
+
+
+class TestCheckpointDurability:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("durability", ["sync", "async", "exit"])
+    async def test_interrupt_and_end_are_durable(self, durability):
+        saver = CountingSaver()
+        graph = build().compile(checkpointer=saver)
+        config = {"configurable": {"thread_id": durability}}
+
+        await graph.ainvoke({"evaluations": 0}, config, durability=durability)
+
+        state = await graph.aget_state(config)
+        assert state.next == ("finish",)
+        assert state.values["evaluations"] == EVALUATIONS
+        response = await graph.ainvoke(
+            Command(resume="verified"), config, durability=durability
+        )
+        assert response["answer"] == "verified"
+        assert (await graph.aget_state(config)).next == ()
+
+    @pytest.mark.asyncio
+    async def test_exit_writes_a_fraction_of_the_checkpoints(self):
+        writes = {}
+        for durability in ["sync", "exit"]:
+            saver = CountingSaver()
+            graph = build().compile(checkpointer=saver)
+            config = {"configurable": {"thread_id": durability}}
+            await graph.ainvoke({"evaluations": 0}, config, durability=durability)
+            writes[durability] = saver.puts
+
+        assert writes["exit"] * 4 <= writes["sync"]
+
+    @pytest.mark.asyncio
+    async def test_sync_keeps_every_step(self):
+        died, failed = await crash("sync")
+
+        assert died.values["evaluations"] == 3
+        assert died.next == ("split",)
+        assert failed.next == ("split",)
+
+    @pytest.mark.asyncio
+    async def test_async_may_lose_the_last_step(self):
+        died, failed = await crash("async")
+
+        # the write of the last step may still be on its way
+        assert died.values["evaluations"] in (2, 3)
+        assert failed.values["evaluations"] == 3
+        assert failed.next == ("split",)
+
+    @pytest.mark.asyncio
+    async def test_exit_keeps_a_failed_run_but_not_a_dead_worker(self):
+        died, failed = await crash("exit")
+
+        # nothing of the run has been written, the answer is sent again
+        assert died.values == {}
+        # an error ending the run is an exit, its last step is kept
+        assert failed.values["evaluations"] == 3
+        assert failed.next == ("split",)
+
+    def test_durability_setting(self):
+        assert checkpoint_durability(None, "exit") == "exit"
+        assert checkpoint_durability("async", "exit") == "async"
+        with pytest.raises(ValueError):
+            checkpoint_durability("never", "exit")
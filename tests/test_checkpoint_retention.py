@@ -0,0 +1,179 @@
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, START, MessagesState, StateGraph
+from langgraph.types import Command, interrupt
+
+from agents.checkpoint_retention import (
+    ARCHIVED_METADATA_KEY,
+    CheckpointRetention,
+    InMemoryCheckpointTables,
+    LocalCheckpointArchive,
+)
+
+
+class ChatState(MessagesState):
+    answer: str
+
+
+def build() -> StateGraph:
+    builder = StateGraph(ChatState)
+
+    async def ask(state):
+        return {"messages": [("ai", "Which production incidents did you own? " * 5)]}
+
+    async def human(state):
+        value = interrupt({"answer_to_revisit": "Which grade?"})
+        return {"answer": value}
+
+    builder.add_node("ask", ask)
+    builder.add_node("human", human)
+    builder.add_edge(START, "ask")
+    builder.add_edge("ask", "human")
+    builder.add_edge("human", END)
+    return builder
+
+
+async def chat(graph, thread_id: str, turns: int) -> dict:
+    config = {"configurable": {"thread_id": thread_id}}
+    for turn in range(turns):
+        await graph.ainvoke({"messages": [("human", f"turn {turn}")]}, config)
+    return config
+
+
+class FailingTables(InMemoryCheckpointTables):
+    """
+    Tables of a database failing once while the thread is collapsed
+    """
+
+    def __init__(self, saver: InMemorySaver):
+        super().__init__(saver)
+        self.failures = 1
+
+    async def collapse(self, thread_id: str) -> int:
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("connection lost")
+        return await super().collapse(thread_id)
+
+
+async def checkpoint_count(saver: InMemorySaver, thread_id: str) -> int:
+    return len(
+        [_ async for _ in saver.alist({"configurable": {"thread_id": thread_id}})]
+    )
+
+
+class TestCheckpointRetention:
+    @pytest.mark.asyncio
+    async def test_live_threads_keep_their_latest_checkpoints(self, tmp_path):
+        saver = InMemorySaver()
+        graph = build().compile(checkpointer=saver)
+        config = await chat(graph, "live", turns=6)
+        state = await graph.aget_state(config)
+        retention = CheckpointRetention(saver, LocalCheckpointArchive(tmp_path), keep=3)
+
+        report = await retention.run([])
+
+        assert report.pruned_threads == 1
+        assert report.deleted_checkpoints > 0
+        assert report.reclaimed_bytes > 0
+        assert await checkpoint_count(saver, "live") == 3
+        pruned = await graph.aget_state(config)
+        assert pruned.values == state.values
+        assert pruned.next == ("human",)
+        # nothing is archived for the threads still running
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_finished_threads_are_archived_and_collapsed(self, tmp_path):
+        saver = InMemorySaver()
+        graph = build().compile(checkpointer=saver)
+        config = await chat(graph, "finished", turns=4)
+        history = [state async for state in graph.aget_state_history(config)]
+        archive = LocalCheckpointArchive(tmp_path)
+        retention = CheckpointRetention(saver, archive, keep=100)
+
+        report = await retention.run(["finished"])
+
+        assert report.collapsed_threads == 1
+        assert report.deleted_checkpoints == len(history) - 1
+        assert report.archived_bytes > 0
+        assert await checkpoint_count(saver, "finished") == 1
+        [collapsed] = [state async for state in graph.aget_state_history(config)]
+        assert collapsed.metadata[ARCHIVED_METADATA_KEY]
+        archived = await archive.read("finished")
+        assert [record["checkpoint_id"] for record in archived] == [
+            state.config["configurable"]["checkpoint_id"] for state in history
+        ]
+        assert archived[0]["values"]["messages"] == history[0].values["messages"]
+        # the interrupt of the final checkpoint survives the collapse
+        response = await graph.ainvoke(Command(resume="Senior"), config)
+        assert response["answer"] == "Senior"
+
+    @pytest.mark.asyncio
+    async def test_history_of_a_resumed_thread_is_appended(self, tmp_path):
+        saver = InMemorySaver()
+        graph = build().compile(checkpointer=saver)
+        config = await chat(graph, "resumed", turns=2)
+        archive = LocalCheckpointArchive(tmp_path)
+        retention = CheckpointRetention(saver, archive)
+        await retention.run(["resumed"])
+        first = await archive.read("resumed")
+
+        await chat(graph, "resumed", turns=2)
+        await retention.run(["resumed"])
+
+        archived = await archive.read("resumed")
+        history = [state async for state in graph.aget_state_history(config)]
+        assert len(history) == 1
+        assert len(archived) > len(first)
+        assert archived[-len(first) :] == first
+
+    @pytest.mark.asyncio
+    async def test_failed_collapse_keeps_the_thread(self, tmp_path):
+        saver = InMemorySaver()
+        graph = build().compile(checkpointer=saver)
+        config = await chat(graph, "failed", turns=3)
+        history = [state async for state in graph.aget_state_history(config)]
+        archive = LocalCheckpointArchive(tmp_path)
+        retention = CheckpointRetention(saver, archive, keep=100)
+        retention.tables = FailingTables(saver)
+
+        with pytest.raises(ConnectionError):
+            await retention.run(["failed"])
+
+        assert await checkpoint_count(saver, "failed") == len(history)
+        state = await graph.aget_state(config)
+        assert state.values == history[0].values
+        assert state.next == ("human",)
+
+        report = await retention.run(["failed"])
+
+        assert report.collapsed_threads == 1
+        assert report.deleted_checkpoints == len(history) - 1
+        # the retried run does not archive the history twice
+        assert len(await archive.read("failed")) == len(history)
+        response = await graph.ainvoke(Command(resume="Senior"), config)
+        assert response["answer"] == "Senior"
+
+    @pytest.mark.asyncio
+    async def test_every_namespace_keeps_its_latest_checkpoint(self, tmp_path):
+        saver = InMemorySaver()
+        child = build().compile()
+        builder = StateGraph(ChatState)
+        builder.add_node("chat", child)
+        builder.add_edge(START, "chat")
+        graph = builder.compile(checkpointer=saver)
+        config = await chat(graph, "nested", turns=3)
+        state = await graph.aget_state(config, subgraphs=True)
+        retention = CheckpointRetention(saver, LocalCheckpointArchive(tmp_path))
+
+        await retention.run(["nested"])
+
+        assert all(
+            len(checkpoints) == 1 for checkpoints in saver.storage["nested"].values()
+        )
+        assert len(saver.storage["nested"]) > 1
+        collapsed = await graph.aget_state(config, subgraphs=True)
+        assert collapsed.tasks[0].state.values == state.tasks[0].state.values
+        response = await graph.ainvoke(Command(resume="Senior"), config)
+        assert response["answer"] == "Senior"
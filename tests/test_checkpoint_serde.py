@@ -0,0 +1,83 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.graph import START, MessagesState, StateGraph
+
+from agents.checkpoint_serde import (
+    ZSTD_HEADER_MAGIC,
+    CheckpointFormatError,
+    CompressedSerializer,
+)
+
+
+def conversation(turns: int) -> list:
+    return [
+        message
+        for turn in range(turns)
+        for message in (
+            HumanMessage(content=f"I have been writing Java services for {turn} years"),
+            AIMessage(
+                content="Could you describe a production incident you owned? " * 5
+            ),
+        )
+    ]
+
+
+class TestCompressedSerializer:
+    def test_large_blobs_are_compressed_and_read_back(self):
+        serializer = CompressedSerializer(enabled=True, min_bytes=1024)
+        messages = conversation(20)
+
+        type_, data = serializer.dumps_typed(messages)
+
+        assert type_ == "msgpack+zstd"
+        assert data.startswith(ZSTD_HEADER_MAGIC)
+        assert len(data) * 3 < len(JsonPlusSerializer().dumps_typed(messages)[1])
+        assert serializer.loads_typed((type_, data)) == messages
+
+    def test_small_blobs_are_stored_like_the_default_serializer(self):
+        serializer = CompressedSerializer(enabled=True, min_bytes=1024)
+        value = {"id": 7}
+
+        blob = serializer.dumps_typed(value)
+
+        assert blob == JsonPlusSerializer().dumps_typed(value)
+        assert serializer.loads_typed(blob) == value
+        assert serializer.stats.compressed == 0
+
+    def test_checkpoints_of_the_default_serializer_stay_readable(self):
+        messages = conversation(20)
+        blob = JsonPlusSerializer().dumps_typed(messages)
+
+        assert CompressedSerializer(enabled=True).loads_typed(blob) == messages
+
+    def test_unknown_format_version_is_rejected(self):
+        serializer = CompressedSerializer(enabled=True, min_bytes=0)
+        type_, data = serializer.dumps_typed(conversation(20))
+        newer = ZSTD_HEADER_MAGIC + bytes([99]) + data[len(ZSTD_HEADER_MAGIC) + 1 :]
+
+        with pytest.raises(CheckpointFormatError):
+            serializer.loads_typed((type_, newer))
+        with pytest.raises(CheckpointFormatError):
+            serializer.loads_typed((type_, b"garbage"))
+
+    @pytest.mark.asyncio
+    async def test_graph_resumes_from_compressed_checkpoints(self):
+        serializer = CompressedSerializer(enabled=True, min_bytes=256)
+        builder = StateGraph(MessagesState)
+
+        async def answer(state):
+            return {"messages": [conversation(1)[1]]}
+
+        builder.add_node("answer", answer)
+        builder.add_edge(START, "answer")
+        graph = builder.compile(checkpointer=InMemorySaver(serde=serializer))
+        config = {"configurable": {"thread_id": "chat"}}
+
+        for turn in range(5):
+            await graph.ainvoke({"messages": [("human", f"turn {turn}")]}, config)
+
+        state = await graph.aget_state(config)
+        assert len(state.values["messages"]) == 10
+        assert serializer.stats.compressed > 0
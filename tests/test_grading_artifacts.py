@@ -0,0 +1,37 @@
+import pytest
+
+from db.models import MatrixSkillKnowledgeBase
+from service.grading_artifacts import GradingArtifactsStore, compute_source_hash
+
+
+class TestGradingArtifactsStore:
+    @pytest.mark.asyncio
+    async def test_find_stale_artifacts(self, test_session, test_skill):
+        knowledge_base = MatrixSkillKnowledgeBase(
+            skill_id=test_skill.id,
+            difficulty_level=1,
+            question="What is a deadlock?",
+            answer="Two threads waiting on each other's lock",
+            rules="Mention the circular wait",
+            question_type="input",
+            is_code_question=False,
+        )
+        test_session.add(knowledge_base)
+        await test_session.commit()
+        store = GradingArtifactsStore(test_session)
+
+        stale = await store.find_stale("1", "1", [knowledge_base.id])
+        assert [item.id for item in stale] == [knowledge_base.id]
+
+        await store.save(knowledge_base, "Observation: units", "1", "Be strict", "1")
+        assert await store.find_stale("1", "1", [knowledge_base.id]) == []
+        artifacts = await store.get(knowledge_base.id)
+        assert artifacts.source_hash == compute_source_hash(
+            knowledge_base.question, knowledge_base.answer, knowledge_base.rules
+        )
+        # a new prompt version or an edited question needs new artifacts
+        assert len(await store.find_stale("2", "1", [knowledge_base.id])) == 1
+        knowledge_base.rules = "Mention the circular wait and a fix"
+        test_session.add(knowledge_base)
+        await test_session.commit()
+        assert len(await store.find_stale("1", "1", [knowledge_base.id])) == 1
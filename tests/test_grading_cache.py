@@ -0,0 +1,77 @@
+import hashlib
+import math
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from agents.grading_cache import GradingCache, GradingVerdict
+from db.models import MatrixSkillKnowledgeBase
+
+
+class BagOfWordsEmbeddings(Embeddings):
+    """
+    Local embedding stand-in, words are hashed into the vector dimensions so
+    answers sharing most of their words are close to each other
+    """
+
+    size = 1536
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for word in text.split():
+            index = int(hashlib.md5(word.encode()).hexdigest(), 16) % self.size
+            vector[index] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+ANSWER = (
+    "A process owns its memory while threads share the memory of their process "
+    "so switching between threads is cheaper than switching between processes"
+)
+
+
+class TestGradingCache:
+    @pytest.mark.asyncio
+    async def test_similar_answer_reuses_verdict(
+        self, test_engine, test_session, test_skill
+    ):
+        knowledge_base = MatrixSkillKnowledgeBase(
+            skill_id=test_skill.id,
+            difficulty_level=1,
+            question="What is the difference between a process and a thread?",
+            answer="Threads share the memory of their process",
+            rules="",
+            question_type="input",
+            is_code_question=False,
+        )
+        test_session.add(knowledge_base)
+        await test_session.commit()
+        cache = GradingCache(
+            sessionmaker(test_engine, expire_on_commit=False, class_=AsyncSession),
+            BagOfWordsEmbeddings(),
+            threshold=0.9,
+        )
+        verdict = GradingVerdict(
+            final_grade="Correct", completeness=90, response="Completeness: 90%"
+        )
+
+        assert await cache.lookup(knowledge_base.id, ANSWER, "1") is None
+        await cache.store(knowledge_base.id, ANSWER, "1", verdict)
+
+        cached = await cache.lookup(
+            knowledge_base.id, "  " + ANSWER.upper() + " indeed", "1"
+        )
+        assert cached is not None
+        assert cached.final_grade == "Correct"
+        assert cached.completeness == 90
+        assert cached.similarity >= 0.9
+        assert await cache.lookup(knowledge_base.id, "No idea", "1") is None
+        # verdicts of another grading prompt version are not reused
+        assert await cache.lookup(knowledge_base.id, ANSWER, "2") is None
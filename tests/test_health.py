@@ -0,0 +1,25 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+class TestHealthRouter:
+    def test_get_checkpointer_health_unauthorized(self, test_client: TestClient):
+        response = test_client.get("/api/v1/health/checkpointer")
+        assert response.status_code == 401
+
+    def test_get_checkpointer_health_forbidden_non_admin(
+        self, test_client: TestClient, auth_headers
+    ):
+        response = test_client.get("/api/v1/health/checkpointer", headers=auth_headers)
+        assert response.status_code == 403
+
+    def test_get_checkpointer_health_success(
+        self, test_client: TestClient, admin_auth_headers, mock_admin_user
+    ):
+        response = test_client.get(
+            "/api/v1/health/checkpointer", headers=admin_auth_headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] in ["ok", "degraded", "disabled"]
+        assert data["connections_in_use"] >= 0
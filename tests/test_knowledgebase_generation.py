@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from db.models import KnowledgeBaseGenerationJob, MatrixSkillKnowledgeBase
+from service.knowledgebase_generation import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_RUNNING,
+    GeneratedQuestions,
+    KnowledgeBaseGenerationLedger,
+    KnowledgeBaseGenerator,
+)
+from utils.rate_limit import RateLimiter
+
+
+def generation_jobs(skill, levels: int):
+    return [
+        KnowledgeBaseGenerationJob(
+            skill_id=skill.id,
+            skill_name=skill.name,
+            difficulty_level=level,
+            min_level=1,
+            max_level=levels,
+            questions_requested=1,
+        )
+        for level in range(1, levels + 1)
+    ]
+
+
+class CountingHandler:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+
+    async def __call__(self, job: KnowledgeBaseGenerationJob) -> GeneratedQuestions:
+        self.calls.append(job.difficulty_level)
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise ValueError("malformed response")
+        return GeneratedQuestions(
+            questions=[
+                MatrixSkillKnowledgeBase(
+                    skill_id=job.skill_id,
+                    difficulty_level=job.difficulty_level,
+                    question=f"Question {job.difficulty_level}",
+                    answer="Answer",
+                    question_type="input",
+                    rules="Testing",
+                    is_code_question=False,
+                    created_at=datetime.now(),
+                    updated_at=datetime.now(),
+                )
+            ]
+        )
+
+
+def generator(test_engine, handler, **kwargs) -> KnowledgeBaseGenerator:
+    return KnowledgeBaseGenerator(
+        sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False),
+        handler,
+        limiter=RateLimiter(10000, 10000000),
+        concurrency=3,
+        max_attempts=1,
+        **kwargs,
+    )
+
+
+async def count_questions(test_session, skill) -> int:
+    result = await test_session.execute(
+        select(func.count()).where(MatrixSkillKnowledgeBase.skill_id == skill.id)
+    )
+    return result.scalar()
+
+
+class TestKnowledgeBaseGenerator:
+    @pytest.mark.asyncio
+    async def test_concurrent_runs_generate_every_job_once(
+        self, test_engine, test_session, test_skill
+    ):
+        run_id = await KnowledgeBaseGenerationLedger(test_session).create_run(
+            generation_jobs(test_skill, levels=8)
+        )
+        handler = CountingHandler()
+
+        finished = await asyncio.gather(
+            generator(test_engine, handler).run(run_id),
+            generator(test_engine, handler).run(run_id),
+        )
+
+        assert sum(finished) == 8
+        assert sorted(handler.calls) == list(range(1, 9))
+        assert await count_questions(test_session, test_skill) == 8
+
+    @pytest.mark.asyncio
+    async def test_only_expired_leases_are_claimed_again(
+        self, test_engine, test_session, test_skill
+    ):
+        ledger = KnowledgeBaseGenerationLedger(test_session)
+        run_id = await ledger.create_run(generation_jobs(test_skill, levels=2))
+        # both jobs are running, the worker of the first one died
+        for job_id, lease_expires_at in await self.claim_all(ledger, run_id):
+            await test_session.execute(
+                update(KnowledgeBaseGenerationJob)
+                .where(KnowledgeBaseGenerationJob.id == job_id)
+                .values(lease_expires_at=lease_expires_at)
+            )
+        await test_session.commit()
+        handler = CountingHandler()
+
+        assert await generator(test_engine, handler).run(run_id) == 1
+        assert handler.calls == [1]
+        statuses = await test_session.execute(
+            select(KnowledgeBaseGenerationJob.status)
+            .where(KnowledgeBaseGenerationJob.run_id == run_id)
+            .order_by(KnowledgeBaseGenerationJob.id)
+            .execution_options(populate_existing=True)
+        )
+        assert statuses.scalars().all() == [JOB_DONE, JOB_RUNNING]
+
+    @staticmethod
+    async def claim_all(ledger, run_id):
+        first = await ledger.claim_next_job(run_id, datetime.now())
+        second = await ledger.claim_next_job(run_id, datetime.now())
+        assert await ledger.claim_next_job(run_id, datetime.now()) is None
+        return [
+            (first.id, datetime.now() - timedelta(minutes=1)),
+            (second.id, datetime.now() + timedelta(minutes=5)),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_failed_jobs_are_retried_by_the_next_runs_until_the_bound(
+        self, test_engine, test_session, test_skill
+    ):
+        ledger = KnowledgeBaseGenerationLedger(test_session, max_job_attempts=2)
+        run_id = await ledger.create_run(generation_jobs(test_skill, levels=1))
+        handler = CountingHandler(fail=True)
+
+        for _ in range(3):
+            await generator(test_engine, handler, max_job_attempts=2).run(run_id)
+
+        # a failing job is not retried within the run that failed it
+        assert handler.calls == [1, 1]
+        job = (
+            await test_session.execute(
+                select(KnowledgeBaseGenerationJob)
+                .where(KnowledgeBaseGenerationJob.run_id == run_id)
+                .execution_options(populate_existing=True)
+            )
+        ).scalar_one()
+        assert job.status == JOB_FAILED
+        assert job.attempts == 2
+        assert await ledger.get_unfinished_run() != run_id
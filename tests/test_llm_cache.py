@@ -0,0 +1,82 @@
+from typing import TypedDict
+
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import RetryPolicy
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from agents.llm_cache import LLMResponseCache
+from agents.validations_agent import LLMFormatError
+
+
+class GradingState(TypedDict):
+    answer: str
+
+
+class TestLLMResponseCache:
+    @pytest.mark.asyncio
+    async def test_repeated_call_is_answered_from_memory(self):
+        cache = LLMResponseCache(memory_size=1)
+        model = FakeListChatModel(responses=["first", "second"], cache=cache)
+
+        assert (await model.ainvoke("question")).content == "first"
+        assert (await model.ainvoke("question")).content == "first"
+        assert (await model.ainvoke("other question")).content == "second"
+        # the single memory slot now holds the other question
+        assert (await model.ainvoke("question")).content == "first"
+        assert cache.stats.memory_hits == 1
+        assert cache.stats.misses == 3
+
+    @pytest.mark.asyncio
+    async def test_repeated_call_is_answered_from_database(self, test_engine):
+        session_factory = sessionmaker(
+            test_engine, expire_on_commit=False, class_=AsyncSession
+        )
+        model = FakeListChatModel(
+            responses=["first", "second"],
+            cache=LLMResponseCache(session_factory=session_factory),
+        )
+        assert (await model.ainvoke("persisted question")).content == "first"
+
+        cache = LLMResponseCache(session_factory=session_factory)
+        model = FakeListChatModel(responses=["first", "second"], cache=cache)
+        assert (await model.ainvoke("persisted question")).content == "first"
+        assert cache.stats.persistent_hits == 1
+        await cache.aclear()
+
+    @pytest.mark.asyncio
+    async def test_unparsable_answer_is_not_replayed_on_retry(self):
+        cache = LLMResponseCache()
+        model = FakeListChatModel(
+            responses=["no markers at all", "Final Answer: Correct"], cache=cache
+        )
+        attempts = []
+
+        async def evaluator(state):
+            response = await model.ainvoke("grade the answer")
+            attempts.append(response.content)
+            if "Final Answer: " not in response.content:
+                await cache.ainvalidate(response)
+                raise LLMFormatError("Not correct response format")
+            return {"answer": response.content}
+
+        builder = StateGraph(GradingState)
+        builder.add_node(
+            "evaluator",
+            evaluator,
+            retry_policy=RetryPolicy(max_attempts=2, initial_interval=0),
+        )
+        builder.add_edge(START, "evaluator")
+        builder.add_edge("evaluator", END)
+
+        response = await builder.compile().ainvoke({"answer": ""})
+
+        assert response["answer"] == "Final Answer: Correct"
+        assert attempts == ["no markers at all", "Final Answer: Correct"]
+        # the parsed answer stays cached
+        assert (await model.ainvoke("grade the answer")).content == (
+            "Final Answer: Correct"
+        )
+        assert cache.stats.memory_hits == 1
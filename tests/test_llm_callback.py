@@ -0,0 +1,88 @@
+from typing import Tuple
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import StatusCode
+
+from agents.llm_callback import LlmTelemetryCallback, truncate
+
+
+class FailingChatModel(GenericFakeChatModel):
+    async def _astream(self, *args, **kwargs):
+        raise TimeoutError("model timed out")
+        yield
+
+
+def tracing(sample_rate: float) -> Tuple[LlmTelemetryCallback, InMemorySpanExporter]:
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    callback = LlmTelemetryCallback(
+        "test", sample_rate=sample_rate, tracer=provider.get_tracer(__name__)
+    )
+    return callback, exporter
+
+
+def answer_model(callback: LlmTelemetryCallback) -> GenericFakeChatModel:
+    message = AIMessage(
+        content="a streamed answer",
+        response_metadata={"model_name": "gpt-4o-mini"},
+        usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15},
+    )
+    return GenericFakeChatModel(messages=iter([message]), callbacks=[callback])
+
+
+class TestLlmTelemetryCallback:
+    @pytest.mark.asyncio
+    async def test_span_has_primitive_attributes_and_no_payload(self):
+        callback, exporter = tracing(sample_rate=0)
+        model = answer_model(callback)
+
+        async for _ in model.astream(
+            "question", config={"metadata": {"langgraph_node": "evaluator"}}
+        ):
+            pass
+
+        [span] = exporter.get_finished_spans()
+        assert span.name == "llm evaluator"
+        assert span.attributes["node"] == "evaluator"
+        assert span.attributes["llm.time_to_first_token"] >= 0
+        assert "llm.prompt" not in span.attributes
+        assert "llm.completion" not in span.attributes
+
+    @pytest.mark.asyncio
+    async def test_sampled_payload_is_captured(self):
+        callback, exporter = tracing(sample_rate=1)
+        model = answer_model(callback)
+
+        await model.ainvoke("question")
+
+        [span] = exporter.get_finished_spans()
+        assert span.attributes["llm.prompt"] == "question"
+        assert span.attributes["llm.completion"] == "a streamed answer"
+        assert span.attributes["llm.usage.prompt_tokens"] == 12
+        assert span.attributes["llm.response.model"] == "gpt-4o-mini"
+        assert span.attributes["node"] == "test"
+
+    @pytest.mark.asyncio
+    async def test_error_marks_the_span(self):
+        callback, exporter = tracing(sample_rate=0)
+        model = FailingChatModel(messages=iter([]), callbacks=[callback])
+
+        with pytest.raises(TimeoutError):
+            async for _ in model.astream("question"):
+                pass
+
+        [span] = exporter.get_finished_spans()
+        assert span.status.status_code == StatusCode.ERROR
+        assert span.attributes["error.type"] == "TimeoutError"
+
+    def test_truncate(self):
+        assert truncate("abcdef", 4) == "abcd... [2 more]"
+        assert truncate("abc", 4) == "abc"
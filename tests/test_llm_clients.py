@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from agents.llm_clients import LLM_HTTP2, close_llm_clients, get_chat_model
+
+
+async def create_chat_model():
+    return get_chat_model("gpt-4o-mini", temperature=0)
+
+
+class TestChatModelPool:
+    @pytest.mark.asyncio
+    async def test_equal_keys_share_the_model_and_the_http_client(self):
+        chat_model = get_chat_model("gpt-4o-mini", temperature=0, stop=["\n"])
+
+        same = get_chat_model("gpt-4o-mini", temperature=0, stop=["\n"])
+        other = get_chat_model("gpt-4o-mini", temperature=0.7, stop=["\n"])
+
+        assert same is chat_model
+        assert other is not chat_model
+        assert other.http_async_client is chat_model.http_async_client
+        # the pooled connections multiplex the calls over http/2
+        assert LLM_HTTP2 is True
+        assert chat_model.http_async_client._transport._pool._http2 is True
+        await close_llm_clients()
+
+    def test_new_event_loop_gets_a_new_http_client(self):
+        first = asyncio.run(create_chat_model())
+        second = asyncio.run(create_chat_model())
+
+        assert second is not first
+        assert second.http_async_client is not first.http_async_client
+        assert first.model_name == second.model_name == "gpt-4o-mini"
+
+    @pytest.mark.asyncio
+    async def test_closed_client_is_replaced(self):
+        chat_model = get_chat_model("gpt-4o-mini")
+        await close_llm_clients()
+
+        reopened = get_chat_model("gpt-4o-mini")
+
+        assert chat_model.http_async_client.is_closed
+        assert reopened is not chat_model
+        assert not reopened.http_async_client.is_closed
+        await close_llm_clients()
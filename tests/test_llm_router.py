@@ -0,0 +1,174 @@
+import asyncio
+import uuid
+from typing import Any, List, Optional
+
+import httpx
+import openai
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from agents.llm_router import (
+    BREAKER_CLOSED,
+    BREAKER_HALF_OPEN,
+    BREAKER_OPEN,
+    CircuitBreaker,
+    RoutedChatModel,
+    get_model_health,
+)
+
+
+class ScriptedChatModel(BaseChatModel):
+    answer: str
+    delay: float = 0
+    error: Optional[Exception] = None
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, **kwargs: Any):
+        raise NotImplementedError
+
+    async def _agenerate(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.answer))]
+        )
+
+
+def names(count: int) -> List[str]:
+    # the model health is process wide, every test routes to its own models
+    prefix = uuid.uuid4().hex
+    return [f"{prefix}-{index}" for index in range(count)]
+
+
+def status_error(status_code: int) -> openai.APIStatusError:
+    request = httpx.Request("POST", "http://llm/chat/completions")
+    response = httpx.Response(status_code, request=request)
+    return openai.APIStatusError("failed", response=response, body=None)
+
+
+class TestCircuitBreaker:
+    def test_opens_on_error_rate_and_closes_after_trial(self):
+        breaker = CircuitBreaker(window=4, min_calls=4, error_rate=0.5, cooldown=0)
+        breaker.record(True)
+        breaker.record(True)
+        breaker.record(False)
+
+        assert breaker.record(False) == BREAKER_OPEN
+        assert breaker.state == BREAKER_HALF_OPEN
+        permit = breaker.allow()
+        assert permit == BREAKER_HALF_OPEN
+        # a single trial at a time
+        assert not breaker.allow()
+        # calls that do not hold the trial leave it running
+        assert breaker.record(True) is None
+        breaker.release(BREAKER_CLOSED)
+        assert not breaker.allow()
+        assert breaker.record(True, permit) == BREAKER_CLOSED
+        assert breaker.state == BREAKER_CLOSED
+
+    def test_stays_open_during_cooldown(self):
+        breaker = CircuitBreaker(window=2, min_calls=2, error_rate=0.5, cooldown=60)
+        breaker.record(False)
+        breaker.record(False)
+
+        assert breaker.state == BREAKER_OPEN
+        assert not breaker.allow()
+
+
+class TestRoutedChatModel:
+    @pytest.mark.asyncio
+    async def test_falls_back_on_server_error(self):
+        primary = ScriptedChatModel(answer="primary", error=status_error(503))
+        fallback = ScriptedChatModel(answer="fallback")
+        model = RoutedChatModel(models=[primary, fallback], model_names=names(2))
+
+        response = await model.ainvoke("question")
+
+        assert response.content == "fallback"
+        assert get_model_health(model.model_names[0]).errors == 1
+
+    @pytest.mark.asyncio
+    async def test_client_error_is_not_retried(self):
+        primary = ScriptedChatModel(answer="primary", error=status_error(400))
+        fallback = ScriptedChatModel(answer="fallback")
+        model = RoutedChatModel(models=[primary, fallback], model_names=names(2))
+
+        with pytest.raises(openai.APIStatusError):
+            await model.ainvoke("question")
+        assert fallback.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_timeout_falls_back(self):
+        primary = ScriptedChatModel(answer="primary", delay=1)
+        fallback = ScriptedChatModel(answer="fallback")
+        model = RoutedChatModel(
+            models=[primary, fallback], model_names=names(2), timeout=0.01
+        )
+
+        assert (await model.ainvoke("question")).content == "fallback"
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_skips_model(self):
+        primary = ScriptedChatModel(answer="primary")
+        fallback = ScriptedChatModel(answer="fallback")
+        model = RoutedChatModel(models=[primary, fallback], model_names=names(2))
+        breaker = get_model_health(model.model_names[0]).breaker
+        breaker.cooldown = 60
+        for _ in range(breaker.min_calls):
+            breaker.record(False)
+
+        assert (await model.ainvoke("question")).content == "fallback"
+        assert primary.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_hedge_answers_when_primary_is_slow(self):
+        primary = ScriptedChatModel(answer="primary", delay=1)
+        fallback = ScriptedChatModel(answer="fallback")
+        model = RoutedChatModel(
+            models=[primary, fallback],
+            model_names=names(2),
+            hedging=True,
+            hedge_min_samples=1,
+            hedge_min_delay=0.01,
+        )
+        primary_health = get_model_health(model.model_names[0])
+        primary_health.latencies.append(0.01)
+
+        assert (await model.ainvoke("question")).content == "fallback"
+        assert get_model_health(model.model_names[1]).hedge_wins == 1
+        # the cancelled primary call is neither a success nor an error
+        assert primary_health.errors == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_call_keeps_the_trial_it_does_not_hold(self):
+        primary = ScriptedChatModel(answer="primary", delay=1)
+        fallback = ScriptedChatModel(answer="fallback")
+        model = RoutedChatModel(models=[primary, fallback], model_names=names(2))
+        breakers = [get_model_health(name).breaker for name in model.model_names]
+        for breaker, cooldown in zip(breakers, [0, 60]):
+            breaker.cooldown = cooldown
+            for _ in range(breaker.min_calls):
+                breaker.record(False)
+        # the trial of the primary is running for another request
+        assert breakers[0].allow() == BREAKER_HALF_OPEN
+
+        # with every breaker open the primary is called without the trial
+        call = asyncio.create_task(model.ainvoke("question"))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+        assert primary.calls == 1
+        assert breakers[0].trial_in_flight
+        assert not breakers[0].allow()
@@ -0,0 +1,206 @@
+import asyncio
+import uuid
+from typing import Any, List
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult, LLMResult
+
+from agents.llm_cache import mark_cache_hit
+from agents.llm_usage import (
+    LLMUsageRecord,
+    LLMUsageTracker,
+    LLMUsageWriter,
+    compute_cost,
+    completion_usage_record,
+    usage_tags,
+)
+
+
+class UsageChatModel(BaseChatModel):
+    @property
+    def _llm_type(self) -> str:
+        return "usage"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, **kwargs: Any):
+        raise NotImplementedError
+
+    async def _agenerate(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        message = AIMessage(
+            content="answer",
+            response_metadata={"model_name": "gpt-4o-mini-2024-07-18"},
+            usage_metadata={
+                "input_tokens": 1000,
+                "output_tokens": 100,
+                "total_tokens": 1100,
+                "input_token_details": {"cache_read": 400},
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class RecordingWriter(LLMUsageWriter):
+    def __init__(self):
+        super().__init__()
+        self.records: List[LLMUsageRecord] = []
+
+    def record(self, record: LLMUsageRecord) -> None:
+        self.records.append(record)
+
+
+class FakeSession:
+    def __init__(self, inserted: list, fail: bool):
+        self.inserted = inserted
+        self.fail = fail
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, statement, rows):
+        if self.fail:
+            raise ConnectionError("database is down")
+        self.inserted.extend(rows)
+
+    async def commit(self):
+        pass
+
+
+def usage_record() -> LLMUsageRecord:
+    return LLMUsageRecord(
+        model="gpt-4o",
+        prompt_tokens=10,
+        completion_tokens=5,
+        cached_tokens=0,
+        cost_usd=0.0001,
+        latency_ms=20,
+        cache_hit=False,
+    )
+
+
+class TestComputeCost:
+    def test_cached_tokens_are_billed_at_the_cached_price(self):
+        cost = compute_cost("gpt-4o-mini", 1_000_000, 1_000_000, cached_tokens=500_000)
+
+        assert cost == pytest.approx(0.5 * 0.15 + 0.5 * 0.075 + 0.60)
+
+    def test_litellm_names_match_the_longest_model(self):
+        assert compute_cost("openai/gpt-4o-mini-2024-07-18", 1_000_000, 0) == 0.15
+        assert compute_cost("openai/gpt-4o-2024-08-06", 1_000_000, 0) == 2.50
+
+    def test_unknown_model_costs_nothing(self):
+        assert compute_cost("mistral-large", 1_000_000, 1_000_000) == 0.0
+
+    def test_batch_result_is_billed_at_the_batch_price(self):
+        body = {
+            "model": "gpt-4o-mini",
+            "usage": {"prompt_tokens": 1_000_000, "completion_tokens": 0},
+        }
+
+        record = completion_usage_record(
+            body, usage_tags("knowledge_base", skill_id=3), price_ratio=0.5
+        )
+
+        assert record.cost_usd == pytest.approx(0.075)
+        assert (record.graph, record.skill_id) == ("knowledge_base", 3)
+
+
+class TestLLMUsageTracker:
+    @pytest.mark.asyncio
+    async def test_call_is_recorded_with_its_tags(self):
+        writer = RecordingWriter()
+        model = UsageChatModel(callbacks=[LLMUsageTracker(writer)])
+        config = {
+            "metadata": usage_tags(
+                "matrix_validation", "thread", 7, 3, validation_id=11, node="evaluator"
+            )
+        }
+
+        await model.ainvoke("question", config=config)
+
+        [record] = writer.records
+        assert (record.prompt_tokens, record.completion_tokens) == (1000, 100)
+        assert record.cached_tokens == 400
+        assert record.model == "gpt-4o-mini-2024-07-18"
+        assert record.cost_usd == pytest.approx(
+            compute_cost("gpt-4o-mini", 1000, 100, cached_tokens=400)
+        )
+        assert (record.graph, record.node, record.thread_id) == (
+            "matrix_validation",
+            "evaluator",
+            "thread",
+        )
+        assert (record.user_id, record.skill_id, record.validation_id) == (7, 3, 11)
+
+    def test_cache_hit_costs_nothing(self):
+        writer = RecordingWriter()
+        tracker = LLMUsageTracker(writer)
+        generations = mark_cache_hit(
+            [
+                ChatGeneration(
+                    message=AIMessage(
+                        content="answer",
+                        usage_metadata={
+                            "input_tokens": 10,
+                            "output_tokens": 5,
+                            "total_tokens": 15,
+                        },
+                    )
+                )
+            ]
+        )
+        run_id = uuid.uuid4()
+        tracker.on_chat_model_start(
+            {}, [], run_id=run_id, metadata={"ls_model_name": "gpt-4o"}
+        )
+        tracker.on_llm_end(LLMResult(generations=[generations]), run_id=run_id)
+
+        [record] = writer.records
+        assert record.cache_hit
+        assert record.cost_usd == 0.0
+        assert record.prompt_tokens == 10
+
+
+class TestLLMUsageWriter:
+    @pytest.mark.asyncio
+    async def test_full_batch_is_flushed(self):
+        inserted = []
+        writer = LLMUsageWriter(
+            session_factory=lambda: FakeSession(inserted, fail=False),
+            batch_size=2,
+            flush_interval=60,
+        )
+
+        for _ in range(2):
+            writer.record(usage_record())
+        await asyncio.sleep(0)
+
+        assert len(inserted) == 2
+        writer.record(usage_record())
+        assert writer.pending == 1
+        await writer.close()
+        assert len(inserted) == 3
+        assert writer.pending == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_the_records(self):
+        inserted = []
+        session = FakeSession(inserted, fail=True)
+        writer = LLMUsageWriter(
+            session_factory=lambda: session,
+            flush_interval=60,
+            max_buffer=2,
+        )
+        for _ in range(3):
+            writer.record(usage_record())
+
+        assert await writer.flush() == 0
+        assert writer.pending == 2
+        session.fail = False
+        await writer.close()
+        assert len(inserted) == 2
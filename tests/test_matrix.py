@@ -1,6 +1,24 @@
+from contextlib import contextmanager
+
 import pytest
 from fastapi.testclient import TestClient
-from db.models import UserSkills
+from sqlalchemy import event
+from db.models import Skill, UserSkills
+from service.service import BaseService
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
 
 
 class TestMatrixRouter:
@@ -89,3 +107,85 @@ class TestMatrixRouter:
         )
         assert response.status_code == 200
         assert response.json() is True
+
+
+class TestMatrixEagerLoading:
+    @pytest.mark.asyncio
+    async def test_page_of_twenty_rows_is_a_single_query(
+        self,
+        test_client: TestClient,
+        auth_headers,
+        mock_current_user,
+        test_user,
+        test_grade,
+        test_engine,
+        test_session,
+    ):
+        skills = [
+            Skill(name=f"Skill {index}", description="Eager loading")
+            for index in range(20)
+        ]
+        test_session.add_all(skills)
+        await test_session.flush()
+        test_session.add_all(
+            [
+                UserSkills(
+                    user_id=test_user.id, skill_id=skill.id, grade_id=test_grade.id
+                )
+                for skill in skills
+            ]
+        )
+        user_id = test_user.id
+        await test_session.commit()
+        test_session.expunge_all()
+
+        with count_statements(test_engine) as statements:
+            response = test_client.get(
+                f"/api/v1/users/{user_id}/matrix?limit=20", headers=auth_headers
+            )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) == 20
+        assert all(row["skill"]["name"].startswith("Skill") for row in data)
+        assert len(statements) == 1
+
+    @pytest.mark.asyncio
+    async def test_nested_relationship_is_loaded_with_the_rows(
+        self, test_engine, test_session, test_user, test_grade
+    ):
+        parent = Skill(name="Backend", description="Parent skill")
+        test_session.add(parent)
+        await test_session.flush()
+        child = Skill(name="Java", description="Child skill", parent_id=parent.id)
+        test_session.add(child)
+        await test_session.flush()
+        test_session.add(
+            UserSkills(user_id=test_user.id, skill_id=child.id, grade_id=test_grade.id)
+        )
+        user_id = test_user.id
+        await test_session.commit()
+        test_session.expunge_all()
+        service = BaseService(UserSkills, test_session)
+
+        with count_statements(test_engine) as statements:
+            [user_skill] = await service.list_all(
+                filters={"user_id": user_id}, load=["skill.parent"]
+            )
+            skill = await user_skill.awaitable_attrs.skill
+            skill_parent = await skill.awaitable_attrs.parent
+
+        assert skill.name == "Java"
+        assert skill_parent.name == "Backend"
+        assert len(statements) == 1
+
+    @pytest.mark.asyncio
+    async def test_unknown_relationship_is_rejected(self, test_session):
+        service = BaseService(UserSkills, test_session)
+
+        with pytest.raises(
+            ValueError, match="Unknown relationship parent on UserSkills"
+        ):
+            await service.list_all(load=["parent"])
+        with pytest.raises(ValueError, match="Unknown relationship owner on Skill"):
+            await service.get(1, load=["skill.owner"])
@@ -1,6 +1,9 @@
 import pytest
 import uuid
 from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from agents.reasoner import TokenStream
 from db.models import MatrixChat
 
 
@@ -100,3 +103,50 @@ class TestMatrixChatsRouter:
             f"/api/v1/matrix-chats/{chat.id}", json=message_data, headers=auth_headers
         )
         assert response.status_code == 403
+
+
+class TestTokenStream:
+    MODEL_METADATA = {"langgraph_node": "reasoner", "ls_provider": "openai"}
+
+    def feed_chunks(self, stream: TokenStream, namespace, content: str, metadata):
+        tokens = []
+        for index in range(0, len(content), 5):
+            token = stream.feed(
+                namespace,
+                AIMessageChunk(content=content[index : index + 5], id="run-1"),
+                metadata,
+            )
+            if token is not None:
+                tokens.append(token)
+        return tokens
+
+    def test_only_user_message_of_json_answer_is_streamed(self):
+        content = (
+            '```json\n{"final_class": "Senior", "final_class_id": 3, '
+            '"message_to_the_user": "Thank you, you are a senior!"}\n```'
+        )
+        tokens = self.feed_chunks(TokenStream(), (), content, self.MODEL_METADATA)
+
+        assert {node for node, _ in tokens} == {"reasoner"}
+        assert "".join(token for _, token in tokens) == "Thank you, you are a senior!"
+
+    def test_guidance_agent_tokens_are_streamed_for_answer_classifier(self):
+        metadata = {"langgraph_node": "agent", "ls_provider": "openai"}
+        tokens = self.feed_chunks(
+            TokenStream(),
+            ("answer_classifier:1234",),
+            '{"has_user_answered": true, "message": "Noted"}',
+            metadata,
+        )
+
+        assert tokens[-1][0] == "answer_classifier"
+        assert "".join(token for _, token in tokens) == "Noted"
+
+    def test_other_nodes_and_node_outputs_are_not_streamed(self):
+        stream = TokenStream()
+        message = AIMessage(content='{"message_to_the_user": "Hi"}', id="run-2")
+
+        assert stream.feed(("deeply_classify:1",), message, self.MODEL_METADATA) is None
+        assert stream.feed((), message, {"langgraph_node": "reasoner"}) is None
+        # a cached response arrives as a single message
+        assert stream.feed((), message, self.MODEL_METADATA) == ("reasoner", "Hi")
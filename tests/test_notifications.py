@@ -36,6 +36,56 @@ class TestNotificationsRouter:
         data = response.json()
         assert isinstance(data, list)
 
+    @pytest.mark.asyncio
+    async def test_list_notifications_cursor_pagination(
+        self,
+        test_client: TestClient,
+        auth_headers,
+        mock_current_user,
+        test_user,
+        test_session,
+    ):
+        for index in range(3):
+            notification = Notification(
+                notification_type="TEST",
+                message=f"Test notification {index}",
+                user_id=test_user.id,
+                status="UNREAD",
+                chat_uuid=uuid.uuid4(),
+                user_group="USER",
+            )
+            test_session.add(notification)
+        await test_session.commit()
+
+        first_page = test_client.get(
+            f"/api/v1/users/{test_user.id}/notifications?limit=2",
+            headers=auth_headers,
+        )
+        assert first_page.status_code == 200
+        assert len(first_page.json()) == 2
+        next_cursor = first_page.headers["X-Next-Cursor"]
+
+        second_page = test_client.get(
+            f"/api/v1/users/{test_user.id}/notifications",
+            params={"limit": 2, "cursor": next_cursor},
+            headers=auth_headers,
+        )
+        assert second_page.status_code == 200
+        first_ids = {item["id"] for item in first_page.json()}
+        second_ids = {item["id"] for item in second_page.json()}
+        assert len(second_ids) >= 1
+        assert first_ids.isdisjoint(second_ids)
+
+    def test_list_notifications_invalid_cursor(
+        self, test_client: TestClient, auth_headers, mock_current_user, test_user
+    ):
+        response = test_client.get(
+            f"/api/v1/users/{test_user.id}/notifications",
+            params={"cursor": "not-a-cursor"},
+            headers=auth_headers,
+        )
+        assert response.status_code == 400
+
     @pytest.mark.asyncio
     async def test_mark_notification_success(
         self,
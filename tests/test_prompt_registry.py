@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+import pytest
+
+import agents.prompt_registry as prompt_registry_module
+from agents.prompt_registry import PromptRegistry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class Registry:
+    """
+    Stand-in of the Langtrace registry returning a new version on every
+    fetch, a fetch blocks until it is released
+    """
+
+    def __init__(self):
+        self.fetches = 0
+        self.failing = False
+        self.released = threading.Event()
+        self.released.set()
+
+    def __call__(self, prompt_id, options=None):
+        self.released.wait(timeout=5)
+        self.fetches += 1
+        if self.failing:
+            raise ConnectionError("registry unavailable")
+        return {"value": f"{prompt_id} v{self.fetches}"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prompt_registry_module.time, "time", clock.time)
+    return clock
+
+
+async def settle() -> None:
+    """
+    Lets the background refreshes finish
+    """
+    await asyncio.sleep(0.1)
+
+
+class TestPromptRegistry:
+    @pytest.mark.asyncio
+    async def test_fresh_prompt_is_served_from_the_cache(self, clock):
+        fetcher = Registry()
+        registry = PromptRegistry(
+            ttl=60, max_stale=600, redis_url=None, fetcher=fetcher
+        )
+
+        assert (await registry.get("grading"))["value"] == "grading v1"
+        clock.now += 59
+        assert (await registry.get("grading"))["value"] == "grading v1"
+        assert fetcher.fetches == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_prompt_is_served_stale_and_refreshed_once(self, clock):
+        fetcher = Registry()
+        registry = PromptRegistry(
+            ttl=60, max_stale=600, redis_url=None, fetcher=fetcher
+        )
+        await registry.get("grading")
+        clock.now += 61
+        fetcher.released.clear()
+
+        # every caller gets the stale prompt while a single refresh runs
+        prompts = await asyncio.gather(*[registry.get("grading") for _ in range(5)])
+        fetcher.released.set()
+        await settle()
+
+        assert [prompt["value"] for prompt in prompts] == ["grading v1"] * 5
+        assert fetcher.fetches == 2
+        assert (await registry.get("grading"))["value"] == "grading v2"
+        assert fetcher.fetches == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_refresh_keeps_the_stale_prompt(self, clock):
+        fetcher = Registry()
+        registry = PromptRegistry(
+            ttl=60, max_stale=600, redis_url=None, fetcher=fetcher
+        )
+        await registry.get("grading")
+        clock.now += 61
+        fetcher.failing = True
+
+        assert (await registry.get("grading"))["value"] == "grading v1"
+        await settle()
+        # the next call tries again and still gets the stale prompt
+        assert (await registry.get("grading"))["value"] == "grading v1"
+        await settle()
+
+        assert fetcher.fetches == 3
+
+    @pytest.mark.asyncio
+    async def test_prompt_past_max_stale_is_fetched_again(self, clock):
+        fetcher = Registry()
+        registry = PromptRegistry(
+            ttl=60, max_stale=600, redis_url=None, fetcher=fetcher
+        )
+        await registry.get("grading")
+        clock.now += 601
+        fetcher.failing = True
+
+        with pytest.raises(ConnectionError):
+            await registry.get("grading")
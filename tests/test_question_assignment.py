@@ -0,0 +1,195 @@
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import (
+    Grade,
+    MatrixSkillKnowledgeBase,
+    QuestionAssignmentState,
+    UserSkills,
+    UserValidationQuestions,
+)
+from service.question_assignment import (
+    ASSIGNMENT_STATE_NAME,
+    UserValidationQuestionsAssigner,
+)
+
+
+def knowledge_base_questions(skill, difficulty_level: int, count: int):
+    return [
+        MatrixSkillKnowledgeBase(
+            skill_id=skill.id,
+            difficulty_level=difficulty_level,
+            question=f"Question {difficulty_level}.{index}",
+            answer="Answer",
+            rules="Testing",
+            question_type="input",
+            is_code_question=False,
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+        )
+        for index in range(count)
+    ]
+
+
+async def assigned_questions(session: AsyncSession, user, skill) -> int:
+    result = await session.execute(
+        select(func.count()).where(
+            UserValidationQuestions.user_id == user.id,
+            UserValidationQuestions.skill_id == skill.id,
+        )
+    )
+    return result.scalar()
+
+
+async def get_state(session: AsyncSession) -> QuestionAssignmentState:
+    result = await session.execute(
+        select(QuestionAssignmentState)
+        .where(QuestionAssignmentState.name == ASSIGNMENT_STATE_NAME)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one()
+
+
+@pytest.fixture
+async def user_skill(test_session, test_user, test_skill, test_grade):
+    user_skill = UserSkills(
+        user_id=test_user.id, skill_id=test_skill.id, grade_id=test_grade.id
+    )
+    test_session.add(user_skill)
+    test_session.add_all(
+        knowledge_base_questions(test_skill, test_grade.value, count=2)
+    )
+    await test_session.commit()
+    await test_session.refresh(user_skill)
+    return user_skill
+
+
+class TestIncrementalAssignment:
+    @pytest.mark.asyncio
+    async def test_watermark_advances_only_on_success(
+        self, test_session, test_user, test_skill, test_grade, user_skill
+    ):
+        assigner = UserValidationQuestionsAssigner(test_session)
+        await assigner.run(full=True)
+        watermark = (await get_state(test_session)).knowledgebase_watermark
+        test_session.add_all(
+            knowledge_base_questions(test_skill, test_grade.value, count=1)
+        )
+        await test_session.commit()
+
+        async def fail(since):
+            raise ConnectionError("connection lost")
+
+        failing = UserValidationQuestionsAssigner(test_session)
+        failing._insert = fail
+        with pytest.raises(ConnectionError):
+            await failing.run(full=False)
+        await test_session.rollback()
+
+        assert (await get_state(test_session)).knowledgebase_watermark == watermark
+
+        report = await assigner.run(full=False)
+
+        assert report.total_rows >= 1
+        assert (await get_state(test_session)).knowledgebase_watermark > watermark
+        assert await assigned_questions(test_session, test_user, test_skill) == 3
+
+    @pytest.mark.asyncio
+    async def test_second_run_skips_while_the_lock_is_held(
+        self, test_engine, test_session, test_user, test_skill, user_skill
+    ):
+        assigner = UserValidationQuestionsAssigner(test_session)
+        async with AsyncSession(test_engine) as other:
+            # the run of an overlapping beat tick
+            await other.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext(:name))"),
+                {"name": ASSIGNMENT_STATE_NAME},
+            )
+
+            report = await assigner.run(full=True)
+
+            assert report.total_rows == 0
+            assert await assigned_questions(test_session, test_user, test_skill) == 0
+            await other.commit()
+
+        report = await assigner.run(full=True)
+
+        assert report.total_rows >= 2
+        assert await assigned_questions(test_session, test_user, test_skill) == 2
+
+    @pytest.mark.asyncio
+    async def test_rows_edited_after_the_watermark_are_picked_up(
+        self, test_session, test_user, test_skill, user_skill
+    ):
+        senior = Grade(label="Senior", value=2)
+        test_session.add(senior)
+        test_session.add_all(knowledge_base_questions(test_skill, 2, count=3))
+        await test_session.commit()
+        assigner = UserValidationQuestionsAssigner(test_session)
+        await assigner.run(full=True)
+        assert await assigned_questions(test_session, test_user, test_skill) == 2
+
+        # the user is promoted after the watermark
+        user_skill.grade_id = senior.id
+        test_session.add(user_skill)
+        await test_session.commit()
+        report = await assigner.run(full=False)
+
+        assert report.full is False
+        assert report.total_rows >= 3
+        assert await assigned_questions(test_session, test_user, test_skill) == 5
+
+
+def index_scans(node: dict, index_name: str) -> list:
+    scans = [node] if node.get("Index Name") == index_name else []
+    for child in node.get("Plans", []):
+        scans += index_scans(child, index_name)
+    return scans
+
+
+class TestAssignmentPlan:
+    @pytest.mark.asyncio
+    async def test_dry_run_seeks_only_the_missing_questions(
+        self, test_session, test_user, test_skill, test_grade
+    ):
+        test_session.add(
+            UserSkills(
+                user_id=test_user.id, skill_id=test_skill.id, grade_id=test_grade.id
+            )
+        )
+        test_session.add_all(
+            knowledge_base_questions(test_skill, test_grade.value, count=50)
+        )
+        await test_session.commit()
+        assigner = UserValidationQuestionsAssigner(test_session, questions_per_skill=10)
+
+        report = await assigner.plan()
+
+        assert report.dry_run is True
+        assert report.total_rows == 10
+        assert report.rows[0].questions == 10
+        assert await assigned_questions(test_session, test_user, test_skill) == 0
+
+        await test_session.execute(text("SET LOCAL enable_seqscan = off"))
+        explain = await test_session.execute(
+            text(
+                "EXPLAIN (ANALYZE, FORMAT JSON) "
+                + assigner._picked_questions(None)
+                + "SELECT * FROM picked"
+            ),
+            assigner._params(None),
+        )
+        [plan] = explain.scalar()
+        await test_session.rollback()
+
+        scans = index_scans(
+            plan["Plan"], "matrix_knowledgebase_skill_level_ordinal_idx"
+        )
+        # the pick is a limited index seek, not a sort of every question
+        assert len(scans) > 0
+        assert "WindowAgg" not in json.dumps(plan)
+        assert sum(scan["Actual Rows"] * scan["Actual Loops"] for scan in scans) <= 10
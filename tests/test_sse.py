@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from utils.sse import ServerSentEvent, event_stream
+
+
+async def collect(stream, limit: int = 100):
+    frames = []
+    async for frame in stream:
+        frames.append(frame)
+        if len(frames) >= limit:
+            break
+    await stream.aclose()
+    return frames
+
+
+class TestServerSentEvents:
+    def test_event_is_framed_line_by_line(self):
+        event = ServerSentEvent(data='{"a": 1}\n{"b": 2}', event="ai", id="7")
+
+        assert event.encode() == 'id: 7\nevent: ai\ndata: {"a": 1}\ndata: {"b": 2}\n\n'
+
+    @pytest.mark.asyncio
+    async def test_events_get_sequential_ids_and_an_end_event(self):
+        async def events():
+            yield ServerSentEvent(data="{}", event="ai")
+            yield "{}"
+
+        frames = await collect(event_stream(events(), retry=None))
+
+        assert frames == [
+            "id: 1\nevent: ai\ndata: {}\n\n",
+            "id: 2\ndata: {}\n\n",
+            "event: end\ndata: {}\n\n",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_keep_alive_is_sent_while_producer_is_silent(self):
+        async def events():
+            await asyncio.sleep(0.05)
+            yield "{}"
+
+        frames = await collect(event_stream(events(), heartbeat=0.01, retry=None))
+
+        assert frames[0] == ": keep-alive\n\n"
+        assert "id: 1\ndata: {}\n\n" in frames
+
+    @pytest.mark.asyncio
+    async def test_producer_error_is_sent_as_event(self):
+        async def events():
+            yield "{}"
+            raise ValueError("graph failed")
+
+        frames = await collect(event_stream(events(), retry=None))
+
+        assert frames[1].startswith("id: 2\nevent: error\n")
+        assert "graph failed" in frames[1]
+        assert frames[-1] == "event: end\ndata: {}\n\n"
+
+    @pytest.mark.asyncio
+    async def test_slow_client_holds_back_producer(self):
+        produced = []
+
+        async def events():
+            for index in range(100):
+                produced.append(index)
+                yield "{}"
+
+        stream = event_stream(events(), queue_size=2, retry=None)
+        await stream.__anext__()
+        await asyncio.sleep(0.01)
+
+        # one event sent, two queued and one waiting for a free slot
+        assert len(produced) <= 4
+        await stream.aclose()
@@ -0,0 +1,182 @@
+import json
+from typing import Annotated, Any, List, TypedDict
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.graph import END, START, StateGraph, add_messages
+from langgraph.types import Command, interrupt
+
+from agents.reasoner import compact_thread_state
+from agents.state_refs import (
+    GradeLoader,
+    SkillRef,
+    UserRef,
+    grade_ids,
+    is_legacy_state,
+    skill_ref,
+    user_ref,
+)
+from db.models import Grade, Skill, User
+
+
+def user() -> User:
+    return User(
+        id=7,
+        first_name="Ana",
+        last_name="Petrovic",
+        email="ana@htec.com",
+        password="$2b$12$hashedpasswordhashedpasswordhashedpassword",
+        description="Backend engineer " * 20,
+        additional_data='{"linkedin": "https://linkedin.com/in/ana", "team": "core"}',
+    )
+
+
+def legacy_grades() -> List[str]:
+    return [
+        json.dumps({"id": index, "label": f"Grade {index}", "value": index})
+        for index in range(1, 6)
+    ]
+
+
+class FakeResult:
+    def __init__(self, grades: List[Grade]):
+        self.grades = grades
+
+    def scalars(self):
+        return self.grades
+
+
+class FakeSession:
+    def __init__(self, loads: List[int]):
+        self.loads = loads
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, statement):
+        self.loads.append(1)
+        return FakeResult(
+            [Grade(id=index, label=f"Grade {index}", value=index) for index in (1, 2)]
+        )
+
+
+class TestStateRefs:
+    def test_refs_of_rows_and_legacy_values(self):
+        assert user_ref(user()) == UserRef(id=7)
+        assert user_ref({"id": 7, "password": "secret"}) == UserRef(id=7)
+        assert skill_ref(Skill(id=3, name="Java")) == SkillRef(id=3, name="Java")
+        assert grade_ids(legacy_grades()) == [1, 2, 3, 4, 5]
+
+    def test_legacy_state_detection(self):
+        assert is_legacy_state({"user": user(), "grade_ids": [1]})
+        assert is_legacy_state({"grades": legacy_grades()})
+        # the grades channel outlives the compaction of a thread
+        assert not is_legacy_state(
+            {
+                "grades": legacy_grades(),
+                "grade_ids": [1],
+                "user": UserRef(id=7),
+                "skill": SkillRef(id=3, name="Java"),
+            }
+        )
+
+    def test_compact_state_is_an_order_of_magnitude_smaller(self):
+        serializer = JsonPlusSerializer()
+        legacy = {
+            "grades": legacy_grades(),
+            "user": user(),
+            "skill": Skill(id=3, name="Java", description="Java development " * 10),
+        }
+        compact = {
+            "grade_ids": [1, 2, 3, 4, 5],
+            "user": UserRef(id=7),
+            "skill": SkillRef(id=3, name="Java"),
+        }
+
+        def blobs(values: dict) -> bytes:
+            # one checkpoint blob per channel
+            return b"".join(
+                serializer.dumps_typed(value)[1] for value in values.values()
+            )
+
+        assert len(blobs(compact)) * 10 <= len(blobs(legacy))
+        assert b"hashedpassword" not in blobs(compact)
+
+
+class TestGradeLoader:
+    @pytest.mark.asyncio
+    async def test_grades_are_loaded_once_per_ttl(self):
+        loads = []
+        loader = GradeLoader(session_factory=lambda: FakeSession(loads), ttl=60)
+
+        assert [grade.id for grade in await loader.get([2, 1])] == [2, 1]
+        assert [grade.id for grade in await loader.get(None)] == [1, 2]
+        # a removed grade is looked up once, not on every call
+        assert [grade.id for grade in await loader.get([1, 9])] == [1]
+        assert [grade.id for grade in await loader.get([1, 9])] == [1]
+
+        assert len(loads) == 2
+
+
+class LegacyState(TypedDict):
+    grades: List[str]
+    user: Any
+    skill: Any
+    messages: Annotated[list, add_messages]
+    answer: str
+
+
+class CompactState(TypedDict):
+    grade_ids: List[int]
+    user: UserRef
+    skill: SkillRef
+    messages: Annotated[list, add_messages]
+    answer: str
+
+
+def build(schema: type) -> StateGraph:
+    builder = StateGraph(schema)
+
+    async def ask(state):
+        return {"messages": [("ai", "Which grade?")]}
+
+    async def human(state):
+        value = interrupt({"answer_to_revisit": "Which grade?"})
+        return {"answer": f"{value} {state['user']['id']} {state['grade_ids']}"}
+
+    builder.add_node("ask", ask)
+    builder.add_node("human", human)
+    builder.add_edge(START, "ask")
+    builder.add_edge("ask", "human")
+    builder.add_edge("human", END)
+    return builder
+
+
+class TestCompactThreadState:
+    @pytest.mark.asyncio
+    async def test_interrupted_legacy_thread_is_compacted_and_resumed(self):
+        checkpointer = InMemorySaver()
+        config = {"configurable": {"thread_id": "chat"}}
+        legacy_graph = build(LegacyState).compile(checkpointer=checkpointer)
+        await legacy_graph.ainvoke(
+            {
+                "grades": legacy_grades(),
+                "user": user(),
+                "skill": Skill(id=3, name="Java"),
+                "messages": [("human", "I am a senior")],
+            },
+            config,
+        )
+        graph = build(CompactState).compile(checkpointer=checkpointer)
+
+        assert await compact_thread_state(graph, "chat")
+        assert not await compact_thread_state(graph, "chat")
+        state = await graph.aget_state(config)
+        assert state.next == ("human",)
+        assert state.values["user"] == UserRef(id=7)
+        response = await graph.ainvoke(Command(resume="Senior"), config)
+        assert response["answer"] == "Senior 7 [1, 2, 3, 4, 5]"
@@ -0,0 +1,146 @@
+import json
+
+import pytest
+from pydantic import BaseModel, ValidationError
+
+import agents.structured_output as structured_output
+from agents.reasoner import FinalClassificationStdOutput
+from agents.structured_output import (
+    json_schema_response_format,
+    parse_stats,
+    parse_structured,
+    repair_json,
+)
+from agents.validations_agent import LLMFormatError, parse_evaluator_answer
+from dto.inner.knowledge_base import GeneratedKnowledgeBase
+from service.knowledgebase_generation import parse_knowledge_base_content
+
+
+class Answer(BaseModel):
+    label: str
+    score: int
+
+
+class TestRepairJson:
+    def test_fenced_answer_with_trailing_comma(self):
+        content = 'Here you go:\n```json\n{"label": "Senior", "score": 3,}\n```'
+
+        assert repair_json(content) == {"label": "Senior", "score": 3}
+
+    def test_python_literal(self):
+        assert repair_json("{'label': 'Senior', 'score': 3}") == {
+            "label": "Senior",
+            "score": 3,
+        }
+
+    def test_truncated_answer_is_closed(self):
+        assert repair_json('[{"label": "Senior", "score": 3}, {"label": "Jun') == [
+            {"label": "Senior", "score": 3}
+        ]
+
+    def test_truncated_member_is_dropped(self):
+        assert repair_json('{"label": "Senior", "score": 31') == {"label": "Senior"}
+        assert repair_json('{"label": "Senior, lead", "sco') == {
+            "label": "Senior, lead"
+        }
+
+    def test_answer_without_json(self):
+        assert repair_json("Senior") is None
+
+
+class TestParseStructured:
+    def test_outcomes_are_counted_per_node(self):
+        parse_structured("test-node", Answer, '{"label": "Senior", "score": 3}')
+        parse_structured(
+            "test-node", Answer, '```json\n{"label": "Senior", "score": 3}```'
+        )
+        with pytest.raises(ValidationError):
+            parse_structured("test-node", Answer, "Senior")
+
+        stats = parse_stats()["test-node"]
+        assert (stats.parses, stats.repaired, stats.failed) == (3, 1, 1)
+
+    def test_strict_schema_requires_every_field(self):
+        schema = json_schema_response_format(GeneratedKnowledgeBase)["json_schema"]
+        question = schema["schema"]["$defs"]["CreateKnowledgeBaseRequest"]
+
+        assert schema["strict"] is True
+        assert set(question["required"]) == set(question["properties"])
+        assert question["additionalProperties"] is False
+        assert "default" not in question["properties"]["answer"]
+
+    def test_truncated_answer_is_rejected(self):
+        with pytest.raises(ValidationError):
+            parse_structured("test-node", Answer, '{"score": 3, "label": "Sen')
+
+    def test_final_classification_repaired(self):
+        content = '```json\n{"final_class": "Senior", "final_class_id": 3, "message_to_the_user": "Thanks!",}\n```'
+
+        result = parse_structured("reasoner", FinalClassificationStdOutput, content)
+
+        assert result.final_class_id == 3
+
+
+class TestEvaluatorAnswer:
+    def test_json_answer(self, monkeypatch):
+        monkeypatch.setattr(structured_output, "STRUCTURED_OUTPUT_MODE", "json_schema")
+        content = json.dumps(
+            {
+                "thought": "Covered",
+                "action": "final_answer",
+                "action_input": "",
+                "final_answer": "Well done",
+                "completeness": 80,
+            }
+        )
+
+        answer = parse_evaluator_answer(content)
+
+        assert answer.final_answer == "Well done\nCompleteness: 80%"
+        assert answer.completeness == 80
+
+    def test_json_split_action_is_rendered_for_the_scratchpad(self, monkeypatch):
+        monkeypatch.setattr(structured_output, "STRUCTURED_OUTPUT_MODE", "json_schema")
+        content = json.dumps(
+            {
+                "thought": "Unclear",
+                "action": "split",
+                "action_input": "What is a closure?",
+                "final_answer": "",
+                "completeness": 0,
+            }
+        )
+
+        answer = parse_evaluator_answer(content)
+
+        assert answer.final_answer is None
+        assert "Action: split\nAction Input: What is a closure?" in answer.content
+
+    def test_text_answer_missing_exact_marker_is_repaired(self, monkeypatch):
+        monkeypatch.setattr(structured_output, "STRUCTURED_OUTPUT_MODE", "text")
+
+        answer = parse_evaluator_answer("**Final Answer:** Good. Completeness: 72.5%")
+
+        assert answer.final_answer == "Good. Completeness: 72.5%"
+        assert answer.completeness == 72
+
+    def test_text_answer_without_markers_fails(self, monkeypatch):
+        monkeypatch.setattr(structured_output, "STRUCTURED_OUTPUT_MODE", "text")
+
+        with pytest.raises(LLMFormatError):
+            parse_evaluator_answer("I think the user is right")
+
+
+class TestKnowledgeBaseContent:
+    @pytest.mark.parametrize(
+        "content",
+        [
+            '[{"type": "input", "question": "Q", "answer": "A", "is_code": false}]',
+            '{"questions": [{"type": "input", "question": "Q", "answer": "A", "is_code": false}]}',
+            '```json\n[{"type": "input", "question": "Q", "answer": "A", "is_code": false},]\n```',
+        ],
+    )
+    def test_list_object_and_fenced_answers(self, content):
+        dtos = parse_knowledge_base_content(content, skill_id=1, difficulty_level=2)
+
+        assert [(dto.question, dto.difficulty_level) for dto in dtos] == [("Q", 2)]
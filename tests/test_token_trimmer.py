@@ -0,0 +1,88 @@
+from agents.token_trimmer import SUMMARY_HEADER, TokenBudgetTrimmer, TokenCounter
+from dto.request.testing import MessagesRequestBase
+
+
+class WordCounter(TokenCounter):
+    """
+    One token per word, keeps the tests independent of the tiktoken download
+    """
+
+    def count(self, content: str) -> int:
+        return len(content.split())
+
+    def truncate(self, content: str, limit: int) -> str:
+        return " ".join(content.split()[:limit])
+
+
+def discussion(*messages: str):
+    roles = ["ai", "human"]
+    return [
+        MessagesRequestBase(role=roles[index % 2], message=message)
+        for index, message in enumerate(messages)
+    ]
+
+
+class TestTokenBudgetTrimmer:
+    def test_first_answer_is_passed_as_it_is(self):
+        trimmer = TokenBudgetTrimmer(budget=5, counter=WordCounter())
+        trimmed = trimmer.trim(discussion("What is an enum?", "Named constants"))
+
+        assert trimmed.ai_context == "What is an enum?"
+        assert trimmed.human_message == "Named constants"
+        assert trimmed.summarized_turns == 0
+
+    def test_latest_turns_within_budget_are_kept(self):
+        trimmer = TokenBudgetTrimmer(budget=8, counter=WordCounter())
+        trimmed = trimmer.trim(
+            discussion(
+                "What is an enum in Java?",
+                "Constants",
+                "Can you be more specific?",
+                "Named constants",
+                "Give an example.",
+                "Days of the week",
+            )
+        )
+
+        assert trimmed.ai_context.endswith(
+            "- Can you be more specific?\n- Give an example."
+        )
+        assert trimmed.summary == "- What is an enum in Java?"
+        assert trimmed.summarized_turns == 1
+        assert trimmed.ai_context.startswith(SUMMARY_HEADER)
+        assert trimmed.human_message == "Days of the week"
+
+    def test_summary_is_only_extended_with_new_turns(self):
+        trimmer = TokenBudgetTrimmer(budget=3, counter=WordCounter())
+        messages = discussion(
+            "First question. With details",
+            "a",
+            "Second question",
+            "b",
+            "Third question",
+            "c",
+        )
+        trimmed = trimmer.trim(messages)
+        assert trimmed.summary == "- First question.\n- Second question"
+        assert trimmed.summarized_turns == 2
+
+        # a later evaluator pass of the same turn reuses the stored summary
+        stored = trimmer.trim(messages, "- stored summary", trimmed.summarized_turns)
+        assert stored.summary == "- stored summary"
+
+        messages += discussion("Fourth question", "d")
+        extended = trimmer.trim(messages, trimmed.summary, trimmed.summarized_turns)
+        assert extended.summary == (
+            "- First question.\n- Second question\n- Third question"
+        )
+        assert extended.summarized_turns == 3
+
+    def test_summary_is_kept_within_its_budget(self):
+        trimmer = TokenBudgetTrimmer(budget=2, summary_budget=4, counter=WordCounter())
+        trimmed = trimmer.trim(
+            discussion("one two", "a", "three four", "b", "five six", "c")
+        )
+
+        assert trimmed.summary == "- three four"
+        assert trimmed.summarized_turns == 2
+        assert trimmed.ai_context.endswith("- five six")
@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import csv
+import json
+import statistics
+import time
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from agents.token_trimmer import (
+    MSG_TRIM_MODE_LLM,
+    MSG_TRIM_MODE_TOKENS,
+    token_counter,
+    token_trimmer,
+)
+from agents.validations_agent import MsgTrimmer
+from dto.request.testing import MessagesRequestBase
+
+load_dotenv()
+
+MODEL = "gpt-4o"
+
+
+def load_discussions(path: str) -> List[List[MessagesRequestBase]]:
+    """
+    Every prefix of the multiturn evaluation conversations that ends with a
+    message of the user, i.e. what the evaluator is called with
+    """
+    discussions = []
+    with open(path) as file:
+        for row in csv.DictReader(file):
+            messages = [
+                MessagesRequestBase(role=msg["role"], message=msg["content"])
+                for msg in json.loads(row["input"])["messages"]
+            ]
+            for index, msg in enumerate(messages):
+                if msg.role == "human" and index > 0:
+                    discussions.append(messages[: index + 1])
+    return discussions
+
+
+async def run_llm(
+    discussions: List[List[MessagesRequestBase]], passes: int
+) -> Dict[str, float]:
+    trimmer = MsgTrimmer(MODEL)
+    latencies, tokens, calls = [], [], 0
+    for messages in discussions:
+        for _ in range(passes):
+            if len([msg for msg in messages if msg.role == "ai"]) >= 2:
+                calls += 1
+            started = time.perf_counter()
+            trimmed = await trimmer.trim(messages)
+            latencies.append(time.perf_counter() - started)
+            tokens.append(token_counter.count(trimmed[0]))
+    return summarize(latencies, tokens, calls)
+
+
+async def run_tokens(
+    discussions: List[List[MessagesRequestBase]], passes: int
+) -> Dict[str, float]:
+    latencies, tokens = [], []
+    # the graph state of a thread, kept between the turns of one conversation
+    state = {}
+    for messages in discussions:
+        if len(messages) == 2:
+            state = {}
+        for _ in range(passes):
+            started = time.perf_counter()
+            trimmed = token_trimmer.trim(
+                messages, state.get("summary"), state.get("summarized_turns")
+            )
+            latencies.append(time.perf_counter() - started)
+            tokens.append(token_counter.count(trimmed.ai_context))
+            state = {
+                "summary": trimmed.summary,
+                "summarized_turns": trimmed.summarized_turns,
+            }
+    return summarize(latencies, tokens, 0)
+
+
+def summarize(
+    latencies: List[float], tokens: List[int], calls: int
+) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "evaluator passes": len(latencies),
+        "llm calls": calls,
+        "mean ms": statistics.mean(latencies) * 1000,
+        "p95 ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "total s": sum(latencies),
+        "mean context tokens": statistics.mean(tokens),
+        "max context tokens": max(tokens),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the LLM and the token budget message trimmers"
+    )
+    parser.add_argument("--dataset", default="evaluation_dataset_multiturn.csv")
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=[MSG_TRIM_MODE_TOKENS, MSG_TRIM_MODE_LLM],
+        choices=[MSG_TRIM_MODE_TOKENS, MSG_TRIM_MODE_LLM],
+    )
+    # the evaluator runs once more for every split it asks for
+    parser.add_argument("--passes", type=int, default=2)
+    args = parser.parse_args()
+
+    discussions = load_discussions(args.dataset)
+    for mode in args.modes:
+        if mode == MSG_TRIM_MODE_LLM:
+            results = await run_llm(discussions, args.passes)
+        else:
+            results = await run_tokens(discussions, args.passes)
+        print(f"\n{mode}")
+        for name, value in results.items():
+            print(f"  {name}: {round(value, 3)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,5 @@
 import uuid
-from typing import List
+from typing import List, Optional
 
 from langchain_core.messages import (
     AIMessage,
@@ -14,8 +14,13 @@ from dto.request.testing import MessagesRequestBase
 from dto.response.matrix_chats import MessageDict
 
 
-async def common_parameters(offset: int = 0, limit: int = 20, order_by: List[str] = []):
-    return {"offset": offset, "limit": limit, "order_by": order_by}
+async def common_parameters(
+    offset: int = 0,
+    limit: int = 20,
+    order_by: List[str] = [],
+    cursor: Optional[str] = None,
+):
+    return {"offset": offset, "limit": limit, "order_by": order_by, "cursor": cursor}
 
 
 def convert_msg_dict_to_langgraph_format(
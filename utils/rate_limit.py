@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket refilled continuously at ``capacity`` tokens per
+    ``period`` seconds. Callers wait until enough tokens are available.
+    The bucket may go into debt through ``adjust`` when the real cost of a
+    call turns out higher than the amount acquired upfront.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        # requests larger than the bucket would never fit, let them drain it
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                self.__refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """
+        Charges (positive) or refunds (negative) tokens after the fact
+        """
+        self.__refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    Requests per minute and tokens per minute limits of an LLM deployment
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def record_usage(self, estimated_tokens: int, used_tokens: int) -> None:
+        self.tokens.adjust(used_tokens - estimated_tokens)
+
+
+async def retry_with_jitter(
+    func: Callable[[], Awaitable[T]],
+    max_attempts: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    on_error: Optional[Callable[[int, Exception], Awaitable[None]]] = None,
+) -> T:
+    """
+    Calls ``func`` until it succeeds, sleeping a random (full jitter)
+    exponential backoff between the attempts
+
+    :param func: coroutine factory to call
+    :param max_attempts: attempts before the last error is raised
+    :param base_delay: backoff of the first retry in seconds
+    :param max_delay: upper bound of a single backoff in seconds
+    :param on_error: awaited with the attempt number and the error of every
+        failed attempt
+    :return: result of the first successful call
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await func()
+        except Exception as e:
+            if on_error is not None:
+                await on_error(attempt, e)
+            if attempt >= max_attempts:
+                raise
+            backoff = min(max_delay, base_delay * 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(0, backoff))
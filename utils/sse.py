@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Optional, Union
+
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+load_dotenv()
+
+SSE_MEDIA_TYPE = "text/event-stream"
+# seconds without an event after which a keep-alive comment is sent
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# events buffered per connection before the producer has to wait for the client
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "64"))
+# reconnection delay suggested to the browser, in milliseconds
+SSE_RETRY = int(os.getenv("SSE_RETRY_MS", "3000"))
+SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "Connection": "keep-alive",
+    # nginx and most ingresses buffer responses unless told otherwise
+    "X-Accel-Buffering": "no",
+}
+SSE_ERROR_EVENT = "error"
+SSE_END_EVENT = "end"
+
+
+@dataclass
+class ServerSentEvent:
+    """
+    Single event of a ``text/event-stream`` response
+
+    :ivar data: payload, json for every event sent by the API
+    :type data: str
+    :ivar event: event type the client listens to
+    :type event: Optional[str]
+    :ivar id: event id the client reports back in ``Last-Event-ID``
+    :type id: Optional[str]
+    :ivar retry: reconnection delay in milliseconds
+    :type retry: Optional[int]
+    """
+
+    data: str
+    event: Optional[str] = None
+    id: Optional[str] = None
+    retry: Optional[int] = None
+
+    def encode(self) -> str:
+        lines = []
+        if self.id is not None:
+            lines.append(f"id: {self.id}")
+        if self.event is not None:
+            lines.append(f"event: {self.event}")
+        if self.retry is not None:
+            lines.append(f"retry: {self.retry}")
+        # a data line per payload line, the client joins them back with \n
+        lines.extend(f"data: {line}" for line in self.data.splitlines() or [""])
+        return "\n".join(lines) + "\n\n"
+
+
+def encode_comment(comment: str) -> str:
+    return f": {comment}\n\n"
+
+
+def accepts_event_stream(request: Request) -> bool:
+    """
+    Whether the client asked for server-sent events, streaming routes keep
+    their json chunks for the other clients
+    """
+    return SSE_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def json_events(
+    chunks: AsyncIterator[str], event_type: Callable[[dict], str]
+) -> AsyncGenerator[ServerSentEvent, Any]:
+    """
+    Wraps the json chunks of a streaming route into typed events
+
+    :param chunks: json documents produced by the route
+    :param event_type: returns the event type of a parsed chunk
+    """
+    async for chunk in chunks:
+        yield ServerSentEvent(data=chunk, event=event_type(json.loads(chunk)))
+
+
+async def event_stream(
+    events: AsyncIterator[Union[ServerSentEvent, str]],
+    request: Optional[Request] = None,
+    heartbeat: float = SSE_HEARTBEAT_INTERVAL,
+    queue_size: int = SSE_QUEUE_SIZE,
+    retry: Optional[int] = SSE_RETRY,
+) -> AsyncGenerator[str, Any]:
+    """
+    Encodes the events as server-sent events. The events are produced in a
+    separate task into a bounded queue, so a slow client makes the producer
+    (and the graph stream behind it) wait instead of buffering without limit.
+    A keep-alive comment is sent when the producer is silent for
+    ``heartbeat`` seconds and the producer is cancelled once the client goes
+    away. Events without an id get a sequential one.
+
+    :param events: events or plain data of the default ``message`` type
+    :param request: request of the connection, used to detect a disconnect
+    :param heartbeat: seconds between keep-alive comments
+    :param queue_size: events buffered for the connection
+    :param retry: reconnection delay sent with the first event
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    done = object()
+
+    async def produce() -> None:
+        try:
+            async for event in events:
+                if isinstance(event, str):
+                    event = ServerSentEvent(data=event)
+                await queue.put(event)
+        except Exception as e:
+            print(f"Event stream failed: {e}")
+            await queue.put(
+                ServerSentEvent(
+                    data=json.dumps({"detail": str(e)}), event=SSE_ERROR_EVENT
+                )
+            )
+        await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    sequence = 0
+    try:
+        if retry is not None:
+            yield f"retry: {retry}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if request is not None and await request.is_disconnected():
+                    break
+                yield encode_comment("keep-alive")
+                continue
+            if event is done:
+                yield ServerSentEvent(data="{}", event=SSE_END_EVENT).encode()
+                break
+            sequence += 1
+            if event.id is None:
+                event.id = str(sequence)
+            yield event.encode()
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+def event_stream_response(
+    events: AsyncIterator[Union[ServerSentEvent, str]],
+    request: Optional[Request] = None,
+) -> StreamingResponse:
+    """
+    ``StreamingResponse`` of server-sent events with the headers that keep
+    proxies from buffering the stream
+    """
+    return StreamingResponse(
+        event_stream(events, request),
+        media_type=SSE_MEDIA_TYPE,
+        headers=SSE_HEADERS,
+    )